@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+自适应的消息合并等待时间。
+
+固定的 QUEUE_WAITING_TIME 对只发一条消息的用户是纯粹的延迟，对连续打字较慢的用户又会把一段话拆成多次回复。
+这里为每个聊天学习:
+    - 一条消息之后还会紧跟下一条的概率 p_continue（指数加权平均 EWMA）；
+    - 连发时相邻消息间隔 gap 的分布（最近若干个间隔样本）。
+间隔不超过"连发上限"时算作紧跟：有样本时为间隔尺度（中位数 / ln2，即指数分布均值的稳健估计）的
+continuation_factor 倍，样本不足时为默认等待时间；不用 max_wait 判断，否则两段之间的停顿也会被当成连发。
+等待 w 秒仍未收到新消息时"还会有下一条"的后验概率为
+    p * S(w) / (p * S(w) + 1 - p)，其中 S(w) = P(gap > w)
+令其不超过 target_probability，即 S(w) <= t(1-p) / (p(1-t))。
+w 取经验分布的分位数（最高取到 tail_quantile，偶尔一次很长的间隔不会拉高结果），
+更高的分位按指数分布从该分位向外推算。
+只有几乎总是只发一条消息的聊天（p_continue <= target_probability）才会提前到 min_wait 派发；
+会连发的聊天以固定等待时间为下限，否则连发较快的用户也会被拆成多次回复。
+max_wait 高于固定等待时间时，打字较慢的聊天可以延长到 max_wait 以减少拆分（代价是额外延迟），
+默认与固定等待时间相同，即只缩短、不延长。
+"""
+
+import logging
+import math
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def _quantile(ordered, q):
+    """已排序样本的 q 分位数（线性插值）。"""
+    if not ordered:
+        return 0.0
+    position = min(max(q, 0.0), 1.0) * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class _ChatDebounceState:
+    __slots__ = ('mean_gap', 'gaps', 'p_continue', 'samples', 'last_message_time', 'dispatched_at',
+                 'added_latency', 'dispatches', 'split_bursts')
+
+    def __init__(self, history_size, gap_history_size):
+        self.mean_gap = None        # 连发间隔的 EWMA（秒）
+        self.gaps = deque(maxlen=gap_history_size)  # 最近的连发间隔样本
+        self.p_continue = None      # 消息后紧跟下一条的概率 EWMA
+        self.samples = 0            # 已学习的消息数
+        self.last_message_time = None
+        self.dispatched_at = None   # 最近一次派发时间（派发后又很快来消息说明回复被拆分）
+        self.added_latency = deque(maxlen=history_size)  # 最后一条消息到派发的等待（秒）
+        self.dispatches = 0
+        self.split_bursts = 0
+
+
+class AdaptiveDebouncer:
+    """
+    按聊天学习消息间隔分布，给出每个队列应等待的时间。
+
+    on_message() 在每条用户消息入队时调用，用于学习并返回本次应等待的秒数；
+    record_dispatch() 在队列被派发时调用，用于统计每个聊天的额外延迟 p50/p95。
+    """
+
+    def __init__(self, default_wait, min_wait, max_wait, alpha=0.2, target_probability=0.05,
+                 warmup_messages=3, history_size=200, gap_history_size=32, continuation_factor=4.0,
+                 tail_quantile=0.9):
+        self.default_wait = default_wait
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self.target_probability = target_probability
+        self.warmup_messages = warmup_messages
+        self.history_size = history_size
+        self.gap_history_size = gap_history_size
+        self.continuation_factor = continuation_factor
+        self.tail_quantile = tail_quantile
+        self._lock = threading.Lock()
+        self._chats = {}
+
+    def configure(self, default_wait=None, min_wait=None, max_wait=None):
+        """运行时更新参数（来自动态配置）。"""
+        with self._lock:
+            if default_wait is not None:
+                self.default_wait = float(default_wait)
+            if min_wait is not None:
+                self.min_wait = float(min_wait)
+            if max_wait is not None:
+                self.max_wait = max(float(max_wait), self.min_wait)
+
+    def _state(self, chat):
+        state = self._chats.get(chat)
+        if state is None:
+            state = self._chats[chat] = _ChatDebounceState(self.history_size, self.gap_history_size)
+        return state
+
+    def _ewma(self, old, value):
+        return value if old is None else (1 - self.alpha) * old + self.alpha * value
+
+    def _default_wait(self):
+        return max(self.default_wait, self.min_wait)
+
+    def _ceiling(self):
+        """连发聊天的等待上限，不低于固定等待时间。"""
+        return max(self.max_wait, self._default_wait())
+
+    def _gap_scale(self, ordered):
+        """间隔尺度：中位数 / ln2，间隔服从指数分布时等于其均值，不受个别很长的间隔影响。"""
+        return max(_quantile(ordered, 0.5) / math.log(2), 0.1)
+
+    def _continuation_limit(self, state):
+        """两条消息间隔不超过该值时视为连发。"""
+        if len(state.gaps) < self.warmup_messages:
+            return self._default_wait()
+        limit = self.continuation_factor * self._gap_scale(sorted(state.gaps))
+        return min(max(limit, self.min_wait), self._ceiling())
+
+    def _wait_for_state(self, state):
+        if state.samples < self.warmup_messages or state.p_continue is None:
+            # 数据不足时沿用固定等待时间
+            return self._default_wait()
+        p = min(max(state.p_continue, 1e-3), 1 - 1e-3)
+        t = self.target_probability
+        if p <= t:
+            # 该聊天几乎总是只发一条消息
+            return self.min_wait
+        if len(state.gaps) < self.warmup_messages:
+            return self._default_wait()
+        # 允许的剩余概率 S(w)
+        survival = t * (1 - p) / (p * (1 - t))
+        ordered = sorted(state.gaps)
+        quantile = min(1 - survival, self.tail_quantile)
+        wait = _quantile(ordered, quantile)
+        if survival < 1 - quantile:
+            # 超出 tail_quantile 的部分按指数分布外推
+            wait += self._gap_scale(ordered) * math.log((1 - quantile) / survival)
+        # 会连发的聊天不早于固定等待时间派发
+        return min(max(wait, self._default_wait()), self._ceiling())
+
+    def on_message(self, chat, now, learn=True):
+        """
+        记录一条新消息并返回该聊天本次应等待的秒数。
+        learn=False 用于系统生成的消息（主动消息、提醒），只计算等待时间不更新统计。
+        """
+        with self._lock:
+            state = self._state(chat)
+            if learn:
+                previous = state.last_message_time
+                if previous is not None:
+                    gap = now - previous
+                    continued = gap <= self._continuation_limit(state)
+                    # 上一条消息之后是否紧跟了这一条
+                    state.p_continue = self._ewma(state.p_continue, 1.0 if continued else 0.0)
+                    if continued:
+                        state.mean_gap = self._ewma(state.mean_gap, gap)
+                        state.gaps.append(gap)
+                        if state.dispatched_at is not None and state.dispatched_at >= previous:
+                            # 上一段已派发但用户仍在继续输入：回复被拆分了
+                            state.split_bursts += 1
+                state.last_message_time = now
+                state.samples += 1
+            return self._wait_for_state(state)
+
+    def current_wait(self, chat):
+        with self._lock:
+            state = self._chats.get(chat)
+            if state is None:
+                return self._default_wait()
+            return self._wait_for_state(state)
+
+    def record_dispatch(self, chat, last_message_time, dispatch_time):
+        """记录一次派发：额外延迟 = 派发时间 - 队列中最后一条消息的时间。"""
+        with self._lock:
+            state = self._state(chat)
+            state.dispatched_at = dispatch_time
+            state.dispatches += 1
+            state.added_latency.append(max(0.0, dispatch_time - last_message_time))
+
+    def chat_stats(self, chat):
+        with self._lock:
+            state = self._chats.get(chat)
+            if state is None:
+                return None
+            latencies = list(state.added_latency)
+            return {
+                'wait': round(self._wait_for_state(state), 2),
+                'mean_gap': round(state.mean_gap, 2) if state.mean_gap is not None else None,
+                'p_continue': round(state.p_continue, 3) if state.p_continue is not None else None,
+                'dispatches': state.dispatches,
+                'split_bursts': state.split_bursts,
+                'p50_added_latency': round(_percentile(latencies, 50), 2),
+                'p95_added_latency': round(_percentile(latencies, 95), 2),
+            }
+
+    def stats(self):
+        with self._lock:
+            chats = list(self._chats.keys())
+        return {chat: self.chat_stats(chat) for chat in chats}
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+辅助判断路由：把同一轮对话需要的几项辅助判断合并为一次模型调用。
+
+支持的判断：
+- reminder: 提醒解析，结果为与原提醒解析相同结构的字典，或 None（不是提醒请求）；
+- search:   联网检测，结果为需要搜索的内容，或 None（不需要联网）。
+
+表情情绪不在这里判断：它要依据生成的回复内容，并且只在按概率决定发送表情时才需要。
+
+模型按提示中给出的 JSON 结构返回所有判断；返回内容无法解析或不符合结构时 route() 返回 None，
+调用方应退回原来的逐项判断。
+"""
+
+import json
+import logging
+import re
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+TASK_REMINDER = 'reminder'
+TASK_SEARCH = 'search'
+TASK_ORDER = (TASK_REMINDER, TASK_SEARCH)
+
+REMINDER_TYPES = ('recurring', 'one-off-long', 'one-off-short')
+
+# tasks 为本次实际判断的项目，只有其中的字段有意义
+RouteResult = namedtuple('RouteResult', 'tasks reminder search')
+
+_NULL_WORDS = ('', 'null', 'none', '无')
+
+_SCHEMA = {
+    TASK_REMINDER: '"reminder": 提醒对象或 null',
+    TASK_SEARCH: '"search": 需要搜索的内容（字符串）或 null',
+}
+
+
+def build_route_prompt(text, tasks, now_str, search_hint=''):
+    """构造合并判断的提示词，只包含 tasks 中的判断项。"""
+    sections = []
+    if TASK_REMINDER in tasks:
+        sections.append(
+            '【reminder】判断消息是否要求设置提醒或定时，按以下格式给出：\n'
+            '- 每日重复提醒（如"每天早上8点叫我起床"）：'
+            '{"type": "recurring", "time_str": "HH:MM", "message": "提醒的具体内容"}，time_str 为 24 小时制\n'
+            '- 一次性提醒，距现在超过 10 分钟（如"1小时后提醒我"、"明天早上叫我"）：'
+            '{"type": "one-off-long", "target_datetime_str": "YYYY-MM-DD HH:MM", "message": "提醒的具体内容"}，'
+            '为计算出的未来目标时间\n'
+            '- 一次性提醒，距现在不超过 10 分钟（如"5分钟后提醒我"）：'
+            '{"type": "one-off-short", "delay_seconds": 秒数, "message": "提醒的具体内容"}，'
+            'delay_seconds 为小于等于 600 的正整数\n'
+            '- 不是设置提醒的请求（包括"取消提醒"、普通聊天）：null'
+        )
+    if TASK_SEARCH in tasks:
+        sections.append(
+            f'【search】判断消息是否明确需要查询当前、实时或非常具体的外部信息（例如：{search_hint}）。'
+            '需要时给出要搜索的内容；常规聊天、一般知识、历史信息、角色扮演对话等为 null。'
+        )
+    schema = ', '.join(_SCHEMA[task] for task in TASK_ORDER if task in tasks)
+    return (
+        '请根据用户消息完成以下判断。\n'
+        f'当前时间是: {now_str}\n'
+        f'用户消息："{text}"\n\n'
+        + '\n\n'.join(sections) +
+        '\n\n只返回一个 JSON 对象，结构为 {' + schema + '}，'
+        '每个字段都必须给出，不要添加任何解释性文字。'
+    )
+
+
+def _extract_json_object(raw):
+    if not raw:
+        return None
+    if '</think>' in raw:
+        raw = raw.split('</think>', 1)[1]
+    raw = re.sub(r"```(?:json)?", "", raw).strip()
+    start, end = raw.find('{'), raw.rfind('}')
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(raw[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _optional_text(value):
+    """字符串字段：空值和 null 类字样视为 None，非字符串视为无效（抛出 ValueError）。"""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"字段类型错误: {value!r}")
+    value = value.strip()
+    return None if value.lower() in _NULL_WORDS else value
+
+
+def parse_route(raw, tasks):
+    """解析模型返回的合并判断结果，缺少字段或结构不符时返回 None。"""
+    data = _extract_json_object(raw)
+    if data is None or any(task not in data for task in tasks):
+        return None
+    reminder = search = None
+    try:
+        if TASK_REMINDER in tasks:
+            reminder = data[TASK_REMINDER]
+            if isinstance(reminder, str) and reminder.strip().lower() in _NULL_WORDS:
+                reminder = None
+            if reminder is not None and (not isinstance(reminder, dict) or reminder.get('type') not in REMINDER_TYPES):
+                return None
+        if TASK_SEARCH in tasks:
+            search = _optional_text(data[TASK_SEARCH])
+    except ValueError:
+        return None
+    return RouteResult(frozenset(tasks), reminder, search)
+
+
+class AuxRouter:
+    """
+    合并辅助判断的路由器（线程安全）。
+
+    complete(prompt, user_id) 负责实际的模型调用并返回文本（由调用方决定使用辅助模型还是主模型）。
+    """
+
+    def __init__(self, complete):
+        self.complete = complete
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.fallbacks = 0
+        self.calls_saved = 0
+
+    def route(self, text, tasks, user_id, now_str, search_hint=''):
+        """一次调用完成 tasks 中的所有判断，返回 RouteResult；失败时返回 None。"""
+        tasks = frozenset(tasks)
+        prompt = build_route_prompt(text, tasks, now_str, search_hint)
+        try:
+            raw = self.complete(prompt, user_id)
+        except Exception as e:
+            logger.warning(f"合并辅助判断调用失败，用户: {user_id}，将逐项判断: {e}")
+            raw = None
+        result = parse_route(raw, tasks) if raw else None
+        with self._lock:
+            if result is None:
+                self.fallbacks += 1
+            else:
+                self.routed += 1
+                self.calls_saved += len(tasks) - 1
+        if result is None:
+            if raw:
+                logger.warning(f"无法解析合并辅助判断结果，用户: {user_id}，将逐项判断。响应: '{raw[:200]}'")
+            return None
+        logger.info(f"合并辅助判断结果，用户: {user_id}，提醒: {result.reminder}，联网: {result.search}")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'routed': self.routed,
+                'fallbacks': self.fallbacks,
+                'calls_saved': self.calls_saved,
+            }
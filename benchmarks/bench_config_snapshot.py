@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+微基准：对比旧版 get_dynamic_config（每次读取并正则解析 config.py）与 ConfigSnapshot 的查询耗时。
+
+用法:
+    python benchmarks/bench_config_snapshot.py [--iterations 20000]
+"""
+
+import argparse
+import ast
+import os
+import re
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from config_snapshot import ConfigSnapshot, parse_config_text  # noqa: E402
+
+CONFIG_PATH = os.path.join(ROOT_DIR, 'config.py')
+KEYS = ['ENABLE_AUTO_MESSAGE', 'UPLOAD_MEMORY_TO_AI', 'SAVE_MEMORY_TO_SEPARATE_FILE',
+        'USE_VOICE_CALL_FOR_REMINDERS', 'ENABLE_TEXT_COMMANDS', 'NOT_EXISTING_KEY']
+
+
+def legacy_get_dynamic_config(key, default_value=None):
+    """旧版实现（与原 bot.get_dynamic_config 相同）"""
+    try:
+        if not os.path.exists(CONFIG_PATH):
+            return default_value
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            content = f.read()
+        pattern = rf"^{re.escape(key)}\s*=\s*(.+)$"
+        match = re.search(pattern, content, re.M)
+        if match:
+            value_str = match.group(1).strip()
+            if value_str.lower() in ('true', 'false'):
+                return value_str.lower() == 'true'
+            elif value_str.isdigit():
+                return int(value_str)
+            elif value_str.replace('.', '').isdigit():
+                return float(value_str)
+            else:
+                try:
+                    return ast.literal_eval(value_str)
+                except Exception:
+                    return value_str.strip("'\"")
+        return default_value
+    except Exception:
+        return default_value
+
+
+def bench(label, func, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        func(KEYS[i % len(KEYS)], None)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / iterations * 1e6
+    print(f"{label:<28} {iterations:>8} 次  总计 {elapsed:8.3f}s  单次 {per_call_us:10.2f} µs")
+    return per_call_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    snapshot = ConfigSnapshot(CONFIG_PATH)
+
+    # 正确性检查：两种实现对每个配置项返回相同的值
+    with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+        all_keys = list(parse_config_text(f.read()).keys())
+    mismatches = [k for k in all_keys + KEYS if legacy_get_dynamic_config(k) != snapshot.get(k)]
+    print(f"一致性检查: {len(all_keys)} 个配置项，不一致 {len(mismatches)} 个 {mismatches if mismatches else ''}")
+
+    legacy = bench("旧版 get_dynamic_config", legacy_get_dynamic_config, args.iterations)
+    cached = bench("ConfigSnapshot.get", snapshot.get, args.iterations)
+    snapshot.start_watcher()
+    watched = bench("ConfigSnapshot.get (监视线程)", snapshot.get, args.iterations)
+    snapshot.stop_watcher()
+    print(f"加速比: {legacy / cached:.0f}x (查询时检查) / {legacy / watched:.0f}x (监视线程)")
+
+
+if __name__ == '__main__':
+    main()
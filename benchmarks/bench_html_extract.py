@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+基准：链接正文提取，对比原实现（读取整个响应体 + BeautifulSoup 完整解析后再截断）
+与 web_fetch 的流式提取（按块增量解析，正文足够或达到字节上限即停止）。
+
+语料为保存下来的 HTML 文件目录（--corpus）；省略时生成一组合成页面：
+普通文章、GBK 编码的新闻页、超长论坛帖子、脚本很多的单页应用、正文前有大量导航的页面。
+输出每个页面两种方式的耗时、Python 堆内存峰值（tracemalloc，不含 libxml2 内部缓冲）、
+读取的字节数，以及截断后的结果是否一致。需要 lxml 与 beautifulsoup4。
+
+用法:
+    python benchmarks/bench_html_extract.py [--corpus saved_pages/] [--max-length 2000] [--max-bytes 1048576]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from bs4 import BeautifulSoup  # noqa: E402
+from web_fetch import extract_text_from_chunks  # noqa: E402
+
+CHUNK_SIZE = 16 * 1024
+
+
+def legacy_extract(content, max_length):
+    """原 fetch_and_extract_text 的提取逻辑（截断前后的处理保持一致）。"""
+    soup = BeautifulSoup(content, 'lxml')
+    main_text = ""
+    for tag_selector in ['article', 'main', '.main-content', '#content', '.post-content']:
+        element = soup.select_one(tag_selector)
+        if element:
+            main_text = element.get_text(separator='\n', strip=True)
+            break
+    if not main_text and soup.body:
+        main_text = soup.body.get_text(separator='\n', strip=True)
+    elif not main_text:
+        main_text = soup.get_text(separator='\n', strip=True)
+    cleaned_text = '\n'.join(line for line in main_text.splitlines() if line.strip())
+    if len(cleaned_text) > max_length:
+        cleaned_text = cleaned_text[:max_length] + "..."
+    return cleaned_text
+
+
+def streaming_extract(path, max_length, max_bytes):
+    def chunks():
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    text, bytes_read, _ = extract_text_from_chunks(chunks(), max_chars=max_length, max_bytes=max_bytes)
+    if len(text) > max_length:
+        text = text[:max_length] + "..."
+    return text, bytes_read
+
+
+def _paragraphs(prefix, count, length=120):
+    sentence = "这是用于基准测试的正文段落，包含一些中文内容和 some English words。"
+    body = (sentence * (length // len(sentence) + 1))[:length]
+    return ''.join(f"<p>{prefix}{i}：{body}</p>\n" for i in range(count))
+
+
+def _nav(count):
+    return '<nav><ul>' + ''.join(f'<li><a href="/c/{i}">栏目{i}</a></li>' for i in range(count)) + '</ul></nav>'
+
+
+def generate_corpus(directory):
+    """生成合成语料，返回文件路径列表。"""
+    pages = {
+        'article.html': (
+            f"<html><head><title>文章</title></head><body>{_nav(50)}"
+            f"<article><h1>标题</h1>{_paragraphs('段落', 200)}</article>"
+            f"<footer>{_paragraphs('页脚', 20)}</footer></body></html>", 'utf-8'),
+        'news_gbk.html': (
+            f'<html><head><meta charset="gbk"><title>新闻</title></head><body>{_nav(200)}'
+            f"<div class=\"main-content\">{_paragraphs('新闻', 400)}</div></body></html>", 'gbk'),
+        'forum_huge.html': (
+            f"<html><body>{_nav(100)}<div id=\"content\">"
+            + ''.join(f"<div class=\"post\"><span>楼层{i}</span>{_paragraphs('回复', 5)}</div>" for i in range(12000))
+            + "</div></body></html>", 'utf-8'),
+        'spa_scripts.html': (
+            "<html><head>" + ''.join(f"<script>var data{i} = {list(range(400))};</script>" for i in range(1500))
+            + "<style>" + "body{margin:0}" * 20000 + "</style></head>"
+            f"<body><div id=\"app\">{_paragraphs('应用', 30)}</div></body></html>", 'utf-8'),
+        'nav_then_main.html': (
+            f"<html><body>{_nav(30000)}<main>{_paragraphs('主体', 300)}</main></body></html>", 'utf-8'),
+    }
+    paths = []
+    for name, (html, encoding) in pages.items():
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as f:
+            f.write(html.encode(encoding))
+        paths.append(path)
+    return paths
+
+
+def measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='保存的 HTML 页面目录；省略时生成合成语料')
+    parser.add_argument('--max-length', type=int, default=2000, help='正文最大字符数（MAX_WEB_CONTENT_LENGTH）')
+    parser.add_argument('--max-bytes', type=int, default=1024 * 1024, help='流式提取最多读取的字节数')
+    args = parser.parse_args()
+
+    if args.corpus:
+        paths = sorted(os.path.join(args.corpus, name) for name in os.listdir(args.corpus)
+                       if name.lower().endswith(('.html', '.htm')))
+    else:
+        paths = generate_corpus(tempfile.mkdtemp(prefix='html_corpus_'))
+
+    print(f"{'页面':<22}{'大小(KB)':>10}{'原实现(ms)':>12}{'原峰值(MB)':>12}"
+          f"{'流式(ms)':>10}{'流式峰值(MB)':>14}{'读取(KB)':>10}{'结果一致':>10}")
+    totals = [0.0, 0.0]
+    for path in paths:
+        size = os.path.getsize(path)
+
+        def run_legacy():
+            with open(path, 'rb') as f:
+                return legacy_extract(f.read(), args.max_length)
+
+        legacy_text, legacy_time, legacy_peak = measure(run_legacy)
+        (stream_text, bytes_read), stream_time, stream_peak = measure(
+            lambda: streaming_extract(path, args.max_length, args.max_bytes))
+        totals[0] += legacy_time
+        totals[1] += stream_time
+        same = "是" if legacy_text == stream_text else "否"
+        print(f"{os.path.basename(path):<24}{size / 1024:>10.0f}{legacy_time * 1000:>12.1f}{legacy_peak / 1e6:>12.1f}"
+              f"{stream_time * 1000:>10.1f}{stream_peak / 1e6:>14.2f}{bytes_read / 1024:>10.0f}{same:>8}")
+    print(f"合计: 原实现 {totals[0] * 1000:.0f} ms，流式 {totals[1] * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+基准：图片识别上传前预处理的效果。
+
+生成几张模拟手机照片（大尺寸 JPEG，带 EXIF 方向）和截图（PNG），
+分别以原图和预处理后的图片向本地伪视觉接口（benchmarks/fake_openai_server.py）发送识别请求，
+对比上传字节数和端到端耗时（预处理 + base64 + 上传 + 接口延迟）。
+伪服务器按 --upload-bandwidth 模拟上行带宽，请求体越大耗时越长。需要 Pillow。
+
+用法:
+    python benchmarks/bench_image_preprocess.py [--images 6] [--max-edge 1600] [--upload-bandwidth 2000000]
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import random
+import sys
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from image_preprocess import Image, ImagePreprocessor  # noqa: E402
+from fake_openai_server import start_fake_server  # noqa: E402
+
+
+def make_photo(seed, size=(4032, 3024)):
+    """模拟手机照片：渐变 + 噪点，高质量 JPEG，EXIF 方向为旋转 90 度。"""
+    rng = random.Random(seed)
+    base = Image.linear_gradient('L').resize(size).convert('RGB')
+    tint = Image.new('RGB', size, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    noise = Image.effect_noise(size, 40).convert('RGB')
+    image = Image.blend(Image.blend(base, tint, 0.4), noise, 0.3)
+    exif = image.getexif()
+    exif[0x0112] = 6  # Orientation
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+def make_screenshot(seed, size=(1440, 3200)):
+    """模拟聊天截图：浅色背景上的色块，PNG。"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, (245, 245, 245))
+    for _ in range(40):
+        x0, y0 = rng.randint(0, size[0] - 200), rng.randint(0, size[1] - 80)
+        color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        image.paste(color, (x0, y0, x0 + rng.randint(100, 600), y0 + rng.randint(40, 120)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def post_image(base_url, data_url):
+    payload = {
+        'model': 'fake-vision',
+        'messages': [{'role': 'user', 'content': [
+            {'type': 'image_url', 'image_url': {'url': data_url}},
+            {'type': 'text', 'text': '请用中文描述这张图片的主要内容或主题。'},
+        ]}],
+    }
+    body = json.dumps(payload).encode('utf-8')
+    request = urllib.request.Request(f"{base_url}/chat/completions", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        json.loads(response.read().decode('utf-8'))
+    return len(body)
+
+
+def run(images, base_url, preprocessor=None, max_edge=1600):
+    upload_bytes = 0
+    latencies = []
+    for data in images:
+        started = time.perf_counter()
+        if preprocessor is None:
+            data_url = f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+        else:
+            data_url = preprocessor.prepare(data, max_edge=max_edge).data_url
+        upload_bytes += post_image(base_url, data_url)
+        latencies.append(time.perf_counter() - started)
+    return upload_bytes, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=6, help='图片数（照片与截图各一半）')
+    parser.add_argument('--max-edge', type=int, default=1600)
+    parser.add_argument('--latency', type=float, default=0.3, help='伪接口的固定延迟（秒）')
+    parser.add_argument('--upload-bandwidth', type=float, default=2000000, help='模拟上行带宽（字节/秒）')
+    args = parser.parse_args()
+
+    if Image is None:
+        print("需要安装 Pillow 才能运行该基准。")
+        return
+
+    images = [make_photo(i) if i % 2 == 0 else make_screenshot(i) for i in range(args.images)]
+    print(f"{len(images)} 张图片，原始大小共 {sum(len(d) for d in images) / 1e6:.1f} MB")
+
+    server, base_url, _ = start_fake_server(latency=args.latency, upload_bandwidth=args.upload_bandwidth)
+    preprocessor = ImagePreprocessor(max_workers=2)
+    try:
+        print(f"{'方式':<10}{'上传(MB)':>12}{'平均耗时(s)':>14}{'最大耗时(s)':>14}")
+        for name, pre in (("原图", None), ("预处理", preprocessor)):
+            upload_bytes, latencies = run(images, base_url, pre, args.max_edge)
+            print(f"{name:<10}{upload_bytes / 1e6:>12.2f}{sum(latencies) / len(latencies):>14.2f}"
+                  f"{max(latencies):>14.2f}")
+        print(f"预处理统计: {preprocessor.stats()}")
+    finally:
+        preprocessor.shutdown(wait=True)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+基准：多个用户同时进入待回复状态时，串行处理（旧版 check_inactive_users）与
+KeyedWorkerPool 并发处理的总耗时和每个用户的等待时间对比。
+
+每个用户的处理流程模拟 process_user_messages 中的三次调用：
+联网判断 -> 主模型回复 -> 表情情绪判断，均请求本地伪 OpenAI 服务器。
+
+用法:
+    python benchmarks/bench_llm_pipeline.py [--users 8] [--latency 0.5] [--workers 1 3 6]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openai_server import start_fake_server  # noqa: E402
+from message_dispatcher import KeyedWorkerPool  # noqa: E402
+
+
+def chat(base_url, content):
+    body = json.dumps({'model': 'fake-model', 'messages': [{'role': 'user', 'content': content}]}).encode('utf-8')
+    request = urllib.request.Request(f"{base_url}/chat/completions", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read())['choices'][0]['message']['content']
+
+
+def user_pipeline(base_url, user_id, turn, started_at, results):
+    message = f"第{turn}条消息"
+    chat(base_url, f"判断是否需要联网：{message}")
+    reply = chat(base_url, message)
+    chat(base_url, f"判断以下回复的情绪，选择表情：{reply}")
+    results.setdefault(user_id, []).append((turn, time.monotonic() - started_at))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run(base_url, users, workers, turns_per_user):
+    pool = KeyedWorkerPool(max_workers=workers, name=f"Bench{workers}")
+    results = {}
+    started_at = time.monotonic()
+    for turn in range(turns_per_user):
+        for i in range(users):
+            pool.submit(f"user{i}", user_pipeline, base_url, f"user{i}", turn, started_at, results)
+    pool.wait_idle()
+    makespan = time.monotonic() - started_at
+    pool.shutdown()
+    # 同一用户的多轮处理必须按顺序完成
+    ordered = all([turn for turn, _ in done] == list(range(turns_per_user)) for done in results.values())
+    waits = [latency for done in results.values() for _, latency in done]
+    return makespan, waits, ordered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=1, help='每个用户连续提交的轮数（用于检查顺序）')
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 3, 6])
+    args = parser.parse_args()
+
+    server, base_url, state = start_fake_server(latency=args.latency, jitter=args.jitter)
+    print(f"{args.users} 个用户 x {args.turns} 轮，每次API调用约 {args.latency}s，每轮 3 次调用")
+    print(f"{'并发上限':<8}{'总耗时(s)':>10}{'p50等待(s)':>12}{'p95等待(s)':>12}{'最大等待(s)':>12}{'服务端峰值并发':>16}{'顺序正确':>10}")
+    try:
+        for workers in args.workers:
+            state.max_in_flight = 0
+            makespan, waits, ordered = run(base_url, args.users, workers, args.turns)
+            label = f"{workers}{' (旧版)' if workers == 1 else ''}"
+            print(f"{label:<10}{makespan:>10.2f}{statistics.median(waits):>12.2f}{percentile(waits, 95):>12.2f}"
+                  f"{max(waits):>12.2f}{state.max_in_flight:>16}{'是' if ordered else '否':>10}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
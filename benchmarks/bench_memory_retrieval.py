@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+基准与语料：核心记忆检索 (memory_retrieval)。
+
+用一份模拟的核心记忆（与 CoreMemory 目录下的 JSON 文件格式相同）和一组带有期望记忆的消息，
+比较每轮全部注入记忆与只注入检索结果时记忆部分的 token 数，并统计期望记忆的召回率和检索耗时。
+召回率低于 --min-recall 时以非零状态码退出。不需要第三方库。
+
+用法:
+    python benchmarks/bench_memory_retrieval.py [--top-k 8] [--rounds 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_retrieval import MemoryIndex, select_memories  # noqa: E402
+from token_budget import estimate_text_tokens as estimate_tokens  # noqa: E402
+
+SUMMARIES = [
+    ("用户养了一只橘猫叫咪咪，最近总是挑食，只吃三文鱼味的猫粮", 4),
+    ("用户在一家互联网公司做后端开发，主要写 Python 和 Go", 4),
+    ("用户的生日是十月二十三号，希望那天能收到祝福", 5),
+    ("用户最近在准备考研，目标是北京的学校，每天晚上复习到十一点", 5),
+    ("用户喜欢吃辣，最爱的是重庆火锅和麻辣烫", 3),
+    ("用户周末和朋友去爬了香山，拍了很多红叶的照片", 2),
+    ("用户说自己对芒果过敏，吃了会起疹子", 5),
+    ("用户的妈妈住在成都，用户打算国庆回家看她", 4),
+    ("用户最近失眠，晚上两三点才睡着，白天很困", 4),
+    ("用户在学吉他，已经能弹简单的和弦了，想学《晴天》", 3),
+    ("用户和女朋友小雨在一起三年了，打算明年结婚", 5),
+    ("用户上周感冒发烧，吃了布洛芬后好多了", 2),
+    ("用户喜欢看科幻小说，最喜欢刘慈欣的《三体》", 3),
+    ("用户的老板最近给了很多需求，经常加班到晚上十点", 3),
+    ("用户在健身，每周去三次健身房，目标是减重十斤", 3),
+    ("用户养了一盆绿萝，放在办公室的窗台上", 1),
+    ("用户说自己不喜欢下雨天，下雨会心情不好", 2),
+    ("用户打算换一台新电脑，在纠结 MacBook 和游戏本", 2),
+    ("用户玩原神，主力角色是胡桃，最近在抽新角色", 2),
+    ("用户的好朋友阿杰下个月要去上海工作了", 3),
+    ("用户喜欢喝奶茶，常点少糖去冰的杨枝甘露", 2),
+    ("用户害怕打针，每次体检抽血都很紧张", 2),
+    ("用户在存钱准备买房，每个月工资存一半", 4),
+    ("用户小时候在奶奶家长大，和奶奶感情很好", 4),
+    ("用户说咪咪前几天吐了毛球，带去宠物医院看过没事", 3),
+    ("用户最近在追一部悬疑剧《漫长的季节》，觉得很好看", 2),
+    ("用户的英语不太好，想报个口语班练习", 2),
+    ("用户有轻微的近视，度数大概三百度", 1),
+    ("用户很喜欢周杰伦，去过他的演唱会", 3),
+    ("用户下周三要去面试一家新公司，有点紧张", 4),
+    ("用户早上习惯喝一杯美式咖啡提神", 2),
+    ("用户觉得最近工作压力很大，想找时间出去旅游放松", 3),
+    ("用户想去日本旅游，看京都的樱花", 2),
+    ("用户的弟弟今年高考，考上了武汉大学", 3),
+    ("用户不会做饭，平时基本点外卖", 2),
+    ("用户说自己是射手座，性格比较外向", 1),
+    ("用户最近在学做蛋糕，第一次做的戚风塌了", 2),
+    ("用户的电动车前几天被偷了，很郁闷", 2),
+    ("用户讨厌香菜，点外卖都会备注不要香菜", 3),
+    ("用户每天坐地铁通勤，单程要一个小时", 2),
+    ("用户喜欢在睡前听播客，最近在听历史类节目", 1),
+    ("用户的膝盖以前打球受过伤，跑步太久会疼", 3),
+    ("用户说考研数学是最薄弱的科目，高数总是做不出来", 4),
+    ("用户在公司负责的项目下个月要上线，最近一直在修 bug", 3),
+    ("用户答应小雨周末一起去看电影", 3),
+    ("用户养的猫咪咪三岁了，是从流浪猫救助站领养的", 3),
+    ("用户喜欢秋天，觉得北京的秋天最好看", 1),
+    ("用户在考虑要不要辞职去读研", 4),
+    ("用户喜欢吃妈妈做的红烧肉", 2),
+    ("用户的手机屏幕摔碎了，还没去修", 1),
+]
+
+MEMORIES = [
+    {"timestamp": f"2025-05-{1 + i // 2:02d} Thursday {8 + i % 12:02d}:00", "summary": summary, "importance": importance}
+    for i, (summary, importance) in enumerate(SUMMARIES)
+]
+
+# (消息, 期望被选用的记忆序号)
+QUERIES = [
+    ("[2025-06-01 Sunday 20:15] 咪咪今天又不吃饭了怎么办", [0, 24, 45]),
+    ("[2025-06-01 Sunday 20:16] 今天又加班到好晚，老板真的烦", [13]),
+    ("[2025-06-01 Sunday 20:17] 我想吃火锅了", [4]),
+    ("[2025-06-01 Sunday 20:18] 昨晚又失眠了，好困", [8]),
+    ("[2025-06-01 Sunday 20:19] 高数这道题怎么做啊，看不懂", [42]),
+    ("[2025-06-01 Sunday 20:20] 明天就要面试了好紧张", [29]),
+    ("[2025-06-01 Sunday 20:21] 晴天的前奏怎么弹", [9]),
+    ("[2025-06-01 Sunday 20:22] 帮我推荐一家奶茶", [20]),
+    ("[2025-06-01 Sunday 20:23] 小雨说想去看电影", [10, 44]),
+    ("[2025-06-01 Sunday 20:24] 国庆要回成都了", [7]),
+    ("[2025-06-01 Sunday 20:25] 我在纠结买 MacBook 还是游戏本", [17]),
+    ("[2025-06-01 Sunday 20:26] 三体的结局你怎么看", [12]),
+    ("[2025-06-01 Sunday 20:27] 这周去了三次健身房，体重没变", [14]),
+    ("[2025-06-01 Sunday 20:28] 外卖又放了香菜，气死", [38]),
+    ("[2025-06-01 Sunday 20:29] 跑步跑到膝盖疼", [41]),
+    ("[2025-06-01 Sunday 20:30] 弟弟开学了", [33]),
+    ("[2025-06-01 Sunday 20:31] 想去日本看樱花", [32]),
+    ("[2025-06-01 Sunday 20:32] 项目终于上线了", [43]),
+    ("[2025-06-01 Sunday 20:33] 蛋糕又塌了", [36]),
+    ("[2025-06-01 Sunday 20:34] 原神新角色抽到了", [18]),
+]
+
+
+def format_memories(memories):
+    """与 bot.format_json_memories_for_prompt 相同的格式。"""
+    return ''.join(f"## 记忆片段 [{m['timestamp']}]\n**重要度**: {m['importance']}\n**摘要**: {m['summary']}\n\n"
+                   for m in memories)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top-k', type=int, default=8, help='每轮按相关度选用的记忆数')
+    parser.add_argument('--pinned-importance', type=int, default=5, help='置顶记忆的重要度阈值')
+    parser.add_argument('--rounds', type=int, default=200, help='计时的轮数（每轮检索全部消息）')
+    parser.add_argument('--min-recall', type=float, default=0.9, help='期望记忆的最低召回率')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = MemoryIndex([m['summary'] for m in MEMORIES])
+    build_time = time.perf_counter() - started
+
+    full_tokens = estimate_tokens(format_memories(MEMORIES))
+    expected_total = found_total = used_total = 0
+    for query, expected in QUERIES:
+        selection = select_memories(MEMORIES, index, query, top_k=args.top_k, pinned_importance=args.pinned_importance)
+        chosen = {id(m) for m in selection.memories}
+        found = [i for i in expected if id(MEMORIES[i]) in chosen]
+        missed = [i for i in expected if i not in found]
+        used = estimate_tokens(format_memories(selection.memories))
+        expected_total += len(expected)
+        found_total += len(found)
+        used_total += used
+        print(f"{query.split('] ', 1)[1]:<24} 选用 {len(selection.memories):>2}/{selection.total} 条"
+              f"（相关 {selection.relevant}，置顶 {selection.pinned}），约 {used:>4} tokens"
+              + (f"，未召回 {missed}" if missed else ""))
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for query, _ in QUERIES:
+            select_memories(MEMORIES, index, query, top_k=args.top_k, pinned_importance=args.pinned_importance)
+    per_query = (time.perf_counter() - started) / (args.rounds * len(QUERIES))
+
+    recall = found_total / expected_total
+    avg_used = used_total / len(QUERIES)
+    print(f"记忆 {len(MEMORIES)} 条：全部注入约 {full_tokens} tokens/轮，检索后平均约 {avg_used:.0f} tokens/轮，"
+          f"减少 {1 - avg_used / full_tokens:.0%}")
+    print(f"期望记忆召回率 {recall:.0%}，建索引 {build_time * 1e3:.2f} 毫秒，每次检索 {per_query * 1e6:.0f} 微秒")
+    sys.exit(0 if recall >= args.min_recall else 1)
+
+
+if __name__ == '__main__':
+    main()
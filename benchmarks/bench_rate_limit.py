@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+基准：服务商限流 (429) 下的客户端行为对比。
+
+本地伪 OpenAI 服务器按滑动窗口限流（默认每 60 秒 30 个请求），多个线程同时发起调用：
+- 旧行为：每个线程独立调用，失败后立即重试（最多 3 次），不看 Retry-After；
+- 自适应：经 LLMGateway 调用，未配置 RPM，收到 429 后整个服务商冷却并降速；
+- 配置 RPM：经 LLMGateway 调用，RPM 设为服务器的实际限额，提前排队发送。
+输出成功/失败数、服务器返回的 429 次数、总耗时和调用耗时分位数。需要 openai 包。
+
+用法:
+    python benchmarks/bench_rate_limit.py [--threads 8] [--calls 6] [--limit 30] [--window 60]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai import OpenAI  # noqa: E402
+
+from fake_openai_server import start_fake_server  # noqa: E402
+from llm_gateway import LLMGateway  # noqa: E402
+
+MESSAGES = [{'role': 'user', 'content': '你好，今天过得怎么样？'}]
+
+
+def legacy_call(client):
+    """原 call_chat_api_with_retry 的做法：异常后立即重试。"""
+    for _ in range(3):
+        try:
+            return client.chat.completions.create(model='fake-model', messages=MESSAGES)
+        except Exception:
+            continue
+    raise RuntimeError("重试次数用尽")
+
+
+def run(mode, threads, calls, limit, window, latency, retries):
+    server, base_url, state = start_fake_server(latency=latency, rate_limit_rpm=limit, rate_limit_window=window)
+    per_minute = int(limit * 60 / window)
+    client = OpenAI(base_url=base_url, api_key='key', max_retries=0)
+    if mode == 'adaptive':
+        gateway = LLMGateway(max_retries=retries)
+    elif mode == 'configured':
+        gateway = LLMGateway(max_retries=retries, rpm=per_minute)
+    latencies, failures = [], [0]
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(calls):
+            started = time.perf_counter()
+            try:
+                if mode == 'legacy':
+                    legacy_call(client)
+                else:
+                    gateway.chat(base_url, 'key', 'fake-model', MESSAGES)
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+            except Exception:
+                with lock:
+                    failures[0] += 1
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    client.close()
+    if mode != 'legacy':
+        gateway.close()
+    server.shutdown()
+    latencies.sort()
+    return {
+        'ok': len(latencies),
+        'failed': failures[0],
+        'server_429': state.rate_limited,
+        'elapsed': elapsed,
+        'p50': statistics.median(latencies) if latencies else 0.0,
+        'p95': latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--calls', type=int, default=6, help='每个线程的调用次数')
+    parser.add_argument('--limit', type=int, default=30, help='服务器每个窗口接受的请求数')
+    parser.add_argument('--window', type=float, default=60.0, help='服务器限流窗口（秒）')
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--retries', type=int, default=4, help='网关对可重试错误的最多重试次数')
+    args = parser.parse_args()
+
+    total = args.threads * args.calls
+    print(f"{args.threads} 个线程共 {total} 次调用，服务器限额 {args.limit} 次/{args.window:.0f} 秒")
+    print(f"{'方式':<10}{'成功':>6}{'失败':>6}{'服务器429':>10}{'总耗时(s)':>11}{'p50(s)':>9}{'p95(s)':>9}")
+    for mode, name in (('legacy', '旧行为'), ('adaptive', '自适应'), ('configured', '配置RPM')):
+        result = run(mode, args.threads, args.calls, args.limit, args.window, args.latency, args.retries)
+        print(f"{name:<10}{result['ok']:>6}{result['failed']:>6}{result['server_429']:>10}"
+              f"{result['elapsed']:>11.1f}{result['p50']:>9.2f}{result['p95']:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+基准：图片识别缓存的查找耗时。
+
+对比精确命中（SHA-256）、表情截图的感知哈希命中（需要 Pillow）和未命中时的查找开销，
+与一次视觉模型调用的秒级耗时相比，命中时只需要微秒到毫秒级。
+
+用法:
+    python benchmarks/bench_recognition_cache.py [--entries 2000] [--size 200000]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from recognition_cache import Image, RecognitionCache  # noqa: E402
+
+
+def make_image(seed, noise=0):
+    """生成一张随机色块图片（PNG）；noise 为随机改动的像素数，模拟截图的细微差异。"""
+    rng = random.Random(seed)
+    image = Image.new('RGB', (120, 120), (255, 255, 255))
+    pixels = image.load()
+    for _ in range(8):
+        x0, y0 = rng.randint(0, 80), rng.randint(0, 80)
+        color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+        for x in range(x0, min(120, x0 + 40)):
+            for y in range(y0, min(120, y0 + 40)):
+                pixels[x, y] = color
+    noise_rng = random.Random(seed * 7919 + noise)
+    for _ in range(noise):
+        pixels[noise_rng.randint(0, 119), noise_rng.randint(0, 119)] = (0, 0, 0)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def timed(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=2000, help='缓存中的条目数')
+    parser.add_argument('--size', type=int, default=200000, help='模拟图片文件大小（字节）')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'recognition_cache.json')
+    cache = RecognitionCache(path, max_entries=args.entries + 10, save_interval=1e9)
+    rng = random.Random(1)
+    blobs = [rng.randbytes(args.size) if hasattr(rng, 'randbytes') else os.urandom(args.size)
+             for _ in range(min(args.entries, 200))]
+    for i in range(args.entries):
+        cache.put(blobs[i % len(blobs)] + i.to_bytes(4, 'big'), 'image', f"发送了图片：第{i}张", latency=3.0)
+
+    hit = blobs[0] + (0).to_bytes(4, 'big')
+    miss = blobs[0] + b'miss'
+    print(f"缓存条目: {len(cache._entries)}，图片大小: {args.size} 字节")
+    print(f"{'场景':<20}{'耗时(微秒)':>12}")
+    print(f"{'精确命中':<18}{timed(lambda: cache.lookup(hit, 'image'), args.repeat):>14.1f}")
+    print(f"{'未命中':<19}{timed(lambda: cache.lookup(miss, 'image'), args.repeat):>14.1f}")
+
+    if Image is None:
+        print("未安装 Pillow，跳过感知哈希场景。")
+    else:
+        for i in range(200):
+            cache.put(make_image(i), 'emoji', f"发送了表情包：第{i}个", perceptual=True, latency=3.0)
+        similar = make_image(5, noise=20)  # 与第 5 个表情只差 20 个像素
+        found = cache.lookup(similar, 'emoji', perceptual=True)
+        print(f"{'感知哈希命中':<16}{timed(lambda: cache.lookup(similar, 'emoji', perceptual=True), args.repeat // 10):>14.1f}"
+              f"  -> {found}")
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+基准与语料：提醒请求的本地时间解析 (reminder_time_parser)。
+
+对下面的语料逐条比对解析结果（当前时间默认固定为 2025-05-28 星期三 10:00:00，
+个别条目以第三项指定当前时间），期望为 None 的条目应当交给模型解析。输出不一致的条目、本地解析覆盖率和单次解析耗时；
+有不一致时以非零状态码退出。不需要第三方库。
+
+用法:
+    python benchmarks/bench_reminder_parser.py [--rounds 200]
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reminder_time_parser import chinese_to_number, parse_reminder_text  # noqa: E402
+
+NOW = dt.datetime(2025, 5, 28, 10, 0, 0)  # 星期三
+EVENING = dt.datetime(2025, 5, 28, 21, 0, 0)
+
+
+def short(seconds, message):
+    return {"type": "one-off-short", "delay_seconds": seconds, "message": message}
+
+
+def long(when, message):
+    return {"type": "one-off-long", "target_datetime_str": when, "message": message}
+
+
+def daily(when, message):
+    return {"type": "recurring", "time_str": when, "message": message}
+
+
+CORPUS = [
+    # --- 相对时间：10 分钟以内 ---
+    ("10分钟后提醒我喝水", short(600, "喝水")),
+    ("5分钟后提醒我站起来活动", short(300, "站起来活动")),
+    ("提醒我5分钟后站起来活动", short(300, "站起来活动")),
+    ("十分钟后叫我", short(600, "叫我")),
+    ("三分钟之后提醒我关火", short(180, "关火")),
+    ("两分钟以后提醒我看锅", short(120, "看锅")),
+    ("30秒后提醒我拿快递", short(30, "拿快递")),
+    ("提醒我600秒后喝水", short(600, "喝水")),
+    ("过5分钟叫我", short(300, "叫我")),
+    ("再过两分钟提醒我出门", short(120, "出门")),
+    ("１０分钟后提醒我吃药", short(600, "吃药")),
+    ("5分后提醒我关灯", short(300, "关灯")),
+    ("一分半钟后提醒我", None),
+    ("请在8分钟后提醒我给猫喂食", short(480, "给猫喂食")),
+    ("麻烦你7分钟后提醒我一下收衣服", short(420, "收衣服")),
+    ("9分钟后提醒我出发吧", short(540, "出发")),
+    ("1分钟后喊我起来", short(60, "喊我起来")),
+    # --- 相对时间：超过 10 分钟 ---
+    ("提醒我30分钟后喝水", long("2025-05-28 10:30", "喝水")),
+    ("一小时后提醒我喝水", long("2025-05-28 11:00", "喝水")),
+    ("1个小时后提醒我开会", long("2025-05-28 11:00", "开会")),
+    ("两个小时以后提醒我取外卖", long("2025-05-28 12:00", "取外卖")),
+    ("半小时后提醒我下楼", long("2025-05-28 10:30", "下楼")),
+    ("半个小时后叫我", long("2025-05-28 10:30", "叫我")),
+    ("一个半小时以后提醒我收衣服", long("2025-05-28 11:30", "收衣服")),
+    ("1.5小时后提醒我关电脑", long("2025-05-28 11:30", "关电脑")),
+    ("1小时20分钟后提醒我去接孩子", long("2025-05-28 11:20", "接孩子")),
+    ("两小时三十分钟后提醒我喝水", long("2025-05-28 12:30", "喝水")),
+    ("一刻钟后提醒我洗衣服", long("2025-05-28 10:15", "洗衣服")),
+    ("三刻钟后提醒我下班", long("2025-05-28 10:45", "下班")),
+    ("3个钟头后提醒我充电", long("2025-05-28 13:00", "充电")),
+    ("二十分钟后提醒我写日报", long("2025-05-28 10:20", "写日报")),
+    ("四十五分钟后叫我起床", long("2025-05-28 10:45", "叫我起床")),
+    ("过一个小时提醒我活动一下", long("2025-05-28 11:00", "活动")),
+    ("11分钟后提醒我", None),
+    ("90分钟后提醒我去健身", long("2025-05-28 11:30", "健身")),
+    ("一百分钟后提醒我休息", long("2025-05-28 11:40", "休息")),
+    # --- 日期与时刻 ---
+    ("明天下午三点提醒我开会", long("2025-05-29 15:00", "开会")),
+    ("明天下午3点提醒我开会", long("2025-05-29 15:00", "开会")),
+    ("明天早上7点叫我起床", long("2025-05-29 07:00", "叫我起床")),
+    ("明早7点半叫我", long("2025-05-29 07:30", "叫我")),
+    ("明晚8点提醒我看球赛", long("2025-05-29 20:00", "看球赛")),
+    ("今晚8点半提醒我追剧", long("2025-05-28 20:30", "追剧")),
+    ("今天下午两点提醒我交报告", long("2025-05-28 14:00", "交报告")),
+    ("今天晚上十点提醒我洗澡", long("2025-05-28 22:00", "洗澡")),
+    ("今天中午12点提醒我吃饭", long("2025-05-28 12:00", "吃饭")),
+    ("中午一点提醒我午休", long("2025-05-28 13:00", "午休")),
+    ("下午3点提醒我开会", long("2025-05-28 15:00", "开会")),
+    ("下午三点一刻提醒我开会", long("2025-05-28 15:15", "开会")),
+    ("下午四点三刻提醒我取件", long("2025-05-28 16:45", "取件")),
+    ("下午5点15提醒我下班打卡", long("2025-05-28 17:15", "下班打卡")),
+    ("下午5点15分提醒我下班打卡", long("2025-05-28 17:15", "下班打卡")),
+    ("晚上八点零五分提醒我看直播", long("2025-05-28 20:05", "看直播")),
+    ("晚上12点提醒我睡觉", long("2025-05-29 00:00", "睡觉")),
+    ("晚上11点提醒我关窗", long("2025-05-28 23:00", "关窗")),
+    ("傍晚6点提醒我遛狗", long("2025-05-28 18:00", "遛狗")),
+    ("凌晨2点提醒我看流星雨", long("2025-05-29 02:00", "看流星雨")),
+    ("早上8点提醒我吃早饭", long("2025-05-29 08:00", "吃早饭")),
+    ("上午11点提醒我打电话", long("2025-05-28 11:00", "打电话")),
+    ("上午10点05提醒我发邮件", short(300, "发邮件")),
+    ("10:05提醒我发邮件", short(300, "发邮件")),
+    ("10：08提醒我发邮件", short(480, "发邮件")),
+    ("14:30提醒我开会", long("2025-05-28 14:30", "开会")),
+    ("后天早上7:30叫我", long("2025-05-30 07:30", "叫我")),
+    ("后天晚上九点提醒我还书", long("2025-05-30 21:00", "还书")),
+    ("大后天上午十点提醒我去银行", long("2025-05-31 10:00", "银行")),
+    ("3点提醒我开会", long("2025-05-28 15:00", "开会")),
+    ("三点钟提醒我取快递", long("2025-05-28 15:00", "取快递")),
+    ("9点提醒我写周报", long("2025-05-28 21:00", "写周报")),
+    ("11点半提醒我吃饭", long("2025-05-28 11:30", "吃饭")),
+    ("12点提醒我吃饭", long("2025-05-28 12:00", "吃饭")),
+    ("20点提醒我跑步", long("2025-05-28 20:00", "跑步")),
+    ("明天8点提醒我交材料", long("2025-05-29 08:00", "交材料")),
+    ("明天20点提醒我复习", long("2025-05-29 20:00", "复习")),
+    ("明天3点提醒我", None),
+    ("明天3点提醒我交材料", None),
+    ("下周三上午10点提醒我面试", long("2025-06-04 10:00", "面试")),
+    ("下周一早上9点提醒我开周会", long("2025-06-02 09:00", "开周会")),
+    ("周五下午四点提醒我交周报", long("2025-05-30 16:00", "交周报")),
+    ("星期六早上9点叫我去爬山", long("2025-05-31 09:00", "叫我去爬山")),
+    ("礼拜天晚上8点提醒我给家里打电话", long("2025-06-01 20:00", "给家里打电话")),
+    ("周三下午3点提醒我开会", long("2025-05-28 15:00", "开会")),
+    ("周三早上8点提醒我开会", None),
+    ("这周一下午3点提醒我开会", None),
+    ("6月15号上午9点提醒我考试", long("2025-06-15 09:00", "考试")),
+    ("6月15日9点提醒我考试", long("2025-06-15 09:00", "考试")),
+    ("六月十五号下午两点提醒我体检", long("2025-06-15 14:00", "体检")),
+    ("1月3号上午10点提醒我续费", long("2026-01-03 10:00", "续费")),
+    ("2025年12月24日晚上8点提醒我买礼物", long("2025-12-24 20:00", "买礼物")),
+    ("2025-06-01 10:00提醒我交房租", long("2025-06-01 10:00", "交房租")),
+    ("30号下午3点提醒我交水电费", long("2025-05-30 15:00", "交水电费")),
+    ("5号上午十点提醒我还信用卡", long("2025-06-05 10:00", "还信用卡")),
+    ("3天后下午2点提醒我复诊", long("2025-05-31 14:00", "复诊")),
+    ("两天后早上8点提醒我出发", long("2025-05-30 08:00", "出发")),
+    ("今天早上8点提醒我吃药", long("2025-05-28 08:00", "吃药")),
+    ("2月30号上午10点提醒我", None),
+    # --- 每日重复 ---
+    ("每天早上8点叫我起床", daily("08:00", "叫我起床")),
+    ("每天早上八点提醒我吃早饭", daily("08:00", "吃早饭")),
+    ("提醒我每天晚上10点睡觉", daily("22:00", "睡觉")),
+    ("每晚10点提醒我睡觉", daily("22:00", "睡觉")),
+    ("每晚十一点半提醒我关灯", daily("23:30", "关灯")),
+    ("每天中午12点提醒我吃饭", daily("12:00", "吃饭")),
+    ("每天下午3点提醒我喝水", daily("15:00", "喝水")),
+    ("每天7:30叫我起床", daily("07:30", "叫我起床")),
+    ("每日21点提醒我写日记", daily("21:00", "写日记")),
+    ("天天早上6点半喊我跑步", daily("06:30", "喊我跑步")),
+    ("每早7点提醒我背单词", daily("07:00", "背单词")),
+    ("每天6点叫我起床", daily("06:00", "叫我起床")),
+    ("每天晚上12点提醒我睡觉", daily("00:00", "睡觉")),
+    # --- 只说钟点：取上午和下午/晚上中最早到来的一个 ---
+    ("提醒我8点吃药", long("2025-05-29 08:00", "吃药"), EVENING),
+    ("提醒我9点半开会", long("2025-05-28 21:30", "开会"), EVENING),
+    ("提醒我11点睡觉", long("2025-05-28 23:00", "睡觉"), EVENING),
+    # --- 交给模型：否定、疑问、修改、不支持的重复方式、时间不完整 ---
+    ("取消明天早上8点的提醒", None),
+    ("不用提醒我了", None),
+    ("别忘了10分钟后提醒我", None),
+    ("你能10分钟后提醒我吗", None),
+    ("10分钟后提醒我？", None),
+    ("把提醒改到下午3点", None),
+    ("提醒推迟10分钟", None),
+    ("每周一早上9点提醒我开会", None),
+    ("每个月1号提醒我交房租", None),
+    ("工作日早上8点叫我", None),
+    ("每隔两小时提醒我喝水", None),
+    ("明天早上叫我起床", None),
+    ("明天提醒我交作业", None),
+    ("下午提醒我开会", None),
+    ("睡觉之前提醒我关窗", None),
+    ("提醒我少吃一点", None),
+    ("一点提醒我吃药", None),
+    ("10分钟后提醒我", None),
+    ("明天下午三点提醒", None),
+    ("8点和9点都提醒我", None),
+    ("提醒我3号楼开会", None),
+    ("提醒我吃2片药", None),
+    ("1个月后提醒我续费", None),
+    ("下周提醒我交材料", None),
+    ("明天下午3点或者4点提醒我", None),
+    ("今天天气怎么样", None),
+    ("我每天都好累", None),
+    ("设置一个闹钟", None),
+    ("30分钟后", None),
+    ("", None),
+]
+
+
+def check():
+    mismatches = []
+    for text, expected, *now in CORPUS:
+        result = parse_reminder_text(text, now[0] if now else NOW)
+        if result != expected:
+            mismatches.append((text, expected, result))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200, help='计时的轮数（每轮解析全部语料）')
+    args = parser.parse_args()
+
+    assert chinese_to_number('二十五') == 25 and chinese_to_number('一百零五') == 105
+    assert chinese_to_number('零五') == 5 and chinese_to_number('两') == 2
+
+    mismatches = check()
+    for text, expected, result in mismatches:
+        print(f"不一致: {text!r}\n    期望: {expected}\n    实际: {result}")
+
+    parsed = sum(1 for _, expected, *_ in CORPUS if expected is not None)
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        for text, _, *now in CORPUS:
+            parse_reminder_text(text, now[0] if now else NOW)
+    per_call = (time.perf_counter() - started) / (args.rounds * len(CORPUS))
+
+    print(f"语料 {len(CORPUS)} 条：本地解析 {parsed} 条，交给模型 {len(CORPUS) - parsed} 条，"
+          f"不一致 {len(mismatches)} 条")
+    print(f"平均每条解析耗时 {per_call * 1e6:.1f} 微秒")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
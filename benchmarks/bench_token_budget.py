@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+基准：按 token 预算组装上下文 (token_budget) 与固定轮数裁剪的对比。
+
+模拟三类对话的历史记录（短句闲聊、夹带网页内容的消息、夹带合并转发的消息），分别按原来的
+固定 MAX_GROUPS 轮裁剪和按 token 预算组装（同样以 MAX_GROUPS 轮为上限，只在超出预算时减少），
+比较每次请求的估算 token 数、保留的历史消息数和超出预算的请求数；另外给出单次组装耗时以及消息 token 数缓存命中前后的差别。不需要第三方库。
+
+用法:
+    python benchmarks/bench_token_budget.py [--budget 8000] [--max-groups 5] [--rounds 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from token_budget import TokenCounter, build_context, estimate_text_tokens, format_breakdown  # noqa: E402
+
+REPLY_RESERVE = 2000  # 与 config.MAX_TOKEN 默认值相同
+SYSTEM_PROMPT = "# 角色设定\n你是一个温柔体贴的朋友，说话简短自然，喜欢用口语。\n" * 12
+MEMORY_PROMPT = "## 记忆片段 [2025-05-01 Thursday 08:00]\n**重要度**: 4\n**摘要**: 用户养了一只橘猫叫咪咪\n\n" * 6
+CHAT_CHARS = '的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然'
+WEB_TEXT = ("The quick brown fox jumps over the lazy dog. " * 40 + "网页正文内容，包含新闻报道和评论。" * 60)
+MERGED_TEXT = "\n".join(f"[2025-05-28 10:{i:02d}] 群友{i}: " + "今天的会议纪要已经发到群里了，大家记得查看并回复。" * 2
+                        for i in range(60))
+
+
+def chat_line(rng):
+    return ''.join(rng.choice(CHAT_CHARS) for _ in range(rng.randint(4, 30)))
+
+
+def make_history(rng, kind, length=60):
+    history = []
+    for i in range(length):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        content = f"[2025-05-28 Wednesday 10:{i % 60:02d}] {chat_line(rng)}"
+        if role == 'user' and kind == 'web' and rng.random() < 0.3:
+            content += f"\n[链接内容]: {WEB_TEXT}"
+        if role == 'user' and kind == 'merged' and rng.random() < 0.2:
+            content = f"[合并转发消息]:\n{MERGED_TEXT}"
+        history.append({"role": role, "content": content})
+    return history
+
+
+def fixed_context(history, message, max_groups):
+    limit = max_groups * 2
+    return ([{"role": "system", "content": SYSTEM_PROMPT + '\n\n' + MEMORY_PROMPT}]
+            + history[-limit:] + [{"role": "user", "content": message}])
+
+
+def total_tokens(messages):
+    return sum(estimate_text_tokens(m['content']) + 4 for m in messages) + REPLY_RESERVE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=int, default=8000, help='每次请求的 token 预算（含预留回复）')
+    parser.add_argument('--max-groups', type=int, default=5, help='固定裁剪的对话轮数')
+    parser.add_argument('--rounds', type=int, default=200, help='计时的轮数')
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    for kind, label in (('chat', '短句闲聊'), ('web', '夹带网页内容'), ('merged', '夹带合并转发')):
+        fixed_tokens = budget_tokens = fixed_kept = budget_kept = fixed_over = budget_over = 0
+        requests = 30
+        last_breakdown = None
+        counter = TokenCounter()
+        for _ in range(requests):
+            history = make_history(rng, kind)
+            message = chat_line(rng)
+            fixed = fixed_context(history, message, args.max_groups)
+            plan = build_context(counter, SYSTEM_PROMPT, MEMORY_PROMPT, history, message,
+                                 budget=args.budget, reply_reserve=REPLY_RESERVE,
+                                 max_history_messages=args.max_groups * 2)
+            fixed_total = total_tokens(fixed)
+            fixed_tokens += fixed_total
+            fixed_kept += len(fixed) - 2
+            fixed_over += fixed_total > args.budget
+            budget_tokens += plan.breakdown.total
+            budget_kept += plan.breakdown.history_messages
+            budget_over += plan.breakdown.total > args.budget
+            last_breakdown = plan.breakdown
+        print(f"{label}：固定 {args.max_groups} 轮 平均 {fixed_tokens / requests:6.0f} tokens、"
+              f"历史 {fixed_kept / requests:4.1f} 条、超出预算 {fixed_over}/{requests} 次；"
+              f"按预算 平均 {budget_tokens / requests:6.0f} tokens、历史 {budget_kept / requests:4.1f} 条、"
+              f"超出预算 {budget_over}/{requests} 次")
+        print(f"    最后一次组装: {format_breakdown(last_breakdown)}")
+
+    history = make_history(random.Random(5), 'web')
+    cold = 0.0
+    for _ in range(args.rounds):
+        counter = TokenCounter()
+        started = time.perf_counter()
+        build_context(counter, SYSTEM_PROMPT, MEMORY_PROMPT, history, '你好', budget=args.budget,
+                      reply_reserve=REPLY_RESERVE, max_history_messages=args.max_groups * 2)
+        cold += time.perf_counter() - started
+    counter = TokenCounter()
+    build_context(counter, SYSTEM_PROMPT, MEMORY_PROMPT, history, '你好', budget=args.budget, reply_reserve=REPLY_RESERVE,
+                  max_history_messages=args.max_groups * 2)
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        build_context(counter, SYSTEM_PROMPT, MEMORY_PROMPT, history, '你好', budget=args.budget,
+                      reply_reserve=REPLY_RESERVE, max_history_messages=args.max_groups * 2)
+    warm = time.perf_counter() - started
+    print(f"组装耗时：首次 {cold / args.rounds * 1e6:.0f} 微秒，消息 token 数已缓存 {warm / args.rounds * 1e6:.0f} 微秒"
+          f"（缓存命中率 {counter.stats()['hit_rate']:.0%}）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+基准：群聊消息的触发词检查（@机器人、群聊关键词、提醒关键词）。
+
+生成一段模拟的群聊消息流（大部分消息不含触发词，少部分 @机器人、包含关键词或提醒词），
+对比原来的逐项检查（三个正则依次检查 @ 的写法，再用 any(keyword in ...) 扫描关键词和提醒词）
+与 trigger_matcher 一次扫描的吞吐量，并逐条核对两者的判断结果一致；不一致时以非零状态码退出。
+群聊关键词数量分别取 5、50、500 个。不需要第三方库。
+
+用法:
+    python benchmarks/bench_trigger_matcher.py [--messages 20000] [--seed 7]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trigger_matcher import TRIGGER_KEYWORD, TRIGGER_REMINDER, TriggerEngine  # noqa: E402
+
+ROBOT_NAME = '小助手'
+REMINDER_KEYWORDS = ["每日", "每天", "提醒", "提醒我", "定时", "分钟后", "小时后", "计时", "闹钟", "通知我", "叫我",
+                     "提醒一下", "倒计时", "稍后提醒", "稍后通知", "提醒时间", "设置提醒", "喊我"]
+CHARS = ('的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然'
+         '于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所斯么吃饭哈哈嗯啊吧呢')
+FILLERS = ['哈哈哈', '今天吃什么', '有人在吗', '周末去哪玩', '收到', '[图片]', '这个好看', '+1', '晚上好', 'ok']
+
+
+def legacy_check(content, keywords, robot_name):
+    """原来的检查方式：返回 (是否 @, 移除 @ 后的内容, 是否命中关键词, 是否命中提醒词)。"""
+    at_triggered = False
+    processed = content
+    unicode_at_pattern = f'@{re.escape(robot_name)}\u2005'
+    space_at_pattern = f'@{re.escape(robot_name)} '
+    exact_at_string = f'@{re.escape(robot_name)}'
+    if re.search(unicode_at_pattern, content):
+        at_triggered = True
+        processed = re.sub(unicode_at_pattern, '', content, 1).strip()
+    elif re.search(space_at_pattern, content):
+        at_triggered = True
+        processed = re.sub(space_at_pattern, '', content, 1).strip()
+    elif content.strip() == exact_at_string:
+        at_triggered = True
+        processed = ''
+    keyword_triggered = any(keyword in processed for keyword in keywords)
+    reminder_triggered = any(keyword in content for keyword in REMINDER_KEYWORDS)
+    return at_triggered, processed, keyword_triggered, reminder_triggered
+
+
+def engine_check(engine, content):
+    triggers = engine.scan(content)
+    reminder_triggered = triggers.has(TRIGGER_REMINDER)
+    at_triggered = False
+    processed = content
+    span = triggers.mention_span()
+    if span is not None:
+        at_triggered = True
+        triggers = triggers.without(span)
+        processed = triggers.text.strip()
+    return at_triggered, processed, triggers.has(TRIGGER_KEYWORD), reminder_triggered
+
+
+def make_keywords(rng, count):
+    keywords = set()
+    while len(keywords) < count:
+        keywords.add(''.join(rng.choice(CHARS) for _ in range(rng.randint(2, 4))))
+    return sorted(keywords)
+
+
+def make_stream(rng, count, keywords):
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            text = rng.choice(FILLERS)
+        else:
+            text = ''.join(rng.choice(CHARS) for _ in range(rng.randint(4, 60)))
+        roll = rng.random()
+        if roll < 0.05:
+            position = rng.randint(0, len(text))
+            text = text[:position] + rng.choice(keywords) + text[position:]
+        elif roll < 0.08:
+            position = rng.randint(0, len(text))
+            text = text[:position] + rng.choice(REMINDER_KEYWORDS) + text[position:]
+        roll = rng.random()
+        # @ 只放在开头或结尾（与实际一致），避免移除后前后文字拼出新的关键词
+        if roll < 0.08:
+            text = f'@{ROBOT_NAME}\u2005{text}'
+        elif roll < 0.10:
+            text = f'{text} @{ROBOT_NAME} '
+        elif roll < 0.11:
+            text = f' @{ROBOT_NAME}'
+        messages.append(text)
+    return messages
+
+
+def timed(func, messages):
+    started = time.perf_counter()
+    for content in messages:
+        func(content)
+    return (time.perf_counter() - started) / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000, help='模拟消息条数')
+    parser.add_argument('--seed', type=int, default=7, help='随机种子')
+    args = parser.parse_args()
+
+    mismatches = 0
+    for keyword_count in (5, 50, 500):
+        rng = random.Random(args.seed)
+        keywords = make_keywords(rng, keyword_count)
+        messages = make_stream(rng, args.messages, keywords)
+
+        engine = TriggerEngine()
+        started = time.perf_counter()
+        engine.configure(keywords, REMINDER_KEYWORDS, ROBOT_NAME)
+        build_time = time.perf_counter() - started
+
+        for content in messages:
+            expected = legacy_check(content, keywords, ROBOT_NAME)
+            actual = engine_check(engine, content)
+            if expected != actual:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"不一致: {content!r}\n    原检查: {expected}\n    新检查: {actual}")
+
+        legacy_time = timed(lambda content: legacy_check(content, keywords, ROBOT_NAME), messages)
+        engine_time = timed(lambda content: engine_check(engine, content), messages)
+        stats = engine.stats()
+        triggered = sum(1 for content in messages if engine.scan(content).matches)
+        print(f"关键词 {keyword_count:>3} 个：原检查 {legacy_time * 1e6:6.1f} 微秒/条，"
+              f"一次扫描 {engine_time * 1e6:6.1f} 微秒/条（{legacy_time / engine_time:4.1f} 倍），"
+              f"含触发词 {triggered / len(messages):.0%}，构建 {build_time * 1e3:.1f} 毫秒，"
+              f"自动机节点 {stats['automaton_nodes']} 个")
+
+    print(f"共 {args.messages} 条 x 3 组，判断不一致 {mismatches} 条")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
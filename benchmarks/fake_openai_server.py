@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+本地伪 OpenAI 兼容服务器，仅用于基准测试。
+
+实现 POST /v1/chat/completions（支持 stream=True 的 SSE 分块返回），按配置的延迟返回固定格式的回复，
+不依赖任何第三方库。可以独立运行，也可以在基准脚本中通过 start_fake_server() 启动。
+设置 --rate-limit-rpm 后按 60 秒滑动窗口限流，超出时返回 429 和 Retry-After，用于测试客户端限流。
+
+用法:
+    python benchmarks/fake_openai_server.py --port 18080 --latency 0.8 --jitter 0.2 [--rate-limit-rpm 30]
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServerState:
+    """服务器行为配置与请求统计（线程安全）。"""
+
+    def __init__(self, latency=0.5, jitter=0.0, reply_text="好的，我知道啦", upload_bandwidth=0.0,
+                 rate_limit_rpm=0, rate_limit_window=60.0, send_retry_after=True):
+        self.latency = latency
+        self.jitter = jitter
+        self.upload_bandwidth = upload_bandwidth  # 字节/秒，>0 时按请求体大小额外延迟，模拟上行带宽
+        self.reply_text = reply_text
+        self.rate_limit_rpm = rate_limit_rpm  # >0 时每个窗口内最多接受的请求数
+        self.rate_limit_window = rate_limit_window
+        self.send_retry_after = send_retry_after  # 429 响应是否附带 Retry-After
+        self.accepted_times = deque()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_bytes = 0
+        self.rate_limited = 0
+        self.streams_aborted = 0  # 客户端中途关闭的流式响应数
+
+    def begin(self, size):
+        with self.lock:
+            self.requests += 1
+            self.request_bytes += size
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def admit(self):
+        """按滑动窗口判断是否接受请求；拒绝时返回建议的等待秒数。"""
+        if self.rate_limit_rpm <= 0:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted_times and now - self.accepted_times[0] >= self.rate_limit_window:
+                self.accepted_times.popleft()
+            if len(self.accepted_times) < self.rate_limit_rpm:
+                self.accepted_times.append(now)
+                return None
+            self.rate_limited += 1
+            return self.rate_limit_window - (now - self.accepted_times[0])
+
+    def end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def _build_reply(state, payload):
+    """根据请求内容返回与 bot 中各类判断调用格式一致的回复。"""
+    messages = payload.get('messages') or []
+    last = messages[-1].get('content', '') if messages else ''
+    if isinstance(last, list):
+        return "图片内容：一只猫"
+    if '需要联网' in last:
+        return "不需要联网"
+    if '情绪' in last or '表情' in last:
+        return "无"
+    return state.reply_text
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # 由 start_fake_server 注入
+
+    def log_message(self, format, *args):
+        pass  # 保持基准输出整洁
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, payload, content, delay, prompt_tokens):
+        """
+        以 SSE 分块返回回复，delay 平均分摊到各个分块之间，客户端断开时停止发送。
+        请求带 stream_options.include_usage 时，与 OpenAI 一样在最后追加一个只含 usage 的分块。
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)] or ['']
+        step = delay / (len(pieces) + 1)
+        try:
+            for piece in pieces + [None]:
+                time.sleep(step)
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': payload.get('model', 'fake-model'),
+                    'choices': [{
+                        'index': 0,
+                        'delta': {'content': piece} if piece is not None else {},
+                        'finish_reason': None if piece is not None else 'stop',
+                    }],
+                }
+                self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            if (payload.get('stream_options') or {}).get('include_usage'):
+                usage_chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': payload.get('model', 'fake-model'),
+                    'choices': [],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content),
+                              'total_tokens': prompt_tokens + len(content)},
+                }
+                self._write_chunk(f"data: {json.dumps(usage_chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            with self.state.lock:
+                self.state.streams_aborted += 1
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        state = self.state
+        state.begin(len(raw))
+        try:
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self._send_json(404, {'error': {'message': 'not found'}})
+                return
+            try:
+                payload = json.loads(raw.decode('utf-8') or '{}')
+            except ValueError:
+                self._send_json(400, {'error': {'message': 'invalid json'}})
+                return
+
+            retry_after = state.admit()
+            if retry_after is not None:
+                headers = {'Retry-After': str(max(1, int(retry_after + 0.999)))} if state.send_retry_after else None
+                self._send_json(429, {'error': {'message': 'rate limit exceeded', 'type': 'rate_limit_error'}}, headers)
+                return
+
+            delay = max(0.0, state.latency + random.uniform(-state.jitter, state.jitter))
+            if state.upload_bandwidth > 0:
+                delay += len(raw) / state.upload_bandwidth
+            content = _build_reply(state, payload)
+            if payload.get('stream'):
+                self._send_stream(payload, content, delay, len(raw) // 4)
+                return
+            time.sleep(delay)
+
+            self._send_json(200, {
+                'id': f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': payload.get('model', 'fake-model'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': len(raw) // 4, 'completion_tokens': len(content), 'total_tokens': len(raw) // 4 + len(content)},
+            })
+        finally:
+            state.end()
+
+
+def start_fake_server(latency=0.5, jitter=0.0, port=0, **state_kwargs):
+    """在后台线程启动伪服务器，返回 (server, base_url, state)。"""
+    state = FakeServerState(latency=latency, jitter=jitter, **state_kwargs)
+    handler = type('BoundFakeOpenAIHandler', (FakeOpenAIHandler,), {'state': state})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="FakeOpenAIServer", daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    return server, base_url, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.5, help='每个请求的平均延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟的随机抖动范围（秒）')
+    parser.add_argument('--upload-bandwidth', type=float, default=0.0, help='模拟上行带宽（字节/秒），0 表示不限')
+    parser.add_argument('--rate-limit-rpm', type=int, default=0, help='每 60 秒最多接受的请求数，超出返回 429，0 表示不限')
+    parser.add_argument('--no-retry-after', action='store_true', help='429 响应不附带 Retry-After')
+    args = parser.parse_args()
+    server, base_url, _ = start_fake_server(args.latency, args.jitter, args.port,
+                                            upload_bandwidth=args.upload_bandwidth,
+                                            rate_limit_rpm=args.rate_limit_rpm,
+                                            send_retry_after=not args.no_retry_after)
+    print(f"伪 OpenAI 服务器已启动: {base_url} (Ctrl+C 退出)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+回放：把消息时间戳按聊天依次送入合并策略，对比固定等待时间（旧版 QUEUE_WAITING_TIME）
+与 AdaptiveDebouncer 的额外延迟和回复拆分情况。
+
+输入文件（可选）每行一条 JSON 记录，或 CSV（chat,timestamp[,burst[,profile]]）:
+    {"chat": "张三", "timestamp": 1718000000.5, "burst": 3, "profile": "群聊"}
+burst 为可选的真实分段编号；没有时，把派发后 --split-gap 秒内又到达的消息视为回复被拆分。
+profile 为可选的用户类型，用于分组汇总（没有时按聊天分组）。
+不提供文件时生成合成数据：只发一条的用户、连发很快的用户、打字较慢的连发用户。
+默认输出总体和每类用户的结果，--per-chat 额外输出每个聊天的结果。
+
+用法:
+    python benchmarks/replay_debounce.py [--input messages.jsonl] [--fixed-wait 7] [--min-wait 2] [--max-wait 7]
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from adaptive_debounce import AdaptiveDebouncer  # noqa: E402
+
+# 合成数据的用户类型: (每段消息条数范围, 段内间隔均值秒, 段间间隔范围秒)
+SYNTHETIC_PROFILES = {
+    'single': ((1, 1), 1.0, (60, 900)),
+    'bursty_fast': ((3, 6), 1.5, (60, 600)),
+    'slow_typist': ((2, 4), 7.0, (120, 900)),
+    'mixed': ((1, 3), 3.0, (30, 600)),
+}
+
+
+def generate_synthetic(users_per_profile=5, bursts_per_user=60, seed=42):
+    rng = random.Random(seed)
+    records = []
+    for profile, (count_range, mean_gap, idle_range) in SYNTHETIC_PROFILES.items():
+        for u in range(users_per_profile):
+            chat = f"{profile}_{u}"
+            t = rng.uniform(0, 600)
+            for burst in range(bursts_per_user):
+                for i in range(rng.randint(*count_range)):
+                    if i:
+                        t += rng.expovariate(1.0 / mean_gap)
+                    records.append({'chat': chat, 'timestamp': t, 'burst': burst, 'profile': profile})
+                t += rng.uniform(*idle_range)
+    return records
+
+
+def load_records(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for row in csv.reader(f):
+                if not row or row[0] == 'chat':
+                    continue
+                record = {'chat': row[0], 'timestamp': float(row[1])}
+                if len(row) > 2 and row[2] != '':
+                    record['burst'] = int(row[2])
+                if len(row) > 3 and row[3] != '':
+                    record['profile'] = row[3]
+                records.append(record)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    record['timestamp'] = float(record['timestamp'])
+                    records.append(record)
+    return records
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def replay_chat(messages, wait_for, split_gap):
+    """
+    回放一个聊天的消息（按时间排序），wait_for(timestamp) 返回该消息到达后应等待的秒数。
+    返回 (每次派发的额外延迟列表, 派发次数, 被拆分的段数)。
+    """
+    latencies = []
+    dispatches = 0
+    split = 0
+    has_bursts = all('burst' in m for m in messages)
+    dispatched_bursts = {}  # {burst: 派发次数}
+    pending_bursts = set()
+    previous_time = None
+    last_dispatch = None
+
+    for index, message in enumerate(messages):
+        t = message['timestamp']
+        if not has_bursts and last_dispatch is not None and previous_time is not None:
+            if last_dispatch >= previous_time and t - previous_time <= split_gap:
+                split += 1
+        deadline = t + wait_for(t)
+        if has_bursts:
+            pending_bursts.add(message['burst'])
+        previous_time = t
+        next_time = messages[index + 1]['timestamp'] if index + 1 < len(messages) else None
+        if next_time is None or next_time >= deadline:
+            latencies.append(deadline - t)
+            dispatches += 1
+            last_dispatch = deadline
+            for burst in pending_bursts:
+                dispatched_bursts[burst] = dispatched_bursts.get(burst, 0) + 1
+            pending_bursts.clear()
+
+    if has_bursts:
+        split = sum(1 for count in dispatched_bursts.values() if count > 1)
+    return latencies, dispatches, split
+
+
+def run_policy(by_chat, make_wait_for, split_gap):
+    per_chat = {}
+    for chat, messages in by_chat.items():
+        per_chat[chat] = replay_chat(messages, make_wait_for(chat), split_gap)
+    return per_chat
+
+
+def group_by_profile(per_chat, profiles):
+    grouped = {}
+    for chat, result in per_chat.items():
+        grouped.setdefault(profiles[chat], {})[chat] = result
+    return grouped
+
+
+def summarize(per_chat):
+    latencies = [x for lat, _, _ in per_chat.values() for x in lat]
+    dispatches = sum(d for _, d, _ in per_chat.values())
+    split = sum(s for _, _, s in per_chat.values())
+    return latencies, dispatches, split
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input', help='消息时间戳文件（JSONL 或 CSV）；省略时使用合成数据')
+    parser.add_argument('--fixed-wait', type=float, default=7.0, help='旧版固定等待时间（秒）')
+    parser.add_argument('--min-wait', type=float, default=2.0)
+    parser.add_argument('--max-wait', type=float, default=7.0)
+    parser.add_argument('--split-gap', type=float, default=10.0, help='无真实分段时判断回复被拆分的间隔（秒）')
+    parser.add_argument('--per-chat', action='store_true', help='额外输出每个聊天的 p50/p95')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    records = load_records(args.input) if args.input else generate_synthetic(seed=args.seed)
+    by_chat = {}
+    for record in records:
+        by_chat.setdefault(record['chat'], []).append(record)
+    for messages in by_chat.values():
+        messages.sort(key=lambda m: m['timestamp'])
+    profiles = {chat: messages[0].get('profile') or chat for chat, messages in by_chat.items()}
+
+    debouncer = AdaptiveDebouncer(default_wait=args.fixed_wait, min_wait=args.min_wait, max_wait=args.max_wait)
+    policies = [
+        (f"固定 {args.fixed_wait:g}s", lambda chat: (lambda t: args.fixed_wait)),
+        ("自适应", lambda chat: (lambda t: debouncer.on_message(chat, t))),
+    ]
+
+    print(f"{len(by_chat)} 个聊天，{len(records)} 条消息")
+    print(f"{'策略':<12}{'派发次数':>10}{'拆分段数':>10}{'p50延迟(s)':>12}{'p95延迟(s)':>12}{'平均延迟(s)':>12}")
+    results = {}
+    for name, make_wait_for in policies:
+        per_chat = run_policy(by_chat, make_wait_for, args.split_gap)
+        results[name] = per_chat
+        latencies, dispatches, split = summarize(per_chat)
+        mean = sum(latencies) / len(latencies) if latencies else 0.0
+        print(f"{name:<14}{dispatches:>10}{split:>10}{percentile(latencies, 50):>12.2f}"
+              f"{percentile(latencies, 95):>12.2f}{mean:>12.2f}")
+
+    # 每类用户分别汇总：总体指标会掩盖某一类用户变差的情况
+    print()
+    print(f"{'用户类型':<16}" + ''.join(f"{name + ' p50/p95/派发/拆分':>30}" for name, _ in policies))
+    grouped = {name: group_by_profile(per_chat, profiles) for name, per_chat in results.items()}
+    for profile in sorted(set(profiles.values())):
+        row = f"{profile:<20}"
+        for name, _ in policies:
+            latencies, dispatches, split = summarize(grouped[name][profile])
+            row += (f"{percentile(latencies, 50):>12.2f}{percentile(latencies, 95):>8.2f}"
+                    f"{dispatches:>6}{split:>6}")
+        print(row)
+
+    if args.per_chat:
+        print()
+        header = f"{'聊天':<18}" + ''.join(f"{name + ' p50/p95/拆分':>26}" for name, _ in policies)
+        print(header)
+        for chat in sorted(by_chat):
+            row = f"{chat:<20}"
+            for name, _ in policies:
+                latencies, _, split = results[name][chat]
+                row += f"{percentile(latencies, 50):>12.2f}{percentile(latencies, 95):>8.2f}{split:>6}"
+            print(row)
+
+
+if __name__ == '__main__':
+    main()
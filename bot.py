@@ -11,26 +11,39 @@
 # ***********************************************************************
 
 import sys
-import base64
 import requests
 import logging
 from datetime import datetime
 import datetime as dt
 import threading
 import time
-from openai import OpenAI
 import random
 from typing import Optional
 import pyautogui
 import shutil
 import re
-import ast
 from config import *
 import queue
 import json
-from threading import Timer
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from context_store import ChatContextStore
+from config_snapshot import ConfigSnapshot
+from send_scheduler import SendScheduler, SendStep
+from message_dispatcher import DeadlineScheduler, DispatchPause, KeyedWorkerPool
+from adaptive_debounce import AdaptiveDebouncer
+from reminder_scheduler import ReminderScheduler
+from timer_service import TimerService
+from recognition_cache import RecognitionCache
+from image_preprocess import ImagePreprocessor
+from web_fetch import DNSCache, WebFetcher
+from llm_gateway import LLMGateway
+from provider_pool import ChatProvider, ProviderPool
+from aux_router import AuxRouter, TASK_REMINDER, TASK_SEARCH
+from reminder_time_parser import parse_reminder_text
+from trigger_matcher import TriggerEngine, TRIGGER_KEYWORD, TRIGGER_REMINDER
+from memory_retrieval import MemoryRetriever
+from token_budget import TokenCounter, append_section, build_context, format_breakdown
 import os
 try:
     from wxautox_wechatbot import WeChat
@@ -128,36 +141,15 @@ wait = 1  # 设置1秒查看一次是否有新消息
 # 获取程序根目录
 root_dir = os.path.dirname(os.path.abspath(__file__))
 
+# 动态配置快照：config.py 只在文件变化时重新解析，查询为字典查找
+CONFIG_CHECK_INTERVAL = 1.0  # 秒，检查 config.py 是否被修改的最小间隔
+config_snapshot = ConfigSnapshot(os.path.join(root_dir, 'config.py'), check_interval=CONFIG_CHECK_INTERVAL)
+
 # 动态配置获取函数
 def get_dynamic_config(key, default_value=None):
-    """动态从config.py文件获取最新配置值"""
+    """从 config.py 的缓存快照获取最新配置值（文件修改后自动重新加载）"""
     try:
-        config_path = os.path.join(root_dir, 'config.py')
-        if not os.path.exists(config_path):
-            return default_value
-        
-        with open(config_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # 使用正则表达式查找配置项
-        pattern = rf"^{re.escape(key)}\s*=\s*(.+)$"
-        match = re.search(pattern, content, re.M)
-        if match:
-            value_str = match.group(1).strip()
-            # 处理常见的Python字面量
-            if value_str.lower() in ('true', 'false'):
-                return value_str.lower() == 'true'
-            elif value_str.isdigit():
-                return int(value_str)
-            elif value_str.replace('.', '').isdigit():
-                return float(value_str)
-            else:
-                # 使用安全的字面量解析
-                try:
-                    return ast.literal_eval(value_str)
-                except Exception:
-                    return value_str.strip("'\"")
-        return default_value
+        return config_snapshot.get(key, default_value)
     except Exception as e:
         logger.warning(f"获取动态配置 {key} 失败: {e}")
         return default_value
@@ -165,8 +157,25 @@ def get_dynamic_config(key, default_value=None):
 # 用户消息队列和聊天上下文管理
 user_queues = {}  # {user_id: {'messages': [], 'last_message_time': 时间戳, ...}}
 queue_lock = threading.Lock()  # 队列访问锁
-chat_contexts = {}  # {user_id: [{'role': 'user', 'content': '...'}, ...]}
-CHAT_CONTEXTS_FILE = "chat_contexts.json" # 存储聊天上下文的文件名
+dispatch_scheduler = DeadlineScheduler()  # 各用户消息队列的派发截止时间（最后一条消息时间 + 合并等待时间）
+DISPATCH_RETRY_INTERVAL = 1.0  # 秒，暂停派发（如正在识别图片）时的重试间隔
+# 按聊天学习消息间隔的自适应合并等待时间（ENABLE_ADAPTIVE_DEBOUNCE 关闭时仅统计，仍使用 QUEUE_WAITING_TIME）
+message_debouncer = AdaptiveDebouncer(
+    default_wait=QUEUE_WAITING_TIME,
+    min_wait=ADAPTIVE_DEBOUNCE_MIN_WAIT,
+    max_wait=ADAPTIVE_DEBOUNCE_MAX_WAIT
+)
+CHAT_CONTEXTS_DIR = "chat_contexts" # 存储聊天上下文日志的目录（每个用户一个 JSONL 文件）
+CHAT_CONTEXTS_FILE = "chat_contexts.json" # 旧版聊天上下文文件，启动时自动迁移到 CHAT_CONTEXTS_DIR
+CHAT_CONTEXTS_FLUSH_INTERVAL = 2.0  # 秒，聊天上下文后台写盘间隔
+CHAT_CONTEXTS_COMPACT_THRESHOLD = 64  # 单个用户日志超过该记录数时压缩为快照
+# 聊天上下文存储: 内存为权威数据，后台线程定期追加到用户日志 {user_id: [{'role': 'user', 'content': '...'}, ...]}
+chat_context_store = ChatContextStore(
+    CHAT_CONTEXTS_DIR,
+    flush_interval=CHAT_CONTEXTS_FLUSH_INTERVAL,
+    compact_threshold=CHAT_CONTEXTS_COMPACT_THRESHOLD,
+    legacy_file=CHAT_CONTEXTS_FILE,
+)
 USER_TIMERS_FILE = "user_timers.json"  # 存储用户计时器状态的文件名
 
 # 心跳相关全局变量
@@ -174,16 +183,21 @@ HEARTBEAT_INTERVAL = 5  # 秒
 FLASK_SERVER_URL_BASE = f'http://localhost:{PORT}' # 使用从config导入的PORT
 
 # --- REMINDER RELATED GLOBALS ---
-RECURRING_REMINDERS_FILE = "recurring_reminders.json" # 存储重复和长期一次性提醒的文件名
-# recurring_reminders 结构:
+RECURRING_REMINDERS_FILE = "recurring_reminders.json" # 存储重复和长期一次性提醒的文件名（配置编辑器读写的快照）
+# recurring_reminders.json 结构:
 # [{'reminder_type': 'recurring', 'user_id': 'xxx', 'time_str': 'HH:MM', 'content': '...'},
 #  {'reminder_type': 'one-off', 'user_id': 'xxx', 'target_datetime_str': 'YYYY-MM-DD HH:MM', 'content': '...'}]
-recurring_reminders = [] # 内存中加载的提醒列表
-recurring_reminder_lock = threading.RLock() # 锁，用于处理提醒文件和列表的读写
+REMINDER_CATCH_UP_WINDOW = 3600  # 秒，重启后补发该时间内错过的提醒
+# 提醒调度器: 按下一次触发时间建堆，准点触发；变更追加到 recurring_reminders.json.journal
+reminder_scheduler = ReminderScheduler(
+    RECURRING_REMINDERS_FILE,
+    on_fire=lambda reminder, scheduled_at, late_seconds: fire_reminder(reminder, scheduled_at, late_seconds),
+    catch_up_window=REMINDER_CATCH_UP_WINDOW
+)
 
-active_timers = {} # { (user_id, timer_id): Timer_object } (用于短期一次性提醒 < 10min)
-timer_lock = threading.Lock()
-next_timer_id = 0
+SHORT_REMINDERS_FILE = "short_reminders.json" # 待触发的短期一次性提醒 (<= 10min)，重启后恢复
+# 定时器服务: 短期提醒、表情包防抖、延迟重启共用一个线程；短期提醒按用户分组计数并持久化
+timer_service = TimerService(name="TimerService", persist_path=SHORT_REMINDERS_FILE)
 
 # 提醒功能的资源限制（防止拒绝服务攻击）
 MAX_ACTIVE_TIMERS_PER_USER = 10  # 每个用户最多10个活动的短期提醒
@@ -538,11 +552,40 @@ ROBOT_WX_NAME = wx.nickname
 # 存储用户的计时器和随机等待时间
 user_timers = {}
 user_wait_times = {}
-emoji_timer = None
-emoji_timer_lock = threading.Lock()
-# 全局变量，控制消息发送状态
-can_send_messages = True
-is_sending_message = False
+# 图片/表情识别结果缓存：按内容哈希（表情截图另加感知哈希）复用识别结果
+RECOGNITION_CACHE_FILE = "recognition_cache.json"
+RECOGNITION_CACHE_MAX_ENTRIES = 2000  # 最多缓存的识别结果数（LRU 淘汰）
+RECOGNITION_CACHE_TTL = 30 * 86400  # 秒，识别结果的有效期
+recognition_cache = RecognitionCache(
+    RECOGNITION_CACHE_FILE,
+    max_entries=RECOGNITION_CACHE_MAX_ENTRIES,
+    ttl_seconds=RECOGNITION_CACHE_TTL
+)
+# 图片上传前的预处理（缩小、去除元数据、转码），在独立线程池中执行
+IMAGE_PREPROCESS_WORKERS = 2  # 同时预处理的图片数，限制解码大图时的内存占用
+image_preprocessor = ImagePreprocessor(max_workers=IMAGE_PREPROCESS_WORKERS)
+EMOJI_DEBOUNCE_SECONDS = 3.0  # 秒，连续收到表情包时只处理最后一个
+emoji_timer_lock = threading.Lock()  # 串行处理表情包识别
+emoji_debounce_lock = threading.Lock()
+emoji_debounce_handle = None  # 尚未触发的表情包防抖任务
+# 图片/表情识别期间暂停派发消息队列（计数器，多个识别并发时全部结束后才恢复）
+dispatch_pause = DispatchPause()
+# 合并转发消息中的图片并发识别，限制同时进行的识别请求数
+MERGED_IMAGE_RECOGNITION_WORKERS = 4
+MERGED_IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+merged_image_pool = ThreadPoolExecutor(max_workers=MERGED_IMAGE_RECOGNITION_WORKERS,
+                                       thread_name_prefix="MergedImageRecognition")
+# 消息发送调度器：按聊天分队列，由单一发送线程交错执行
+send_scheduler = SendScheduler(name="SendScheduler")
+SEND_QUEUE_DRAIN_TIMEOUT = 30  # 秒，重启或退出前等待发送队列清空的最长时间
+# 回复生成线程池：同一用户按顺序处理，不同用户最多 MAX_CONCURRENT_LLM_REQUESTS 个并发
+llm_worker_pool = KeyedWorkerPool(max_workers=MAX_CONCURRENT_LLM_REQUESTS, name="ReplyWorker")
+# 消息接收分两段：wxauto 回调只记录消息，语音转文字、合并转发展开、图片下载识别、链接抓取、提醒解析等
+# 耗时处理在预处理线程池中按聊天串行执行，不再阻塞其他聊天的消息接收
+INGEST_WORKERS = 4
+ingest_pool = KeyedWorkerPool(max_workers=INGEST_WORKERS, name="Ingest")
+# 回调中记录的消息快照，received_at 为收到消息的时间
+IncomingMessage = namedtuple('IncomingMessage', ['who', 'msg', 'type', 'attr', 'sender', 'content', 'received_at'])
 
 # 用于拍一拍功能的全局变量
 user_last_msg = {}  # {user_id: msg对象} 存储每个用户最后发送的消息对象
@@ -583,20 +626,47 @@ def _is_base_url_untrusted(base_url: str) -> bool:
     url_lower = str(base_url).lower()
     return any((s in url_lower) for s in bl)
 
-# 初始化OpenAI客户端
-client = OpenAI(
-    api_key=DEEPSEEK_API_KEY,
-    base_url=DEEPSEEK_BASE_URL
+# 大模型调用统一经过网关：按 (base_url, key) 复用客户端与连接池，统一超时与退避重试
+LLM_REQUEST_TIMEOUT = 120  # 秒，单次模型请求的超时时间
+LLM_MAX_RETRIES = 2  # 限流、5xx、超时、连接错误的最多重试次数（带抖动的指数退避）
+# 每个服务商共享的客户端限流（RPM/TPM 为 0 表示不设上限，仅在收到 429 后自适应降速并遵循 Retry-After）
+llm_gateway = LLMGateway(timeout=LLM_REQUEST_TIMEOUT, max_retries=LLM_MAX_RETRIES,
+                         rpm=LLM_RATE_LIMIT_RPM, tpm=LLM_RATE_LIMIT_TPM)
+
+# 预先创建主模型客户端
+llm_gateway.client(DEEPSEEK_BASE_URL, DEEPSEEK_API_KEY)
+
+def _build_chat_providers():
+    """主对话模型的服务商列表：DEEPSEEK 配置为首选，CHAT_BACKUP_PROVIDERS 中的条目依次作为备用。"""
+    providers = [ChatProvider(DEEPSEEK_BASE_URL, DEEPSEEK_API_KEY, MODEL)]
+    for entry in CHAT_BACKUP_PROVIDERS or []:
+        try:
+            base_url, model, api_key = (list(entry) + ['', '', ''])[:3]
+        except TypeError:
+            logger.warning(f"备用对话服务商配置格式错误，已忽略: {entry!r}")
+            continue
+        if not base_url or not model:
+            logger.warning(f"备用对话服务商缺少地址或模型，已忽略: {entry!r}")
+            continue
+        providers.append(ChatProvider(base_url, api_key, model))
+        logger.info(f"已添加备用对话服务商: {providers[-1].name}")
+    return providers
+
+# 主对话模型服务商池：配置了备用服务商时，首选服务商超过其 p95 耗时未返回则向备用服务商发出对冲请求，
+# 出错或返回空回复时自动切换；回复结果与上下文存储方式不变
+CHAT_HEDGE_DEFAULT_DELAY = 8.0  # 秒，耗时样本不足时的对冲等待时间
+chat_provider_pool = ProviderPool(
+    llm_gateway, _build_chat_providers(),
+    hedging=ENABLE_CHAT_HEDGING,
+    hedge_delay=CHAT_HEDGE_DEFAULT_DELAY,
+    max_workers=MAX_CONCURRENT_LLM_REQUESTS * 2,
+    provider_filter=lambda provider: not _is_base_url_untrusted(provider.base_url)
 )
 
-#初始化在线 AI 客户端 (如果启用)
-online_client: Optional[OpenAI] = None
+# 初始化在线 AI 客户端 (如果启用)
 if ENABLE_ONLINE_API:
     try:
-        online_client = OpenAI(
-            api_key=ONLINE_API_KEY,
-            base_url=ONLINE_BASE_URL
-        )
+        llm_gateway.client(ONLINE_BASE_URL, ONLINE_API_KEY)
         logger.info("联网搜索 API 客户端已初始化。")
     except Exception as e:
         logger.error(f"初始化联网搜索 API 客户端失败: {e}", exc_info=True)
@@ -604,13 +674,9 @@ if ENABLE_ONLINE_API:
         logger.warning("由于初始化失败，联网搜索功能已被禁用。")
 
 # 初始化辅助模型客户端 (如果启用)
-assistant_client: Optional[OpenAI] = None
 if ENABLE_ASSISTANT_MODEL:
     try:
-        assistant_client = OpenAI(
-            api_key=ASSISTANT_API_KEY,
-            base_url=ASSISTANT_BASE_URL
-        )
+        llm_gateway.client(ASSISTANT_BASE_URL, ASSISTANT_API_KEY)
         logger.info("辅助模型 API 客户端已初始化。")
     except Exception as e:
         logger.error(f"初始化辅助模型 API 客户端失败: {e}", exc_info=True)
@@ -739,17 +805,7 @@ def check_user_timeouts():
                         logger.info(f"为用户 {user} 生成主动消息并加入队列: {auto_content}")
 
                         # 将主动消息加入队列（模拟用户消息）
-                        with queue_lock:
-                            if user not in user_queues:
-                                user_queues[user] = {
-                                    'messages': [auto_content],
-                                    'sender_name': user,
-                                    'username': user,
-                                    'last_message_time': time.time()
-                                }
-                            else:
-                                user_queues[user]['messages'].append(auto_content)
-                                user_queues[user]['last_message_time'] = time.time()
+                        enqueue_user_message(user, auto_content)
 
                         # 更新全局的最后消息活动时间戳，因为机器人主动发消息也算一种活动
                         last_received_message_timestamp = time.time()
@@ -776,8 +832,75 @@ def on_user_message(user):
         user_names.append(user)
     reset_user_timer(user)
 
-# 修改get_user_prompt函数（增强路径验证）
-def get_user_prompt(user_id):
+class PromptCache:
+    """
+    已组装系统提示词的 LRU 缓存。
+
+    条目按 (user_id, prompt 文件) 存放，并附带生成时的版本签名（prompt 文件与核心记忆文件的
+    mtime/size，以及配置快照版本）；签名不一致时视为失效并重新组装。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {(user_id, prompt_path): (signature, prompt_content)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, signature):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == signature:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                # 文件或配置已变化，旧条目失效
+                del self._entries[key]
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, signature, value):
+        with self._lock:
+            self._entries[key] = (signature, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+PROMPT_CACHE_SIZE = 64  # 最多缓存的已组装系统提示词数量
+prompt_cache = PromptCache(max_entries=PROMPT_CACHE_SIZE)
+
+def _file_version(path):
+    """返回文件的 (mtime_ns, size)，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def _resolve_prompt_path(user_id):
+    """返回用户对应的 prompt 文件绝对路径及清理后的文件名，并校验路径安全。"""
     # 查找映射中的文件名，若不存在则使用user_id
     prompt_file = prompt_mapping.get(user_id, user_id)
     
@@ -792,11 +915,48 @@ def get_user_prompt(user_id):
     if not prompt_path.startswith(prompts_dir + os.sep):
         logger.error(f"检测到路径遍历尝试: user_id={user_id}, prompt_file={prompt_file}, path={prompt_path}")
         raise ValueError(f"非法的prompt文件路径访问尝试")
-    
-    if not os.path.exists(prompt_path):
+    return prompt_path, safe_prompt_file
+
+def get_user_prompt_parts(user_id, query=None):
+    """
+    返回 (prompt 文件内容, JSON 核心记忆文本)。prompt 文件内容在文件和配置未变化时直接返回缓存结果；
+    启用核心记忆检索时，JSON 核心记忆只选用与 query（本轮消息）相关的部分和置顶的高重要度记忆。
+    """
+    prompt_path, safe_prompt_file = _resolve_prompt_path(user_id)
+
+    prompt_version = _file_version(prompt_path)
+    if prompt_version is None:
         logger.error(f"Prompt文件不存在: {prompt_path}")
         raise FileNotFoundError(f"Prompt文件 {safe_prompt_file}.md 未找到于 prompts 目录")
 
+    upload_memory = get_dynamic_config('UPLOAD_MEMORY_TO_AI', UPLOAD_MEMORY_TO_AI)
+    retrieve_memory = upload_memory and get_dynamic_config('ENABLE_MEMORY_RETRIEVAL', ENABLE_MEMORY_RETRIEVAL)
+    memory_path = get_core_memory_file_path(user_id)
+    memory_version = _file_version(memory_path) if upload_memory else None
+    cache_key = (user_id, prompt_path)
+    signature = (prompt_version, config_snapshot.version)
+
+    prompt_content = prompt_cache.get(cache_key, signature)
+    if prompt_content is None:
+        prompt_content = _assemble_user_prompt(prompt_path, upload_memory)
+        # 组装过程中可能把 prompt 文件重新转码保存，使用组装后的版本作为签名
+        signature = (_file_version(prompt_path), config_snapshot.version)
+        prompt_cache.put(cache_key, signature, prompt_content)
+
+    # JSON 核心记忆按记忆文件版本缓存在 memory_retriever 中
+    memory_content = ''
+    if memory_version is not None:
+        memory_content = memory_retriever.prompt_section(
+            memory_path, memory_version, lambda: load_core_memory_from_json(user_id), query or '',
+            label=user_id,
+            top_k=get_dynamic_config('MEMORY_RETRIEVAL_TOP_K', MEMORY_RETRIEVAL_TOP_K),
+            pinned_importance=get_dynamic_config('MEMORY_PINNED_IMPORTANCE', MEMORY_PINNED_IMPORTANCE),
+            retrieve=retrieve_memory,
+        )
+    return prompt_content, memory_content
+
+def _assemble_user_prompt(prompt_path, upload_memory):
+    """读取 prompt 文件，不上传记忆时去掉其中的记忆片段（JSON 核心记忆由 get_user_prompt_parts 另行加入）。"""
     # 增强编码处理的文件读取
     prompt_content = None
     try:
@@ -836,104 +996,24 @@ def get_user_prompt(user_id):
         raise FileNotFoundError(f"无法读取Prompt文件内容: {prompt_path}")
     
     # 处理记忆的上传
-    if not get_dynamic_config('UPLOAD_MEMORY_TO_AI', UPLOAD_MEMORY_TO_AI):
+    if not upload_memory:
         # 如果不上传记忆到AI，则移除所有记忆片段
         memory_marker = "## 记忆片段"
         if memory_marker in prompt_content:
             prompt_content = prompt_content.split(memory_marker, 1)[0].strip()
-        return prompt_content
-    
-    # 上传记忆到AI时，需要合并prompt文件中的记忆和JSON文件中的记忆
-    json_memories = load_core_memory_from_json(user_id)
-    json_memory_content = format_json_memories_for_prompt(json_memories)
-    
-    # 如果有JSON记忆需要添加
-    if json_memory_content:
-        # 找到prompt内容的结尾，添加JSON记忆
-        if prompt_content.endswith('\n'):
-            combined_content = prompt_content + '\n' + json_memory_content
-        else:
-            combined_content = prompt_content + '\n\n' + json_memory_content
-        
-        logger.debug(f"为用户 {user_id} 合并了 {len(json_memories)} 条JSON记忆到prompt中")
-        return combined_content
-    else:
-        # 没有JSON记忆，直接返回原始prompt内容
-        return prompt_content
+    return prompt_content
              
 # 加载聊天上下文
 def load_chat_contexts():
-    """从文件加载聊天上下文。"""
-    global chat_contexts # 声明我们要修改全局变量
-    try:
-        if os.path.exists(CHAT_CONTEXTS_FILE):
-            with open(CHAT_CONTEXTS_FILE, 'r', encoding='utf-8') as f:
-                loaded_contexts = json.load(f)
-                if isinstance(loaded_contexts, dict):
-                    chat_contexts = loaded_contexts
-                    logger.info(f"成功从 {CHAT_CONTEXTS_FILE} 加载 {len(chat_contexts)} 个用户的聊天上下文。")
-                else:
-                    logger.warning(f"{CHAT_CONTEXTS_FILE} 文件内容格式不正确（非字典），将使用空上下文。")
-                    chat_contexts = {} # 重置为空
-        else:
-            logger.info(f"{CHAT_CONTEXTS_FILE} 未找到，将使用空聊天上下文启动。")
-            chat_contexts = {} # 初始化为空
-    except json.JSONDecodeError:
-        logger.error(f"解析 {CHAT_CONTEXTS_FILE} 失败，文件可能已损坏。将使用空上下文。")
-        # 可以考虑在这里备份损坏的文件
-        # shutil.copy(CHAT_CONTEXTS_FILE, CHAT_CONTEXTS_FILE + ".corrupted")
-        chat_contexts = {} # 重置为空
-    except Exception as e:
-        logger.error(f"加载聊天上下文失败: {e}", exc_info=True)
-        chat_contexts = {} # 出现其他错误也重置为空，保证程序能启动
-
-def merge_context(context_list):
-    """
-    合并连续相同 role 的消息，保证 user/assistant 交替。
-    """
-    if not context_list:
-        return []
-    merged = []
-    last_role = None
-    buffer = []
-    for item in context_list:
-        role = item.get('role')
-        content = item.get('content', '')
-        if role == last_role:
-            buffer.append(content)
-        else:
-            if buffer:
-                merged.append({'role': last_role, 'content': '\n'.join(buffer)})
-            buffer = [content]
-            last_role = role
-    if buffer:
-        merged.append({'role': last_role, 'content': '\n'.join(buffer)})
-    return merged
+    """从用户日志加载聊天上下文到内存存储（首次运行时自动迁移旧版 chat_contexts.json）。"""
+    chat_context_store.load()
 
 # 保存聊天上下文
 def save_chat_contexts():
-    """将当前聊天上下文保存到文件。"""
-    global chat_contexts
-    temp_file_path = CHAT_CONTEXTS_FILE + ".tmp"
-    try:
-        # 创建要保存的上下文副本，以防在写入时被其他线程修改
-        # 如果在 queue_lock 保护下调用，则直接使用全局 chat_contexts 即可
-        contexts_to_save = dict(chat_contexts) # 创建浅拷贝
-        # --- 新增：保存前合并每个用户的上下文 ---
-        for user in contexts_to_save:
-            contexts_to_save[user] = merge_context(contexts_to_save[user])
-        # --- END ---
-        with open(temp_file_path, 'w', encoding='utf-8') as f:
-            json.dump(contexts_to_save, f, ensure_ascii=False, indent=4)
-        shutil.move(temp_file_path, CHAT_CONTEXTS_FILE) # 原子替换
-        logger.debug(f"聊天上下文已成功保存到 {CHAT_CONTEXTS_FILE}")
-    except Exception as e:
-        logger.error(f"保存聊天上下文到 {CHAT_CONTEXTS_FILE} 失败: {e}", exc_info=True)
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path) # 清理临时文件
-            except OSError:
-                pass # 忽略清理错误
+    """立即将内存中有变更的聊天上下文追加到用户日志（常规情况下由后台写线程定期完成）。"""
+    chat_context_store.flush()
+
+token_counter = TokenCounter()
 
 def get_deepseek_response(message, user_id, store_context=True, is_summary=False):
     """
@@ -946,31 +1026,33 @@ def get_deepseek_response(message, user_id, store_context=True, is_summary=False
                               对于工具调用（如解析或总结），设置为 False。
     """
     try:
-        # 每次调用都重新加载聊天上下文，以应对文件被外部修改的情况
-        load_chat_contexts()
-        
         logger.info(f"调用 Chat API - ID: {user_id}, 是否存储上下文: {store_context}, 消息: {message[:100]}...") # 日志记录消息片段
 
         messages_to_send = []
         context_limit = MAX_GROUPS * 2  # 最大消息总数（不包括系统消息）
+        use_token_budget = get_dynamic_config('ENABLE_TOKEN_BUDGET', ENABLE_TOKEN_BUDGET)
 
         if store_context:
             # --- 处理需要上下文的常规聊天消息 ---
-            # 1. 获取该用户的系统提示词
+            # 1. 获取该用户的系统提示词和核心记忆
             try:
-                user_prompt = get_user_prompt(user_id)
-                messages_to_send.append({"role": "system", "content": user_prompt})
+                user_prompt, memory_prompt = get_user_prompt_parts(user_id, query=message)
             except FileNotFoundError as e:
                 logger.error(f"用户 {user_id} 的提示文件错误: {e}，使用默认提示。")
-                messages_to_send.append({"role": "system", "content": "你是一个乐于助人的助手。"})
-
-            # 2. 管理并检索聊天历史记录
-            with queue_lock: # 确保对 chat_contexts 的访问是线程安全的
-                if user_id not in chat_contexts:
-                    chat_contexts[user_id] = []
-
-                # 在添加当前消息之前获取现有历史记录
-                history = list(chat_contexts.get(user_id, []))  # 获取副本
+                user_prompt, memory_prompt = "你是一个乐于助人的助手。", ''
+
+            # 2. 从内存存储中检索聊天历史记录（外部修改由存储自行检测）
+            history = chat_context_store.get(user_id)
+
+            if use_token_budget:
+                # 3. 在 MAX_GROUPS 轮以内，系统提示词、记忆、当前消息和预留回复之外的预算从最新的历史消息开始填充
+                plan = build_context(token_counter, user_prompt, memory_prompt, history, message,
+                                     budget=get_dynamic_config('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET),
+                                     reply_reserve=MAX_TOKEN, max_history_messages=context_limit)
+                messages_to_send = plan.messages
+                logger.info(f"上下文预算 (ID: {user_id})：{format_breakdown(plan.breakdown)}")
+            else:
+                messages_to_send.append({"role": "system", "content": append_section(user_prompt, memory_prompt)})
 
                 # 如果历史记录超过限制，则进行裁剪
                 if len(history) > context_limit:
@@ -982,15 +1064,8 @@ def get_deepseek_response(message, user_id, store_context=True, is_summary=False
                 # 3. 将当前用户消息添加到 API 请求列表中
                 messages_to_send.append({"role": "user", "content": message})
 
-                # 4. 在准备 API 调用后更新持久上下文
-                # 将用户消息添加到持久存储中
-                chat_contexts[user_id].append({"role": "user", "content": message})
-                # 如果需要，裁剪持久存储（在助手回复后会再次裁剪）
-                if len(chat_contexts[user_id]) > context_limit + 1:  # +1 因为刚刚添加了用户消息
-                    chat_contexts[user_id] = chat_contexts[user_id][-(context_limit + 1):]
-                
-                # 保存上下文到文件
-                save_chat_contexts() # 在用户消息添加后保存一次
+            # 4. 更新持久上下文（+1 因为刚刚添加了用户消息，在助手回复后会再次裁剪），由后台线程落盘
+            chat_context_store.append(user_id, {"role": "user", "content": message}, max_messages=context_limit + 1)
 
         else:
             # --- 处理工具调用（如提醒解析、总结） ---
@@ -1002,17 +1077,7 @@ def get_deepseek_response(message, user_id, store_context=True, is_summary=False
 
         # --- 如果需要，存储助手回复到上下文中 ---
         if store_context:
-            with queue_lock: # 再次获取锁来更新和保存
-                if user_id not in chat_contexts:
-                   chat_contexts[user_id] = []  # 安全初始化 (理论上此时应已存在)
-
-                chat_contexts[user_id].append({"role": "assistant", "content": reply})
-
-                if len(chat_contexts[user_id]) > context_limit:
-                    chat_contexts[user_id] = chat_contexts[user_id][-context_limit:]
-                
-                # 保存上下文到文件
-                save_chat_contexts() # 在助手回复添加后再次保存
+            chat_context_store.append(user_id, {"role": "assistant", "content": reply}, max_messages=context_limit)
         
         return reply
 
@@ -1031,14 +1096,20 @@ def strip_before_thought_tags(text):
     else:
         return text
 
+def _is_usable_reply(content):
+    """主模型回复是否可用：非空、不是图片占位符，且去掉思考过程后仍有内容。"""
+    content = content.strip()
+    return bool(content) and "[image]" not in content and content != "ext" and bool(strip_before_thought_tags(content))
+
 def call_chat_api_with_retry(messages_to_send, user_id, max_retries=2, is_summary=False):
     """
-    调用 Chat API 并在第一次失败或返回空结果时重试。
+    调用 Chat API（经 chat_provider_pool，配置了备用服务商时支持对冲请求与故障转移），
+    返回空结果时重试；限流、超时等请求错误由 llm_gateway 退避重试。
 
     参数:
         messages_to_send (list): 要发送给 API 的消息列表。
         user_id (str): 用户或系统组件的标识符。
-        max_retries (int): 最大重试次数。
+        max_retries (int): 返回空结果时的最大重试次数。
 
     返回:
         str: API 返回的文本回复。
@@ -1052,37 +1123,23 @@ def call_chat_api_with_retry(messages_to_send, user_id, max_retries=2, is_summar
         try:
             logger.debug(f"发送给 API 的消息 (ID: {user_id}): {messages_to_send}")
 
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=messages_to_send,
+            result = chat_provider_pool.complete(
+                messages_to_send,
+                validate=_is_usable_reply,
+                purpose='summary' if is_summary else 'chat',
                 temperature=TEMPERATURE,
-                max_tokens=MAX_TOKEN,
-                stream=False
+                max_tokens=MAX_TOKEN
             )
-
-            if response.choices:
-                # 检查API是否返回了空的消息内容
-                message_content = response.choices[0].message.content
-                if message_content is None:
-                    logger.error(f"API返回了空的信息，可能是因为触发了安全检查机制，请修改Prompt并清空上下文再试 (ID: {user_id})")
-                    logger.error(f"错误请求消息体模型: {MODEL}")
-                    logger.error(json.dumps(messages_to_send, ensure_ascii=False, indent=2))
-                    logger.error(f"完整响应对象: {response}")
-                else:
-                    content = message_content.strip()
-                    if content and "[image]" not in content and content != "ext":
-                        filtered_content = strip_before_thought_tags(content)
-                        if filtered_content:
-                            return filtered_content
+            if result.hedged or result.attempts > 1:
+                logger.info(f"本次回复来自服务商 {result.provider}（共发出 {result.attempts} 个请求）(ID: {user_id})")
+
+            # 检查API是否返回了空的消息内容
+            message_content = result.content
+            if message_content is None:
+                logger.error(f"API返回了空的信息，可能是因为触发了安全检查机制，请修改Prompt并清空上下文再试 (ID: {user_id})")
+            elif _is_usable_reply(message_content):
+                return strip_before_thought_tags(message_content.strip())
             else:
-                # 记录错误日志 - 无选择项
-                logger.error(f"API返回了空的选择项 (ID: {user_id})")
-                logger.error(f"错误请求消息体模型: {MODEL}")
-                logger.error(json.dumps(messages_to_send, ensure_ascii=False, indent=2))
-                logger.error(f"完整响应对象: {response}")
-
-            # 如果到这里说明内容为空或过滤后为空
-            if response.choices and response.choices[0].message.content is not None:
                 logger.error(f"API返回了空的内容或内容被过滤 (ID: {user_id})")
             logger.error(f"错误请求消息体模型: {MODEL}")
             logger.error(json.dumps(messages_to_send, ensure_ascii=False, indent=2))
@@ -1091,20 +1148,17 @@ def call_chat_api_with_retry(messages_to_send, user_id, max_retries=2, is_summar
             logger.error(f"错误请求消息体: {MODEL}")
             logger.error(json.dumps(messages_to_send, ensure_ascii=False, indent=2))
             error_info = str(e)
-            logger.error(f"自动重试：第 {attempt + 1} 次调用 {MODEL}失败 (ID: {user_id}) 原因: {error_info}", exc_info=False)
+            logger.error(f"第 {attempt + 1} 次调用 {MODEL} 失败 (ID: {user_id}) 原因: {error_info}", exc_info=False)
 
             # 细化错误分类
             if "real name verification" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈请完成实名认证后再使用！\033[0m")
-                break  # 终止循环，不再重试
             elif "rate limit" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈当前访问 API 服务频次达到上限，请稍后再试！\033[0m")
             elif "payment required" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈您正在使用付费模型，请先充值再使用或使用免费额度模型！\033[0m")
-                break  # 终止循环，不再重试
             elif "user quota" in error_info or "is not enough" in error_info or "UnlimitedQuota" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈，你的余额不足，请先充值再使用! 如有余额，请检查令牌是否为无限额度。\033[0m")
-                break  # 终止循环，不再重试
             elif "Api key is invalid" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈 API KEY 不可用，请检查配置选项！\033[0m")
             elif "service unavailable" in error_info:
@@ -1115,10 +1169,13 @@ def call_chat_api_with_retry(messages_to_send, user_id, max_retries=2, is_summar
                     logger.warning(f"已开启敏感词自动清除上下文功能，开始清除用户 {user_id} 的聊天上下文和临时记忆")
                     clear_chat_context(user_id)
                     clear_memory_temp_files(user_id)  # 清除临时记忆文件
-                break  # 终止循环，不再重试
             else:
                 logger.error("\033[31m未知错误：" + error_info + "\033[0m")
+            # 限流、超时等可重试的错误已由网关退避重试过，其余错误重试无意义
+            break
 
+        if attempt < max_retries:
+            time.sleep(llm_gateway.backoff_delay(attempt))  # 空回复重试前退避，避免紧密循环
         attempt += 1
 
     raise RuntimeError("抱歉，我现在有点忙，稍后再聊吧。")
@@ -1135,7 +1192,7 @@ def get_assistant_response(message, user_id, is_summary=False):
     返回:
         str: 辅助模型返回的文本回复。
     """
-    if not assistant_client:
+    if not ENABLE_ASSISTANT_MODEL:
         logger.warning(f"辅助模型客户端未初始化，回退使用主模型。用户ID: {user_id}")
         # 回退到主模型
         return get_deepseek_response(message, user_id, store_context=False, is_summary=is_summary)
@@ -1158,12 +1215,12 @@ def get_assistant_response(message, user_id, is_summary=False):
 
 def call_assistant_api_with_retry(messages_to_send, user_id, max_retries=2, is_summary=False):
     """
-    调用辅助模型 API 并在第一次失败或返回空结果时重试。
+    调用辅助模型 API，返回空结果时重试；限流、超时等请求错误由 llm_gateway 退避重试。
 
     参数:
         messages_to_send (list): 要发送给辅助模型的消息列表。
         user_id (str): 用户或系统组件的标识符。
-        max_retries (int): 最大重试次数。
+        max_retries (int): 返回空结果时的最大重试次数。
 
     返回:
         str: 辅助模型返回的文本回复。
@@ -1173,9 +1230,9 @@ def call_assistant_api_with_retry(messages_to_send, user_id, max_retries=2, is_s
         try:
             logger.debug(f"发送给辅助模型 API 的消息 (ID: {user_id}): {messages_to_send}")
 
-            response = assistant_client.chat.completions.create(
-                model=ASSISTANT_MODEL,
-                messages=messages_to_send,
+            response = llm_gateway.chat(
+                ASSISTANT_BASE_URL, ASSISTANT_API_KEY, ASSISTANT_MODEL, messages_to_send,
+                purpose='assistant',
                 temperature=ASSISTANT_TEMPERATURE,
                 max_tokens=ASSISTANT_MAX_TOKEN,
                 stream=False
@@ -1213,20 +1270,17 @@ def call_assistant_api_with_retry(messages_to_send, user_id, max_retries=2, is_s
             logger.error(f"{ASSISTANT_MODEL}")
             logger.error(json.dumps(messages_to_send, ensure_ascii=False, indent=2))
             error_info = str(e)
-            logger.error(f"辅助模型自动重试：第 {attempt + 1} 次调用失败 (ID: {user_id}) 原因: {error_info}", exc_info=False)
+            logger.error(f"辅助模型第 {attempt + 1} 次调用失败 (ID: {user_id}) 原因: {error_info}", exc_info=False)
 
             # 细化错误分类
             if "real name verification" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈请完成实名认证后再使用！\033[0m")
-                break  # 终止循环，不再重试
             elif "rate limit" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈当前访问 API 服务频次达到上限，请稍后再试！\033[0m")
             elif "payment required" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈您正在使用付费模型，请先充值再使用或使用免费额度模型！\033[0m")
-                break  # 终止循环，不再重试
             elif "user quota" in error_info or "is not enough" in error_info or "UnlimitedQuota" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈，你的余额不足，请先充值再使用! 如有余额，请检查令牌是否为无限额度。\033[0m")
-                break  # 终止循环，不再重试
             elif "Api key is invalid" in error_info:
                 logger.error("\033[31m错误：API 服务商反馈 API KEY 不可用，请检查配置选项！\033[0m")
             elif "service unavailable" in error_info:
@@ -1237,10 +1291,13 @@ def call_assistant_api_with_retry(messages_to_send, user_id, max_retries=2, is_s
                     logger.warning(f"已开启敏感词自动清除上下文功能，开始清除用户 {user_id} 的聊天上下文和临时记忆")
                     clear_chat_context(user_id)
                     clear_memory_temp_files(user_id)  # 清除临时记忆文件
-                break  # 终止循环，不再重试
             else:
                 logger.error("\033[31m未知错误：" + error_info + "\033[0m")
+            # 限流、超时等可重试的错误已由网关退避重试过，其余错误重试无意义
+            break
 
+        if attempt < max_retries:
+            time.sleep(llm_gateway.backoff_delay(attempt))  # 空回复重试前退避，避免紧密循环
         attempt += 1
 
     raise RuntimeError("抱歉，辅助模型现在有点忙，稍后再试吧。")
@@ -1286,13 +1343,93 @@ def keep_alive():
         # 等待指定间隔后再进行下一次检查
         time.sleep(check_interval)
 
+def _merged_image_path(content):
+    """合并转发中的图片可能是 WindowsPath 对象或字符串路径，返回路径字符串，不是图片时返回 None。"""
+    # WindowsPath对象
+    if hasattr(content, 'suffix') and str(content.suffix).lower() in MERGED_IMAGE_SUFFIXES:
+        return str(content)
+    # 字符串路径 (兼容性保留)
+    if isinstance(content, str) and content.lower().endswith(MERGED_IMAGE_SUFFIXES):
+        return content
+    return None
+
+def _recognize_merged_image(image_path):
+    logger.info(f"开始识别图片: {image_path}")
+    try:
+        image_content = recognize_image_with_moonshot(image_path, is_emoji=False)
+    except Exception as e:
+        logger.error(f"图片识别失败: {e}")
+        return "[图片识别失败]"
+    if image_content:
+        logger.info(f"图片识别成功: {image_content}")
+        return f"[图片识别结果]: {image_content}"
+    return "[图片识别结果]: 无法识别图片内容"
+
+def format_merged_messages(mergecontent):
+    """
+    把合并转发的消息列表转换为多行文本。
+    其中的图片提交到识别线程池并发识别，全部完成后按原顺序填回；识别期间暂停派发消息。
+    """
+    lines = []
+    pending = []  # [(行号, Future)]
+    with dispatch_pause.paused():
+        for item in mergecontent:
+            if not (isinstance(item, list) and len(item) == 3):
+                lines.append(str(item))
+                continue
+            sender, content, timestamp = item
+            image_path = _merged_image_path(content)
+            if image_path is not None:
+                if ENABLE_IMAGE_RECOGNITION:
+                    pending.append((len(lines), merged_image_pool.submit(_recognize_merged_image, image_path)))
+                    content = None  # 稍后填入识别结果
+                else:
+                    content = "[图片]"
+            lines.append((timestamp, sender, content))
+        if pending:
+            logger.info(f"合并转发消息中有 {len(pending)} 张图片，并发识别中...")
+        for index, future in pending:
+            timestamp, sender, _ = lines[index]
+            try:
+                content = future.result()
+            except Exception as e:
+                logger.error(f"图片识别失败: {e}")
+                content = "[图片识别失败]"
+            lines[index] = (timestamp, sender, content)
+    return "\n".join(
+        line if isinstance(line, str) else f"[{line[0]}] {line[1]}: {line[2]}" for line in lines
+    )
+
 def message_listener(msg, chat):
-    global can_send_messages
-    who = chat.who 
-    msgtype = msg.type
-    original_content = msg.content
-    sender = msg.sender
-    msgattr = msg.attr
+    """wxauto 回调：只记录消息快照并放入预处理队列，按聊天保持顺序。"""
+    record = IncomingMessage(chat.who, msg, msg.type, msg.attr, msg.sender, msg.content, time.time())
+    try:
+        ingest_pool.submit(record.who, process_incoming_message, record)
+    except RuntimeError as e:
+        logger.warning(f"消息预处理队列已关闭，忽略来自 {record.who} 的消息: {e}")
+
+# 提醒关键词：包含其中任一词的消息标记为提醒候选
+REMINDER_KEYWORDS = ["每日","每天","提醒","提醒我", "定时", "分钟后", "小时后", "计时", "闹钟", "通知我", "叫我", "提醒一下", "倒计时", "稍后提醒", "稍后通知", "提醒时间", "设置提醒", "喊我"]
+
+trigger_engine = TriggerEngine()
+
+def scan_message_triggers(content):
+    """一次扫描找出消息中的群聊关键词、提醒关键词和 @机器人（配置变化时自动重建匹配器）。"""
+    trigger_engine.configure(
+        keywords=get_dynamic_config('GROUP_KEYWORD_LIST', GROUP_KEYWORD_LIST),
+        reminder_keywords=REMINDER_KEYWORDS,
+        robot_name=ROBOT_WX_NAME,
+    )
+    return trigger_engine.scan(content)
+
+def process_incoming_message(record):
+    """预处理线程：把原始消息整理为文本（语音、链接、引用、合并转发等），过滤后交给消息处理流程。"""
+    who = record.who
+    msg = record.msg
+    msgtype = record.type
+    original_content = record.content
+    sender = record.sender
+    msgattr = record.attr
     logger.info(f'收到来自聊天窗口 "{who}" 中用户 "{sender}" 的原始消息 (类型: {msgtype}, 属性: {msgattr}): {original_content[:100]}')
 
     if msgattr == 'tickle':
@@ -1338,64 +1475,7 @@ def message_listener(msg, chat):
         # mergecontent 是一个列表，每个元素是 [发送者, 内容, 时间]
         # 转换为多行文本，每行格式: [时间] 发送者: 内容
         if isinstance(mergecontent, list):
-            merged_text_lines = []
-            for item in mergecontent:
-                if isinstance(item, list) and len(item) == 3:
-                    sender, content, timestamp = item
-                    # 修改这里的判断逻辑，正确处理WindowsPath对象
-                    # 检查是否为WindowsPath对象
-                    if hasattr(content, 'suffix') and str(content.suffix).lower() in ('.png', '.jpg', '.jpeg', '.gif', '.bmp'):
-                        # 是WindowsPath对象且是图片
-                        if ENABLE_IMAGE_RECOGNITION:
-                            try:
-                                logger.info(f"开始识别图片: {str(content)}")
-                                # 将WindowsPath对象转换为字符串
-                                image_path = str(content)
-                                # 保存当前状态
-                                original_can_send_messages = can_send_messages
-                                # 处理图片
-                                content = recognize_image_with_moonshot(image_path, is_emoji=False)
-                                if content:
-                                    logger.info(f"图片识别成功: {content}")
-                                    content = f"[图片识别结果]: {content}"
-                                else:
-                                    content = "[图片识别结果]: 无法识别图片内容"
-                                # 确保状态恢复
-                                can_send_messages = original_can_send_messages
-                            except Exception as e:
-                                content = "[图片识别失败]"
-                                logger.error(f"图片识别失败: {e}")
-                                # 确保状态恢复
-                                can_send_messages = True
-                        else:
-                            content = "[图片]"
-                    # 处理字符串路径的判断 (兼容性保留)
-                    elif isinstance(content, str) and content.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp')):
-                        if ENABLE_IMAGE_RECOGNITION:
-                            try:
-                                logger.info(f"开始识别图片: {content}")
-                                # 保存当前状态
-                                original_can_send_messages = can_send_messages
-                                # 处理图片
-                                image_content = recognize_image_with_moonshot(content, is_emoji=False)
-                                if image_content:
-                                    logger.info(f"图片识别成功: {image_content}")
-                                    content = f"[图片识别结果]: {image_content}"
-                                else:
-                                    content = "[图片识别结果]: 无法识别图片内容"
-                                # 确保状态恢复
-                                can_send_messages = original_can_send_messages
-                            except Exception as e:
-                                content = "[图片识别失败]"
-                                logger.error(f"图片识别失败: {e}")
-                                # 确保状态恢复
-                                can_send_messages = True
-                        else:
-                            content = "[图片]"
-                    merged_text_lines.append(f"[{timestamp}] {sender}: {content}")
-                else:
-                    merged_text_lines.append(str(item))
-            merged_text = "\n".join(merged_text_lines)
+            merged_text = format_merged_messages(mergecontent)
             original_content = f"[合并转发消息]:\n{merged_text}"
         else:
             original_content = f"[合并转发消息]: {mergecontent}"
@@ -1407,6 +1487,7 @@ def message_listener(msg, chat):
         
     should_process_this_message = False
     content_for_handler = original_content 
+    triggers = scan_message_triggers(original_content)
 
     is_group_chat = is_user_group_chat(who)
 
@@ -1422,28 +1503,16 @@ def message_listener(msg, chat):
         keyword_triggered = False
 
         if not ACCEPT_ALL_GROUP_CHAT_MESSAGES and ENABLE_GROUP_AT_REPLY and ROBOT_WX_NAME:
-            temp_content_after_at_check = processed_group_content
-            
-            unicode_at_pattern = f'@{re.escape(ROBOT_WX_NAME)}\u2005'
-            space_at_pattern = f'@{re.escape(ROBOT_WX_NAME)} '
-            exact_at_string = f'@{re.escape(ROBOT_WX_NAME)}'
-            
-            if re.search(unicode_at_pattern, processed_group_content):
-                at_triggered = True
-                temp_content_after_at_check = re.sub(unicode_at_pattern, '', processed_group_content, 1).strip()
-            elif re.search(space_at_pattern, processed_group_content):
+            # 优先级：@机器人\u2005 > @机器人+空格 > 整条消息只有 @机器人，移除第一处后再检查关键词
+            mention_span = triggers.mention_span()
+            if mention_span is not None:
                 at_triggered = True
-                temp_content_after_at_check = re.sub(space_at_pattern, '', processed_group_content, 1).strip()
-            elif processed_group_content.strip() == exact_at_string:
-                at_triggered = True
-                temp_content_after_at_check = ''
-                
-            if at_triggered:
                 logger.info(f"群聊 '{who}' 中检测到 @机器人。")
-                processed_group_content = temp_content_after_at_check
+                triggers = triggers.without(mention_span)
+                processed_group_content = triggers.text.strip()
 
         if ENABLE_GROUP_KEYWORD_REPLY:
-            if any(keyword in processed_group_content for keyword in GROUP_KEYWORD_LIST):
+            if triggers.has(TRIGGER_KEYWORD):
                 keyword_triggered = True
                 logger.info(f"群聊 '{who}' 中检测到关键词。")
         
@@ -1499,55 +1568,64 @@ def message_listener(msg, chat):
         if is_animation_emoji_in_original and ENABLE_EMOJI_RECOGNITION:
             handle_emoji_message(msg, who)
         else:
-            handle_wxauto_message(msg, who)
+            handle_wxauto_message(msg, who, received_at=record.received_at, triggers=triggers)
 
 def recognize_image_with_moonshot(image_path, is_emoji=False):
-    # 先暂停向API发送消息队列
-    global can_send_messages
-    can_send_messages = False
-
-    """使用AI识别图片内容并返回文本"""
+    """使用AI识别图片内容并返回文本（相同或几乎相同的图片直接使用缓存结果）"""
+    # 先暂停向API发送消息队列（可与其他识别并发，全部结束后才恢复）
+    dispatch_pause.pause()
     try:
 
         processed_image_path = image_path
         
-        # 读取图片内容并编码
+        # 读取图片内容
         with open(processed_image_path, 'rb') as img_file:
-            image_content = base64.b64encode(img_file.read()).decode('utf-8')
-            
-        headers = {
-            'Authorization': f'Bearer {MOONSHOT_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        text_prompt = "请用中文描述这张图片的主要内容或主题。不要使用'这是'、'这张'等开头，直接描述。如果有文字，请包含在描述中。" if not is_emoji else "请用中文简洁地描述这个聊天窗口最后一张表情包所表达的情绪、含义或内容。如果表情包含文字，请一并描述。注意：1. 只描述表情包本身，不要添加其他内容 2. 不要出现'这是'、'这个'等词语"
-        data = {
-            "model": MOONSHOT_MODEL,
-            "messages": [
+            image_bytes = img_file.read()
+
+        cache_kind = 'emoji' if is_emoji else 'image'
+        # 表情截图每次可能有几个像素的差异，额外使用感知哈希匹配
+        recognized_text = recognition_cache.lookup(image_bytes, cache_kind, perceptual=is_emoji)
+        if recognized_text:
+            logger.info(f"AI图片识别结果 (缓存): {recognized_text}")
+        else:
+            started_at = time.time()
+            # 缩小并去除元数据后再上传，MIME 类型按实际编码格式填写
+            prepared_image = image_preprocessor.prepare(
+                image_bytes, max_edge=get_dynamic_config('IMAGE_RECOGNITION_MAX_EDGE', 1600))
+                
+            text_prompt = "请用中文描述这张图片的主要内容或主题。不要使用'这是'、'这张'等开头，直接描述。如果有文字，请包含在描述中。" if not is_emoji else "请用中文简洁地描述这个聊天窗口最后一张表情包所表达的情绪、含义或内容。如果表情包含文字，请一并描述。注意：1. 只描述表情包本身，不要添加其他内容 2. 不要出现'这是'、'这个'等词语"
+            messages = [
                 {
                     "role": "user",
                     "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_content}"}},
+                        {"type": "image_url", "image_url": {"url": prepared_image.data_url}},
                         {"type": "text", "text": text_prompt}
                     ]
                 }
-            ],
-            "temperature": MOONSHOT_TEMPERATURE
-        }
-        
-        response = requests.post(f"{MOONSHOT_BASE_URL}/chat/completions", headers=headers, json=data)
-        response.raise_for_status()
-        result = response.json()
-        recognized_text = result['choices'][0]['message']['content']
-        
-        if is_emoji:
-            # 如果recognized_text包含"最后一张表情包是"，只保留后面的文本
-            if "最后一张表情包" in recognized_text:
-                recognized_text = recognized_text.split("最后一张表情包", 1)[1].strip()
-            recognized_text = "发送了表情包：" + recognized_text
-        else:
-            recognized_text = "发送了图片：" + recognized_text
+            ]
+
+            response = llm_gateway.chat(
+                MOONSHOT_BASE_URL, MOONSHOT_API_KEY, MOONSHOT_MODEL, messages,
+                purpose='emoji' if is_emoji else 'vision',
+                temperature=MOONSHOT_TEMPERATURE
+            )
+            description = (response.choices[0].message.content or '').strip()
             
-        logger.info(f"AI图片识别结果: {recognized_text}")
+            if is_emoji:
+                # 如果recognized_text包含"最后一张表情包是"，只保留后面的文本
+                if "最后一张表情包" in description:
+                    description = description.split("最后一张表情包", 1)[1].strip()
+                recognized_text = "发送了表情包：" + description
+            else:
+                recognized_text = "发送了图片：" + description
+                
+            logger.info(f"AI图片识别结果: {recognized_text}")
+            if description:
+                recognition_cache.put(image_bytes, cache_kind, recognized_text, perceptual=is_emoji,
+                                      latency=time.time() - started_at)
+            else:
+                # 空结果不缓存，下次收到同一张图片时重新识别
+                logger.warning("AI图片识别返回空内容，本次结果不写入缓存。")
         
         # 清理临时文件
         if is_emoji and os.path.exists(processed_image_path):
@@ -1557,35 +1635,38 @@ def recognize_image_with_moonshot(image_path, is_emoji=False):
             except Exception as clean_err:
                 logger.warning(f"清理临时表情图片失败: {clean_err}")
                 
-        # 恢复向Deepseek发送消息队列
-        can_send_messages = True
         return recognized_text
 
     except Exception as e:
         logger.error(f"调用AI识别图片失败: {str(e)}", exc_info=True)
-        # 恢复向Deepseek发送消息队列
-        can_send_messages = True
         return ""
+    finally:
+        # 恢复向Deepseek发送消息队列
+        dispatch_pause.resume()
 
 def handle_emoji_message(msg, who):
-    global emoji_timer
-    global can_send_messages
-    can_send_messages = False
+    global emoji_debounce_handle
+    # 等待防抖期间暂停派发，表情识别结果可与同批消息合并
+    dispatch_pause.pause()
 
     def timer_callback():
-        with emoji_timer_lock:           
-            handle_wxauto_message(msg, who)   
-            emoji_timer = None       
+        try:
+            with emoji_timer_lock:
+                handle_wxauto_message(msg, who)
+        finally:
+            dispatch_pause.resume()
 
-    with emoji_timer_lock:
-        if emoji_timer is not None:
-            emoji_timer.cancel()
-        emoji_timer = threading.Timer(3.0, timer_callback)
-        emoji_timer.start()
+    # 防抖：新的表情包会取消尚未处理的上一个，被取消的任务不会执行回调，在这里释放它的暂停
+    with emoji_debounce_lock:
+        previous = emoji_debounce_handle
+        emoji_debounce_handle = timer_service.debounce('emoji', EMOJI_DEBOUNCE_SECONDS, timer_callback, blocking=True)
+    if previous is not None and previous.cancelled:
+        dispatch_pause.resume()
 
 def is_safe_url(url: str) -> bool:
     """
     验证URL是否安全，防止SSRF攻击。
+    域名解析结果带缓存；实际连接使用检查过的 IP（见 web_fetch.PinnedAddressAdapter）。
     
     Args:
         url: 要验证的URL
@@ -1593,74 +1674,25 @@ def is_safe_url(url: str) -> bool:
     Returns:
         bool: URL是否安全
     """
-    try:
-        import socket
-        import ipaddress
-        
-        parsed = urlparse(url)
-        
-        # 1. 只允许HTTP和HTTPS协议
-        if parsed.scheme not in ['http', 'https']:
-            logger.warning(f"不允许的协议: {parsed.scheme}")
-            return False
-        
-        # 2. 获取主机名
-        hostname = parsed.hostname
-        if not hostname:
-            logger.warning("URL中没有主机名")
-            return False
-        
-        # 3. 解析IP地址并检查是否为内网地址
-        try:
-            # 解析域名到IP
-            ip = socket.gethostbyname(hostname)
-            ip_obj = ipaddress.ip_address(ip)
-            
-            # 检查是否为私有地址、回环地址、链路本地地址等
-            if (ip_obj.is_private or 
-                ip_obj.is_loopback or 
-                ip_obj.is_link_local or
-                ip_obj.is_reserved or
-                ip_obj.is_multicast):
-                logger.warning(f"禁止访问内网/特殊地址: {hostname} -> {ip}")
-                return False
-            
-            # 额外检查：禁止访问云元数据服务
-            if ip.startswith('169.254.'):
-                logger.warning(f"禁止访问云元数据服务: {hostname} -> {ip}")
-                return False
-                
-        except socket.gaierror:
-            # 域名无法解析
-            logger.warning(f"域名无法解析: {hostname}")
-            return False
-        except ValueError as e:
-            # IP地址格式错误
-            logger.warning(f"IP地址格式错误: {hostname}, 错误: {e}")
-            return False
-        
-        # 4. 端口限制（只允许常见的HTTP/HTTPS端口）
-        port = parsed.port
-        allowed_ports = [80, 443, 8080, 8443]
-        if port and port not in allowed_ports:
-            logger.warning(f"不允许的端口: {port}, 仅允许: {allowed_ports}")
-            return False
-        
-        # 5. URL长度限制
-        if len(url) > 2048:
-            logger.warning(f"URL过长: {len(url)} 字符")
-            return False
-        
-        return True
-        
-    except Exception as e:
-        logger.error(f"URL安全验证失败: {url}, 错误: {e}")
-        return False
+    return web_fetcher.is_safe_url(url)
+
+# 链接内容抓取：共享连接池，按 URL 缓存提取后的正文（支持 ETag/Last-Modified 条件请求）
+WEB_FETCH_CACHE_TTL = 1800  # 秒，正文缓存有效期
+WEB_FETCH_CACHE_MAX_ENTRIES = 500
+WEB_FETCH_MAX_BYTES = 1024 * 1024  # 每个页面最多下载的字节数，正文足够时会更早停止
+WEB_FETCH_DNS_TTL = 300  # 秒，域名解析结果缓存时间
+WEB_FETCH_DNS_NEGATIVE_TTL = 30  # 秒，解析失败的缓存时间
+web_fetcher = WebFetcher(
+    resolver=DNSCache(ttl=WEB_FETCH_DNS_TTL, negative_ttl=WEB_FETCH_DNS_NEGATIVE_TTL),
+    cache_ttl=WEB_FETCH_CACHE_TTL,
+    max_entries=WEB_FETCH_CACHE_MAX_ENTRIES,
+    max_bytes=WEB_FETCH_MAX_BYTES
+)
 
 def fetch_and_extract_text(url: str) -> Optional[str]:
     """
     获取给定 URL 的网页内容并提取主要文本。
-    已增强SSRF防护。
+    已增强SSRF防护；通过共享连接池抓取，相同链接在缓存有效期内直接返回缓存的正文。
 
     Args:
         url (str): 要抓取的网页链接。
@@ -1669,94 +1701,12 @@ def fetch_and_extract_text(url: str) -> Optional[str]:
         Optional[str]: 提取并清理后的网页文本内容（限制了最大长度），如果失败则返回 None。
     """
     try:
-        # SSRF防护 - 验证URL安全性
-        if not is_safe_url(url):
-            logger.warning(f"URL安全检查失败，拒绝访问: {url}")
-            return None
-        
-        # 基本 URL 格式验证
-        parsed_url = urlparse(url)
-        if not all([parsed_url.scheme, parsed_url.netloc]):
-             logger.warning(f"无效的URL格式，跳过抓取: {url}")
-             return None
-
-        headers = {'User-Agent': REQUESTS_USER_AGENT}
-        logger.info(f"开始抓取链接内容: {url}")
-        
-        # 使用自定义Session处理跳转，验证每个跳转目标的安全性
-        session = requests.Session()
-        session.headers.update(headers)
-        session.max_redirects = 5  # 限制最大跳转次数
-        
-        # 创建钩子函数，在每次跳转前验证URL安全性
-        def check_redirect_safety(response, *args, **kwargs):
-            if response.is_redirect:
-                redirect_url = response.headers.get('Location', '')
-                # 处理相对路径
-                from urllib.parse import urljoin
-                absolute_redirect = urljoin(response.url, redirect_url)
-                
-                # 验证跳转目标的安全性
-                if not is_safe_url(absolute_redirect):
-                    logger.warning(f"跳转目标不安全，已阻止: {response.url} -> {absolute_redirect}")
-                    raise requests.exceptions.RequestException(f"不安全的跳转目标: {absolute_redirect}")
-                
-                logger.debug(f"安全跳转: {response.url} -> {absolute_redirect}")
-        
-        session.hooks['response'].append(check_redirect_safety)
-        
-        # 发送请求，允许经过安全验证的跳转
-        response = session.get(url, timeout=REQUESTS_TIMEOUT, allow_redirects=True, verify=True)
-        response.raise_for_status()  # 检查HTTP请求是否成功 (状态码 2xx)
-
-        # 检查内容类型，避免处理非HTML内容（如图片、PDF等）
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'html' not in content_type:
-            logger.warning(f"链接内容类型非HTML ({content_type})，跳过文本提取: {url}")
-            return None
-
-        # 使用BeautifulSoup解析HTML
-        # 指定 lxml 解析器以获得更好的性能和兼容性
-        soup = BeautifulSoup(response.content, 'lxml') # 使用 response.content 获取字节流，让BS自动处理编码
-
-        # --- 文本提取策略 ---
-        # 尝试查找主要内容区域 (这部分可能需要根据常见网站结构调整优化)
-        main_content_tags = ['article', 'main', '.main-content', '#content', '.post-content'] # 示例选择器
-        main_text = ""
-        for tag_selector in main_content_tags:
-            element = soup.select_one(tag_selector)
-            if element:
-                main_text = element.get_text(separator='\n', strip=True)
-                break # 找到一个就停止
-
-        # 如果没有找到特定的主要内容区域，则获取整个 body 的文本作为备选
-        if not main_text and soup.body:
-            main_text = soup.body.get_text(separator='\n', strip=True)
-        elif not main_text: # 如果连 body 都没有，则使用整个 soup
-             main_text = soup.get_text(separator='\n', strip=True)
-
-        # 清理文本：移除过多空行
-        lines = [line for line in main_text.splitlines() if line.strip()]
-        cleaned_text = '\n'.join(lines)
-
-        # 限制内容长度
-        if len(cleaned_text) > MAX_WEB_CONTENT_LENGTH:
-            cleaned_text = cleaned_text[:MAX_WEB_CONTENT_LENGTH] + "..." # 截断并添加省略号
-            logger.info(f"网页内容已提取，并截断至 {MAX_WEB_CONTENT_LENGTH} 字符。")
-        elif cleaned_text:
-            logger.info(f"成功提取网页文本内容 (长度 {len(cleaned_text)}).")
-        else:
-            logger.warning(f"未能从链接 {url} 提取到有效文本内容。")
-            return None # 如果提取后为空，也视为失败
-
-        return cleaned_text
-
-    except requests.exceptions.Timeout:
-        logger.error(f"抓取链接超时 ({REQUESTS_TIMEOUT}秒): {url}")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"抓取链接时发生网络错误: {url}, 错误: {e}")
-        return None
+        return web_fetcher.fetch_text(
+            url,
+            timeout=REQUESTS_TIMEOUT,
+            max_length=MAX_WEB_CONTENT_LENGTH,
+            user_agent=REQUESTS_USER_AGENT
+        )
     except Exception as e:
         # 捕获其他可能的错误，例如 BS 解析错误
         logger.error(f"处理链接时发生未知错误: {url}, 错误: {e}", exc_info=True)
@@ -1828,6 +1778,7 @@ def _update_config_boolean(key: str, value: bool) -> bool:
         with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(new_content)
         shutil.move(tmp_path, config_path)
+        config_snapshot.invalidate()
         # 同步到内存
         try:
             globals()[key] = bool(value)
@@ -1842,14 +1793,18 @@ def _schedule_restart(reason: str = "指令触发"):
     """延迟1.5秒执行重启，尽量保证提示消息已发送。"""
     def _do_restart():
         try:
+            # 等待正在生成的回复及已提交的提示消息发送完毕
+            if not llm_worker_pool.wait_idle(timeout=SEND_QUEUE_DRAIN_TIMEOUT):
+                logger.warning("等待回复生成完成超时。")
+            if not send_scheduler.wait_idle(timeout=SEND_QUEUE_DRAIN_TIMEOUT):
+                logger.warning("等待发送队列清空超时，仍有未发送的消息。")
             # 重启前清理与保存
-            with queue_lock:
-                save_chat_contexts()
+            save_chat_contexts()
+            recognition_cache.save()
             if get_dynamic_config('ENABLE_AUTO_MESSAGE', ENABLE_AUTO_MESSAGE):
                 save_user_timers()
             if ENABLE_REMINDERS:
-                with recurring_reminder_lock:
-                    save_recurring_reminders()
+                save_recurring_reminders()
             if 'async_http_handler' in globals() and isinstance(async_http_handler, AsyncHTTPHandler):
                 try:
                     async_http_handler.close()
@@ -1870,7 +1825,7 @@ def _schedule_restart(reason: str = "指令触发"):
             sys.exit(0)
         except Exception as e:
             logger.error(f"执行重启失败: {e}", exc_info=True)
-    threading.Timer(1.5, _do_restart).start()
+    timer_service.schedule(1.5, _do_restart, blocking=True)
 
 def _handle_text_command_if_any(original_content: str, user_id: str) -> bool:
     """
@@ -1968,11 +1923,12 @@ def _handle_text_command_if_any(original_content: str, user_id: str) -> bool:
         logger.error(f"处理文本命令失败: {e}", exc_info=True)
         return False
 
-def handle_wxauto_message(msg, who):
+def handle_wxauto_message(msg, who, received_at=None, triggers=None):
     """
     处理来自Wxauto的消息，包括可能的提醒、图片/表情、链接内容获取和常规聊天。
+    received_at 为收到消息的时间，消息前的时间戳使用该时间而不是处理完成的时间。
+    triggers 为预处理时已得到的触发词匹配结果，未提供时在这里扫描。
     """
-    global can_send_messages # 引用全局变量以控制发送状态
     global last_received_message_timestamp # 引用全局变量以更新活动时间
     try:
         last_received_message_timestamp = time.time()
@@ -1996,15 +1952,13 @@ def handle_wxauto_message(msg, who):
         on_user_message(username)
 
         # --- 1. 提醒检查 (基于原始消息内容) ---
-        reminder_keywords = ["每日","每天","提醒","提醒我", "定时", "分钟后", "小时后", "计时", "闹钟", "通知我", "叫我", "提醒一下", "倒计时", "稍后提醒", "稍后通知", "提醒时间", "设置提醒", "喊我"]
-        if ENABLE_REMINDERS and any(keyword in original_content for keyword in reminder_keywords):
+        # 包含提醒关键词的消息标记为提醒候选，处理消息队列时与本轮的其他辅助判断一起解析
+        reminder_text = None
+        if triggers is None:
+            triggers = scan_message_triggers(original_content)
+        if ENABLE_REMINDERS and triggers.has(TRIGGER_REMINDER):
             logger.info(f"检测到可能的提醒请求，用户 {username}: {original_content}")
-            # 尝试解析并设置提醒
-            reminder_set = try_parse_and_set_reminder(original_content, username)
-            # 如果成功设置了提醒，则处理完毕，直接返回
-            if reminder_set:
-                logger.info(f"成功为用户 {username} 设置提醒，消息处理结束。")
-                return # 停止进一步处理此消息
+            reminder_text = original_content
 
         # --- 2. 图片/表情处理 (基于原始消息内容) ---
         img_path = None         # 图片路径
@@ -2077,7 +2031,6 @@ def handle_wxauto_message(msg, who):
             # 使用识别结果或回退占位符更新 processed_content
             processed_content = recognized_text if recognized_text else ("[图片]" if not is_emoji else "[动画表情]")
             clean_up_temp_files() # 清理临时截图文件
-            can_send_messages = True # 确保识别后可以发送消息
             logger.info(f"图片/表情识别完成，结果: {processed_content}")
 
         # --- 3. 链接内容获取 (仅当ENABLE_URL_FETCHING为True且当前非图片/表情处理流程时) ---
@@ -2112,56 +2065,106 @@ def handle_wxauto_message(msg, who):
         # 只有在 processed_content 有效时才加入队列
         if processed_content:
             # 获取当前时间戳，添加到消息内容前
-            current_time_str = datetime.now().strftime("%Y-%m-%d %A %H:%M:%S")
+            message_time = datetime.fromtimestamp(received_at) if received_at else datetime.now()
+            current_time_str = message_time.strftime("%Y-%m-%d %A %H:%M:%S")
             content_with_time = f"[{current_time_str}] {processed_content}" # 使用最终处理过的内容
             logger.info(f"准备将处理后的消息加入队列 - 用户 {username}: {content_with_time[:150]}...") # 日志截断防止过长
 
             sender_name = username # 发送者名字（对于好友聊天，who就是username）
 
-            # 使用锁保护对共享队列的访问
-            with queue_lock:
-                # 如果用户队列不存在，则初始化
-                if username not in user_queues:
-                    user_queues[username] = {
-                        'messages': [content_with_time],
-                        'sender_name': sender_name,
-                        'username': username,
-                        'last_message_time': time.time()
-                    }
-                    logger.info(f"已为用户 {sender_name} 初始化消息队列并加入消息。")
-                else:
-                    # 用户队列已存在，追加消息并管理队列长度
-                    user_queues[username]['messages'].append(content_with_time)
-                    # 更新最后消息时间戳
-                    user_queues[username]['last_message_time'] = time.time()
-                    logger.info(f"用户 {sender_name} 的消息已加入队列（当前 {len(user_queues[username]['messages'])} 条）并更新时间。")
+            queued_count = enqueue_user_message(username, content_with_time, sender_name=sender_name, user_initiated=True,
+                                                reminder_text=reminder_text)
+            if queued_count == 1:
+                logger.info(f"已为用户 {sender_name} 初始化消息队列并加入消息。")
+            else:
+                logger.info(f"用户 {sender_name} 的消息已加入队列（当前 {queued_count} 条）并更新时间。")
         else:
             # 如果经过所有处理后 processed_content 变为 None 或空字符串，则记录警告
             logger.warning(f"在处理后未找到用户 {username} 的可处理内容。原始消息: '{original_content}'")
 
     except Exception as e:
-        can_send_messages = True # 确保发生错误时可以恢复发送消息
         logger.error(f"消息处理失败 (handle_wxauto_message): {str(e)}", exc_info=True)
 
+def _message_wait_time(user_id, now=None, user_initiated=False):
+    """
+    计算用户消息队列的合并等待时间。
+    user_initiated=True 时把这条消息计入该聊天的消息间隔统计；now 为 None 时只查询当前等待时间。
+    """
+    message_debouncer.configure(
+        default_wait=get_dynamic_config('QUEUE_WAITING_TIME', QUEUE_WAITING_TIME),
+        min_wait=get_dynamic_config('ADAPTIVE_DEBOUNCE_MIN_WAIT', ADAPTIVE_DEBOUNCE_MIN_WAIT),
+        max_wait=get_dynamic_config('ADAPTIVE_DEBOUNCE_MAX_WAIT', ADAPTIVE_DEBOUNCE_MAX_WAIT)
+    )
+    if now is None:
+        wait_time = message_debouncer.current_wait(user_id)
+    else:
+        wait_time = message_debouncer.on_message(user_id, now, learn=user_initiated)
+    if not get_dynamic_config('ENABLE_ADAPTIVE_DEBOUNCE', ENABLE_ADAPTIVE_DEBOUNCE):
+        return get_dynamic_config('QUEUE_WAITING_TIME', QUEUE_WAITING_TIME)
+    return wait_time
+
+def enqueue_user_message(user_id, message, sender_name=None, username=None, user_initiated=False, reminder_text=None):
+    """
+    将一条消息加入用户的消息队列，并刷新该队列的派发截止时间。
+    user_initiated 表示消息来自用户本人（主动消息、提醒等系统消息不参与消息间隔学习）。
+    reminder_text 不为空时该消息是提醒候选，处理队列时用它解析提醒。
+    返回加入后队列中的消息数。
+    """
+    now = time.time()
+    wait_time = _message_wait_time(user_id, now, user_initiated)
+    with queue_lock:
+        if user_id not in user_queues:
+            user_queues[user_id] = {
+                'messages': [message],
+                'sender_name': sender_name or user_id,
+                'username': username or user_id,
+                'last_message_time': now,
+                'reminder_requests': []
+            }
+        else:
+            user_queues[user_id]['messages'].append(message)
+            user_queues[user_id]['last_message_time'] = now
+        if reminder_text:
+            user_queues[user_id]['reminder_requests'].append((message, reminder_text))
+        queued_count = len(user_queues[user_id]['messages'])
+        dispatch_scheduler.schedule(user_id, now + wait_time)
+    return queued_count
+
+def _process_user_messages_and_reschedule(user_id):
+    """在工作线程中处理用户消息；处理期间又有新消息入队时，按其截止时间重新排入派发调度。"""
+    try:
+        process_user_messages(user_id)
+    finally:
+        with queue_lock:
+            user_data = user_queues.get(user_id)
+            if user_data and dispatch_scheduler.deadline_of(user_id) is None:
+                dispatch_scheduler.schedule(user_id, user_data.get('last_message_time', 0) + _message_wait_time(user_id))
+
 def check_inactive_users():
-    global can_send_messages
+    """消息派发线程：睡眠到最近的队列截止时间，再把到期用户提交给回复生成线程池。"""
     while True:
+        due_users = dispatch_scheduler.wait_due()
+        if not due_users:
+            continue
+        llm_worker_pool.set_max_workers(get_dynamic_config('MAX_CONCURRENT_LLM_REQUESTS', MAX_CONCURRENT_LLM_REQUESTS))
         current_time = time.time()
-        inactive_users = []
         with queue_lock:
-            for username, user_data in user_queues.items():
-                last_time = user_data.get('last_message_time', 0)
-                if current_time - last_time > QUEUE_WAITING_TIME and can_send_messages and not is_sending_message: 
-                    inactive_users.append(username)
-
-        for username in inactive_users:
-            process_user_messages(username)
-
-        time.sleep(1)  # 每秒检查一次
+            for username in due_users:
+                user_data = user_queues.get(username)
+                if not user_data:
+                    continue
+                if llm_worker_pool.is_busy(username):
+                    # 该用户上一轮回复仍在生成，新消息继续在队列中合并，处理完成后会重新排入调度
+                    continue
+                if dispatch_pause.is_paused() or ingest_pool.is_busy(username):
+                    # 图片识别等流程暂停了派发，或该聊天还有消息在预处理中，稍后重试
+                    dispatch_scheduler.schedule(username, current_time + DISPATCH_RETRY_INTERVAL)
+                    continue
+                message_debouncer.record_dispatch(username, user_data.get('last_message_time', current_time), current_time)
+                llm_worker_pool.submit(username, _process_user_messages_and_reschedule, username)
 
 def process_user_messages(user_id):
     """处理指定用户的消息队列，包括可能的联网搜索。"""
-    global can_send_messages # 引用全局变量
 
     with queue_lock:
         if user_id not in user_queues:
@@ -2171,6 +2174,7 @@ def process_user_messages(user_id):
         messages = user_data['messages']
         sender_name = user_data['sender_name']
         username = user_data['username'] # username 可能是群聊名或好友昵称
+        reminder_requests = user_data['reminder_requests']
 
     # 合并消息
     merged_message = ' '.join(messages)
@@ -2183,10 +2187,24 @@ def process_user_messages(user_id):
     online_info = None
 
     try:
+        # --- 本轮的辅助判断（提醒解析、联网检测）尽量合并为一次调用 ---
+        reminder_text = ' '.join(text for _, text in reminder_requests)
+        route = route_aux_tasks(merged_message, user_id, reminder_text)
+
+        # --- 提醒解析 ---
+        if reminder_text and try_parse_and_set_reminder(reminder_text, user_id, route=route):
+            # 提醒已设置并发送了确认回复，本轮的其他消息照常回复
+            reminder_messages = set(message for message, _ in reminder_requests)
+            messages = [message for message in messages if message not in reminder_messages]
+            if not messages:
+                logger.info(f"成功为用户 {user_id} 设置提醒，本轮消息处理结束。")
+                return
+            merged_message = ' '.join(messages)
+
         # --- 新增：联网搜索逻辑 ---
         if ENABLE_ONLINE_API:
             # 1. 检测是否需要联网
-            search_content = needs_online_search(merged_message, user_id)
+            search_content = needs_online_search(merged_message, user_id, route=route)
             if search_content:
                 # 2. 如果需要，调用在线 API
                 logger.info(f"尝试为用户 {user_id} 执行在线搜索...")
@@ -2251,31 +2269,21 @@ def process_user_messages(user_id):
             raise
         
 def send_reply(user_id, sender_name, username, original_merged_message, reply, is_system_message=False):
-    """发送回复消息，可能分段发送，并管理发送标志。
-    
+    """将回复拆分为若干发送动作并提交到该聊天的发送队列，立即返回。
+
+    实际发送由发送调度线程完成：同一聊天内按顺序并保留打字延迟，不同聊天之间交错发送。
+
     Args:
         is_system_message: 如果为True，则不记录到Memory_Temp且不进行表情判断
     """
-    global is_sending_message
     if not reply:
         logger.warning(f"尝试向 {user_id} 发送空回复。")
         return
 
-    # --- 如果正在发送，等待 ---
-    wait_start_time = time.time()
-    MAX_WAIT_SENDING = 15.0  # 最大等待时间（秒）
-    while is_sending_message:
-        if time.time() - wait_start_time > MAX_WAIT_SENDING:
-            logger.warning(f"等待 is_sending_message 标志超时，准备向 {user_id} 发送回复，继续执行。")
-            break  # 避免无限等待
-        logger.debug(f"等待向 {user_id} 发送回复，另一个发送正在进行中。")
-        time.sleep(0.5)  # 短暂等待
-
     try:
-        is_sending_message = True  # <<< 在发送前设置标志
         logger.info(f"准备向 {sender_name} (用户ID: {user_id}) 发送消息")
 
-        # --- 表情包发送逻辑 ---
+        # --- 表情包发送逻辑（涉及AI调用，在提交前于当前线程完成，不占用发送线程）---
         emoji_path = None
         if ENABLE_EMOJI_SENDING and not is_system_message:
             emotion = is_emoji_request(reply)
@@ -2291,7 +2299,6 @@ def send_reply(user_id, sender_name, username, original_merged_message, reply, i
 
         if not parts:
             logger.warning(f"回复消息在分割/清理后为空，无法发送给 {user_id}。")
-            is_sending_message = False
             return
 
         # --- 构建消息队列（文本+表情+拍一拍随机插入）---
@@ -2311,89 +2318,27 @@ def send_reply(user_id, sender_name, username, original_merged_message, reply, i
             insert_pos = random.randint(0, len(message_actions))
             message_actions.insert(insert_pos, ('emoji', emoji_path))
 
-        # --- 发送混合消息队列 ---
+        # --- 提交到发送队列 ---
+        steps = []
         for idx, (action_type, content) in enumerate(message_actions):
+            delay_before = 0.0
             if action_type == 'emoji':
-                # 表情包发送三次重试
-                success = False
-                for attempt in range(3):
-                    try:
-                        if wx.SendFiles(filepath=content, who=user_id):
-                            logger.info(f"已向 {user_id} 发送表情包")
-                            success = True
-                            break
-                        else:
-                            logger.warning(f"发送表情包失败，尝试第 {attempt + 1} 次")
-                    except Exception as e:
-                        logger.warning(f"发送表情包异常，尝试第 {attempt + 1} 次: {str(e)}")
-                    
-                    if attempt < 2:  # 不是最后一次尝试
-                        time.sleep(0.5)  # 短暂等待后重试
-                
-                if not success:
-                    logger.error(f"表情包发送失败，已重试3次")
-                else:
-                    time.sleep(random.uniform(0.5, 1.5))  # 表情包发送后随机延迟
+                action = lambda content=content: _send_emoji_action(user_id, content)
+                delay_after = random.uniform(0.5, 1.5)  # 表情包发送后随机延迟
             elif action_type == 'tickle':
-                # 处理[tickle] - 拍一拍用户
-                try:
-                    global user_last_msg
-                    if user_id in user_last_msg and user_last_msg[user_id]:
-                        user_last_msg[user_id].tickle()
-                        logger.info(f"已拍一拍用户 {user_id}")
-                    else:
-                        logger.warning(f"无法拍一拍用户 {user_id}，找不到用户最后发送的消息")
-                except Exception as e:
-                    logger.error(f"拍一拍用户失败: {str(e)}")
-                time.sleep(random.uniform(2.0, 3.0))  # 拍一拍后延迟
+                action = lambda: _send_tickle_action(user_id)
+                delay_after = random.uniform(2.0, 3.0)  # 拍一拍后延迟
             elif action_type == 'tickle_self':
-                # 处理[tickle_self] - 拍一拍机器人自己的消息
-                try:
-                    global bot_last_sent_msg
-                    if bot_last_sent_msg and user_id in bot_last_sent_msg and bot_last_sent_msg[user_id]:
-                        bot_last_sent_msg[user_id].tickle()
-                        logger.info(f"已拍一拍机器人发送给 {user_id} 的消息")
-                    else:
-                        logger.warning(f"无法拍一拍机器人发送给 {user_id} 的消息，找不到最后发送的消息")
-                except Exception as e:
-                    logger.error(f"拍一拍机器人消息失败: {str(e)}")
-                time.sleep(random.uniform(2.0, 3.0))  # 拍一拍后延迟
+                action = lambda: _send_tickle_self_action(user_id)
+                delay_after = random.uniform(2.0, 3.0)  # 拍一拍后延迟
             elif action_type == 'recall':
-                # 处理[recall] - 撤回机器人上一条消息
-                try:
-                    if bot_last_sent_msg and user_id in bot_last_sent_msg and bot_last_sent_msg[user_id]:
-                        # 延时确保撤回最新消息
-                        time.sleep(random.uniform(3.0, 5.0))
-                        bot_last_sent_msg[user_id].select_option('撤回')
-                        logger.info(f"已撤回机器人发送给 {user_id} 的上一条消息")
-                        # 撤回后清除记录的消息对象，避免重复撤回
-                        bot_last_sent_msg[user_id] = None
-                    else:
-                        logger.warning(f"无法撤回机器人发送给 {user_id} 的消息，找不到最后发送的消息")
-                except Exception as e:
-                    logger.error(f"撤回机器人消息失败: {str(e)}")
-                time.sleep(random.uniform(2.0, 3.0))  # 撤回后延迟
+                action = lambda: _send_recall_action(user_id)
+                delay_before = random.uniform(3.0, 5.0)  # 延时确保撤回最新消息
+                delay_after = random.uniform(2.0, 3.0)  # 撤回后延迟
             else:
-                # 文本消息发送三次重试
-                success = False
-                for attempt in range(3):
-                    try:
-                        if wx.SendMsg(msg=content, who=user_id):
-                            logger.info(f"分段回复 {idx+1}/{len(message_actions)} 给 {sender_name}: {content[:50]}...")
-                            if ENABLE_MEMORY and not is_system_message:
-                                log_ai_reply_to_memory(username, content)
-                            success = True
-                            break
-                        else:
-                            logger.warning(f"发送文本消息失败，尝试第 {attempt + 1} 次")
-                    except Exception as e:
-                        logger.warning(f"发送文本消息异常，尝试第 {attempt + 1} 次: {str(e)}")
-                    
-                    if attempt < 2:  # 不是最后一次尝试
-                        time.sleep(0.5)  # 短暂等待后重试
-                
-                if not success:
-                    logger.error(f"文本消息发送失败，已重试3次: {content[:50]}...")
+                action = (lambda content=content, idx=idx, total=len(message_actions):
+                          _send_text_action(user_id, sender_name, username, content, idx, total, is_system_message))
+                delay_after = 0.0
 
             # 处理分段延迟（仅当下一动作为文本时计算）
             if idx < len(message_actions) - 1:
@@ -2402,16 +2347,92 @@ def send_reply(user_id, sender_name, username, original_merged_message, reply, i
                     next_part_len = len(next_action[1])
                     base_delay = next_part_len * AVERAGE_TYPING_SPEED
                     random_delay = random.uniform(RANDOM_TYPING_SPEED_MIN, RANDOM_TYPING_SPEED_MAX)
-                    total_delay = max(1.0, base_delay + random_delay)
-                    time.sleep(total_delay)
+                    delay_after += max(1.0, base_delay + random_delay)
                 else:
                     # 表情包前后使用固定随机延迟
-                    time.sleep(random.uniform(0.5, 1.5))
+                    delay_after += random.uniform(0.5, 1.5)
+
+            steps.append(SendStep(action, delay_before=delay_before, delay_after=delay_after,
+                                  description=f"{action_type} {idx+1}/{len(message_actions)}"))
+
+        send_scheduler.submit(user_id, steps)
+        logger.debug(f"已将 {len(steps)} 个发送动作加入 {user_id} 的发送队列（当前待发送: {send_scheduler.pending_count()}）")
 
     except Exception as e:
         logger.error(f"向 {user_id} 发送回复失败: {str(e)}", exc_info=True)
-    finally:
-        is_sending_message = False
+
+def _send_emoji_action(user_id, emoji_path):
+    """发送表情包（三次重试），在发送线程中执行。"""
+    for attempt in range(3):
+        try:
+            if wx.SendFiles(filepath=emoji_path, who=user_id):
+                logger.info(f"已向 {user_id} 发送表情包")
+                return True
+            else:
+                logger.warning(f"发送表情包失败，尝试第 {attempt + 1} 次")
+        except Exception as e:
+            logger.warning(f"发送表情包异常，尝试第 {attempt + 1} 次: {str(e)}")
+        
+        if attempt < 2:  # 不是最后一次尝试
+            time.sleep(0.5)  # 短暂等待后重试
+    
+    logger.error(f"表情包发送失败，已重试3次")
+    return False
+
+def _send_tickle_action(user_id):
+    """处理[tickle] - 拍一拍用户"""
+    try:
+        if user_id in user_last_msg and user_last_msg[user_id]:
+            user_last_msg[user_id].tickle()
+            logger.info(f"已拍一拍用户 {user_id}")
+        else:
+            logger.warning(f"无法拍一拍用户 {user_id}，找不到用户最后发送的消息")
+    except Exception as e:
+        logger.error(f"拍一拍用户失败: {str(e)}")
+
+def _send_tickle_self_action(user_id):
+    """处理[tickle_self] - 拍一拍机器人自己的消息"""
+    try:
+        if bot_last_sent_msg and user_id in bot_last_sent_msg and bot_last_sent_msg[user_id]:
+            bot_last_sent_msg[user_id].tickle()
+            logger.info(f"已拍一拍机器人发送给 {user_id} 的消息")
+        else:
+            logger.warning(f"无法拍一拍机器人发送给 {user_id} 的消息，找不到最后发送的消息")
+    except Exception as e:
+        logger.error(f"拍一拍机器人消息失败: {str(e)}")
+
+def _send_recall_action(user_id):
+    """处理[recall] - 撤回机器人上一条消息"""
+    try:
+        if bot_last_sent_msg and user_id in bot_last_sent_msg and bot_last_sent_msg[user_id]:
+            bot_last_sent_msg[user_id].select_option('撤回')
+            logger.info(f"已撤回机器人发送给 {user_id} 的上一条消息")
+            # 撤回后清除记录的消息对象，避免重复撤回
+            bot_last_sent_msg[user_id] = None
+        else:
+            logger.warning(f"无法撤回机器人发送给 {user_id} 的消息，找不到最后发送的消息")
+    except Exception as e:
+        logger.error(f"撤回机器人消息失败: {str(e)}")
+
+def _send_text_action(user_id, sender_name, username, content, idx, total, is_system_message):
+    """发送一段文本（三次重试），在发送线程中执行。"""
+    for attempt in range(3):
+        try:
+            if wx.SendMsg(msg=content, who=user_id):
+                logger.info(f"分段回复 {idx+1}/{total} 给 {sender_name}: {content[:50]}...")
+                if ENABLE_MEMORY and not is_system_message:
+                    log_ai_reply_to_memory(username, content)
+                return True
+            else:
+                logger.warning(f"发送文本消息失败，尝试第 {attempt + 1} 次")
+        except Exception as e:
+            logger.warning(f"发送文本消息异常，尝试第 {attempt + 1} 次: {str(e)}")
+        
+        if attempt < 2:  # 不是最后一次尝试
+            time.sleep(0.5)  # 短暂等待后重试
+    
+    logger.error(f"文本消息发送失败，已重试3次: {content[:50]}...")
+    return False
 
 def split_message_with_context(text):
     """
@@ -2569,6 +2590,11 @@ def remove_parentheses_and_content(text: str) -> str:
     processed_text = "\n".join(stripped_lines)
     return processed_text
 
+def list_emoji_categories():
+    """emojis 目录下的情绪分类文件夹名称。"""
+    return [d for d in os.listdir(EMOJI_DIR)
+            if os.path.isdir(os.path.join(EMOJI_DIR, d))]
+
 def is_emoji_request(text: str) -> Optional[str]:
     """使用AI判断消息情绪并返回对应的表情文件夹名称"""
     try:
@@ -2578,8 +2604,7 @@ def is_emoji_request(text: str) -> Optional[str]:
             return None
         
         # 获取emojis目录下的所有情绪分类文件夹
-        emoji_categories = [d for d in os.listdir(EMOJI_DIR) 
-                            if os.path.isdir(os.path.join(EMOJI_DIR, d))]
+        emoji_categories = list_emoji_categories()
         
         if not emoji_categories:
             logger.warning("表情包目录下未找到有效情绪分类文件夹")
@@ -2853,6 +2878,9 @@ def format_json_memories_for_prompt(memories):
     
     return ''.join(formatted_lines)
 
+# 核心记忆检索：每轮只把与消息相关的记忆和置顶的高重要度记忆放进提示词
+memory_retriever = MemoryRetriever(format_json_memories_for_prompt)
+
 def append_to_memory_section(user_id, content):
     """将内容追加到用户prompt文件的记忆部分"""
     try:
@@ -3288,11 +3316,9 @@ def clear_chat_context(user_id):
     """清除指定用户的聊天上下文"""
     logger.info(f"已开启自动清除上下文功能，尝试清除用户 {user_id} 的聊天上下文")
     try:
-        with queue_lock:
-            if user_id in chat_contexts:
-                del chat_contexts[user_id]
-                save_chat_contexts()
-                logger.warning(f"已清除用户 {user_id} 的聊天上下文")
+        if chat_context_store.clear(user_id):
+            save_chat_contexts()
+            logger.warning(f"已清除用户 {user_id} 的聊天上下文")
     except Exception as e:
         logger.error(f"清除聊天上下文失败: {str(e)}")
 
@@ -3321,13 +3347,13 @@ def send_error_reply(user_id, error_description_for_ai, fallback_message, error_
             # 如果连send_reply都失败了，记录严重错误
             logger.critical(f"发送备用错误消息也失败 ({error_context_log}): {send_fallback_err}")
 
-def try_parse_and_set_reminder(message_content, user_id):
+def try_parse_and_set_reminder(message_content, user_id, route=None):
     """
     尝试解析消息内容，区分短期一次性、长期一次性、重复提醒。
-    使用 AI 进行分类和信息提取，然后设置短期定时器或保存到文件。
+    使用 AI 进行分类和信息提取，然后设置短期定时器或保存到文件；
+    route 为本轮合并辅助判断的结果，其中已有提醒解析时直接使用，不再单独调用模型。
     如果成功设置了任一类型的提醒，返回 True，否则返回 False。
     """
-    global next_timer_id # 引用全局变量，用于生成短期一次性提醒的ID
     logger.debug(f"尝试为用户 {user_id} 解析提醒请求 (需要识别类型和时长): '{message_content}'")
     
     # 长度限制
@@ -3338,29 +3364,23 @@ def try_parse_and_set_reminder(message_content, user_id):
         return False
     
     # 检查用户活动短期定时器数量
-    with timer_lock:
-        user_timer_count = sum(1 for (uid, _) in active_timers.keys() if uid == user_id)
-        if user_timer_count >= MAX_ACTIVE_TIMERS_PER_USER:
-            logger.warning(f"用户 {user_id} 的活动短期提醒已达上限: {user_timer_count}/{MAX_ACTIVE_TIMERS_PER_USER}")
-            error_msg = f"你的活动提醒数量已经达到上限啦（{MAX_ACTIVE_TIMERS_PER_USER}个），等之前的提醒完成后再设置新的吧~"
-            send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
-            return False
+    user_timer_count = timer_service.count(group=user_id)
+    if user_timer_count >= MAX_ACTIVE_TIMERS_PER_USER:
+        logger.warning(f"用户 {user_id} 的活动短期提醒已达上限: {user_timer_count}/{MAX_ACTIVE_TIMERS_PER_USER}")
+        error_msg = f"你的活动提醒数量已经达到上限啦（{MAX_ACTIVE_TIMERS_PER_USER}个），等之前的提醒完成后再设置新的吧~"
+        send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
+        return False
     
     # 检查用户的重复提醒和一次性提醒数量
-    with recurring_reminder_lock:
-        user_recurring_count = sum(1 for r in recurring_reminders 
-                                  if r.get('user_id') == user_id 
-                                  and r.get('reminder_type') == 'recurring')
-        user_oneoff_count = sum(1 for r in recurring_reminders 
-                               if r.get('user_id') == user_id 
-                               and r.get('reminder_type') == 'one-off')
-        
-        # 如果已经达到任一限制，先提示用户（具体类型限制在后面再次检查）
-        if user_recurring_count >= MAX_RECURRING_REMINDERS_PER_USER and user_oneoff_count >= MAX_ONEOFF_REMINDERS_PER_USER:
-            logger.warning(f"用户 {user_id} 的所有类型提醒都已达上限")
-            error_msg = f"你的提醒数量已经很多啦，可以先删除一些再添加新的哦~"
-            send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
-            return False
+    user_recurring_count = reminder_scheduler.count(user_id, 'recurring')
+    user_oneoff_count = reminder_scheduler.count(user_id, 'one-off')
+
+    # 如果已经达到任一限制，先提示用户（具体类型限制在后面再次检查）
+    if user_recurring_count >= MAX_RECURRING_REMINDERS_PER_USER and user_oneoff_count >= MAX_ONEOFF_REMINDERS_PER_USER:
+        logger.warning(f"用户 {user_id} 的所有类型提醒都已达上限")
+        error_msg = f"你的提醒数量已经很多啦，可以先删除一些再添加新的哦~"
+        send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
+        return False
 
     try:
         # --- 1. 获取当前时间，准备给 AI 的上下文信息 ---
@@ -3400,8 +3420,17 @@ D) **非提醒请求**：例如 "今天天气怎么样?", "取消提醒"。
 请务必严格遵守输出格式，只返回指定的 JSON 对象或 `null`，不要添加任何解释性文字。
 """
         # --- 3. 调用 AI 进行解析和分类 ---
+        # 常见的时间说法先用本地规则解析，没有把握时才交给模型
+        local_reminder_data = parse_reminder_text(message_content, now)
+        if local_reminder_data is not None:
+            ai_raw_response = json.dumps(local_reminder_data, ensure_ascii=False)
+            logger.info(f"本地解析提醒请求成功，用户: {user_id}，结果: {ai_raw_response}")
+        elif route is not None and TASK_REMINDER in route.tasks:
+            # 合并辅助判断已完成解析，按分类器的输出格式交给后续步骤
+            ai_raw_response = json.dumps(route.reminder, ensure_ascii=False) if route.reminder is not None else "null"
+            logger.debug(f"使用合并辅助判断的提醒解析结果: {ai_raw_response}")
         # 根据配置选择使用辅助模型或主模型
-        if ENABLE_ASSISTANT_MODEL:
+        elif ENABLE_ASSISTANT_MODEL:
             logger.info(f"向辅助模型发送提醒解析请求（区分时长），用户: {user_id}，内容: '{message_content}'")
             ai_raw_response = get_assistant_response(parsing_prompt, "reminder_parser_classifier_v2_" + user_id)
             logger.debug(f"辅助模型提醒解析原始响应 (分类器 v2): {ai_raw_response}")
@@ -3461,23 +3490,17 @@ D) **非提醒请求**：例如 "今天天气怎么样?", "取消提醒"。
                      send_error_reply(user_id, error_prompt, fallback, f"One-off-short数据解析失败 ({type(val_e).__name__})")
                      return False
 
-                # 设置 threading.Timer 定时器
+                # 加入定时器服务
                 target_dt = now + dt.timedelta(seconds=delay_seconds)
                 confirmation_time_str = target_dt.strftime('%Y-%m-%d %H:%M:%S')
                 delay_str_approx = format_delay_approx(delay_seconds, target_dt)
 
                 logger.info(f"准备为用户 {user_id} 设置【短期一次性】提醒 (<=10min)，计划触发时间: {confirmation_time_str} (延迟 {delay_seconds:.2f} 秒)，内容: '{reminder_msg}'")
 
-                with timer_lock:
-                    timer_id = next_timer_id
-                    next_timer_id += 1
-                    timer_key = (user_id, timer_id)
-                    timer = Timer(float(delay_seconds), trigger_reminder, args=[user_id, timer_id, reminder_msg])
-                    active_timers[timer_key] = timer
-                    timer.start()
-                    logger.info(f"【短期一次性】提醒定时器 (ID: {timer_id}) 已为用户 {user_id} 成功启动。")
-
-                log_original_message_to_memory(user_id, message_content) # 记录原始请求
+                # 触发时可能发起语音通话（阻塞的界面操作），在单独的线程中执行，不拖延其他定时任务
+                handle = timer_service.schedule(float(delay_seconds), trigger_reminder, user_id, reminder_msg,
+                                                group=user_id, kind='short_reminder', blocking=True)
+                logger.info(f"【短期一次性】提醒定时器 (ID: {handle.id}) 已为用户 {user_id} 成功启动。")
 
                 confirmation_prompt = f"""用户刚才的请求是："{message_content}"。
 根据这个请求，你已经成功将一个【短期一次性】提醒（10分钟内）安排在 {confirmation_time_str} (也就是 {delay_str_approx}) 触发。
@@ -3509,31 +3532,30 @@ D) **非提醒请求**：例如 "今天天气怎么样?", "取消提醒"。
                 logger.info(f"准备为用户 {user_id} 添加【长期一次性】提醒 (>10min)，目标时间: {target_datetime_str}，内容: '{reminder_msg}'")
 
                 # 检查用户长期一次性提醒数量限制
-                with recurring_reminder_lock:
-                    user_oneoff_count = sum(1 for r in recurring_reminders 
-                                           if r.get('user_id') == user_id 
-                                           and r.get('reminder_type') == 'one-off')
-                    if user_oneoff_count >= MAX_ONEOFF_REMINDERS_PER_USER:
-                        logger.warning(f"用户 {user_id} 的长期一次性提醒已达上限: {user_oneoff_count}/{MAX_ONEOFF_REMINDERS_PER_USER}")
-                        error_msg = f"你的一次性提醒数量已经达到上限啦（{MAX_ONEOFF_REMINDERS_PER_USER}个），可以先删除一些再添加新的哦~"
-                        send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
-                        return False
-                    
-                    # 创建要存储的提醒信息字典 (包含类型)
-                    new_reminder = {
-                        "reminder_type": "one-off", # 在存储时统一用 'one-off'
-                        "user_id": user_id,
-                        "target_datetime_str": target_datetime_str, # 存储目标时间
-                        "content": reminder_msg
-                    }
-
-                    # 添加到内存列表并保存到文件
-                    recurring_reminders.append(new_reminder)
-                    save_recurring_reminders() # 保存更新后的列表
+                user_oneoff_count = reminder_scheduler.count(user_id, 'one-off')
+                if user_oneoff_count >= MAX_ONEOFF_REMINDERS_PER_USER:
+                    logger.warning(f"用户 {user_id} 的长期一次性提醒已达上限: {user_oneoff_count}/{MAX_ONEOFF_REMINDERS_PER_USER}")
+                    error_msg = f"你的一次性提醒数量已经达到上限啦（{MAX_ONEOFF_REMINDERS_PER_USER}个），可以先删除一些再添加新的哦~"
+                    send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
+                    return False
 
-                logger.info(f"【长期一次性】提醒已添加并保存到文件。用户: {user_id}, 时间: {target_datetime_str}, 内容: '{reminder_msg}'")
+                # 创建要存储的提醒信息字典 (包含类型)
+                new_reminder = {
+                    "reminder_type": "one-off", # 在存储时统一用 'one-off'
+                    "user_id": user_id,
+                    "target_datetime_str": target_datetime_str, # 存储目标时间
+                    "content": reminder_msg
+                }
+
+                # 加入调度器（立即追加到提醒日志）；目标时间在添加前已经过去时无法安排触发
+                if not reminder_scheduler.add(new_reminder):
+                    logger.warning(f"【长期一次性】提醒未添加（已存在相同提醒或目标时间已过）。用户: {user_id}, 时间: {target_datetime_str}")
+                    error_prompt = f"用户想设置一个提醒（原始请求 '{message_content}'），但目标时间 ({target_datetime_str}) 已经到了或者相同的提醒已经存在。请用你的语气告诉用户这个提醒没有重新设置，如果需要可以说一个更晚的时间。"
+                    fallback = f"这个 {target_datetime_str} 的提醒没有设置成功哦（时间已经到了或者已经有相同的提醒了），要不换一个更晚的时间？"
+                    send_error_reply(user_id, error_prompt, fallback, "长期提醒未能安排")
+                    return False
 
-                log_original_message_to_memory(user_id, message_content)
+                logger.info(f"【长期一次性】提醒已添加并保存到文件。用户: {user_id}, 时间: {target_datetime_str}, 内容: '{reminder_msg}'")
 
                 # 发送确认消息
                 confirmation_prompt = f"""用户刚才的请求是："{message_content}"。
@@ -3560,44 +3582,29 @@ D) **非提醒请求**：例如 "今天天气怎么样?", "取消提醒"。
 
                 logger.info(f"准备为用户 {user_id} 添加【每日重复】提醒，时间: {time_str}，内容: '{reminder_msg}'")
 
-                # 添加到内存列表并保存到文件
-                with recurring_reminder_lock:
-                    # 检查用户每日重复提醒数量限制
-                    user_recurring_count = sum(1 for r in recurring_reminders 
-                                              if r.get('user_id') == user_id 
-                                              and r.get('reminder_type') == 'recurring')
-                    if user_recurring_count >= MAX_RECURRING_REMINDERS_PER_USER:
-                        logger.warning(f"用户 {user_id} 的每日重复提醒已达上限: {user_recurring_count}/{MAX_RECURRING_REMINDERS_PER_USER}")
-                        error_msg = f"你的每日提醒数量已经达到上限啦（{MAX_RECURRING_REMINDERS_PER_USER}个），可以先删除一些再添加新的哦~"
-                        send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
-                        return False
-                    
-                    # 检查是否已存在完全相同的重复提醒
-                    exists = any(
-                        r.get('reminder_type') == 'recurring' and
-                        r.get('user_id') == user_id and
-                        r.get('time_str') == time_str and
-                        r.get('content') == reminder_msg
-                        for r in recurring_reminders
-                    )
-                    if not exists:
-                        # 创建要存储的提醒信息字典 (包含类型)
-                        new_reminder = {
-                            "reminder_type": "recurring", # 明确类型
-                            "user_id": user_id,
-                            "time_str": time_str, # 存储 HH:MM
-                            "content": reminder_msg
-                        }
-                        recurring_reminders.append(new_reminder)
-                        save_recurring_reminders()
-                        logger.info(f"【每日重复】提醒已添加并保存。用户: {user_id}, 时间: {time_str}, 内容: '{reminder_msg}'")
-                    else:
-                        logger.info(f"相同的【每日重复】提醒已存在，未重复添加。用户: {user_id}, 时间: {time_str}")
-                        # 可以选择告知用户提醒已存在
-                        # send_reply(user_id, user_id, user_id, "[重复提醒已存在]", f"嗯嗯，这个 '{reminder_msg}' 的每日 {time_str} 提醒我已经记下啦，不用重复设置哦。")
-                        # return True # 即使未添加，也认为设置意图已满足
+                # 检查用户每日重复提醒数量限制
+                user_recurring_count = reminder_scheduler.count(user_id, 'recurring')
+                if user_recurring_count >= MAX_RECURRING_REMINDERS_PER_USER:
+                    logger.warning(f"用户 {user_id} 的每日重复提醒已达上限: {user_recurring_count}/{MAX_RECURRING_REMINDERS_PER_USER}")
+                    error_msg = f"你的每日提醒数量已经达到上限啦（{MAX_RECURRING_REMINDERS_PER_USER}个），可以先删除一些再添加新的哦~"
+                    send_reply(user_id, user_id, user_id, "[提醒限制]", error_msg, is_system_message=True)
+                    return False
 
-                log_original_message_to_memory(user_id, message_content)
+                # 创建要存储的提醒信息字典 (包含类型)
+                new_reminder = {
+                    "reminder_type": "recurring", # 明确类型
+                    "user_id": user_id,
+                    "time_str": time_str, # 存储 HH:MM
+                    "content": reminder_msg
+                }
+                # 加入调度器；已存在完全相同的重复提醒时不会重复添加
+                if reminder_scheduler.add(new_reminder):
+                    logger.info(f"【每日重复】提醒已添加并保存。用户: {user_id}, 时间: {time_str}, 内容: '{reminder_msg}'")
+                else:
+                    logger.info(f"相同的【每日重复】提醒已存在，未重复添加。用户: {user_id}, 时间: {time_str}")
+                    # 可以选择告知用户提醒已存在
+                    # send_reply(user_id, user_id, user_id, "[重复提醒已存在]", f"嗯嗯，这个 '{reminder_msg}' 的每日 {time_str} 提醒我已经记下啦，不用重复设置哦。")
+                    # return True # 即使未添加，也认为设置意图已满足
 
                 # 向用户发送确认消息
                 confirmation_prompt = f"""用户刚才的请求是："{message_content}"。
@@ -3700,36 +3707,6 @@ def format_delay_approx(delay_seconds, target_dt):
         # 使用中文日期时间格式
         return f"大约 {days} 天后 ({target_dt.strftime('%Y年%m月%d日 %H:%M')}左右)"
 
-def log_original_message_to_memory(user_id, message_content):
-    """将设置提醒的原始用户消息记录到记忆日志文件（如果启用了记忆功能）。"""
-    if ENABLE_MEMORY: # 检查是否启用了记忆功能
-        try:
-            # 获取用户对应的 prompt 文件名（或用户昵称）
-            prompt_name = prompt_mapping.get(user_id, user_id)
-            safe_user_id = sanitize_user_id_for_filename(user_id)
-            safe_prompt_name = sanitize_user_id_for_filename(prompt_name)
-            # 构建日志文件路径
-            log_file = os.path.join(root_dir, MEMORY_TEMP_DIR, f'{safe_user_id}_{safe_prompt_name}_log.txt')
-            # 准备日志条目，记录原始用户消息
-            log_entry = f"{datetime.now().strftime('%Y-%m-%d %A %H:%M:%S')} | [{user_id}] {message_content}\n"
-            # 确保目录存在
-            os.makedirs(os.path.dirname(log_file), exist_ok=True)
-
-            # 增强编码处理的写入
-            try:
-                with open(log_file, 'a', encoding='utf-8') as f:
-                    f.write(log_entry)
-            except UnicodeEncodeError as e:
-                logger.warning(f"UTF-8编码失败，尝试清理特殊字符: {log_file}, 错误: {e}")
-                # 清理无法编码的字符
-                clean_content = message_content.encode('utf-8', errors='ignore').decode('utf-8')
-                clean_log_entry = f"{datetime.now().strftime('%Y-%m-%d %A %H:%M:%S')} | [{user_id}] {clean_content}\n"
-                with open(log_file, 'a', encoding='utf-8') as f:
-                    f.write(clean_log_entry)
-                logger.info(f"已清理特殊字符并写入提醒记忆日志: {log_file}")
-        except Exception as write_err:
-            logger.error(f"写入用户 {user_id} 的提醒设置记忆日志失败: {write_err}")
-
 def send_confirmation_reply(user_id, confirmation_prompt, log_context, fallback_message):
     """使用 AI 生成并发送提醒设置成功的确认消息，包含备用消息逻辑。"""
     logger.debug(f"准备发送给 AI 用于生成确认消息的提示词（部分）: {confirmation_prompt[:250]}...")
@@ -3750,22 +3727,12 @@ def send_confirmation_reply(user_id, confirmation_prompt, log_context, fallback_
              # 如果连发送备用消息都失败了，记录严重错误
              logger.critical(f"发送备用确认消息也失败 ({log_context}): {send_fallback_err}")
     
-def trigger_reminder(user_id, timer_id, reminder_message):
-    """当短期提醒到期时由 threading.Timer 调用的函数。"""
-    global is_sending_message
-
-    timer_key = (user_id, timer_id)
-    logger.info(f"触发【短期】提醒 (ID: {timer_id})，用户 {user_id}，内容: {reminder_message}")
-
-    # 从活动计时器列表中移除 (短期提醒)
-    with timer_lock:
-        if timer_key in active_timers:
-            del active_timers[timer_key]
-        else:
-             logger.warning(f"触发时未在 active_timers 中找到短期计时器键 {timer_key}。")
+def trigger_reminder(user_id, reminder_message):
+    """当短期提醒到期时由定时器服务调用的函数。"""
+    logger.info(f"触发【短期】提醒，用户 {user_id}，内容: {reminder_message}")
 
     if is_quiet_time() and not ALLOW_REMINDERS_IN_QUIET_TIME:
-        logger.info(f"当前为安静时间：抑制【短期】提醒 (ID: {timer_id})，用户 {user_id}。")
+        logger.info(f"当前为安静时间：抑制【短期】提醒，用户 {user_id}。")
         return
 
     try:
@@ -3776,17 +3743,7 @@ def trigger_reminder(user_id, timer_id, reminder_message):
         current_time_str = datetime.now().strftime("%Y-%m-%d %A %H:%M:%S")
         formatted_message = f"[{current_time_str}] {reminder_prefix}"
         
-        with queue_lock:
-            if user_id not in user_queues:
-                user_queues[user_id] = {
-                    'messages': [formatted_message],
-                    'sender_name': user_id,
-                    'username': user_id,
-                    'last_message_time': time.time()
-                }
-            else:
-                user_queues[user_id]['messages'].append(formatted_message)
-                user_queues[user_id]['last_message_time'] = time.time()
+        enqueue_user_message(user_id, formatted_message)
         
         logger.info(f"已将提醒消息 '{reminder_message}' 添加到用户 {user_id} 的消息队列，用以执行联网检查流程")
 
@@ -3799,22 +3756,12 @@ def trigger_reminder(user_id, timer_id, reminder_message):
                 logger.error(f"语音通话提醒失败 (短期提醒)，用户 {user_id}: {voice_err}")
 
     except Exception as e:
-        logger.error(f"处理【短期】提醒失败 (ID: {timer_id})，用户 {user_id}: {str(e)}", exc_info=True)
+        logger.error(f"处理【短期】提醒失败，用户 {user_id}: {str(e)}", exc_info=True)
         # 即使出错，也不再使用原来的直接发送备用消息方法
         # 而是尽可能添加到队列
         try:
             fallback_msg = f"[{datetime.now().strftime('%Y-%m-%d %A %H:%M:%S')}] 提醒时间到：{reminder_message}"
-            with queue_lock:
-                if user_id in user_queues:
-                    user_queues[user_id]['messages'].append(fallback_msg)
-                    user_queues[user_id]['last_message_time'] = time.time()
-                else:
-                    user_queues[user_id] = {
-                        'messages': [fallback_msg],
-                        'sender_name': user_id,
-                        'username': user_id,
-                        'last_message_time': time.time()
-                    }
+            enqueue_user_message(user_id, fallback_msg)
             logger.info(f"已将备用提醒消息添加到用户 {user_id} 的消息队列")
         except Exception as fallback_e:
             logger.error(f"添加提醒备用消息到队列失败，用户 {user_id}: {fallback_e}")
@@ -3848,239 +3795,93 @@ def log_ai_reply_to_memory(username, reply_part):
         logger.error(f"记录 AI 回复到记忆日志失败，用户 {username}: {log_err}")
 
 def load_recurring_reminders():
-    """从 JSON 文件加载重复和长期一次性提醒到内存中。"""
-    global recurring_reminders
-    reminders_loaded = []
+    """从快照和提醒日志加载重复和长期一次性提醒，并补发重启期间错过的提醒。"""
     try:
-        if os.path.exists(RECURRING_REMINDERS_FILE):
-            with open(RECURRING_REMINDERS_FILE, 'r', encoding='utf-8') as f:
-                loaded_data = json.load(f)
-                if isinstance(loaded_data, list):
-                    valid_reminders_count = 0
-                    now = datetime.now() # 获取当前时间用于检查一次性提醒是否已过期
-                    for item in loaded_data:
-                        # 基本结构验证
-                        if not (isinstance(item, dict) and
-                                'reminder_type' in item and
-                                'user_id' in item and
-                                'content' in item):
-                            logger.warning(f"跳过无效格式的提醒项: {item}")
-                            continue
-
-                        user_id = item.get('user_id')
-                        reminder_type = item.get('reminder_type')
-                        content = item.get('content')
-
-                        # 用户有效性检查
-                        if user_id not in user_names:
-                             logger.warning(f"跳过未在监听列表中的用户提醒: {user_id}")
-                             continue
-
-                        # 类型特定验证
-                        is_valid = False
-                        if reminder_type == 'recurring':
-                            time_str = item.get('time_str')
-                            if time_str:
-                                try:
-                                    datetime.strptime(time_str, '%H:%M')
-                                    is_valid = True
-                                except ValueError:
-                                    logger.warning(f"跳过无效时间格式的重复提醒: {item}")
-                            else:
-                                logger.warning(f"跳过缺少 time_str 的重复提醒: {item}")
-                        elif reminder_type == 'one-off':
-                            target_datetime_str = item.get('target_datetime_str')
-                            if target_datetime_str:
-                                try:
-                                    target_dt = datetime.strptime(target_datetime_str, '%Y-%m-%d %H:%M')
-                                    # 只加载未过期的一次性提醒
-                                    if target_dt > now:
-                                        is_valid = True
-                                    else:
-                                        logger.info(f"跳过已过期的一次性提醒: {item}")
-                                except ValueError:
-                                    logger.warning(f"跳过无效日期时间格式的一次性提醒: {item}")
-                            else:
-                                logger.warning(f"跳过缺少 target_datetime_str 的一次性提醒: {item}")
-                        else:
-                            logger.warning(f"跳过未知 reminder_type 的提醒: {item}")
-
-                        if is_valid:
-                            reminders_loaded.append(item)
-                            valid_reminders_count += 1
-
-                    # 使用锁安全地更新全局列表
-                    with recurring_reminder_lock:
-                        recurring_reminders = reminders_loaded
-                    logger.info(f"成功从 {RECURRING_REMINDERS_FILE} 加载 {valid_reminders_count} 条有效提醒。")
-                else:
-                    logger.error(f"{RECURRING_REMINDERS_FILE} 文件内容不是有效的列表格式。将初始化为空列表。")
-                    with recurring_reminder_lock:
-                        recurring_reminders = []
-        else:
-            logger.info(f"{RECURRING_REMINDERS_FILE} 文件未找到。将以无提醒状态启动。")
-            with recurring_reminder_lock:
-                recurring_reminders = []
-    except json.JSONDecodeError:
-        logger.error(f"解析 {RECURRING_REMINDERS_FILE} 文件 JSON 失败。将初始化为空列表。")
-        with recurring_reminder_lock:
-            recurring_reminders = []
+        reminder_scheduler.load(accept=lambda reminder: reminder.get('user_id') in user_names)
     except Exception as e:
         logger.error(f"加载提醒失败: {str(e)}", exc_info=True)
-        with recurring_reminder_lock:
-            recurring_reminders = [] # 确保出错时列表也被初始化
 
 def save_recurring_reminders():
-    """将内存中的当前提醒列表（重复和长期一次性）保存到 JSON 文件。"""
-    global recurring_reminders
-    with recurring_reminder_lock: # 获取锁保证线程安全
-        temp_file_path = RECURRING_REMINDERS_FILE + ".tmp"
-        # 创建要保存的列表副本，以防在写入时列表被其他线程修改
-        reminders_to_save = list(recurring_reminders)
-        try:
-            with open(temp_file_path, 'w', encoding='utf-8') as f:
-                json.dump(reminders_to_save, f, ensure_ascii=False, indent=4)
-            shutil.move(temp_file_path, RECURRING_REMINDERS_FILE)
-            logger.info(f"成功将 {len(reminders_to_save)} 条提醒保存到 {RECURRING_REMINDERS_FILE}")
-        except Exception as e:
-            logger.error(f"保存提醒失败: {str(e)}", exc_info=True)
-            if os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except OSError:
-                    pass
+    """把提醒调度器中尚未写入快照的变更写入 JSON 文件（变更本身已实时追加到提醒日志）。"""
+    try:
+        reminder_scheduler.flush()
+    except Exception as e:
+        logger.error(f"保存提醒失败: {str(e)}", exc_info=True)
 
-def recurring_reminder_checker():
-    """后台线程函数，每分钟检查是否有到期的重复或长期一次性提醒。"""
-    last_checked_minute_str = None # 记录上次检查的 YYYY-MM-DD HH:MM
-    while True:
-        try:
-            now = datetime.now()
-            # 需要精确到分钟进行匹配
-            current_datetime_minute_str = now.strftime("%Y-%m-%d %H:%M")
-            current_time_minute_str = now.strftime("%H:%M") # 仅用于匹配每日重复
-
-            # 仅当分钟数变化时才执行检查
-            if current_datetime_minute_str != last_checked_minute_str:
-                reminders_to_trigger_now = []
-                reminders_to_remove_indices = [] # 记录需要删除的一次性提醒的索引
-
-                # 在锁保护下读取当前的提醒列表副本
-                with recurring_reminder_lock:
-                    current_reminders_copy = list(recurring_reminders) # 创建副本
-
-                for index, reminder in enumerate(current_reminders_copy):
-                    reminder_type = reminder.get('reminder_type')
-                    user_id = reminder.get('user_id')
-                    content = reminder.get('content')
-                    should_trigger = False
-
-                    if reminder_type == 'recurring':
-                        # 检查每日重复提醒 (HH:MM)
-                        if reminder.get('time_str') == current_time_minute_str:
-                            should_trigger = True
-                            logger.info(f"匹配到每日重复提醒: 用户 {user_id}, 时间 {current_time_minute_str}, 内容: {content}")
-                    elif reminder_type == 'one-off':
-                        # 检查长期一次性提醒 (YYYY-MM-DD HH:MM)
-                        if reminder.get('target_datetime_str') == current_datetime_minute_str:
-                            should_trigger = True
-                            # 标记此一次性提醒以便稍后删除
-                            reminders_to_remove_indices.append(index)
-                            logger.info(f"匹配到长期一次性提醒: 用户 {user_id}, 时间 {current_datetime_minute_str}, 内容: {content}")
-
-                    if should_trigger:
-                        reminders_to_trigger_now.append(reminder.copy()) # 添加副本到触发列表
-
-                # --- 触发提醒 ---
-                if reminders_to_trigger_now:
-                    logger.info(f"当前时间 {current_datetime_minute_str}，发现 {len(reminders_to_trigger_now)} 条到期的提醒。")
-                    if is_quiet_time() and not ALLOW_REMINDERS_IN_QUIET_TIME:
-                        logger.info(f"处于安静时间，将抑制 {len(reminders_to_trigger_now)} 条提醒。")
-                    else:
-                        for reminder in reminders_to_trigger_now:
-                            user_id = reminder['user_id']
-                            content = reminder['content']
-                            reminder_type = reminder['reminder_type'] # 获取类型用于日志和提示
-                            logger.info(f"正在为用户 {user_id} 触发【{reminder_type}】提醒：{content}")
-
-                            # 修改：不再直接调用API，而是将提醒添加到消息队列
-                            try:
-                                # 构造提醒消息前缀
-                                if reminder_type == 'recurring':
-                                    prefix = f"每日提醒：{content}"
-                                else: # one-off
-                                    prefix = f"一次性提醒：{content}"
-
-                                # 将提醒添加到用户的消息队列
-                                formatted_message = f"[{now.strftime('%Y-%m-%d %A %H:%M:%S')}] {prefix}"
-                                
-                                with queue_lock:
-                                    if user_id not in user_queues:
-                                        user_queues[user_id] = {
-                                            'messages': [formatted_message],
-                                            'sender_name': user_id,
-                                            'username': user_id,
-                                            'last_message_time': time.time()
-                                        }
-                                    else:
-                                        user_queues[user_id]['messages'].append(formatted_message)
-                                        user_queues[user_id]['last_message_time'] = time.time()
-                                
-                                logger.info(f"已将{reminder_type}提醒 '{content}' 添加到用户 {user_id} 的消息队列，用以执行联网检查流程")
-
-                                # 保留语音通话功能（如果启用）
-                                if get_dynamic_config('USE_VOICE_CALL_FOR_REMINDERS', USE_VOICE_CALL_FOR_REMINDERS):
-                                    try:
-                                        wx.VoiceCall(user_id)
-                                        logger.info(f"通过语音通话提醒用户 {user_id} ({reminder_type}提醒)。")
-                                    except Exception as voice_err:
-                                        logger.error(f"语音通话提醒失败 ({reminder_type}提醒)，用户 {user_id}: {voice_err}")
-
-                            except Exception as trigger_err:
-                                logger.error(f"将提醒添加到消息队列失败，用户 {user_id}，提醒：{content}：{trigger_err}")
-
-                # --- 删除已触发的一次性提醒 ---
-                if reminders_to_remove_indices:
-                    logger.info(f"准备从列表中删除 {len(reminders_to_remove_indices)} 条已触发的一次性提醒。")
-                    something_removed = False
-                    with recurring_reminder_lock:
-                        # 从后往前删除，避免索引错乱
-                        indices_to_delete_sorted = sorted(reminders_to_remove_indices, reverse=True)
-                        original_length = len(recurring_reminders)
-                        for index in indices_to_delete_sorted:
-                            # 再次检查索引是否有效（理论上应该总是有效）
-                            if 0 <= index < len(recurring_reminders):
-                                removed_item = recurring_reminders.pop(index)
-                                logger.debug(f"已从内存列表中删除索引 {index} 的一次性提醒: {removed_item.get('content')}")
-                                something_removed = True
-                            else:
-                                logger.warning(f"尝试删除索引 {index} 时发现其无效（当前列表长度 {len(recurring_reminders)}）。")
+def fire_reminder(reminder, scheduled_at, late_seconds):
+    """提醒调度线程的触发回调：把到期的重复或长期一次性提醒加入用户的消息队列。"""
+    user_id = reminder['user_id']
+    content = reminder['content']
+    reminder_type = reminder['reminder_type'] # 获取类型用于日志和提示
+    if is_quiet_time() and not ALLOW_REMINDERS_IN_QUIET_TIME:
+        logger.info(f"处于安静时间，抑制用户 {user_id} 的【{reminder_type}】提醒：{content}")
+        return
 
-                        if something_removed:
-                            # 只有实际删除了内容才保存文件
-                            logger.info(f"已从内存中删除 {original_length - len(recurring_reminders)} 条一次性提醒，正在保存更新后的列表...")
-                            save_recurring_reminders() # 保存更新后的列表
-                        else:
-                            logger.info("没有实际删除任何一次性提醒（可能索引无效或列表已空）。")
+    logger.info(f"正在为用户 {user_id} 触发【{reminder_type}】提醒：{content}")
+    # 不直接调用API，而是将提醒添加到消息队列
+    try:
+        # 构造提醒消息前缀
+        if reminder_type == 'recurring':
+            prefix = f"每日提醒：{content}"
+        else: # one-off
+            prefix = f"一次性提醒：{content}"
+        if late_seconds >= 60 and scheduled_at is not None:
+            # 重启期间错过后补发的提醒，注明原定时间
+            prefix += f"（原定 {scheduled_at.strftime('%H:%M')}，补发）"
+
+        # 将提醒添加到用户的消息队列
+        formatted_message = f"[{datetime.now().strftime('%Y-%m-%d %A %H:%M:%S')}] {prefix}"
+        enqueue_user_message(user_id, formatted_message)
+        logger.info(f"已将{reminder_type}提醒 '{content}' 添加到用户 {user_id} 的消息队列，用以执行联网检查流程")
+
+        # 保留语音通话功能（如果启用）
+        if get_dynamic_config('USE_VOICE_CALL_FOR_REMINDERS', USE_VOICE_CALL_FOR_REMINDERS):
+            try:
+                wx.VoiceCall(user_id)
+                logger.info(f"通过语音通话提醒用户 {user_id} ({reminder_type}提醒)。")
+            except Exception as voice_err:
+                logger.error(f"语音通话提醒失败 ({reminder_type}提醒)，用户 {user_id}: {voice_err}")
 
-                # 更新上次检查的分钟数
-                last_checked_minute_str = current_datetime_minute_str
+    except Exception as trigger_err:
+        logger.error(f"将提醒添加到消息队列失败，用户 {user_id}，提醒：{content}：{trigger_err}")
 
-            # 休眠，接近一分钟检查一次
-            time.sleep(58)
+# --- 检测是否需要联网搜索的函数 ---
+def _aux_router_complete(prompt, user_id):
+    """合并辅助判断的模型调用：与各项单独判断一样，优先使用辅助模型。"""
+    if ENABLE_ASSISTANT_MODEL:
+        return get_assistant_response(prompt, f"aux_router_{user_id}")
+    return get_deepseek_response(prompt, user_id=f"aux_router_{user_id}", store_context=False)
 
-        except Exception as e:
-            logger.error(f"提醒检查器循环出错: {str(e)}", exc_info=True)
-            time.sleep(60) # 出错后等待时间稍长
+aux_router = AuxRouter(_aux_router_complete)
 
-# --- 检测是否需要联网搜索的函数 ---
-def needs_online_search(message: str, user_id: str) -> Optional[str]:
+def route_aux_tasks(merged_message, user_id, reminder_text):
+    """
+    把本轮需要的辅助判断（提醒解析、联网检测）合并为一次模型调用。
+
+    只需要一项判断、未启用合并或结果无法解析时返回 None，各项判断退回原来的单独调用。
+    表情情绪依据生成的回复判断（is_emoji_request），不在这里合并。
+    """
+    if not ENABLE_AUX_ROUTER:
+        return None
+    tasks = []
+    if reminder_text and parse_reminder_text(reminder_text) is None:
+        tasks.append(TASK_REMINDER)  # 本地规则能解析的提醒不需要模型判断
+    if ENABLE_ONLINE_API:
+        tasks.append(TASK_SEARCH)
+    if len(tasks) < 2:
+        return None
+    now_str = dt.datetime.now().strftime("%Y-%m-%d %A %H:%M:%S")
+    logger.info(f"向模型发送合并辅助判断请求（{', '.join(tasks)}），用户: {user_id}")
+    return aux_router.route(merged_message, tasks, user_id, now_str, search_hint=SEARCH_DETECTION_PROMPT)
+
+def needs_online_search(message: str, user_id: str, route=None) -> Optional[str]:
     """
     使用主 AI 判断用户消息是否需要联网搜索，并返回需要搜索的内容。
 
     参数:
         message (str): 用户的消息。
         user_id (str): 用户标识符 (用于日志)。
+        route: 本轮合并辅助判断的结果，其中已有联网检测时直接使用，不再单独调用模型。
 
     返回:
         Optional[str]: 如果需要联网搜索，返回需要搜索的内容；否则返回 None。
@@ -4088,6 +3889,13 @@ def needs_online_search(message: str, user_id: str) -> Optional[str]:
     if not ENABLE_ONLINE_API:  # 如果全局禁用，直接返回 None
         return None
 
+    if route is not None and TASK_SEARCH in route.tasks:
+        if route.search:
+            logger.info(f"合并辅助判断：用户 {user_id} 的消息需要联网，搜索内容: '{route.search}'")
+        else:
+            logger.info(f"合并辅助判断：用户 {user_id} 的消息不需要联网。")
+        return route.search
+
     # 构建用于检测的提示词
     detection_prompt = f"""
 请判断以下用户消息是否明确需要查询当前、实时或非常具体的外部信息（例如：{SEARCH_DETECTION_PROMPT}）。
@@ -4144,7 +3952,7 @@ def get_online_model_response(query: str, user_id: str) -> Optional[str]:
     返回:
         Optional[str]: 在线 API 的回复内容，如果失败则返回 None。
     """
-    if not online_client: # 检查在线客户端是否已成功初始化
+    if not ENABLE_ONLINE_API: # 检查在线客户端是否已成功初始化
         logger.error(f"在线 API 客户端未初始化，无法为用户 {user_id} 执行在线搜索。")
         return None
 
@@ -4155,10 +3963,11 @@ def get_online_model_response(query: str, user_id: str) -> Optional[str]:
 
     try:
         logger.info(f"调用在线 API - 用户: {user_id}, 查询: '{query[:100]}...'")
-        # 使用 online_client 调用在线模型
-        response = online_client.chat.completions.create(
-            model=ONLINE_MODEL,
-            messages=[{"role": "user", "content": online_query_prompt}],
+        # 通过网关调用在线模型
+        response = llm_gateway.chat(
+            ONLINE_BASE_URL, ONLINE_API_KEY, ONLINE_MODEL,
+            [{"role": "user", "content": online_query_prompt}],
+            purpose='online',
             temperature=ONLINE_API_TEMPERATURE,
             max_tokens=ONLINE_API_MAX_TOKEN,
             stream=False
@@ -4236,62 +4045,35 @@ def scheduled_restart_checker():
         
         # 只有在准备重启时才检查提醒事件，避免不必要的检查
         if interval_reached and inactive_enough:
-            # 检查是否有正在进行的短期提醒
-            has_active_short_reminders = False
-            with timer_lock:
-                if active_timers:
-                    logger.info(f"当前有 {len(active_timers)} 个短期提醒进行中，等待它们完成后再重启。")
-                    has_active_short_reminders = True
+            # 短期提醒已持久化，重启后会恢复，无需等待它们完成
+            pending_short_reminders = timer_service.count(kind='short_reminder')
+            if pending_short_reminders:
+                logger.info(f"当前有 {pending_short_reminders} 个短期提醒进行中，将在重启后恢复。")
             
             # 检查是否有即将到来的提醒（5分钟内）
             has_upcoming_reminders = False
             now = datetime.now()
             five_min_later = now + dt.timedelta(minutes=5)
             
-            with recurring_reminder_lock:
-                for reminder in recurring_reminders:
-                    target_dt = None
-                    
-                    # 处理长期一次性提醒
-                    if reminder.get('reminder_type') == 'one-off':
-                        try:
-                            target_dt = datetime.strptime(reminder.get('target_datetime_str'), '%Y-%m-%d %H:%M')
-                        except (ValueError, TypeError):
-                            continue
-                    
-                    # 处理每日重复提醒 - 需要结合当前日期计算今天的触发时间
-                    elif reminder.get('reminder_type') == 'recurring':
-                        try:
-                            time_str = reminder.get('time_str')
-                            if time_str:
-                                # 解析时间字符串获取小时和分钟
-                                reminder_time = datetime.strptime(time_str, '%H:%M').time()
-                                # 结合当前日期构建完整的目标时间
-                                target_dt = datetime.combine(now.date(), reminder_time)
-                                
-                                # 如果今天的触发时间已过，检查明天的触发时间是否在5分钟内
-                                # (极少情况：如果定时检查恰好在23:55-00:00之间，且有0:00-0:05的提醒)
-                                if target_dt < now:
-                                    target_dt = datetime.combine(now.date() + dt.timedelta(days=1), reminder_time)
-                        except (ValueError, TypeError):
-                            continue
-                    
-                    # 检查目标时间是否在5分钟内
-                    if target_dt and now <= target_dt <= five_min_later:
-                        reminder_type = "长期一次性" if reminder.get('reminder_type') == 'one-off' else "每日重复"
-                        display_time = target_dt.strftime('%Y-%m-%d %H:%M') if reminder.get('reminder_type') == 'one-off' else target_dt.strftime('%H:%M')
-                        logger.info(f"检测到5分钟内即将执行的{reminder_type}提醒，延迟重启。提醒时间: {display_time}")
-                        has_upcoming_reminders = True
-                        break
+            # 提醒调度器的堆顶即最近一次触发时间
+            next_fire_time = reminder_scheduler.next_fire_time() if ENABLE_REMINDERS else None
+            if next_fire_time and next_fire_time <= five_min_later:
+                logger.info(f"检测到5分钟内即将执行的提醒，延迟重启。提醒时间: {next_fire_time.strftime('%Y-%m-%d %H:%M')}")
+                has_upcoming_reminders = True
             
             # 如果没有提醒阻碍，则可以重启
-            if not has_active_short_reminders and not has_upcoming_reminders:
+            if not has_upcoming_reminders:
                 logger.warning(f"满足重启条件：已运行约 {(current_time - program_start_time)/3600:.2f} 小时，已持续 {time_since_last_activity/60:.1f} 分钟无活动，且没有即将执行的提醒。准备重启程序...")
                 try:
                     # --- 执行重启前的清理操作 ---
+                    logger.info("定时重启前：等待回复生成与发送队列清空...")
+                    if not llm_worker_pool.wait_idle(timeout=SEND_QUEUE_DRAIN_TIMEOUT):
+                        logger.warning("等待回复生成完成超时。")
+                    if not send_scheduler.wait_idle(timeout=SEND_QUEUE_DRAIN_TIMEOUT):
+                        logger.warning("等待发送队列清空超时，仍有未发送的消息。")
                     logger.info("定时重启前：保存聊天上下文...")
-                    with queue_lock:
-                        save_chat_contexts()
+                    save_chat_contexts()
+                    recognition_cache.save()
                     
                     # 保存用户计时器状态
                     if get_dynamic_config('ENABLE_AUTO_MESSAGE', ENABLE_AUTO_MESSAGE):
@@ -4300,8 +4082,7 @@ def scheduled_restart_checker():
                     
                     if ENABLE_REMINDERS:
                         logger.info("定时重启前：保存提醒列表...")
-                        with recurring_reminder_lock:
-                            save_recurring_reminders()
+                        save_recurring_reminders()
                     
                     # 关闭异步HTTP日志处理器
                     if 'async_http_handler' in globals() and isinstance(async_http_handler, AsyncHTTPHandler):
@@ -4377,12 +4158,38 @@ def _init_heartbeat_session():
         })
     return _heartbeat_session
 
+def get_runtime_stats():
+    """收集运行时统计信息，随心跳发送给配置编辑器展示。"""
+    stats = {}
+    try:
+        stats['prompt_cache'] = prompt_cache.stats()
+        stats['send_scheduler'] = send_scheduler.stats()
+        stats['reply_workers'] = llm_worker_pool.stats()
+        stats['ingest'] = ingest_pool.stats()
+        stats['message_debounce'] = message_debouncer.stats()
+        stats['reminders'] = reminder_scheduler.stats()
+        stats['timers'] = timer_service.stats()
+        stats['recognition_cache'] = recognition_cache.stats()
+        stats['image_preprocess'] = image_preprocessor.stats()
+        stats['dispatch_pause'] = dispatch_pause.stats()
+        stats['web_fetch'] = web_fetcher.stats()
+        stats['llm'] = llm_gateway.stats()
+        stats['chat_providers'] = chat_provider_pool.stats()
+        stats['aux_router'] = aux_router.stats()
+        stats['triggers'] = trigger_engine.stats()
+        stats['memory_retrieval'] = memory_retriever.stats()
+        stats['token_counter'] = token_counter.stats()
+    except Exception as e:
+        logger.debug(f"收集运行时统计信息失败: {e}")
+    return stats
+
 def send_heartbeat():
     """向Waitress服务器发送心跳信号（使用连接池复用）"""
     heartbeat_url = f"{FLASK_SERVER_URL_BASE}/bot_heartbeat"
     payload = {
         'status': 'alive',
-        'pid': os.getpid()  # 发送当前进程PID，方便调试
+        'pid': os.getpid(),  # 发送当前进程PID，方便调试
+        'stats': get_runtime_stats()  # 运行时统计（缓存命中率等）
     }
     
     try:
@@ -4512,11 +4319,22 @@ def main():
         # 加载聊天上下文
         logger.info("正在加载聊天上下文...")
         load_chat_contexts() # 调用加载函数
+        chat_context_store.start_writer()
+
+        if ENABLE_IMAGE_RECOGNITION or ENABLE_EMOJI_RECOGNITION:
+            recognition_cache.load()
+
+        # 定时器服务：短期提醒、表情包防抖和延迟重启都依赖它
+        timer_service.register_kind('short_reminder', trigger_reminder, blocking=True)
+        timer_service.start()
 
         if ENABLE_REMINDERS:
              logger.info("提醒功能已启用。")
              # 加载已保存的提醒 (包括重复和长期一次性)
              load_recurring_reminders()
+             # 恢复上次退出时尚未触发的短期提醒（过期太久的丢弃）
+             timer_service.restore(max_late=REMINDER_CATCH_UP_WINDOW,
+                                   accept=lambda record: record.get('group') in user_names)
              if not isinstance(ALLOW_REMINDERS_IN_QUIET_TIME, bool):
                   logger.warning("配置项 ALLOW_REMINDERS_IN_QUIET_TIME 的值不是布尔类型 (True/False)，可能导致意外行为。")
         else:
@@ -4565,6 +4383,8 @@ def main():
         listener_thread.start()
         logger.info("消息窗口保活已启动。")
 
+        send_scheduler.start()
+
         checker_thread = threading.Thread(target=check_inactive_users, name="InactiveUserChecker")
         checker_thread.daemon = True
         checker_thread.start()
@@ -4590,10 +4410,8 @@ def main():
 
         # 检查重复和长期一次性提醒
         if ENABLE_REMINDERS:
-            reminder_checker_thread = threading.Thread(target=recurring_reminder_checker, name="ReminderChecker")
-            reminder_checker_thread.daemon = True
-            reminder_checker_thread.start()
-            logger.info("提醒检查线程（重复和长期一次性）已启动。")
+            reminder_scheduler.start()
+            logger.info("提醒调度线程（重复和长期一次性）已启动。")
 
         # 自动消息 - 线程总是启动，但根据动态配置决定是否工作
         auto_message_thread = threading.Thread(target=check_user_timeouts, name="AutoMessageChecker")
@@ -4626,28 +4444,37 @@ def main():
         logger.critical(f"主程序发生严重错误: {str(e)}", exc_info=True)
     finally:
         logger.info("程序准备退出，执行清理操作...")
+        # 不再接收新消息
+        ingest_pool.shutdown(wait=False)
+
+        # 尽量发送完已提交的回复后再停止发送线程
+        if not send_scheduler.wait_idle(timeout=SEND_QUEUE_DRAIN_TIMEOUT):
+            logger.warning("等待发送队列清空超时，未发送的消息将被丢弃。")
+        send_scheduler.stop(timeout=5)
 
         # 保存用户计时器状态（如果启用了自动消息）
         if get_dynamic_config('ENABLE_AUTO_MESSAGE', ENABLE_AUTO_MESSAGE):
             logger.info("程序退出前：保存用户计时器状态...")
             save_user_timers()
 
-        # 取消活动的短期一次性提醒定时器
-        with timer_lock:
-            if active_timers:
-                 logger.info(f"正在取消 {len(active_timers)} 个活动的短期一次性提醒定时器...")
-                 cancelled_count = 0
-                 # 使用 list(active_timers.items()) 创建副本进行迭代
-                 for timer_key, timer in list(active_timers.items()):
-                     try:
-                         timer.cancel()
-                         cancelled_count += 1
-                     except Exception as cancel_err:
-                         logger.warning(f"取消短期定时器 {timer_key} 时出错: {cancel_err}")
-                 active_timers.clear()
-                 logger.info(f"已取消 {cancelled_count} 个短期一次性定时器。")
-            else:
-                 logger.info("没有活动的短期一次性提醒定时器需要取消。")
+        if ENABLE_REMINDERS:
+            logger.info("程序退出前：保存提醒列表...")
+            reminder_scheduler.stop(timeout=5)
+
+        # 停止定时器服务，未触发的短期一次性提醒保存在文件中，下次启动时恢复
+        pending_short_reminders = timer_service.count(kind='short_reminder')
+        timer_service.stop(timeout=5)
+        if pending_short_reminders:
+            logger.info(f"已保存 {pending_short_reminders} 个未触发的短期一次性提醒，下次启动时恢复。")
+        else:
+            logger.info("没有活动的短期一次性提醒需要保存。")
+
+        # 定时器停止后立即写入聊天上下文：后面的关闭步骤可能出错，日志处理器关闭后也无法再上报写入失败
+        logger.info("正在写入未保存的聊天上下文...")
+        try:
+            chat_context_store.close()
+        except Exception as ctx_close_err:
+            logger.error(f"写入聊天上下文时出错: {ctx_close_err}")
 
         if 'async_http_handler' in globals() and isinstance(async_http_handler, AsyncHTTPHandler):
             logger.info("正在关闭异步HTTP日志处理器...")
@@ -4657,6 +4484,13 @@ def main():
             except Exception as log_close_err:
                  logger.error(f"关闭异步日志处理器时出错: {log_close_err}")
         
+        recognition_cache.save()
+        image_preprocessor.shutdown()
+        merged_image_pool.shutdown(wait=False)
+        web_fetcher.close()
+        chat_provider_pool.shutdown()
+        llm_gateway.close()
+
         # 关闭心跳Session，释放Waitress连接
         global _heartbeat_session
         if _heartbeat_session is not None:
@@ -22,6 +22,11 @@ DEEPSEEK_BASE_URL = 'https://vg.v1api.cc/v1'
 MODEL = 'deepseek-v3-0324'
 # 用户和AI对话轮数
 MAX_GROUPS = 5
+# 按 token 预算组装上下文：在 MAX_GROUPS 轮以内，系统提示词、记忆、当前消息和预留回复 (MAX_TOKEN)
+# 之外的预算从最新的历史消息开始填充，放不下的更早消息不再上传；
+# CONTEXT_TOKEN_BUDGET 为每次请求的 token 上限（含预留回复）
+ENABLE_TOKEN_BUDGET = True
+CONTEXT_TOKEN_BUDGET = 8000
 
 # 如果要使用官方的API
 # DEEPSEEK_BASE_URL = 'https://api.deepseek.com'
@@ -32,6 +37,13 @@ MAX_GROUPS = 5
 MAX_TOKEN = 2000
 # DeepSeek温度
 TEMPERATURE = 1.1
+# 每个API服务商的每分钟请求数/token数上限（0 表示不限制，收到限流错误后自动降速）
+LLM_RATE_LIMIT_RPM = 0
+LLM_RATE_LIMIT_TPM = 0
+# 主对话模型的备用服务商，格式：[['API地址', '模型', 'API Key'], ...]
+# 首选服务商响应过慢时向备用服务商发出对冲请求（采用先返回的回复），出错时自动切换
+CHAT_BACKUP_PROVIDERS = []
+ENABLE_CHAT_HEDGING = True
 
 # Moonshot AI配置（用于图片和表情包识别）
 # API申请https://platform.moonshot.cn/
@@ -39,11 +51,22 @@ MOONSHOT_API_KEY = ''
 MOONSHOT_BASE_URL = 'https://vg.v1api.cc/v1'
 MOONSHOT_MODEL = 'gpt-4o'
 MOONSHOT_TEMPERATURE = 0.8
+# 上传识别前将图片长边缩小到该像素数以内，并去除元数据（0 表示不缩小）
+IMAGE_RECOGNITION_MAX_EDGE = 1600
 ENABLE_IMAGE_RECOGNITION = True
 ENABLE_EMOJI_RECOGNITION = True
 
 # 消息队列等待时间
 QUEUE_WAITING_TIME = 7
+# 同时为多少个用户生成回复（并发调用大模型API的数量上限）
+MAX_CONCURRENT_LLM_REQUESTS = 3
+# 自适应消息合并：按每个聊天的消息间隔学习等待时间，几乎总是只发一条消息的聊天提前派发，
+# 会连发的聊天仍至少等待 QUEUE_WAITING_TIME；可用 benchmarks/replay_debounce.py 回放自己的消息记录对比
+ENABLE_ADAPTIVE_DEBOUNCE = True
+# 只发一条消息的聊天的等待时间（秒）
+ADAPTIVE_DEBOUNCE_MIN_WAIT = 2.0
+# 连发聊天最多延长到的等待时间（秒），不高于 QUEUE_WAITING_TIME 时不延长；调高可减少慢速连发被拆分，但会增加延迟
+ADAPTIVE_DEBOUNCE_MAX_WAIT = 7.0
 
 # 表情包存放目录
 EMOJI_DIR = 'emojis'
@@ -79,6 +102,11 @@ MEMORY_TEMP_DIR = 'Memory_Temp'
 MAX_MESSAGE_LOG_ENTRIES = 30
 MAX_MEMORY_NUMBER = 50
 UPLOAD_MEMORY_TO_AI = True
+# 核心记忆检索：每轮只把与消息最相关的记忆（最多 MEMORY_RETRIEVAL_TOP_K 条）
+# 和重要度不低于 MEMORY_PINNED_IMPORTANCE 的置顶记忆放进提示词，关闭后每轮放入全部记忆
+ENABLE_MEMORY_RETRIEVAL = True
+MEMORY_RETRIEVAL_TOP_K = 8
+MEMORY_PINNED_IMPORTANCE = 5
 # 记忆存储方式：True = 保存到单独的JSON文件，False = 保存到prompt文件中
 SAVE_MEMORY_TO_SEPARATE_FILE = True
 CORE_MEMORY_DIR = 'CoreMemory'
@@ -148,6 +176,8 @@ ASSISTANT_API_KEY = ''
 ASSISTANT_TEMPERATURE = 0.3
 ASSISTANT_MAX_TOKEN = 1000
 USE_ASSISTANT_FOR_MEMORY_SUMMARY = False
+# 同一轮对话同时需要提醒解析和联网检测时合并为一次模型调用，结果无法解析时逐项判断
+ENABLE_AUX_ROUTER = True
 
 # 敏感词处理配置
 # 开启后遇到敏感词时自动清除Memory_Temp文件和聊天上下文
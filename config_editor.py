@@ -30,10 +30,11 @@ import ast
 import os
 import subprocess
 import psutil
-import openai
 import tempfile
 import shutil
 from filelock import FileLock
+from context_store import ChatContextJournal
+from llm_gateway import LLMGateway
 from functools import wraps
 import webbrowser
 from threading import Timer
@@ -301,6 +302,27 @@ def is_hidden_api_key(api_key):
     """
     return api_key and '*' in api_key
 
+def parse_backup_providers(text, old_providers):
+    """
+    解析“备用对话服务商”文本框：每行“API地址 | 模型 | API Key”。
+    API Key 为隐藏版本时沿用旧配置中地址和模型相同的条目的 Key。
+    """
+    old_keys = {}
+    for entry in old_providers or []:
+        if isinstance(entry, (list, tuple)) and len(entry) >= 3:
+            old_keys[(entry[0], entry[1])] = entry[2]
+    providers = []
+    for line in (text or '').splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            continue
+        base_url, model = parts[0], parts[1]
+        api_key = parts[2] if len(parts) > 2 else ''
+        if is_hidden_api_key(api_key):
+            api_key = old_keys.get((base_url, model), '')
+        providers.append([base_url, model, api_key])
+    return providers
+
 def safe_type_convert(value, target_type, default_value=None, field_name=""):
     """
     安全的类型转换函数，防止整数转换为字符串
@@ -364,15 +386,18 @@ def validate_config_types(config_path):
         issues = []
         
         # 检查应该是整数但被保存为字符串的配置项
-        int_fields = ['MAX_GROUPS', 'MAX_TOKEN', 'QUEUE_WAITING_TIME', 'EMOJI_SENDING_PROBABILITY', 
+        int_fields = ['MAX_GROUPS', 'MAX_TOKEN', 'QUEUE_WAITING_TIME', 'MAX_CONCURRENT_LLM_REQUESTS', 'EMOJI_SENDING_PROBABILITY', 
                      'MAX_MESSAGE_LOG_ENTRIES', 'MAX_MEMORY_NUMBER', 'PORT', 'ONLINE_API_MAX_TOKEN',
                      'REQUESTS_TIMEOUT', 'MAX_WEB_CONTENT_LENGTH', 'RESTART_INACTIVITY_MINUTES',
-                     'GROUP_CHAT_RESPONSE_PROBABILITY', 'ASSISTANT_MAX_TOKEN']
+                     'GROUP_CHAT_RESPONSE_PROBABILITY', 'ASSISTANT_MAX_TOKEN', 'IMAGE_RECOGNITION_MAX_EDGE',
+                     'LLM_RATE_LIMIT_RPM', 'LLM_RATE_LIMIT_TPM', 'MEMORY_RETRIEVAL_TOP_K', 'MEMORY_PINNED_IMPORTANCE',
+                     'CONTEXT_TOKEN_BUDGET']
         
         # 检查应该是浮点数但被保存为字符串的配置项  
         float_fields = ['TEMPERATURE', 'MOONSHOT_TEMPERATURE', 'MIN_COUNTDOWN_HOURS', 'MAX_COUNTDOWN_HOURS',
                        'AVERAGE_TYPING_SPEED', 'RANDOM_TYPING_SPEED_MIN', 'RANDOM_TYPING_SPEED_MAX',
-                       'ONLINE_API_TEMPERATURE', 'RESTART_INTERVAL_HOURS', 'ASSISTANT_TEMPERATURE']
+                       'ONLINE_API_TEMPERATURE', 'RESTART_INTERVAL_HOURS', 'ASSISTANT_TEMPERATURE',
+                       'ADAPTIVE_DEBOUNCE_MIN_WAIT', 'ADAPTIVE_DEBOUNCE_MAX_WAIT']
         
         for field in int_fields:
             pattern = rf'{field}\s*=\s*[\'"](\d+)[\'"]'
@@ -465,23 +490,25 @@ def clear_login_attempts(ip):
     if ip in login_attempts:
         login_attempts[ip] = []
 
-CHAT_CONTEXTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_contexts.json')
-CHAT_CONTEXTS_LOCK_FILE = CHAT_CONTEXTS_FILE + '.lock'
+CHAT_CONTEXTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_contexts')
+CHAT_CONTEXTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chat_contexts.json')  # 旧版文件，仅用于迁移
+chat_context_journal = ChatContextJournal(CHAT_CONTEXTS_DIR)
+
+# 模型调用网关：按 (base_url, key) 复用客户端与连接池，可重试的错误自动退避重试
+llm_gateway = LLMGateway(max_retries=1)  # 页面请求等待时间有限，只重试一次
 
 last_heartbeat_time = 0  # 上次收到心跳的时间戳
+last_bot_stats = {}  # bot 随心跳上报的运行时统计信息
 HEARTBEAT_TIMEOUT = 15   # 心跳超时阈值（秒），应大于 bot.py 的 HEARTBEAT_INTERVAL
 current_bot_pid = None
 
 def get_chat_context_users():
-    """从 chat_contexts.json 读取用户列表 (即顶级键)"""
-    if not os.path.exists(CHAT_CONTEXTS_FILE):
-        return []
+    """从 chat_contexts/ 日志目录读取用户列表（首次调用时迁移旧版 chat_contexts.json）"""
     try:
-        with open(CHAT_CONTEXTS_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return list(data.keys())
-    except (json.JSONDecodeError, IOError) as e:
-        app.logger.error(f"读取 chat_contexts.json 失败: {e}")
+        chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+        return chat_context_journal.list_users()
+    except Exception as e:
+        app.logger.error(f"读取聊天上下文用户列表失败: {e}")
         return []
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -823,7 +850,8 @@ def submit_config():
             'ENABLE_GROUP_AT_REPLY', 'ENABLE_GROUP_KEYWORD_REPLY','GROUP_KEYWORD_REPLY_IGNORE_PROBABILITY', 'REMOVE_PARENTHESES',
             'ENABLE_ASSISTANT_MODEL', 'USE_ASSISTANT_FOR_MEMORY_SUMMARY', 'ENABLE_FORUM_CUSTOM_MODEL',
             'IGNORE_GROUP_CHAT_FOR_AUTO_MESSAGE', 'ENABLE_SENSITIVE_CONTENT_CLEARING', 'SAVE_MEMORY_TO_SEPARATE_FILE',
-            'ENABLE_TEXT_COMMANDS'
+            'ENABLE_TEXT_COMMANDS', 'ENABLE_ADAPTIVE_DEBOUNCE', 'ENABLE_CHAT_HEDGING', 'ENABLE_AUX_ROUTER',
+            'ENABLE_MEMORY_RETRIEVAL', 'ENABLE_TOKEN_BUDGET'
         ]
         for field in boolean_fields:
             new_values_for_config_py[field] = field in request.form
@@ -834,6 +862,11 @@ def submit_config():
 
             value_from_form = request.form[key_from_form].strip()
             
+            if key_from_form == 'CHAT_BACKUP_PROVIDERS':
+                new_values_for_config_py[key_from_form] = parse_backup_providers(
+                    value_from_form, current_config_before_update.get(key_from_form, []))
+                continue
+
             if key_from_form == 'GROUP_KEYWORD_LIST':
                 if value_from_form:
                     normalized_value = re.sub(r'，|\s+', ',', value_from_form)
@@ -847,7 +880,7 @@ def submit_config():
                 original_type_source = current_config_before_update[key_from_form]
                 if isinstance(original_type_source, bool):
                     new_values_for_config_py[key_from_form] = (value_from_form.lower() == 'true')
-                elif key_from_form in ["MIN_COUNTDOWN_HOURS", "MAX_COUNTDOWN_HOURS", "AVERAGE_TYPING_SPEED", "RANDOM_TYPING_SPEED_MIN", "RANDOM_TYPING_SPEED_MAX", "TEMPERATURE", "MOONSHOT_TEMPERATURE", "ONLINE_API_TEMPERATURE", "ASSISTANT_TEMPERATURE", "RESTART_INTERVAL_HOURS", "FORUM_TEMPERATURE"]: 
+                elif key_from_form in ["MIN_COUNTDOWN_HOURS", "MAX_COUNTDOWN_HOURS", "AVERAGE_TYPING_SPEED", "RANDOM_TYPING_SPEED_MIN", "RANDOM_TYPING_SPEED_MAX", "TEMPERATURE", "MOONSHOT_TEMPERATURE", "ONLINE_API_TEMPERATURE", "ASSISTANT_TEMPERATURE", "RESTART_INTERVAL_HOURS", "FORUM_TEMPERATURE", "ADAPTIVE_DEBOUNCE_MIN_WAIT", "ADAPTIVE_DEBOUNCE_MAX_WAIT"]: 
                     try:
                         # 先确保值是字符串类型，然后进行转换
                         str_value = str(value_from_form).strip()
@@ -965,23 +998,14 @@ def submit_config():
         validate_config_types(config_path)
 
         if users_whose_prompt_changed:
-            with FileLock(CHAT_CONTEXTS_LOCK_FILE):
-                try:
-                    if os.path.exists(CHAT_CONTEXTS_FILE):
-                        with open(CHAT_CONTEXTS_FILE, 'r+', encoding='utf-8') as f:
-                            chat_data = json.load(f)
-                            modified_chat_data = False
-                            for user_to_clear in users_whose_prompt_changed:
-                                if user_to_clear in chat_data:
-                                    del chat_data[user_to_clear]
-                                    modified_chat_data = True
-                                    app.logger.info(f"因Prompt文件变更，用户 '{user_to_clear}' 的聊天上下文已清除。")
-                            if modified_chat_data:
-                                f.seek(0)
-                                json.dump(chat_data, f, ensure_ascii=False, indent=4)
-                                f.truncate()
-                except (json.JSONDecodeError, IOError) as e:
-                    app.logger.error(f"清除因Prompt变更导致的聊天上下文时出错: {e}")
+            try:
+                chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+                with chat_context_journal.lock():
+                    for user_to_clear in users_whose_prompt_changed:
+                        if chat_context_journal.delete_user(user_to_clear):
+                            app.logger.info(f"因Prompt文件变更，用户 '{user_to_clear}' 的聊天上下文已清除。")
+            except OSError as e:
+                app.logger.error(f"清除因Prompt变更导致的聊天上下文时出错: {e}")
                     
         return '', 204 
     except Exception as e:
@@ -1046,7 +1070,7 @@ def stop_bot_process(pid_to_kill=None):
 @limiter.limit("120 per minute")  # 速率限制：每分钟最多120次心跳
 def bot_heartbeat():
     """接收bot进程心跳（安全修复：添加了基本验证）"""
-    global last_heartbeat_time, current_bot_pid
+    global last_heartbeat_time, current_bot_pid, last_bot_stats
     
     try:
         # 安全检查1：验证Content-Type
@@ -1067,6 +1091,9 @@ def bot_heartbeat():
         
         last_heartbeat_time = time.time()
         data = request.get_json()
+
+        if data and isinstance(data.get('stats'), dict):
+            last_bot_stats = data['stats']
         
         if data and 'pid' in data:
             received_pid = data.get('pid')
@@ -1095,6 +1122,19 @@ def bot_heartbeat():
         app.logger.error(f"Error processing heartbeat: {e}")
         return jsonify({'error': 'Failed to process heartbeat'}), 500
 
+@app.route('/api/bot_stats', methods=['GET'])
+@limiter.exempt  # 豁免速率限制：前端频繁轮询，只读操作
+@login_required
+def get_bot_stats():
+    """返回 bot 最近一次心跳上报的运行时统计信息（如提示词缓存命中率）"""
+    heartbeat_is_recent = (time.time() - last_heartbeat_time) < HEARTBEAT_TIMEOUT
+    return jsonify({
+        'status': 'success',
+        'running': heartbeat_is_recent,
+        'last_heartbeat_time': last_heartbeat_time,
+        'stats': last_bot_stats
+    })
+
 def parse_config():
     script_dir = os.path.dirname(os.path.abspath(__file__))
     config_path = os.path.join(script_dir, 'config.py')
@@ -1423,6 +1463,10 @@ def index():
         for field in api_key_fields:
             if field in display_config:
                 display_config[field] = hide_api_key(display_config[field])
+        display_config['CHAT_BACKUP_PROVIDERS'] = [
+            [entry[0], entry[1], hide_api_key(entry[2])] for entry in config.get('CHAT_BACKUP_PROVIDERS') or []
+            if isinstance(entry, (list, tuple)) and len(entry) >= 3
+        ]
 
         return render_template('config_editor.html',
                              config=display_config,
@@ -1567,11 +1611,6 @@ def generate_prompt():
         # 从config.py获取配置
         from config import DEEPSEEK_API_KEY, DEEPSEEK_BASE_URL, MODEL
         
-        client = openai.OpenAI(
-            base_url=DEEPSEEK_BASE_URL,
-            api_key=DEEPSEEK_API_KEY
-        )
-        
         prompt = request.json.get('prompt', '')
         FixedPrompt = (
             "\n请严格按照以下格式生成提示词（仅参考以下格式，将...替换为合适的内容，不要输出其他多余内容）。"
@@ -1596,12 +1635,13 @@ def generate_prompt():
         config = parse_config()
         temperature = config.get('TEMPERATURE', 0.7)
 
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[{
+        completion = llm_gateway.chat(
+            DEEPSEEK_BASE_URL, DEEPSEEK_API_KEY, MODEL,
+            [{
             "role": "user",
             "content": prompt + FixedPrompt
             }],
+            purpose='generate_prompt',
             temperature=temperature,
             max_tokens=5000
         )
@@ -1866,12 +1906,13 @@ def backup_existing_data(backup_dir):
             shutil.copy2(reminders_file, backup_reminders)
             backed_up_items.append('recurring_reminders.json文件')
         
-        # 备份 chat_contexts.json 文件
-        chat_contexts_file = os.path.join(BASE_DIR, 'chat_contexts.json')
-        if os.path.exists(chat_contexts_file):
-            backup_chat_contexts = os.path.join(backup_dir, 'chat_contexts.json')
-            shutil.copy2(chat_contexts_file, backup_chat_contexts)
-            backed_up_items.append('chat_contexts.json文件')
+        # 备份 chat_contexts 上下文日志目录
+        chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+        if os.path.exists(CHAT_CONTEXTS_DIR):
+            backup_chat_contexts = os.path.join(backup_dir, 'chat_contexts')
+            with chat_context_journal.lock():
+                shutil.copytree(CHAT_CONTEXTS_DIR, backup_chat_contexts, ignore=shutil.ignore_patterns('.lock', '*.tmp'))
+            backed_up_items.append('chat_contexts文件夹')
         
         # 备份 Memory_Temp 文件夹
         config = parse_config()
@@ -1978,11 +2019,24 @@ def import_directory_data(source_dir):
             shutil.copy2(source_reminders, target_reminders)
             imported_items.append('recurring_reminders.json文件')
         
-        # 导入 chat_contexts.json 文件
+        # 导入 chat_contexts 上下文日志目录（兼容旧版备份中的 chat_contexts.json）
+        source_chat_contexts_dir = os.path.join(source_dir, 'chat_contexts')
         source_chat_contexts = os.path.join(source_dir, 'chat_contexts.json')
-        if os.path.exists(source_chat_contexts):
-            target_chat_contexts = os.path.join(BASE_DIR, 'chat_contexts.json')
-            shutil.copy2(source_chat_contexts, target_chat_contexts)
+        if os.path.isdir(source_chat_contexts_dir):
+            # 与其他文件夹一样整体替换：先删除现有的用户日志（保留锁文件），再复制备份
+            with chat_context_journal.lock():
+                chat_context_journal.delete_all()
+                shutil.copytree(source_chat_contexts_dir, CHAT_CONTEXTS_DIR, dirs_exist_ok=True,
+                                ignore=shutil.ignore_patterns('.lock', '*.tmp'))
+            imported_items.append('chat_contexts文件夹')
+        elif os.path.exists(source_chat_contexts):
+            # 旧版备份：先删除现有的用户日志，再通过迁移器导入
+            with open(source_chat_contexts, 'r', encoding='utf-8') as f:
+                json.load(f)  # 先确认备份文件可以解析，再删除现有数据
+            with chat_context_journal.lock():
+                chat_context_journal.delete_all()
+            shutil.copy2(source_chat_contexts, CHAT_CONTEXTS_FILE)
+            chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
             imported_items.append('chat_contexts.json文件')
         
         # 导入 Memory_Temp 文件夹
@@ -2359,23 +2413,15 @@ def clear_chat_context(username):
         app.logger.warning(f"无效的用户名: {username}, 错误: {e}")
         return jsonify({'status': 'error', 'message': f'无效的用户名: {str(e)}'}), 400
     
-    if not os.path.exists(CHAT_CONTEXTS_FILE):
-        return jsonify({'status': 'error', 'message': '聊天上下文文件不存在'}), 404
-
-    with FileLock(CHAT_CONTEXTS_LOCK_FILE):
+    chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+    with chat_context_journal.lock():
         try:
-            with open(CHAT_CONTEXTS_FILE, 'r+', encoding='utf-8') as f:
-                data = json.load(f)
-                if username in data:
-                    del data[username]
-                    f.seek(0) # 回到文件开头
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                    f.truncate() # 删除剩余内容
-                    return jsonify({'status': 'success', 'message': f"用户 '{username}' 的聊天上下文已清除"})
-                else:
-                    return jsonify({'status': 'error', 'message': f"用户 '{username}' 未找到"}), 404
-        except (json.JSONDecodeError, IOError) as e:
-            app.logger.error(f"处理 chat_contexts.json 失败: {e}")
+            if chat_context_journal.delete_user(username):
+                return jsonify({'status': 'success', 'message': f"用户 '{username}' 的聊天上下文已清除"})
+            else:
+                return jsonify({'status': 'error', 'message': f"用户 '{username}' 未找到"}), 404
+        except OSError as e:
+            app.logger.error(f"删除用户 {username} 的聊天上下文日志失败: {e}")
             return jsonify({'status': 'error', 'message': '处理聊天上下文文件失败'}), 500
 
 # 聊天上下文编辑API
@@ -2390,21 +2436,12 @@ def get_user_chat_context(username):
         app.logger.warning(f"无效的用户名: {username}, 错误: {e}")
         return jsonify({'error': f'无效的用户名: {str(e)}'}), 400
     
-    if not os.path.exists(CHAT_CONTEXTS_FILE):
-        return jsonify({'error': '聊天上下文文件未找到'}), 404
-
-    with FileLock(CHAT_CONTEXTS_LOCK_FILE):
-        try:
-            with open(CHAT_CONTEXTS_FILE, 'r', encoding='utf-8') as f:
-                contexts = json.load(f)
-            user_context = contexts.get(username)
-            if user_context is None:
-                return jsonify({'error': f"用户 '{username}' 在上下文中不存在"}), 404
-            pretty_context = json.dumps(user_context, ensure_ascii=False, indent=4)
-            return jsonify({'status': 'success', 'context': pretty_context})
-        except (json.JSONDecodeError, IOError) as e:
-            app.logger.error(f"读取或解析聊天上下文文件失败: {e}")
-            return jsonify({'error': f'读取或解析文件失败: {e}'}), 500
+    chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+    user_context = chat_context_journal.read_user(username)
+    if user_context is None:
+        return jsonify({'error': f"用户 '{username}' 在上下文中不存在"}), 404
+    pretty_context = json.dumps(user_context, ensure_ascii=False, indent=4)
+    return jsonify({'status': 'success', 'context': pretty_context})
 
 @app.route('/api/save_chat_context/<username>', methods=['POST'])
 @login_required
@@ -2443,19 +2480,12 @@ def save_user_chat_context(username):
         # --- END ---
     except (json.JSONDecodeError, ValueError) as e:
         return jsonify({'status': 'error', 'message': f'格式错误: {str(e)}'}), 400
-    with FileLock(CHAT_CONTEXTS_LOCK_FILE):
+    chat_context_journal.migrate_legacy_json(CHAT_CONTEXTS_FILE)
+    with chat_context_journal.lock():
         try:
-            if not os.path.exists(CHAT_CONTEXTS_FILE):
-                return jsonify({'status': 'error', 'message': '聊天上下文文件未找到'}), 404
-            with open(CHAT_CONTEXTS_FILE, 'r', encoding='utf-8') as f:
-                all_contexts = json.load(f)
-            if username not in all_contexts:
+            if not os.path.exists(chat_context_journal.path_for(username)):
                 return jsonify({'status': 'error', 'message': '用户在上下文中不存在'}), 404
-            all_contexts[username] = merged_context
-            temp_file_path = CHAT_CONTEXTS_FILE + ".tmp"
-            with open(temp_file_path, 'w', encoding='utf-8') as f:
-                json.dump(all_contexts, f, ensure_ascii=False, indent=4)
-            shutil.move(temp_file_path, CHAT_CONTEXTS_FILE)
+            chat_context_journal.write_snapshot(username, merged_context)
         except Exception as e:
             app.logger.error(f"保存聊天上下文失败: {e}")
             return jsonify({'status': 'error', 'message': f'保存失败: {str(e)}'}), 500
@@ -3041,10 +3071,10 @@ def check_should_post_forum(character_name):
                         "偏向话题与趋势，不要细节长文；每条不超过30字；"
                         "只输出纯文本多行，不要编号、不要任何额外解释。"
                     )
-                    online_client = openai.OpenAI(base_url=online_base_url, api_key=online_api_key, timeout=20)
-                    online_completion = online_client.chat.completions.create(
-                        model=online_model,
-                        messages=[{"role": "user", "content": online_prompt}],
+                    online_completion = llm_gateway.chat(
+                        online_base_url, online_api_key, online_model,
+                        [{"role": "user", "content": online_prompt}],
+                        purpose='online_hot',
                         temperature=online_temperature,
                         max_tokens=min(online_max_tokens, 300),
                         timeout=20
@@ -3167,19 +3197,14 @@ def check_should_post_forum(character_name):
             app.logger.error("API密钥未配置")
             return False, ""
         
-        client = openai.OpenAI(
-            base_url=base_url,
-            api_key=api_key,
-            timeout=30  # 设置30秒超时
-        )
-        
         app.logger.info("开始调用AI API...")
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{
+        completion = llm_gateway.chat(
+            base_url, api_key, model,
+            [{
                 "role": "user",
                 "content": prompt
             }],
+            purpose='forum_post',
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=30  # API调用超时设置
@@ -3408,10 +3433,10 @@ def generate_character_conversation_reply(character_name, post_content, user_mes
         if not api_key:
             return "收到啦～"
 
-        client = openai.OpenAI(base_url=base_url, api_key=api_key, timeout=20)
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
+        completion = llm_gateway.chat(
+            base_url, api_key, model,
+            [{"role": "user", "content": prompt}],
+            purpose='forum_role_reply',
             temperature=temperature,
             max_tokens=max_tokens,
             timeout=20
@@ -3565,10 +3590,10 @@ def generate_likes_feed_items(character_name, use_online=False):
                         "偏向话题与趋势，不要细节长文；每条不超过30字；"
                         "只输出纯文本多行，不要编号、不要任何额外解释。"
                     )
-                    online_client = openai.OpenAI(base_url=online_base_url, api_key=online_api_key, timeout=20)
-                    online_completion = online_client.chat.completions.create(
-                        model=online_model,
-                        messages=[{"role": "user", "content": online_prompt}],
+                    online_completion = llm_gateway.chat(
+                        online_base_url, online_api_key, online_model,
+                        [{"role": "user", "content": online_prompt}],
+                        purpose='online_hot',
                         temperature=online_temperature,
                         max_tokens=min(online_max_tokens, 500),
                         timeout=20
@@ -3635,10 +3660,10 @@ def generate_likes_feed_items(character_name, use_online=False):
 4) 不要使用引号或代码块
 """
 
-        gen_client = openai.OpenAI(base_url=gen_base_url, api_key=gen_api_key, timeout=25)
-        gen_completion = gen_client.chat.completions.create(
-            model=gen_model,
-            messages=[{"role": "user", "content": final_prompt}],
+        gen_completion = llm_gateway.chat(
+            gen_base_url, gen_api_key, gen_model,
+            [{"role": "user", "content": final_prompt}],
+            purpose='likes_feed',
             temperature=gen_temperature,
             max_tokens=gen_max_tokens,
             timeout=25
@@ -4060,18 +4085,13 @@ NPC设定：
             app.logger.warning(f"API密钥未配置，使用默认回复")
             return generate_fallback_reply(npc_name, language_style, relationship)
         
-        client = openai.OpenAI(
-            base_url=base_url,
-            api_key=api_key,
-            timeout=30  # 提高超时阈值，减少长尾超时
-        )
-        
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{
+        completion = llm_gateway.chat(
+            base_url, api_key, model,
+            [{
                 "role": "user",
                 "content": prompt
             }],
+            purpose='npc_reply',
             temperature=temperature,
             max_tokens=min(max_tokens, 120),  # 按20字回复需求收紧，降低超时概率
             timeout=30
@@ -4189,15 +4209,26 @@ def get_default_config():
         "DEEPSEEK_BASE_URL": 'https://vg.v1api.cc/v1',
         "MODEL": 'deepseek-v3-0324',
         "MAX_GROUPS": 5,
+        "ENABLE_TOKEN_BUDGET": True,
+        "CONTEXT_TOKEN_BUDGET": 8000,
         "MAX_TOKEN": 2000,
         "TEMPERATURE": 1.1,
+        "LLM_RATE_LIMIT_RPM": 0,
+        "LLM_RATE_LIMIT_TPM": 0,
+        "CHAT_BACKUP_PROVIDERS": [],
+        "ENABLE_CHAT_HEDGING": True,
         "MOONSHOT_API_KEY": '',
         "MOONSHOT_BASE_URL": 'https://vg.v1api.cc/v1',
         "MOONSHOT_MODEL": 'gpt-4o',
         "MOONSHOT_TEMPERATURE": 0.8,
+        "IMAGE_RECOGNITION_MAX_EDGE": 1600,
         "ENABLE_IMAGE_RECOGNITION": True,
         "ENABLE_EMOJI_RECOGNITION": True,
         "QUEUE_WAITING_TIME": 7,
+        "MAX_CONCURRENT_LLM_REQUESTS": 3,
+        "ENABLE_ADAPTIVE_DEBOUNCE": True,
+        "ADAPTIVE_DEBOUNCE_MIN_WAIT": 2.0,
+        "ADAPTIVE_DEBOUNCE_MAX_WAIT": 7.0,
         "EMOJI_DIR": 'emojis',
         "ENABLE_EMOJI_SENDING": True,
         "EMOJI_SENDING_PROBABILITY": 25,
@@ -4216,6 +4247,9 @@ def get_default_config():
         "MAX_MESSAGE_LOG_ENTRIES": 30,
         "MAX_MEMORY_NUMBER": 50,
         "UPLOAD_MEMORY_TO_AI": True,
+        "ENABLE_MEMORY_RETRIEVAL": True,
+        "MEMORY_RETRIEVAL_TOP_K": 8,
+        "MEMORY_PINNED_IMPORTANCE": 5,
         "ACCEPT_ALL_GROUP_CHAT_MESSAGES": False,
         "ENABLE_GROUP_AT_REPLY": True,
         "ENABLE_GROUP_KEYWORD_REPLY": False,
@@ -4252,6 +4286,7 @@ def get_default_config():
         "ASSISTANT_TEMPERATURE": 0.3,
         "ASSISTANT_MAX_TOKEN": 1000,
         "USE_ASSISTANT_FOR_MEMORY_SUMMARY": False,
+        "ENABLE_AUX_ROUTER": True,
         "IGNORE_GROUP_CHAT_FOR_AUTO_MESSAGE": False,
         "ENABLE_SENSITIVE_CONTENT_CLEARING": True,
         "SAVE_MEMORY_TO_SEPARATE_FILE": True,
@@ -4442,6 +4477,7 @@ if __name__ == '__main__':
                '/save_all_reminders' in msg or \
                '/get_all_reminders' in msg or \
                '/api/get_chat_context_users' in msg or \
+               '/api/bot_stats' in msg or \
                '/bot_heartbeat' in msg:
                 return False
             return True
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+config.py 的缓存快照。
+
+整个文件只解析一次，之后的配置查询都是字典查找；通过 os.stat 的 mtime/size 检测文件变化，
+检查频率受 check_interval 限制，也可以启动后台监视线程代替查询时检查。
+"""
+
+import ast
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# 与旧版 get_dynamic_config 相同的匹配规则：行首的 KEY = VALUE
+_ASSIGNMENT_PATTERN = re.compile(r"^([A-Za-z_]\w*)\s*=\s*(.+)$", re.M)
+
+_MISSING = object()
+
+
+def parse_config_value(value_str):
+    """按旧版 get_dynamic_config 的规则把赋值右侧的文本转换为 Python 值。"""
+    value_str = value_str.strip()
+    # 处理常见的Python字面量
+    if value_str.lower() in ('true', 'false'):
+        return value_str.lower() == 'true'
+    elif value_str.isdigit():
+        return int(value_str)
+    elif value_str.replace('.', '').isdigit():
+        return float(value_str)
+    else:
+        # 使用安全的字面量解析
+        try:
+            return ast.literal_eval(value_str)
+        except Exception:
+            return value_str.strip("'\"")
+
+
+def parse_config_text(content):
+    """解析配置文件文本，同名配置项以第一次出现为准。"""
+    values = {}
+    for match in _ASSIGNMENT_PATTERN.finditer(content):
+        key = match.group(1)
+        if key not in values:
+            values[key] = parse_config_value(match.group(2))
+    return values
+
+
+class ConfigSnapshot:
+    """
+    线程安全的配置快照。
+
+    get() 在距上次检查超过 check_interval 秒时才调用一次 os.stat；
+    文件签名变化时重新解析并递增 version，供依赖配置的缓存判断是否失效。
+    """
+
+    def __init__(self, config_path, check_interval=1.0):
+        self.config_path = config_path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._values = {}
+        self._signature = _MISSING
+        self._last_check = 0.0
+        self._version = 0
+
+        self._watcher_thread = None
+        self._watcher_stop = threading.Event()
+
+    @property
+    def version(self):
+        """配置内容每重新加载一次递增 1。"""
+        self._revalidate()
+        return self._version
+
+    def _read_signature(self):
+        try:
+            st = os.stat(self.config_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _reload(self, signature):
+        """重新解析配置文件（调用方持有 self._lock）。"""
+        values = {}
+        if signature is not None:
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    values = parse_config_text(f.read())
+            except Exception as e:
+                logger.warning(f"解析配置文件 {self.config_path} 失败，继续使用上一次的配置: {e}")
+                return
+        self._values = values
+        self._signature = signature
+        self._version += 1
+        logger.debug(f"配置快照已重新加载 (版本 {self._version}，共 {len(values)} 项)")
+
+    def _revalidate(self, force=False):
+        now = time.monotonic()
+        if not force and self._watcher_thread is not None:
+            return
+        if not force and now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            signature = self._read_signature()
+            if force or signature != self._signature:
+                self._reload(signature)
+
+    def invalidate(self):
+        """立即重新检查并加载配置文件（本进程修改 config.py 后调用）。"""
+        self._revalidate(force=True)
+
+    # --- 访问接口 ---
+    def get(self, key, default_value=None):
+        self._revalidate()
+        return self._values.get(key, default_value)
+
+    def get_bool(self, key, default_value=False):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            return default_value
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', '1', 'yes', 'on')
+        return bool(value)
+
+    def get_int(self, key, default_value=0):
+        value = self.get(key, _MISSING)
+        try:
+            return default_value if value is _MISSING else int(value)
+        except (TypeError, ValueError):
+            logger.warning(f"配置项 {key} 的值 {value!r} 不是整数，使用默认值 {default_value}")
+            return default_value
+
+    def get_float(self, key, default_value=0.0):
+        value = self.get(key, _MISSING)
+        try:
+            return default_value if value is _MISSING else float(value)
+        except (TypeError, ValueError):
+            logger.warning(f"配置项 {key} 的值 {value!r} 不是数字，使用默认值 {default_value}")
+            return default_value
+
+    def get_str(self, key, default_value=''):
+        value = self.get(key, _MISSING)
+        return default_value if value is _MISSING else str(value)
+
+    def get_list(self, key, default_value=None):
+        value = self.get(key, _MISSING)
+        if isinstance(value, (list, tuple)):
+            return list(value)
+        return list(default_value) if default_value is not None else []
+
+    # --- 可选的后台监视线程 ---
+    def _watch_loop(self, interval):
+        while not self._watcher_stop.wait(interval):
+            try:
+                with self._lock:
+                    signature = self._read_signature()
+                    if signature != self._signature:
+                        self._reload(signature)
+                        logger.info(f"检测到 {self.config_path} 已修改，配置快照已更新。")
+            except Exception as e:
+                logger.error(f"配置监视线程异常: {e}", exc_info=True)
+
+    def start_watcher(self, interval=1.0):
+        """启动后台监视线程；启动后 get() 不再进行 os.stat 检查。"""
+        if self._watcher_thread is not None:
+            return
+        self._revalidate(force=True)
+        self._watcher_stop.clear()
+        self._watcher_thread = threading.Thread(target=self._watch_loop, args=(interval,),
+                                                name="ConfigSnapshotWatcher", daemon=True)
+        self._watcher_thread.start()
+
+    def stop_watcher(self):
+        self._watcher_stop.set()
+        if self._watcher_thread is not None:
+            self._watcher_thread.join(timeout=5)
+            self._watcher_thread = None
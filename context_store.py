@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+聊天上下文存储。
+
+每个用户一个追加写的 JSONL 日志文件（位于 chat_contexts/ 目录），单条消息只追加一行，
+写入成本与其他用户的历史长度无关；日志行数超过阈值时原子地压缩为一条快照。
+
+日志记录格式（每行一个 JSON 对象）:
+    {"op": "meta", "user_id": "..."}                    文件首行，记录原始用户ID
+    {"op": "append", "message": {...}, "keep": 11}      追加一条消息，并只保留最近 keep 条
+    {"op": "reset", "messages": [...]}                  以快照替换全部上下文（压缩、编辑器保存）
+清除上下文即删除该用户的日志文件。
+
+ChatContextJournal 只负责文件读写，机器人和配置编辑器共用；
+ChatContextStore 在其之上维护内存中的权威数据和后台写线程，仅供机器人使用。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+from filelock import FileLock
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.jsonl'
+
+
+def merge_context(context_list):
+    """
+    合并连续相同 role 的消息，保证 user/assistant 交替。
+    """
+    if not context_list:
+        return []
+    merged = []
+    last_role = None
+    buffer = []
+    for item in context_list:
+        role = item.get('role')
+        content = item.get('content', '')
+        if role == last_role:
+            buffer.append(content)
+        else:
+            if buffer:
+                merged.append({'role': last_role, 'content': '\n'.join(buffer)})
+            buffer = [content]
+            last_role = role
+    if buffer:
+        merged.append({'role': last_role, 'content': '\n'.join(buffer)})
+    return merged
+
+
+def _append_merged(history, message):
+    """追加消息，若与最后一条 role 相同则合并内容，使内存数据始终保持交替结构。"""
+    if history and history[-1].get('role') == message.get('role'):
+        last = history[-1]
+        history[-1] = {'role': last.get('role'), 'content': f"{last.get('content', '')}\n{message.get('content', '')}"}
+    else:
+        history.append({'role': message.get('role'), 'content': message.get('content', '')})
+
+
+def _apply_append(history, record):
+    """回放一条 append 记录，返回新的消息列表（可能按 keep 截断）。"""
+    _append_merged(history, record['message'])
+    keep = record.get('keep')
+    if isinstance(keep, int) and keep > 0 and len(history) > keep:
+        history = history[-keep:]
+    return history
+
+
+def _file_signature(path):
+    """返回文件的 (mtime_ns, size) 版本签名，文件不存在时返回 None。"""
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+class ChatContextJournal:
+    """
+    按用户分文件的上下文日志，读写单个用户的成本为 O(1)。
+
+    文件名由清理后的用户名加用户ID的哈希前缀组成，既便于人工辨认，
+    也避免了大小写不敏感的文件系统上不同用户名冲突。
+    所有写操作都在目录级 FileLock 下进行，机器人与配置编辑器之间互斥。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock_path = os.path.join(directory, '.lock')
+
+    def lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return FileLock(self.lock_path)
+
+    def path_for(self, user_id):
+        safe_name = re.sub(r'[^\w\-]', '_', user_id)[:40]
+        digest = hashlib.sha1(user_id.encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.directory, f"{safe_name}_{digest}{JOURNAL_SUFFIX}")
+
+    # --- 读取 ---
+    @staticmethod
+    def _replay(path):
+        """回放日志文件，返回 (user_id, 消息列表, 记录数)。损坏的行会被跳过。"""
+        user_id = None
+        history = []
+        records = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 通常是进程在追加过程中退出留下的半行
+                    logger.warning(f"跳过上下文日志 {path} 第 {line_no} 行的损坏记录。")
+                    continue
+                op = record.get('op')
+                records += 1
+                if op == 'meta':
+                    user_id = record.get('user_id')
+                elif op == 'append' and isinstance(record.get('message'), dict):
+                    history = _apply_append(history, record)
+                elif op == 'reset' and isinstance(record.get('messages'), list):
+                    history = list(record['messages'])
+        return user_id, history, records
+
+    def read_user(self, user_id):
+        """读取指定用户的上下文，用户不存在时返回 None。"""
+        path = self.path_for(user_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            _, history, _ = self._replay(path)
+            return history
+        except Exception as e:
+            logger.error(f"读取用户 {user_id} 的上下文日志失败: {e}", exc_info=True)
+            return None
+
+    def list_users(self):
+        """列出所有存在上下文的用户ID（只读取每个文件的首行）。"""
+        if not os.path.isdir(self.directory):
+            return []
+        users = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(JOURNAL_SUFFIX):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                    record = json.loads(f.readline())
+                if record.get('op') == 'meta' and record.get('user_id'):
+                    users.append(record['user_id'])
+            except (OSError, ValueError):
+                logger.warning(f"无法读取上下文日志 {name} 的用户信息，已跳过。")
+        return users
+
+    # --- 写入（调用方负责持有 lock()） ---
+    def append_records(self, user_id, records):
+        """向用户日志追加若干记录，文件不存在时先写入 meta 行。"""
+        path = self.path_for(user_id)
+        os.makedirs(self.directory, exist_ok=True)
+        lines = []
+        if not os.path.exists(path):
+            lines.append(json.dumps({'op': 'meta', 'user_id': user_id}, ensure_ascii=False))
+        lines.extend(json.dumps(record, ensure_ascii=False) for record in records)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def write_snapshot(self, user_id, messages):
+        """以快照原子地重写用户日志（压缩或整体替换）。"""
+        path = self.path_for(user_id)
+        os.makedirs(self.directory, exist_ok=True)
+        temp_file_path = path + '.tmp'
+        try:
+            with open(temp_file_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'op': 'meta', 'user_id': user_id}, ensure_ascii=False) + '\n')
+                f.write(json.dumps({'op': 'reset', 'messages': messages}, ensure_ascii=False) + '\n')
+            os.replace(temp_file_path, path)  # 原子替换
+        finally:
+            if os.path.exists(temp_file_path):
+                try:
+                    os.remove(temp_file_path)
+                except OSError:
+                    pass
+
+    def delete_user(self, user_id):
+        """删除用户日志，返回此前是否存在。"""
+        path = self.path_for(user_id)
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete_all(self):
+        """删除所有用户的日志（保留锁文件），返回删除的文件数。"""
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith((JOURNAL_SUFFIX, JOURNAL_SUFFIX + '.tmp')):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    # --- 迁移 ---
+    def migrate_legacy_json(self, json_path):
+        """
+        一次性将旧版 chat_contexts.json 导入日志目录。
+
+        已存在日志的用户不会被覆盖；导入成功后旧文件被重命名为 *.migrated 以免重复导入。
+        返回导入的用户数。
+        """
+        if not os.path.exists(json_path):
+            return 0
+        with self.lock():
+            if not os.path.exists(json_path):
+                return 0
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                logger.error(f"旧版聊天上下文文件 {json_path} 无法解析，跳过迁移: {e}")
+                return 0
+            imported = 0
+            if isinstance(data, dict):
+                for user_id, messages in data.items():
+                    if not isinstance(messages, list) or os.path.exists(self.path_for(user_id)):
+                        continue
+                    self.write_snapshot(user_id, merge_context(messages))
+                    imported += 1
+            os.replace(json_path, json_path + '.migrated')
+        logger.info(f"已将 {json_path} 中 {imported} 个用户的聊天上下文迁移到 {self.directory}/。")
+        return imported
+
+
+class ChatContextStore:
+    """
+    线程安全的聊天上下文存储。
+
+    - 读写都在内存中完成，调用方不再需要每轮重新解析文件；
+    - 新消息先缓存为待写记录，后台线程每 flush_interval 秒批量追加到各自用户的日志中；
+      写入时只在取出待写记录时持有内存锁，文件读写和压缩在锁外进行，不阻塞读取和追加；
+    - 读取某个用户前用一次 os.stat 比较其日志文件签名，被外部修改（编辑器保存或清除）时只重新回放该用户；
+      该用户还有未落盘的修改时不在读取路径上写盘，由写线程写入时合并外部修改。
+    """
+
+    def __init__(self, directory, flush_interval=2.0, compact_threshold=64, legacy_file=None):
+        self.journal = ChatContextJournal(directory)
+        self.flush_interval = flush_interval
+        self.compact_threshold = compact_threshold
+        self.legacy_file = legacy_file
+
+        self._lock = threading.RLock()
+        self._contexts = {}        # {user_id: [消息...]}，权威数据
+        self._pending = {}         # {user_id: [待追加的日志记录...]}
+        self._cleared = set()      # 待删除日志文件的用户
+        self._record_counts = {}   # {user_id: 日志中的记录数}，用于判断是否需要压缩
+        self._signatures = {}      # {user_id: 最近一次读/写后的文件签名}
+        self._flushing = set()     # 待写记录已取出、正在写入日志的用户
+        self._flush_lock = threading.Lock()  # 保证各次写入按顺序进行
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._writer_thread = None
+
+    # --- 加载 ---
+    def load(self):
+        """迁移旧版文件（如有）并回放全部用户日志，丢弃内存中的数据。"""
+        if self.legacy_file:
+            self.journal.migrate_legacy_json(self.legacy_file)
+        with self._lock:
+            self._contexts.clear()
+            self._pending.clear()
+            self._cleared.clear()
+            self._record_counts.clear()
+            self._signatures.clear()
+            directory = self.journal.directory
+            if not os.path.isdir(directory):
+                logger.info(f"{directory} 未找到，将使用空聊天上下文启动。")
+                return
+            for name in os.listdir(directory):
+                if not name.endswith(JOURNAL_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    signature = _file_signature(path)
+                    user_id, history, records = ChatContextJournal._replay(path)
+                except Exception as e:
+                    logger.error(f"加载上下文日志 {name} 失败: {e}", exc_info=True)
+                    continue
+                if not user_id:
+                    logger.warning(f"上下文日志 {name} 缺少用户信息，已跳过。")
+                    continue
+                self._contexts[user_id] = history
+                self._record_counts[user_id] = records
+                self._signatures[user_id] = signature
+            logger.info(f"成功从 {directory}/ 加载 {len(self._contexts)} 个用户的聊天上下文。")
+
+    def _has_unsaved_locked(self, user_id):
+        return user_id in self._pending or user_id in self._cleared or user_id in self._flushing
+
+    def refresh_user(self, user_id):
+        """
+        检查单个用户日志的签名，如被外部修改则重新回放该用户。
+        该用户还有未落盘的修改时以内存为准，外部修改由写线程写入时合并。
+        """
+        path = self.journal.path_for(user_id)
+        signature = _file_signature(path)
+        with self._lock:
+            known = self._signatures.get(user_id)
+            if signature == known or self._has_unsaved_locked(user_id):
+                return
+        try:
+            _, history, records = ChatContextJournal._replay(path) if signature is not None else (None, None, 0)
+        except Exception as e:
+            logger.error(f"重新加载用户 {user_id} 的上下文日志失败: {e}", exc_info=True)
+            return
+        with self._lock:
+            # 回放期间内存又有变化时放弃本次结果，下次读取再检查
+            if self._signatures.get(user_id) != known or self._has_unsaved_locked(user_id):
+                return
+            if history is None:
+                self._contexts.pop(user_id, None)
+                self._record_counts.pop(user_id, None)
+            else:
+                self._contexts[user_id] = history
+                self._record_counts[user_id] = records
+            self._signatures[user_id] = signature
+        logger.info(f"检测到用户 {user_id} 的上下文日志被外部修改，已重新加载。")
+
+    # --- 读写接口 ---
+    def get(self, user_id):
+        """返回指定用户上下文的副本（只检查文件签名，不在调用线程中写盘）。"""
+        self.refresh_user(user_id)
+        with self._lock:
+            return list(self._contexts.get(user_id, []))
+
+    def append(self, user_id, message, max_messages=None):
+        """追加一条消息，并可选地只保留最近 max_messages 条。"""
+        with self._lock:
+            history = self._contexts.setdefault(user_id, [])
+            _append_merged(history, message)
+            if max_messages is not None and len(history) > max_messages:
+                self._contexts[user_id] = history[-max_messages:]
+            record = {'op': 'append', 'message': message}
+            if max_messages is not None:
+                record['keep'] = max_messages
+            self._pending.setdefault(user_id, []).append(record)
+            self._wakeup.set()
+
+    def clear(self, user_id):
+        """清除指定用户的上下文，返回该用户此前是否存在。"""
+        with self._lock:
+            if user_id not in self._contexts:
+                return False
+            del self._contexts[user_id]
+            self._pending.pop(user_id, None)
+            self._cleared.add(user_id)
+            self._wakeup.set()
+            return True
+
+    def users(self):
+        with self._lock:
+            return list(self._contexts.keys())
+
+    # --- 持久化 ---
+    def _flush_users(self, user_ids):
+        """
+        将指定用户的待写记录追加到日志，需要时压缩。
+
+        在 self._lock 下取出待写记录并复制上下文，文件读写和压缩在锁外（日志目录锁下）进行，
+        最后再回到 self._lock 下更新签名和记录数。
+        """
+        with self._flush_lock:
+            batch = []
+            with self._lock:
+                for user_id in user_ids:
+                    cleared = user_id in self._cleared
+                    self._cleared.discard(user_id)
+                    # 清除后可能又有新消息追加
+                    records = self._pending.pop(user_id, None)
+                    if not cleared and not records:
+                        continue
+                    batch.append((user_id, cleared, records, list(self._contexts.get(user_id, [])),
+                                  self._signatures.get(user_id), self._record_counts.get(user_id, 1)))
+                    self._flushing.add(user_id)
+            if not batch:
+                return
+
+            results = {}  # {user_id: (签名, 记录数, 外部修改后以磁盘为准的上下文或 None)}
+            try:
+                with self.journal.lock():
+                    for user_id, cleared, records, snapshot, signature, record_count in batch:
+                        try:
+                            results[user_id] = self._write_user(user_id, cleared, records, snapshot,
+                                                                signature, record_count)
+                        except Exception as e:
+                            logger.error(f"保存用户 {user_id} 的聊天上下文失败: {e}", exc_info=True)
+            finally:
+                with self._lock:
+                    for user_id, *_ in batch:
+                        self._flushing.discard(user_id)
+                        if user_id not in results:
+                            continue
+                        signature, record_count, reloaded = results[user_id]
+                        if reloaded is not None and user_id not in self._cleared:
+                            # 编辑器在此期间改写了该用户日志：以磁盘内容为准，再补上写入期间新追加的消息
+                            for record in self._pending.get(user_id, ()):
+                                reloaded = _apply_append(reloaded, record)
+                            self._contexts[user_id] = reloaded
+                        if signature is None:
+                            self._signatures.pop(user_id, None)
+                            self._record_counts.pop(user_id, None)
+                        else:
+                            self._signatures[user_id] = signature
+                            self._record_counts[user_id] = record_count
+
+    def _write_user(self, user_id, cleared, records, snapshot, signature, record_count):
+        """写入单个用户（调用方持有日志目录锁，不持有 self._lock），返回 (签名, 记录数, 重新回放的上下文或 None)。"""
+        path = self.journal.path_for(user_id)
+        if cleared:
+            self.journal.delete_user(user_id)
+            signature = None
+            record_count = 1
+            if not records:
+                return None, 0, None
+        reloaded = None
+        externally_modified = _file_signature(path) != signature
+        self.journal.append_records(user_id, records)
+        if externally_modified:
+            _, reloaded, record_count = ChatContextJournal._replay(path)
+            snapshot = reloaded
+            logger.info(f"检测到用户 {user_id} 的上下文日志被外部修改，已合并后重新加载。")
+        else:
+            record_count += len(records)
+
+        if record_count > self.compact_threshold:
+            self.journal.write_snapshot(user_id, snapshot)
+            record_count = 2
+            logger.debug(f"用户 {user_id} 的上下文日志已压缩。")
+        return _file_signature(path), record_count, reloaded
+
+    def flush(self):
+        """将所有未落盘的修改写入各自的用户日志。"""
+        with self._lock:
+            user_ids = list(self._cleared) + [u for u in self._pending if u not in self._cleared]
+        if not user_ids:
+            return False
+        self._flush_users(user_ids)
+        logger.debug(f"聊天上下文已写入 {self.journal.directory}/（本次 {len(user_ids)} 个用户有变更）")
+        return True
+
+    def _writer_loop(self):
+        while not self._stop.is_set():
+            self._wakeup.wait()
+            if self._stop.is_set():
+                break
+            # 去抖：等待一个写盘周期，把这段时间内的修改合并成一次写入
+            self._stop.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"聊天上下文写线程异常: {e}", exc_info=True)
+
+    def start_writer(self):
+        """启动后台写线程（幂等）。"""
+        if self._writer_thread and self._writer_thread.is_alive():
+            return
+        self._stop.clear()
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="ChatContextWriter", daemon=True)
+        self._writer_thread.start()
+
+    def close(self):
+        """停止后台写线程并立即写入所有未落盘的修改。"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._writer_thread and self._writer_thread.is_alive():
+            self._writer_thread.join(timeout=self.flush_interval + 5)
+        self.flush()
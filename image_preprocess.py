@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+上传视觉模型前的图片预处理。
+
+- 按 EXIF 方向摆正，长边缩小到 max_edge 以内；
+- 重新编码时不写入 EXIF/ICC 等元数据，透明图保留为 PNG，其他转为 JPEG；
+- 根据实际格式给出正确的 MIME 类型（不再一律标记为 image/jpeg）；
+- 编码结果直接流式写入 base64 编码器，不额外保存一份完整的编码后字节；
+- 解码、缩放和编码在线程池中执行（Pillow 在这些操作中会释放 GIL），并限制同时处理的图片数以控制内存。
+
+重新编码后反而更大且无需缩小时，直接使用原始文件内容。
+"""
+
+import base64
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 不可用时原样上传
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+    'BMP': 'image/bmp',
+}
+
+# 无需转换即可直接上传的格式
+PASSTHROUGH_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+def sniff_mime_type(data):
+    """根据文件头判断 MIME 类型，无法识别时返回 image/jpeg（与旧行为一致）。"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data.startswith(b'BM'):
+        return 'image/bmp'
+    return 'image/jpeg'
+
+
+class Base64StreamWriter(io.RawIOBase):
+    """
+    只写的文件对象，写入的字节立即转成 base64 文本片段。
+    除了不足 3 字节的尾部外不缓存原始字节，getvalue() 返回完整的 base64 字符串。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._pending = b''
+        self._chunks = []
+        self.raw_size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        written = len(data)
+        self.raw_size += written
+        data = self._pending + bytes(data)
+        usable = written + len(self._pending) - (written + len(self._pending)) % 3
+        if usable:
+            self._chunks.append(base64.b64encode(data[:usable]).decode('ascii'))
+        self._pending = data[usable:]
+        return written
+
+    def getvalue(self):
+        if self._pending:
+            self._chunks.append(base64.b64encode(self._pending).decode('ascii'))
+            self._pending = b''
+        value = ''.join(self._chunks)
+        self._chunks = [value]
+        return value
+
+
+class PreparedImage:
+    """预处理结果: base64 文本、MIME 类型以及尺寸/字节统计。"""
+
+    __slots__ = ('base64_data', 'mime_type', 'original_bytes', 'upload_bytes', 'original_size', 'size', 'reencoded')
+
+    def __init__(self, base64_data, mime_type, original_bytes, upload_bytes, original_size=None, size=None,
+                 reencoded=False):
+        self.base64_data = base64_data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.upload_bytes = upload_bytes
+        self.original_size = original_size
+        self.size = size
+        self.reencoded = reencoded
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64_data}"
+
+
+def _passthrough(data, original_size=None):
+    encoded = base64.b64encode(data).decode('ascii')
+    return PreparedImage(encoded, sniff_mime_type(data), len(data), len(data), original_size, original_size)
+
+
+def prepare_image(data, max_edge=1600, jpeg_quality=85):
+    """
+    预处理图片字节并返回 PreparedImage。Pillow 不可用或图片无法解码时原样上传。
+    max_edge <= 0 表示不缩小。
+    """
+    if Image is None:
+        return _passthrough(data)
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            source_format = image.format
+            original_size = image.size
+            needs_resize = max_edge > 0 and max(original_size) > max_edge
+            if source_format == 'JPEG' and needs_resize:
+                # JPEG 可在解码时按 1/2、1/4、1/8 缩小，减少内存和时间
+                image.draft('RGB', (max_edge, max_edge))
+
+            # 动图只取第一帧；按 EXIF 方向摆正
+            image.seek(0)
+            frame = ImageOps.exif_transpose(image)
+            if needs_resize:
+                frame.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            has_alpha = frame.mode in ('RGBA', 'LA', 'PA') or (frame.mode == 'P' and 'transparency' in frame.info)
+            writer = Base64StreamWriter()
+            if has_alpha:
+                frame.convert('RGBA').save(writer, 'PNG', optimize=False)
+                mime_type = 'image/png'
+            else:
+                if frame.mode != 'RGB':
+                    frame = frame.convert('RGB')
+                frame.save(writer, 'JPEG', quality=jpeg_quality, optimize=False, progressive=False)
+                mime_type = 'image/jpeg'
+            size = frame.size
+    except Exception as e:
+        logger.warning(f"图片预处理失败，将上传原始图片: {e}")
+        return _passthrough(data)
+
+    if not needs_resize and source_format in PASSTHROUGH_FORMATS and writer.raw_size >= len(data):
+        # 原图已足够小，重新编码没有收益（元数据很少，保留原图画质）
+        return PreparedImage(base64.b64encode(data).decode('ascii'), FORMAT_MIME_TYPES[source_format],
+                             len(data), len(data), original_size, original_size)
+    return PreparedImage(writer.getvalue(), mime_type, len(data), writer.raw_size, original_size, size, reencoded=True)
+
+
+class ImagePreprocessor:
+    """
+    图片预处理线程池，并统计上传字节数。
+
+    submit(data) 返回 Future；prepare(data) 同步等待结果。
+    """
+
+    def __init__(self, max_workers=2, max_edge=1600, jpeg_quality=85):
+        self.max_edge = max_edge
+        self.jpeg_quality = jpeg_quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ImagePreprocess")
+        self._lock = threading.Lock()
+        self.images = 0
+        self.original_bytes = 0
+        self.upload_bytes = 0
+
+    def _prepare(self, data, max_edge):
+        prepared = prepare_image(data, self.max_edge if max_edge is None else max_edge, self.jpeg_quality)
+        with self._lock:
+            self.images += 1
+            self.original_bytes += prepared.original_bytes
+            self.upload_bytes += prepared.upload_bytes
+        if prepared.reencoded:
+            logger.debug(f"图片预处理: {prepared.original_size} -> {prepared.size}, "
+                         f"{prepared.original_bytes} -> {prepared.upload_bytes} 字节 ({prepared.mime_type})")
+        return prepared
+
+    def submit(self, data, max_edge=None):
+        return self._executor.submit(self._prepare, data, max_edge)
+
+    def prepare(self, data, max_edge=None):
+        return self.submit(data, max_edge).result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'images': self.images,
+                'original_bytes': self.original_bytes,
+                'upload_bytes': self.upload_bytes,
+                'saved_ratio': round(1 - self.upload_bytes / self.original_bytes, 3) if self.original_bytes else 0.0,
+            }
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+大模型调用网关，bot.py 与 config_editor.py 的所有模型请求都经过这里。
+
+- 按 (base_url, api_key) 缓存 OpenAI 客户端，复用底层 httpx 连接池（keep-alive），
+  不再每次调用都新建客户端、重新握手；
+- 统一的请求超时，可按调用覆盖；
+- 限流 (429)、服务端错误 (5xx)、超时和连接错误按带抖动的指数退避重试，响应带 Retry-After 时遵循；
+  鉴权、余额、参数错误和内容审核等重试无意义的错误直接抛出原异常；
+- 每个服务商一个共享的客户端限流器（见 rate_limiter.py），发送前按 RPM/TPM 排队，
+  429 时整个服务商统一冷却，而不是各线程各自立即重试；
+- 记录每次调用的耗时、重试次数与 token 用量，stats() 按调用用途汇总；
+- chat_stream() 以流式请求获取回复，可通过 StreamHandle 从其他线程随时取消并立即断开连接
+  （供 provider_pool 的对冲请求使用），流式调用同样记录 token 用量。
+
+SDK 自带的重试已关闭（max_retries=0），重试统一由网关负责，避免两层重试叠加。
+"""
+
+import logging
+import random
+import socket
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from urllib.parse import urlparse
+
+import httpx
+import openai
+from openai import OpenAI
+
+from rate_limiter import ProviderLimiter, estimate_tokens, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+# 状态码可重试，但错误内容表明重试也不会成功的情况（余额不足、需实名、内容审核等）
+NON_RETRYABLE_MARKERS = (
+    'insufficient_quota', 'user quota', 'is not enough', 'UnlimitedQuota',
+    'payment required', 'real name verification', 'sensitive',
+)
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+class RequestCancelled(Exception):
+    """请求被调用方取消（例如对冲请求中另一方已先返回）。"""
+
+
+class StreamHandle:
+    """
+    流式请求的取消句柄：调用方创建后传给 chat_stream()，可在任意线程调用 cancel()。
+    收到响应头后 chat_stream() 把流登记到句柄上，cancel() 直接断开其底层连接，
+    阻塞在读取分块上的工作线程立即返回，不必等服务商发来下一个分块（或等到超时）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._stream = None
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def attach(self, stream):
+        """登记进行中的流；已被取消时返回 False，由调用方自行关闭。"""
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._stream = stream
+            return True
+
+    def detach(self):
+        with self._lock:
+            self._stream = None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            stream, self._stream = self._stream, None
+        if stream is not None:
+            _abort_stream(stream)
+
+
+def _abort_stream(stream):
+    """
+    从其他线程中断流式响应：对底层 socket 执行 shutdown，正在 recv 的读取线程会立即收到连接关闭。
+    只 close() 不能唤醒阻塞中的 recv；响应对象本身由读取线程随后关闭，这里不跨线程操作。
+    """
+    response = getattr(stream, 'response', None)
+    network_stream = response.extensions.get('network_stream') if response is not None else None
+    sock = network_stream.get_extra_info('socket') if network_stream is not None else None
+    if sock is None:
+        return
+    try:
+        # TLS 连接上用基类的 shutdown，避免 SSLSocket.shutdown 在读取线程之外改动 SSL 状态
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except OSError:
+        pass  # 连接已经关闭
+
+
+CallRecord = namedtuple('CallRecord', 'purpose model host latency attempts prompt_tokens completion_tokens ok finished_at')
+
+
+def is_retryable_error(error):
+    """判断模型调用异常是否值得重试。"""
+    if isinstance(error, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status in RETRYABLE_STATUS_CODES or status >= 500:
+            message = str(error)
+            return not any(marker in message for marker in NON_RETRYABLE_MARKERS)
+    return False
+
+
+def is_rate_limit_error(error):
+    """429 且不是余额不足之类的永久性错误。"""
+    return isinstance(error, openai.APIStatusError) and error.status_code == 429 and is_retryable_error(error)
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    return parse_retry_after(getattr(response, 'headers', None))
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class _PurposeStats:
+    """单个调用用途的累计统计。"""
+
+    __slots__ = ('calls', 'failures', 'cancelled', 'retries', 'prompt_tokens', 'completion_tokens', 'latencies')
+
+    def __init__(self, window):
+        self.calls = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = deque(maxlen=window)
+
+    def snapshot(self):
+        latencies = sorted(self.latencies)
+        return {
+            'calls': self.calls,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'retries': self.retries,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'avg_latency': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'p95_latency': round(_percentile(latencies, 0.95), 3),
+        }
+
+
+class LLMGateway:
+    """
+    模型调用网关（线程安全）。
+
+    chat(base_url, api_key, model, messages, purpose=..., **params) 返回 SDK 的 ChatCompletion 对象，
+    失败时抛出最后一次的原始异常，调用方原有的错误分类逻辑保持不变。
+    purpose 用于统计分组，例如 'chat'、'assistant'、'online'、'vision'。
+    """
+
+    def __init__(self, timeout=120.0, max_retries=2, backoff_base=1.0, backoff_max=20.0,
+                 max_connections=20, keepalive_expiry=60.0, max_clients=32, history_size=200, rpm=0, tpm=0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.max_clients = max_clients
+        self._clients = OrderedDict()  # {(base_url, api_key): OpenAI}，按最近使用排序
+        self._limiters = {}  # {(base_url, api_key): ProviderLimiter}
+        self._no_stream_usage = set()  # 不支持 stream_options 的服务商
+        self.default_rpm = rpm
+        self.default_tpm = tpm
+        self._lock = threading.Lock()
+        self._history_size = history_size
+        self._purposes = {}
+        self._recent = deque(maxlen=history_size)
+        self.clients_created = 0
+
+    # --- 客户端缓存 ---
+    @staticmethod
+    def _provider_key(base_url, api_key):
+        return (base_url or '').rstrip('/'), api_key or ''
+
+    def client(self, base_url, api_key):
+        """返回 (base_url, api_key) 对应的共享客户端，不存在时创建。"""
+        key = self._provider_key(base_url, api_key)
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached is not None:
+                self._clients.move_to_end(key)
+                return cached
+        http_client = openai.DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections,
+                                keepalive_expiry=self.keepalive_expiry),
+            timeout=self.timeout,
+        )
+        created = OpenAI(api_key=api_key, base_url=base_url or None, timeout=self.timeout,
+                         max_retries=0, http_client=http_client)
+        with self._lock:
+            cached = self._clients.get(key)
+            if cached is not None:  # 其他线程已抢先创建
+                http_client.close()
+                return cached
+            self._clients[key] = created
+            self.clients_created += 1
+            while len(self._clients) > self.max_clients:
+                # 被淘汰的客户端可能仍有调用在使用，不主动关闭，交给垃圾回收
+                self._clients.popitem(last=False)
+        return created
+
+    def limiter(self, base_url, api_key):
+        """返回服务商共享的限流器，不存在时按默认 RPM/TPM 创建。"""
+        key = self._provider_key(base_url, api_key)
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                name = urlparse(key[0]).hostname or key[0] or 'default'
+                limiter = self._limiters[key] = ProviderLimiter(name, self.default_rpm, self.default_tpm)
+            return limiter
+
+    def set_rate_limits(self, base_url, api_key, rpm=0, tpm=0):
+        """为指定服务商设置 RPM/TPM 上限（0 表示不限制，仅在 429 后自适应限速）。"""
+        self.limiter(base_url, api_key).set_limits(rpm, tpm)
+
+    def backoff_delay(self, attempt):
+        """第 attempt 次（从 0 开始）重试前的等待秒数：指数增长，取上限后在后半段随机抖动。"""
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    # --- 调用 ---
+    def _create(self, base_url, api_key, model, messages, purpose, timeout, max_retries, params):
+        """发出请求（含限流排队与退避重试），返回 (响应, 重试次数, 开始时刻, 预估 token 数, 限流器)。"""
+        client = self.client(base_url, api_key)
+        limiter = self.limiter(base_url, api_key)
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.max_retries if max_retries is None else max_retries
+        estimated_tokens = estimate_tokens(messages)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            limiter.acquire(estimated_tokens)
+            try:
+                response = client.chat.completions.create(model=model, messages=messages, timeout=timeout, **params)
+                return response, attempt, started, estimated_tokens, limiter
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if is_rate_limit_error(e):
+                    # 冷却由限流器统一安排，所有线程的下一次发送都会排在冷却之后，这里不再单独等待
+                    delay = limiter.on_rate_limited(retry_after)
+                    sleep_here = False
+                else:
+                    delay = max(self.backoff_delay(attempt), min(retry_after or 0.0, self.backoff_max))
+                    sleep_here = True
+                if attempt < retries and is_retryable_error(e):
+                    logger.warning(f"模型调用失败（{purpose}/{model}，第 {attempt + 1} 次），{delay:.1f} 秒后重试: {e}")
+                    if sleep_here:
+                        time.sleep(delay)
+                    attempt += 1
+                    continue
+                self._record(purpose, model, base_url, started, attempt, None, ok=False)
+                raise
+
+    def chat(self, base_url, api_key, model, messages, purpose='chat', timeout=None, max_retries=None, **params):
+        """
+        调用 chat.completions.create，对可重试错误自动退避重试。
+        timeout / max_retries 为 None 时使用网关默认值；其余参数原样传给 SDK。
+        """
+        response, attempt, started, estimated_tokens, limiter = self._create(
+            base_url, api_key, model, messages, purpose, timeout, max_retries, params)
+        usage = getattr(response, 'usage', None)
+        actual_tokens = getattr(usage, 'total_tokens', None) if usage is not None else None
+        limiter.on_success(actual_tokens - estimated_tokens if actual_tokens else 0)
+        self._record(purpose, model, base_url, started, attempt, usage, ok=True)
+        return response
+
+    def chat_stream(self, base_url, api_key, model, messages, handle, purpose='chat', timeout=None,
+                    max_retries=None, **params):
+        """
+        以流式请求获取完整回复文本，handle（StreamHandle）被取消后立即断开连接并抛出 RequestCancelled。
+        用于可能被取消的请求（如对冲请求中较慢的一方），断开连接后服务商也会停止生成。
+        请求 include_usage，按最后一个分块携带的用量记录 token 统计并校正限流器的预估。
+        没有任何内容时返回 None。
+        """
+        if handle.is_cancelled():
+            raise RequestCancelled()
+        params = dict(params, stream=True)
+        provider_key = self._provider_key(base_url, api_key)
+        if provider_key not in self._no_stream_usage:
+            params.setdefault('stream_options', {'include_usage': True})
+        try:
+            stream, attempt, started, estimated_tokens, limiter = self._create(
+                base_url, api_key, model, messages, purpose, timeout, max_retries, params)
+        except openai.BadRequestError as e:
+            # 部分兼容接口不认 stream_options，记住该服务商，之后的流式请求不再携带
+            if 'stream_options' not in params or 'stream_options' not in str(e):
+                raise
+            logger.info(f"服务商 {urlparse(provider_key[0]).hostname or 'default'} 不支持 stream_options，流式调用不再统计用量。")
+            with self._lock:
+                self._no_stream_usage.add(provider_key)
+            params.pop('stream_options')
+            stream, attempt, started, estimated_tokens, limiter = self._create(
+                base_url, api_key, model, messages, purpose, timeout, max_retries, params)
+        parts = []
+        usage = None
+        try:
+            if not handle.attach(stream):
+                raise RequestCancelled()
+            for chunk in stream:
+                if handle.is_cancelled():
+                    raise RequestCancelled()
+                if getattr(chunk, 'usage', None) is not None:
+                    usage = chunk.usage
+                if chunk.choices:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+            if handle.is_cancelled():  # 连接被 cancel() 断开时，迭代可能直接结束而不抛异常
+                raise RequestCancelled()
+        except Exception as e:
+            handle.detach()
+            stream.close()
+            if isinstance(e, RequestCancelled) or handle.is_cancelled():
+                self._record(purpose, model, base_url, started, attempt, None, ok=False, cancelled=True)
+                raise RequestCancelled() from e
+            self._record(purpose, model, base_url, started, attempt, None, ok=False)
+            raise
+        handle.detach()
+        actual_tokens = getattr(usage, 'total_tokens', None) if usage is not None else None
+        limiter.on_success(actual_tokens - estimated_tokens if actual_tokens else 0)
+        self._record(purpose, model, base_url, started, attempt, usage, ok=True)
+        return ''.join(parts) if parts else None
+
+    def _record(self, purpose, model, base_url, started, attempt, usage, ok, cancelled=False):
+        latency = time.monotonic() - started
+        prompt_tokens = (getattr(usage, 'prompt_tokens', None) or 0) if usage is not None else 0
+        completion_tokens = (getattr(usage, 'completion_tokens', None) or 0) if usage is not None else 0
+        record = CallRecord(purpose, model, urlparse(base_url or '').hostname or '', round(latency, 3), attempt + 1,
+                            prompt_tokens, completion_tokens, ok, time.time())
+        with self._lock:
+            stats = self._purposes.get(purpose)
+            if stats is None:
+                stats = self._purposes[purpose] = _PurposeStats(self._history_size)
+            stats.calls += 1
+            stats.retries += attempt
+            if cancelled:
+                stats.cancelled += 1
+            elif ok:
+                stats.prompt_tokens += prompt_tokens
+                stats.completion_tokens += completion_tokens
+                stats.latencies.append(latency)
+            else:
+                stats.failures += 1
+            self._recent.append(record)
+        status = '已取消' if cancelled else ('成功' if ok else '失败')
+        logger.debug(f"模型调用 {purpose}/{model}: {status}，耗时 {latency:.2f}s，"
+                     f"尝试 {attempt + 1} 次，tokens {prompt_tokens}+{completion_tokens}")
+
+    # --- 统计与关闭 ---
+    def recent_calls(self, limit=20):
+        """最近的调用记录（CallRecord 列表，新的在后）。"""
+        with self._lock:
+            return list(self._recent)[-limit:]
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+            result = {
+                'clients': len(self._clients),
+                'clients_created': self.clients_created,
+                'purposes': {purpose: stats.snapshot() for purpose, stats in self._purposes.items()},
+            }
+        result['limiters'] = {}
+        for limiter in limiters.values():
+            name, suffix = limiter.name, 2
+            while name in result['limiters']:  # 同一服务商的多个 key
+                name, suffix = f"{limiter.name}#{suffix}", suffix + 1
+            result['limiters'][name] = limiter.stats()
+        return result
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for cached in clients:
+            try:
+                cached.close()
+            except Exception as e:
+                logger.debug(f"关闭模型客户端失败: {e}")
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+核心记忆检索：每轮只把与当前消息相关的核心记忆放进系统提示词。
+
+- 索引：对每条记忆的摘要按字切分（中文取单字和相邻两字，英文和数字取整词），建立 BM25 倒排索引，
+  不依赖分词库；索引按记忆文件版本缓存，文件变化后才重建；
+- 选用：与本轮消息最相关的 top_k 条，加上重要度不低于阈值的置顶记忆（最新的若干条），
+  按原顺序（时间先后）输出；
+- 记忆总数不超过可选用数量时全部选用，与原来的行为一致。
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+from token_budget import estimate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_RUN_RE = re.compile(f'[{_CJK}]+|[a-z0-9]+')
+_CJK_RUN_RE = re.compile(f'[{_CJK}]')
+
+# 单独出现时几乎不区分内容的常用字，不作为单字索引项（两字组合仍然保留）
+STOP_CHARS = frozenset('的了是我你他她它们在有和与就不也都很吗呢吧啊哦嗯呀这那个一上下着过到说要会对把被让给还又')
+
+# selected 为选用的记忆（保持原顺序）；relevant/pinned 为其中按相关度和置顶选中的数量
+MemorySelection = namedtuple('MemorySelection', 'memories relevant pinned total')
+
+
+def tokenize(text):
+    """切分为索引项：中文取单字（去掉常用字）和相邻两字，英文和数字取整词（去掉单个字符和纯数字）。"""
+    tokens = []
+    for run in _RUN_RE.findall((text or '').lower()):
+        if _CJK_RUN_RE.match(run):
+            tokens.extend(ch for ch in run if ch not in STOP_CHARS)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1 and not run.isdigit():
+            tokens.append(run)
+    return tokens
+
+
+class MemoryIndex:
+    """一组文档的 BM25 索引（构建后只读）。"""
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(documents)
+        self._postings = {}  # {索引项: [(文档序号, 词频), ...]}
+        self._lengths = []
+        for doc_id, document in enumerate(documents):
+            terms = Counter(tokenize(document))
+            self._lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_length = (sum(self._lengths) / self.size) if self.size else 0.0
+        self._idf = {
+            term: math.log(1 + (self.size - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self._postings.items()
+        }
+
+    def scores(self, query):
+        """返回 {文档序号: 得分}，只包含至少命中一个索引项的文档。"""
+        scores = {}
+        if not self.size or not self._avg_length:
+            return scores
+        k1, b, avg_length, lengths = self.k1, self.b, self._avg_length, self._lengths
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf[term]
+            for doc_id, tf in postings:
+                norm = k1 * (1 - b + b * lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, top_k, min_relative_score=0.0):
+        """返回得分最高的至多 top_k 个 (文档序号, 得分)；低于最高分 min_relative_score 倍的结果被丢弃。"""
+        scores = self.scores(query)
+        if not scores or top_k <= 0:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+        cutoff = ranked[0][1] * min_relative_score
+        return [(doc_id, score) for doc_id, score in ranked if score >= cutoff]
+
+
+def select_memories(memories, index, query, top_k=8, pinned_importance=5, max_pinned=3, min_relative_score=0.25):
+    """从 memories 中选出本轮要放进提示词的记忆，返回 MemorySelection。"""
+    total = len(memories)
+    pinned = []
+    if pinned_importance:
+        for position in range(total - 1, -1, -1):
+            if len(pinned) >= max_pinned:
+                break
+            try:
+                importance = int(memories[position].get('importance', 3))
+            except (TypeError, ValueError):
+                continue
+            if importance >= pinned_importance:
+                pinned.append(position)
+    if total <= top_k + len(pinned):
+        return MemorySelection(list(memories), total, 0, total)
+
+    relevant = [doc_id for doc_id, _ in index.search(query, top_k, min_relative_score)]
+    chosen = set(relevant) | set(pinned)
+    return MemorySelection([memories[i] for i in sorted(chosen)],
+                           len(relevant), len(chosen) - len(relevant), total)
+
+
+class MemoryRetriever:
+    """
+    核心记忆检索器（线程安全）：按记忆文件缓存索引，并统计节省的提示词 token。
+
+    formatter(memories) 把记忆转换为提示词文本（与全部注入时使用同一格式，便于比较 token 数）。
+    """
+
+    def __init__(self, formatter, top_k=8, pinned_importance=5, max_pinned=3,
+                 min_relative_score=0.25, max_indexes=64):
+        self.formatter = formatter
+        self.top_k = top_k
+        self.pinned_importance = pinned_importance
+        self.max_pinned = max_pinned
+        self.min_relative_score = min_relative_score
+        self.max_indexes = max_indexes
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # {key: (version, memories, index, 全部记忆的文本, 其 token 数)}
+        self.turns = 0
+        self.index_builds = 0
+        self.memories_total = 0
+        self.memories_selected = 0
+        self.tokens_full = 0
+        self.tokens_used = 0
+
+    def _get_index(self, key, version, load):
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and entry[0] == version:
+                self._indexes.move_to_end(key)
+                return entry
+        memories = [memory for memory in (load() or []) if isinstance(memory, dict)]
+        index = MemoryIndex([str(memory.get('summary', '')) for memory in memories])
+        full_content = self.formatter(memories) if memories else ''
+        entry = (version, memories, index, full_content, estimate_text_tokens(full_content))
+        with self._lock:
+            self._indexes[key] = entry
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            self.index_builds += 1
+        return entry
+
+    def prompt_section(self, key, version, load, query, label=None, top_k=None, pinned_importance=None,
+                       retrieve=True):
+        """
+        返回本轮要放进提示词的记忆文本。key/version 标识记忆文件及其版本，
+        load() 在索引需要重建时读取记忆列表；retrieve 为 False 时返回全部记忆（同样按文件版本缓存）。
+        """
+        _, memories, index, full_content, full_tokens = self._get_index(key, version, load)
+        if not memories or not retrieve:
+            return full_content
+        selection = select_memories(
+            memories, index, query,
+            top_k=self.top_k if top_k is None else top_k,
+            pinned_importance=self.pinned_importance if pinned_importance is None else pinned_importance,
+            max_pinned=self.max_pinned,
+            min_relative_score=self.min_relative_score,
+        )
+        content = self.formatter(selection.memories)
+        used_tokens = full_tokens if len(selection.memories) == len(memories) else estimate_text_tokens(content)
+        with self._lock:
+            self.turns += 1
+            self.memories_total += selection.total
+            self.memories_selected += len(selection.memories)
+            self.tokens_full += full_tokens
+            self.tokens_used += used_tokens
+        saved = full_tokens - used_tokens
+        ratio = saved / full_tokens if full_tokens else 0.0
+        logger.info(f"核心记忆检索 ({label or key})：选用 {len(selection.memories)}/{selection.total} 条"
+                    f"（相关 {selection.relevant}，置顶 {selection.pinned}），记忆约 {used_tokens} tokens，"
+                    f"全部注入约 {full_tokens} tokens，本轮减少 {saved} tokens（{ratio:.0%}）")
+        return content
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'turns': self.turns,
+                'index_builds': self.index_builds,
+                'cached_indexes': len(self._indexes),
+                'avg_selected': round(self.memories_selected / self.turns, 1) if self.turns else 0.0,
+                'avg_total': round(self.memories_total / self.turns, 1) if self.turns else 0.0,
+                'tokens_full': self.tokens_full,
+                'tokens_used': self.tokens_used,
+                'token_reduction': round(1 - self.tokens_used / self.tokens_full, 4) if self.tokens_full else 0.0,
+            }
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+用户消息处理的调度。
+
+DeadlineScheduler 按每个用户消息队列的截止时间（最后一条消息时间 + 等待时间）排序，
+派发线程只在最近的截止时间到达或截止时间被提前时被唤醒，不再每秒轮询全部队列。
+
+KeyedWorkerPool 是一个按键串行、全局限制并发数的线程池：
+同一个键（用户）的任务严格按提交顺序逐个执行，不同键的任务最多 max_workers 个同时执行。
+用于让多个用户的回复生成（联网判断、在线模型、主模型、表情判断）并发进行。
+
+DispatchPause 是暂停派发的计数器：图片/表情识别期间暂停派发，使识别结果能与同批消息合并。
+多个识别并发进行时，只有全部结束后才恢复派发（取代原来的全局布尔开关）。
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """
+    基于最小堆的截止时间调度器。
+
+    每个键只有一个有效截止时间；刷新截止时间时旧的堆元素不删除，
+    出堆时与当前有效值比较后丢弃（惰性删除），因此 schedule 与 cancel 都是 O(log n)。
+    时间使用 time.time()，与消息队列中的 last_message_time 保持一致。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []          # [(deadline, seq, key)]
+        self._deadlines = {}     # {key: 当前有效的截止时间}
+        self._seq = itertools.count()
+        self._stopped = False
+
+    def schedule(self, key, deadline):
+        """设置（或刷新）键的截止时间；截止时间提前到当前最早时间之前时唤醒等待线程。"""
+        with self._cond:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            if self._heap[0][2] == key and self._heap[0][0] == deadline:
+                self._cond.notify_all()
+            # 堆中失效元素过多时重建，避免频繁刷新导致堆无限增长
+            if len(self._heap) > 64 and len(self._heap) > 4 * len(self._deadlines):
+                self._heap = [(d, next(self._seq), k) for k, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+
+    def cancel(self, key):
+        with self._cond:
+            self._deadlines.pop(key, None)
+
+    def deadline_of(self, key):
+        with self._cond:
+            return self._deadlines.get(key)
+
+    def _discard_stale_locked(self):
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            if self._deadlines.get(key) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def _pop_due_locked(self, now):
+        due = []
+        while True:
+            self._discard_stale_locked()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append(key)
+
+    def wait_due(self, timeout=None):
+        """
+        阻塞直到至少一个键到期并返回到期的键列表（已从调度器移除）。
+        超时或调用 stop() 后返回空列表。
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._stopped:
+                now = time.time()
+                due = self._pop_due_locked(now)
+                if due:
+                    return due
+                wait_time = None
+                if self._heap:
+                    wait_time = max(0.0, self._heap[0][0] - now)
+                if end_time is not None:
+                    remaining = end_time - now
+                    if remaining <= 0:
+                        return []
+                    wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                self._cond.wait(wait_time)
+            return []
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+
+class KeyedWorkerPool:
+    """
+    按键串行的有界线程池。
+
+    - submit(key, fn, ...) 把任务追加到该键的队列；
+    - 某个键同一时刻最多只有一个任务在执行，保证每个用户的处理顺序；
+    - 同时执行的任务数不超过 max_workers，可在运行时通过 set_max_workers 调整。
+    """
+
+    def __init__(self, max_workers=3, name="Worker"):
+        self.name = name
+        self._max_workers = max(1, int(max_workers))
+        self._cond = threading.Condition()
+        self._tasks = {}           # {key: deque[(fn, args, kwargs, submitted_at)]}
+        self._ready = deque()      # 有待执行任务且当前未在执行的键
+        self._running = set()      # 正在执行任务的键
+        self._threads = []
+        self._idle_workers = 0
+        self._shutdown = False
+
+        self._queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_wait = 0.0  # 任务提交到开始执行的最长等待（秒）
+        self.peak_queued = 0       # 排队任务数的历史最大值
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    def set_max_workers(self, max_workers):
+        """调整并发上限，超出的线程会在当前任务结束后等待。"""
+        try:
+            max_workers = max(1, int(max_workers))
+        except (TypeError, ValueError):
+            return
+        with self._cond:
+            if max_workers != self._max_workers:
+                logger.info(f"{self.name} 并发上限由 {self._max_workers} 调整为 {max_workers}")
+                self._max_workers = max_workers
+                self._cond.notify_all()
+
+    # --- 提交 ---
+    def submit(self, key, fn, *args, **kwargs):
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError(f"{self.name} 已关闭，无法提交任务")
+            queue = self._tasks.get(key)
+            if queue is None:
+                queue = self._tasks[key] = deque()
+                if key not in self._running:
+                    self._ready.append(key)
+            queue.append((fn, args, kwargs, time.monotonic()))
+            self._queued += 1
+            self.peak_queued = max(self.peak_queued, self._queued)
+            self._ensure_workers_locked()
+            self._cond.notify()
+
+    def _ensure_workers_locked(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        if self._idle_workers == 0 and len(self._threads) < self._max_workers:
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{len(self._threads) + 1}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    # --- 工作线程 ---
+    def _take_task(self):
+        with self._cond:
+            while True:
+                if self._shutdown and not self._ready:
+                    return None, None
+                if self._ready and len(self._running) < self._max_workers:
+                    key = self._ready.popleft()
+                    fn, args, kwargs, submitted_at = self._tasks[key].popleft()
+                    self._queued -= 1
+                    self._running.add(key)
+                    self.max_queue_wait = max(self.max_queue_wait, time.monotonic() - submitted_at)
+                    return key, (fn, args, kwargs)
+                self._idle_workers += 1
+                try:
+                    self._cond.wait()
+                finally:
+                    self._idle_workers -= 1
+
+    def _worker(self):
+        while True:
+            key, task = self._take_task()
+            if task is None:
+                return
+            fn, args, kwargs = task
+            try:
+                fn(*args, **kwargs)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"{self.name} 处理 {key} 的任务失败: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.discard(key)
+                    if self._tasks.get(key):
+                        # 同一键的后续任务排到队尾，让其他键也有机会执行
+                        self._ready.append(key)
+                    else:
+                        self._tasks.pop(key, None)
+                    self._cond.notify_all()
+
+    # --- 状态 ---
+    def is_busy(self, key):
+        """该键是否有尚未完成的任务（排队或执行中）。"""
+        with self._cond:
+            return key in self._running or bool(self._tasks.get(key))
+
+    def wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._running or self._ready:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_workers': self._max_workers,
+                'running': len(self._running),
+                'queued': self._queued,
+                'peak_queued': self.peak_queued,
+                'max_key_depth': max((len(q) for q in self._tasks.values()), default=0),
+                'completed': self.completed,
+                'failed': self.failed,
+                'max_queue_wait': round(self.max_queue_wait, 3),
+            }
+
+    def shutdown(self, wait=True, timeout=None):
+        """停止接收新任务；已排队的任务仍会执行完。"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            for thread in list(self._threads):
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                thread.join(remaining)
+
+
+class DispatchPause:
+    """
+    可重入的派发暂停计数器。
+
+    pause() / resume() 必须成对调用，推荐使用 with dispatch_pause.paused(): ...
+    计数大于 0 时 is_paused() 为 True。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._paused_since = None
+        self.total_paused = 0.0
+
+    def pause(self):
+        with self._lock:
+            if self._count == 0:
+                self._paused_since = time.monotonic()
+            self._count += 1
+
+    def resume(self):
+        with self._lock:
+            if self._count <= 0:
+                logger.warning("DispatchPause.resume() 调用次数多于 pause()，已忽略。")
+                return
+            self._count -= 1
+            if self._count == 0:
+                self.total_paused += time.monotonic() - self._paused_since
+                self._paused_since = None
+
+    @contextmanager
+    def paused(self):
+        self.pause()
+        try:
+            yield
+        finally:
+            self.resume()
+
+    def is_paused(self):
+        with self._lock:
+            return self._count > 0
+
+    def stats(self):
+        with self._lock:
+            current = time.monotonic() - self._paused_since if self._paused_since is not None else 0.0
+            return {
+                'holders': self._count,
+                'paused_seconds': round(self.total_paused + current, 1),
+            }
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+主对话模型的服务商池：对冲请求与自动故障转移。
+
+- 服务商按配置顺序排列，第一个为首选；
+- 健康评分：记录每个服务商最近请求的耗时和失败率（指数滑动平均）。连续失败的服务商进入冷却
+  （时长指数增长），失败率过高或冷却中的服务商排到健康服务商之后；
+- 对冲请求：首选服务商超过其滚动 p95 耗时仍未返回时，向下一个健康服务商再发一份相同请求，
+  采用先返回的有效回复，另一份立即取消（直接断开其流式连接，释放工作线程，服务商停止生成）；
+- 故障转移：请求出错或回复无效时立即改用下一个服务商。
+
+只有一个可用服务商时直接调用 LLMGateway.chat，行为与原先一致。
+"""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+from llm_gateway import RequestCancelled, StreamHandle
+
+logger = logging.getLogger(__name__)
+
+# content 为 None 表示所有服务商都没有给出有效回复（调用方按空回复处理）
+ChatResult = namedtuple('ChatResult', 'content provider hedged attempts')
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ChatProvider:
+    """一个对话服务商及其健康统计（由 ProviderPool 加锁访问）。"""
+
+    def __init__(self, base_url, api_key, model, name=None, window=100):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.model = model
+        self.name = name or f"{urlparse(base_url or '').hostname or base_url}/{model}"
+        self.latencies = deque(maxlen=window)  # 成功请求的耗时（秒）
+        self.failure_rate = 0.0  # 失败率的指数滑动平均
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.invalid_replies = 0
+        self.hedge_wins = 0
+        self.cancelled = 0
+
+    def latency_percentile(self, fraction):
+        if not self.latencies:
+            return None
+        return _percentile(sorted(self.latencies), fraction)
+
+
+class ProviderPool:
+    """
+    对话服务商池（线程安全）。
+
+    complete(messages, validate, purpose, **params) 返回 ChatResult；validate(text) 判断回复是否可用，
+    不可用的回复会触发故障转移。所有服务商都出错时抛出最后一个异常。
+    provider_filter(provider) 返回 False 的服务商本次不参与（例如不受信任的地址）。
+    """
+
+    def __init__(self, gateway, providers, hedging=True, hedge_delay=8.0, min_hedge_delay=1.0,
+                 max_hedge_delay=30.0, min_samples=10, failure_alpha=0.2, unhealthy_failure_rate=0.5,
+                 cooldown_base=5.0, cooldown_max=300.0, max_workers=8, provider_filter=None):
+        self.gateway = gateway
+        self.providers = list(providers)
+        self.hedging = hedging
+        self.hedge_delay_default = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+        self.failure_alpha = failure_alpha
+        self.unhealthy_failure_rate = unhealthy_failure_rate
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.provider_filter = provider_filter
+        self._lock = threading.Lock()
+        self._executor = None
+        self._max_workers = max_workers
+        self.calls = 0
+        self.hedged_calls = 0
+        self.failovers = 0
+
+    # --- 健康评分 ---
+    def _healthy_locked(self, provider, now):
+        return provider.cooldown_until <= now and provider.failure_rate < self.unhealthy_failure_rate
+
+    def ordered_providers(self):
+        """本次调用的服务商顺序：健康的按配置顺序在前，其余按冷却结束时间排后。"""
+        candidates = [p for p in self.providers if self.provider_filter is None or self.provider_filter(p)]
+        now = time.monotonic()
+        with self._lock:
+            healthy = [p for p in candidates if self._healthy_locked(p, now)]
+            others = sorted((p for p in candidates if p not in healthy), key=lambda p: p.cooldown_until)
+        return healthy + others
+
+    def hedge_delay(self, provider):
+        """对冲等待时间：样本足够时取该服务商的滚动 p95 耗时，否则用默认值。"""
+        with self._lock:
+            if len(provider.latencies) < self.min_samples:
+                return self.hedge_delay_default
+            p95 = provider.latency_percentile(0.95)
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, p95))
+
+    def _record_success(self, provider, latency):
+        with self._lock:
+            provider.successes += 1
+            provider.latencies.append(latency)
+            provider.failure_rate *= (1 - self.failure_alpha)
+            provider.consecutive_failures = 0
+            provider.cooldown_until = 0.0
+
+    def _record_failure(self, provider, invalid=False):
+        with self._lock:
+            if invalid:
+                provider.invalid_replies += 1
+            else:
+                provider.failures += 1
+                provider.consecutive_failures += 1
+                cooldown = min(self.cooldown_max, self.cooldown_base * (2 ** (provider.consecutive_failures - 1)))
+                provider.cooldown_until = time.monotonic() + cooldown
+            provider.failure_rate = provider.failure_rate * (1 - self.failure_alpha) + self.failure_alpha
+
+    # --- 调用 ---
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="ChatProvider")
+            return self._executor
+
+    def _complete_single(self, provider, messages, purpose, params):
+        started = time.monotonic()
+        try:
+            response = self.gateway.chat(provider.base_url, provider.api_key, provider.model, messages,
+                                         purpose=purpose, **params)
+        except Exception:
+            self._record_failure(provider)
+            raise
+        content = response.choices[0].message.content if response.choices else None
+        self._record_success(provider, time.monotonic() - started)
+        return ChatResult(content, provider.name, False, 1)
+
+    def complete(self, messages, validate=None, purpose='chat', **params):
+        params.pop('stream', None)
+        with self._lock:
+            self.calls += 1
+        ordered = self.ordered_providers()
+        if not ordered:
+            raise RuntimeError("没有可用的对话服务商")
+        if len(ordered) == 1:
+            return self._complete_single(ordered[0], messages, purpose, params)
+
+        executor = self._get_executor()
+        queue = list(ordered)
+        pending = {}  # {future: (provider, handle, started)}
+        launched = 0
+        hedged = False
+        last_error = None
+        fallback_content = None
+
+        def launch():
+            nonlocal launched
+            provider = queue.pop(0)
+            handle = StreamHandle()
+            future = executor.submit(self.gateway.chat_stream, provider.base_url, provider.api_key, provider.model,
+                                     messages, handle, purpose=purpose, **params)
+            pending[future] = (provider, handle, time.monotonic())
+            launched += 1
+
+        launch()
+        primary = ordered[0]
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+        while pending:
+            timeout = None
+            if self.hedging and not hedged and queue:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 进行中的请求超过首选服务商的 p95 仍未返回，向下一个服务商发出对冲请求
+                hedged = True
+                with self._lock:
+                    self.hedged_calls += 1
+                slow_provider = next(iter(pending.values()))[0]
+                logger.info(f"服务商 {slow_provider.name} 响应较慢，向 {queue[0].name} 发出对冲请求。")
+                launch()
+                continue
+
+            for future in done:
+                provider, _, started = pending.pop(future)
+                try:
+                    content = future.result()
+                except RequestCancelled:
+                    continue
+                except Exception as e:
+                    last_error = e
+                    self._record_failure(provider)
+                    logger.warning(f"服务商 {provider.name} 调用失败: {e}")
+                else:
+                    if content is not None and (validate is None or validate(content)):
+                        self._record_success(provider, time.monotonic() - started)
+                        self._finish(pending, provider, hedged)
+                        return ChatResult(content, provider.name, hedged, launched)
+                    fallback_content = content if fallback_content is None else fallback_content
+                    self._record_failure(provider, invalid=True)
+                    logger.warning(f"服务商 {provider.name} 返回了空的或无效的回复。")
+                if queue and not pending:
+                    # 没有其他请求在进行，立即故障转移到下一个服务商
+                    with self._lock:
+                        self.failovers += 1
+                    logger.warning(f"故障转移到服务商 {queue[0].name}。")
+                    launch()
+
+        if fallback_content is not None or last_error is None:
+            return ChatResult(fallback_content, primary.name, hedged, launched)
+        raise last_error
+
+    def _finish(self, pending, winner, hedged):
+        """采用 winner 的回复，取消其余仍在进行的请求。"""
+        with self._lock:
+            if hedged and pending:
+                winner.hedge_wins += 1
+            for provider, _, _ in pending.values():
+                provider.cancelled += 1
+        for future, (provider, handle, _) in list(pending.items()):
+            future.cancel()  # 尚未开始执行的直接取消
+            handle.cancel()  # 进行中的断开连接，工作线程立即退出
+        pending.clear()
+
+    # --- 统计与关闭 ---
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            providers = {}
+            for provider in self.providers:
+                p50 = provider.latency_percentile(0.5)
+                p95 = provider.latency_percentile(0.95)
+                providers[provider.name] = {
+                    'healthy': self._healthy_locked(provider, now),
+                    'failure_rate': round(provider.failure_rate, 3),
+                    'p50_latency': round(p50, 3) if p50 is not None else None,
+                    'p95_latency': round(p95, 3) if p95 is not None else None,
+                    'successes': provider.successes,
+                    'failures': provider.failures,
+                    'invalid_replies': provider.invalid_replies,
+                    'hedge_wins': provider.hedge_wins,
+                    'cancelled': provider.cancelled,
+                    'cooldown_remaining': round(max(0.0, provider.cooldown_until - now), 1),
+                }
+            return {
+                'calls': self.calls,
+                'hedged_calls': self.hedged_calls,
+                'failovers': self.failovers,
+                'providers': providers,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+模型服务商的客户端限流。
+
+每个服务商 (base_url, api_key) 一个 ProviderLimiter，所有线程共享：
+- 请求数 (RPM) 与 token 数 (TPM) 两个令牌桶，允许预支：令牌不足时调用方按到达顺序预约
+  各自的发送时间再休眠，先到先发，不会在令牌恢复的瞬间一起涌向服务商；
+- 收到 429 时整个服务商进入冷却：优先使用 Retry-After，没有时按连续限流次数指数退避（带抖动）；
+  冷却期间已在排队的调用醒来后重新排队；
+- 自适应速率：冷却之外的每次 429 速率减半，之后每次成功逐步恢复（AIMD）；冷却期间陆续返回的 429
+  来自冷却前已发出的请求，不再重复减半。未配置 RPM 的服务商在 429 时，若最近一分钟实际发出了
+  至少 learn_min_requests 个请求，以这个数为上限临时限速（这一次不再减半），速率恢复满额且
+  learned_ttl 秒内没有再被限流时取消；请求太少时样本不足以说明限额，只靠冷却和 Retry-After。
+
+token 数在发送前按消息长度估算，响应返回后用实际用量修正。
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from token_budget import MESSAGE_OVERHEAD, estimate_text_tokens, message_content_text
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(messages):
+    """粗略估算消息列表的 token 数，与组装上下文时的预算估算（token_budget）使用同一规则。"""
+    return sum(estimate_text_tokens(message_content_text(message)) + MESSAGE_OVERHEAD
+               for message in messages or [] if isinstance(message, dict))
+
+
+def parse_retry_after(headers):
+    """从响应头解析 Retry-After（秒），支持 retry-after-ms、秒数和 HTTP 日期；没有或无法解析时返回 None。"""
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class TokenBucket:
+    """
+    按分钟计的令牌桶（由调用方加锁）。
+
+    reserve() 立即扣除令牌（可以扣成负数）并返回可以发送的时刻，
+    后到的调用方在更晚的时刻发送，从而按到达顺序排队。
+    突发容量为 burst_seconds 秒的量：请求数桶默认只有 1 秒，服务商多按滑动窗口计数，
+    大的突发容量会让窗口内的总数超限；token 桶用整分钟，否则一个较大的请求在空闲时也要等待。
+    """
+
+    def __init__(self, per_minute, burst_seconds=1.0):
+        self.per_minute = float(per_minute)
+        self.capacity = max(1.0, self.per_minute * burst_seconds / 60)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now, rate):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+
+    def reserve(self, amount, now, scale=1.0):
+        rate = self.per_minute * scale / 60
+        self._refill(now, rate)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return max(now, self.updated)
+        return self.updated + (-self.tokens) / rate
+
+    def adjust(self, amount):
+        """预约后修正扣除的数量（正数为补扣，负数为退还）。"""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def restart(self, until, tokens=0.0):
+        """作废之前的所有预约（包括预支），从 until 时刻起以 tokens 个令牌重新积累。"""
+        self.tokens = min(self.capacity, tokens)
+        self.updated = max(self.updated, until)
+
+
+class ProviderLimiter:
+    """单个服务商的限流器（线程安全）。rpm / tpm 为 0 表示不限制。"""
+
+    def __init__(self, name, rpm=0, tpm=0, min_scale=0.1, recovery_step=0.1,
+                 cooldown_base=1.0, cooldown_max=120.0, learned_ttl=300.0, learn_min_requests=20):
+        self.name = name
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.learned_ttl = learned_ttl
+        self.learn_min_requests = learn_min_requests  # 最近一分钟至少发出这么多请求才学习临时限额
+        self._lock = threading.Lock()
+        self._requests = None
+        self._tokens = None
+        self._learned = False  # 当前的请求桶是否为 429 后临时学习的限额
+        self._recent_starts = deque()  # 最近一分钟的发送时刻，用于学习限额
+        self.scale = 1.0
+        self.blocked_until = 0.0
+        self.last_limited = 0.0
+        self.consecutive_limited = 0
+        self._epoch = 0  # 每次 429 加一，排队中的调用据此判断是否需要重新排队
+        self.rpm = 0
+        self.tpm = 0
+        self.set_limits(rpm, tpm)
+
+        self.acquired = 0
+        self.waiting = 0
+        self.waited_seconds = 0.0
+        self.max_wait = 0.0
+        self.rate_limited = 0
+
+    def set_limits(self, rpm=0, tpm=0):
+        with self._lock:
+            rpm, tpm = int(rpm or 0), int(tpm or 0)
+            if rpm != self.rpm or self._requests is None or self._learned:
+                self._requests = TokenBucket(rpm) if rpm > 0 else None
+                self._learned = False
+            if tpm != self.tpm:
+                self._tokens = TokenBucket(tpm, burst_seconds=60) if tpm > 0 else None
+            self.rpm, self.tpm = rpm, tpm
+
+    def _reserve_locked(self, tokens, now):
+        ready = max(now, self.blocked_until)
+        if self._requests is not None:
+            ready = max(ready, self._requests.reserve(1, now, self.scale))
+        if tokens and self._tokens is not None:
+            ready = max(ready, self._tokens.reserve(tokens, now, self.scale))
+        return ready - now
+
+    def acquire(self, tokens=0):
+        """按顺序等待到可以发送，返回等待的秒数。"""
+        started = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    epoch = self._epoch
+                    wait = self._reserve_locked(tokens, time.monotonic())
+                if wait > 0:
+                    time.sleep(wait)
+                with self._lock:
+                    if self._epoch == epoch:
+                        now = time.monotonic()
+                        self._recent_starts.append(now)
+                        while self._recent_starts and now - self._recent_starts[0] > 60:
+                            self._recent_starts.popleft()
+                        break
+                # 等待期间服务商返回了 429，原预约作废，重新排队
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self.waiting -= 1
+                self.acquired += 1
+                self.waited_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def on_success(self, token_correction=0):
+        """请求成功：逐步恢复速率，并用实际 token 用量修正预估。"""
+        with self._lock:
+            self.consecutive_limited = 0
+            if token_correction and self._tokens is not None:
+                self._tokens.adjust(token_correction)
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + self.recovery_step)
+            elif self._learned and time.monotonic() - self.last_limited > self.learned_ttl:
+                # 临时限额下已稳定运行一段时间，取消，下一次 429 时重新学习
+                self._requests = None
+                self._learned = False
+                logger.info(f"服务商 {self.name} 已稳定 {self.learned_ttl:.0f} 秒，取消临时限流。")
+
+    def on_rate_limited(self, retry_after=None):
+        """收到 429：整个服务商进入冷却并降低速率，返回冷却秒数。"""
+        with self._lock:
+            now = time.monotonic()
+            in_cooldown = now < self.blocked_until
+            self.rate_limited += 1
+            self.consecutive_limited += 1
+            self.last_limited = now
+            if retry_after is not None:
+                cooldown = min(self.cooldown_max, retry_after)
+            else:
+                ceiling = min(self.cooldown_max, self.cooldown_base * (2 ** (self.consecutive_limited - 1)))
+                cooldown = ceiling / 2 + random.uniform(0, ceiling / 2)
+            self.blocked_until = max(self.blocked_until, now + cooldown)
+            if self._requests is None:
+                observed = sum(1 for started in self._recent_starts if now - started <= 60)
+                if observed >= self.learn_min_requests:
+                    self._requests = TokenBucket(observed)
+                    self._learned = True
+                    self.scale = 1.0
+            elif not in_cooldown:
+                self.scale = max(self.min_scale, self.scale * 0.5)
+            if self._requests is not None:
+                # 排队中的调用会重新预约，冷却结束时只放行一个请求，其余按速率依次发送
+                self._requests.restart(self.blocked_until, tokens=1.0)
+            if self._tokens is not None:
+                self._tokens.restart(self.blocked_until)
+            self._epoch += 1
+            rate = self._requests.per_minute * self.scale if self._requests is not None else None
+        if rate is None:
+            logger.warning(f"服务商 {self.name} 返回限流，暂停 {cooldown:.1f} 秒。")
+        else:
+            logger.warning(f"服务商 {self.name} 返回限流，暂停 {cooldown:.1f} 秒，之后按约 {rate:.0f} 次/分钟发送。")
+        return cooldown
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rpm': self.rpm,
+                'tpm': self.tpm,
+                'effective_rpm': round(self._requests.per_minute * self.scale, 1) if self._requests else 0,
+                'learned_limit': self._learned,
+                'scale': round(self.scale, 2),
+                'acquired': self.acquired,
+                'waiting': self.waiting,
+                'waited_seconds': round(self.waited_seconds, 1),
+                'max_wait': round(self.max_wait, 2),
+                'rate_limited': self.rate_limited,
+                'cooldown_remaining': round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            }
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+图片/表情识别结果缓存。
+
+- 按文件内容的 SHA-256 精确匹配：重复发送的图片、转发的图片直接命中；
+- 动画表情通过 msg.capture() 截图识别，每次截图可能有几个像素的差异，
+  因此额外计算 64 位差值哈希 (dHash)，汉明距离不超过 max_distance 即视为同一表情。
+  dHash 切成 max_distance + 1 段建立索引（鸽巢原理：距离不超过阈值时至少有一段完全相同），
+  查找时只比较共享某一段的候选项，而不是遍历全部缓存；
+- LRU + TTL 淘汰，条目数和单条文本长度有上限，定期原子地保存到 JSON 文件。
+
+dHash 依赖 Pillow，未安装时只使用内容哈希。
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow 不可用时只做精确匹配
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DHASH_BITS = 64
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(data, hash_size=8):
+    """计算图片的差值哈希（64 位整数）；无法解码或没有 Pillow 时返回 None。"""
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft('L', (hash_size * 4, hash_size * 4))  # JPEG 解码时直接缩小，降低开销
+            small = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(small.getdata())
+    except Exception as e:
+        logger.debug(f"计算图片感知哈希失败: {e}")
+        return None
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return value
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class RecognitionCache:
+    """
+    识别结果缓存（线程安全）。
+
+    lookup(data, kind, perceptual) 返回缓存的识别文本或 None；
+    put(data, kind, text, perceptual) 在识别成功后写入。
+    kind 区分识别提示词（如 'image' 与 'emoji'），同一图片在不同提示词下的结果分开缓存。
+    """
+
+    def __init__(self, path, max_entries=2000, ttl_seconds=30 * 86400, max_distance=3,
+                 max_text_length=2000, save_interval=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.max_text_length = max_text_length
+        self.save_interval = save_interval
+        self._bands = max_distance + 1
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {key: entry}，按最近使用排序
+        self._band_index = {}          # {(kind, 段号, 段值): {key, ...}}
+        self._dirty = False
+        self._last_save = 0.0
+        self._recent_phash = (None, None)  # 最近一次未命中时算出的 (内容哈希, dHash)，供随后的 put 复用
+
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.seconds_saved = 0.0
+
+    @staticmethod
+    def _key(kind, digest):
+        return f"{kind}:{digest}"
+
+    # --- 感知哈希索引 ---
+    def _band_keys(self, kind, value):
+        width = DHASH_BITS // self._bands
+        keys = []
+        for band in range(self._bands):
+            shift = band * width
+            bits = width if band < self._bands - 1 else DHASH_BITS - shift
+            keys.append((kind, band, (value >> shift) & ((1 << bits) - 1)))
+        return keys
+
+    def _index_locked(self, key, entry):
+        if entry.get('phash') is None:
+            return
+        for band_key in self._band_keys(entry['kind'], entry['phash']):
+            self._band_index.setdefault(band_key, set()).add(key)
+
+    def _unindex_locked(self, key, entry):
+        if entry.get('phash') is None:
+            return
+        for band_key in self._band_keys(entry['kind'], entry['phash']):
+            keys = self._band_index.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._band_index[band_key]
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._unindex_locked(key, entry)
+            self._dirty = True
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry['created'] > self.ttl_seconds
+
+    def _find_similar_locked(self, kind, value, now):
+        best_key, best_distance = None, self.max_distance + 1
+        candidates = set()
+        for band_key in self._band_keys(kind, value):
+            candidates |= self._band_index.get(band_key, set())
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                continue
+            distance = _hamming(value, entry['phash'])
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        return best_key
+
+    # --- 查询与写入 ---
+    def lookup(self, data, kind, perceptual=False):
+        """按内容哈希（以及可选的感知哈希）查找识别结果。"""
+        now = time.time()
+        digest = content_hash(data)
+        key = self._key(kind, digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                self._remove_locked(key)
+                entry = None
+            if entry is not None:
+                return self._hit_locked(key, entry, data)
+        if not perceptual:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # 精确匹配未命中，在锁外解码图片计算 dHash
+        phash = dhash(data)
+        with self._lock:
+            self._recent_phash = (digest, phash)
+            similar_key = self._find_similar_locked(kind, phash, now) if phash is not None else None
+            if similar_key is None:
+                self.misses += 1
+                return None
+            self.perceptual_hits += 1
+            return self._hit_locked(similar_key, self._entries[similar_key], data)
+
+    def _hit_locked(self, key, entry, data):
+        self._entries.move_to_end(key)
+        entry['hits'] = entry.get('hits', 0) + 1
+        self.hits += 1
+        self.bytes_saved += (len(data) + 2) // 3 * 4  # 省下的 base64 上传字节数
+        self.seconds_saved += entry.get('latency', 0.0)
+        self._dirty = True
+        return entry['text']
+
+    def put(self, data, kind, text, perceptual=False, latency=0.0):
+        """写入识别结果。latency 为这次识别耗时，用于估算命中节省的时间。"""
+        if not text or len(text) > self.max_text_length:
+            return
+        digest = content_hash(data)
+        key = self._key(kind, digest)
+        phash = None
+        if perceptual:
+            recent_digest, recent_phash = self._recent_phash
+            phash = recent_phash if recent_digest == digest else dhash(data)
+        with self._lock:
+            self._remove_locked(key)
+            entry = {
+                'kind': kind,
+                'text': text,
+                'phash': phash,
+                'size': len(data),
+                'latency': round(latency, 3),
+                'created': time.time(),
+                'hits': 0,
+            }
+            self._entries[key] = entry
+            self._index_locked(key, entry)
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove_locked(oldest_key)
+            self._dirty = True
+        self.save_if_due()
+
+    # --- 持久化 ---
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取识别缓存失败，将使用空缓存: {e}")
+            return 0
+        now = time.time()
+        with self._lock:
+            self._entries.clear()
+            self._band_index.clear()
+            for key, entry in (data.get('entries') or []) if isinstance(data, dict) else []:
+                if not isinstance(entry, dict) or 'text' not in entry or self._expired(entry, now):
+                    continue
+                self._entries[key] = entry
+                self._index_locked(key, entry)
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+            self._dirty = False
+            self._last_save = time.time()
+            count = len(self._entries)
+        logger.info(f"已加载 {count} 条图片识别缓存。")
+        return count
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {'version': 1, 'entries': list(self._entries.items())}
+            self._dirty = False
+            self._last_save = time.time()
+        temp_path = self.path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"保存识别缓存失败: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def save_if_due(self):
+        if self._dirty and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'perceptual_hits': self.perceptual_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'seconds_saved': round(self.seconds_saved, 1),
+            }
@@ -0,0 +1,540 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+每日重复提醒与长期一次性提醒的调度器。
+
+- 内存中用最小堆保存每条提醒的下一次触发时间，调度线程睡眠到最近的触发时间，准点触发，
+  不再每分钟扫描全部提醒；另有按用户的索引，用于数量限制和去重。
+- recurring_reminders.json 仍是配置编辑器读写的快照（格式不变）；
+  每次新增、删除、触发都先追加到日志文件 recurring_reminders.json.journal。
+  只有新增、删除会让快照过期，由调度线程合并多次变更后再重写；触发只追加一行日志，不重写快照。
+- 重写快照、日志行数超过 journal_compact_lines 或 flush()/stop() 时，日志压缩为 base + 每条提醒最后一次触发记录。
+- 日志中记录每条提醒最后一次触发的分钟，重启后在 catch_up_window 内补发错过的提醒。
+- 快照被外部（配置编辑器）修改时以快照为准重新加载，但保留已有提醒的触发记录。
+
+日志记录格式（每行一个 JSON 对象）:
+    {"op": "base", "signature": [mtime_ns, size]}             快照版本，首行
+    {"op": "add", "reminder": {...}, "at": "YYYY-MM-DD HH:MM"}  新增提醒
+    {"op": "remove", "key": "..."}                            删除提醒
+    {"op": "fired", "key": "...", "at": "YYYY-MM-DD HH:MM"}     提醒在该分钟的触发已完成
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+MINUTE_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def reminder_key(reminder):
+    """提醒的稳定标识：由类型、用户、时间和内容决定，与在列表中的位置无关。"""
+    if reminder.get('reminder_type') == 'recurring':
+        when = reminder.get('time_str')
+    else:
+        when = reminder.get('target_datetime_str')
+    return json.dumps([reminder.get('reminder_type'), reminder.get('user_id'), when, reminder.get('content')],
+                      ensure_ascii=False)
+
+
+def normalize_reminder(item):
+    """校验并返回只包含快照字段的提醒字典；无效时返回 None。"""
+    if not isinstance(item, dict):
+        return None
+    reminder_type = item.get('reminder_type')
+    user_id = item.get('user_id')
+    content = item.get('content')
+    if not user_id or content is None:
+        return None
+    try:
+        if reminder_type == 'recurring':
+            time_str = str(item.get('time_str', '')).strip()
+            datetime.strptime(time_str, '%H:%M')
+            return {'reminder_type': 'recurring', 'user_id': user_id, 'time_str': time_str, 'content': content}
+        if reminder_type == 'one-off':
+            target = str(item.get('target_datetime_str', '')).strip()
+            datetime.strptime(target, MINUTE_FORMAT)
+            return {'reminder_type': 'one-off', 'user_id': user_id, 'target_datetime_str': target, 'content': content}
+    except ValueError:
+        return None
+    return None
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+    except OSError:
+        return None
+
+
+def _parse_minute(value):
+    try:
+        return datetime.strptime(value, MINUTE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def _previous_daily(time_str, now):
+    """time_str (HH:MM) 在 now 之前（含）最近一次出现的时间。"""
+    hour, minute = map(int, time_str.split(':'))
+    occurrence = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if occurrence > now:
+        occurrence -= timedelta(days=1)
+    return occurrence
+
+
+def _next_daily(time_str, after):
+    """time_str (HH:MM) 在 after 之后（不含）的下一次出现时间。"""
+    return _previous_daily(time_str, after) + timedelta(days=1)
+
+
+class ReminderScheduler:
+    """
+    堆索引的提醒调度器。
+
+    on_fire(reminder, scheduled_at, late_seconds) 在调度线程中调用（不持有锁），
+    reminder 为提醒字典的副本，scheduled_at 为原定触发时间（datetime）。
+    """
+
+    def __init__(self, snapshot_path, on_fire=None, catch_up_window=3600, snapshot_delay=3.0,
+                 check_interval=30.0, journal_compact_lines=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path + '.journal'
+        self.on_fire = on_fire
+        self.catch_up_window = catch_up_window  # 秒，重启后补发该时间内错过的提醒
+        self.snapshot_delay = snapshot_delay    # 秒，合并多次变更后再重写快照
+        self.check_interval = check_interval    # 秒，检查快照是否被外部修改的间隔
+        self.journal_compact_lines = journal_compact_lines  # 日志超过该行数时压缩
+        self._cond = threading.Condition(threading.RLock())
+        self._reminders = {}     # {key: 提醒字典}
+        self._order = {}         # 快照中的顺序（有序的 key 集合），重写快照时保持编辑器中的顺序
+        self._by_user = {}       # {user_id: {key, ...}}
+        self._last_fired = {}    # {key: 'YYYY-MM-DD HH:MM'}
+        self._heap = []          # [(fire_ts, seq, key, scheduled_minute_str)]
+        self._scheduled = {}     # {key: 当前有效的 (fire_ts, seq)}
+        self._seq = itertools.count()
+        self._snapshot_signature = None
+        self._snapshot_dirty_since = None
+        self._journal_lines = 0
+        self._last_check = 0.0
+        self._accept = None
+        self._thread = None
+        self._stopped = False
+        self.fired_count = 0
+        self.caught_up_count = 0
+
+    # --- 加载 ---
+    def load(self, accept=None):
+        """
+        从快照和日志加载提醒。accept(reminder) 返回 False 的提醒会被跳过（如用户不在监听列表中）。
+        返回加载的提醒数量。
+        """
+        with self._cond:
+            self._accept = accept
+            snapshot, signature = self._read_snapshot()
+            journal = self._read_journal()
+            trusted = bool(journal) and journal[0].get('op') == 'base' and journal[0].get('signature') == signature
+            if journal and not trusted:
+                logger.info("提醒快照已被外部修改，以快照为准重新加载（保留触发记录）。")
+
+            created = {}
+            reminders = []
+            changed = False  # 加载结果与快照内容不同时需要重写快照
+            for item in snapshot:
+                reminder = normalize_reminder(item)
+                if reminder is None:
+                    logger.warning(f"跳过无效格式的提醒项: {item}")
+                    changed = True
+                    continue
+                reminders.append(reminder)
+            last_fired = {}
+            for record in (journal[1:] if journal and journal[0].get('op') == 'base' else journal):
+                op = record.get('op')
+                if op == 'fired':
+                    last_fired[record.get('key')] = record.get('at')
+                elif not trusted:
+                    continue  # 快照为准，忽略日志中的增删
+                elif op == 'add':
+                    reminder = normalize_reminder(record.get('reminder'))
+                    if reminder is not None:
+                        reminders.append(reminder)
+                        created[reminder_key(reminder)] = record.get('at')
+                        changed = True
+                elif op == 'remove':
+                    key = record.get('key')
+                    reminders = [r for r in reminders if reminder_key(r) != key]
+                    changed = True
+            # 内存中的触发记录（含正在触发的提醒）更新，避免重新加载时重复补发
+            last_fired.update(self._last_fired)
+
+            self._reset_locked()
+            now = datetime.now()
+            for reminder in reminders:
+                if accept is not None and not accept(reminder):
+                    logger.warning(f"跳过未在监听列表中的用户提醒: {reminder.get('user_id')}")
+                    changed = True
+                    continue
+                key = reminder_key(reminder)
+                if key in self._reminders:
+                    changed = True
+                    continue
+                baseline = last_fired.get(key) or created.get(key)
+                if baseline:
+                    self._last_fired[key] = baseline
+                self._insert_locked(key, reminder)
+                if not self._schedule_initial_locked(key, reminder, now):
+                    self._remove_locked(key)
+                    changed = True
+
+            self._snapshot_signature = signature
+            self._snapshot_dirty_since = None
+            self._journal_lines = len(journal)
+            if changed:
+                # 去掉过期项、合并日志中的变更后重写快照（同时压缩日志）
+                self._write_snapshot_locked()
+            elif not trusted or self._journal_lines > self.journal_compact_lines:
+                # 快照不变，只需让日志以当前快照为基准
+                self._compact_journal_locked()
+            self._cond.notify_all()
+            logger.info(f"成功从 {self.snapshot_path} 加载 {len(self._reminders)} 条有效提醒。")
+            return len(self._reminders)
+
+    def _read_snapshot(self):
+        signature = _file_signature(self.snapshot_path)
+        if signature is None:
+            logger.info(f"{self.snapshot_path} 文件未找到。将以无提醒状态启动。")
+            return [], None
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"解析 {self.snapshot_path} 文件失败: {e}。将初始化为空列表。")
+            return [], signature
+        if not isinstance(data, list):
+            logger.error(f"{self.snapshot_path} 文件内容不是有效的列表格式。将初始化为空列表。")
+            return [], signature
+        return data, signature
+
+    def _read_journal(self):
+        records = []
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"跳过提醒日志中损坏的记录: {line[:100]}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"读取提醒日志失败: {e}")
+        return records
+
+    # --- 内部状态 ---
+    def _reset_locked(self):
+        self._reminders.clear()
+        self._order = {}
+        self._by_user.clear()
+        self._last_fired.clear()
+        self._heap = []
+        self._scheduled.clear()
+
+    def _insert_locked(self, key, reminder):
+        self._reminders[key] = reminder
+        self._order[key] = None
+        self._by_user.setdefault(reminder['user_id'], set()).add(key)
+
+    def _remove_locked(self, key):
+        reminder = self._reminders.pop(key, None)
+        if reminder is None:
+            return None
+        self._scheduled.pop(key, None)
+        self._last_fired.pop(key, None)
+        keys = self._by_user.get(reminder['user_id'])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[reminder['user_id']]
+        self._order.pop(key, None)
+        return reminder
+
+    def _push_locked(self, key, fire_at, scheduled_minute):
+        seq = next(self._seq)
+        fire_ts = fire_at.timestamp()
+        self._scheduled[key] = (fire_ts, seq)
+        heapq.heappush(self._heap, (fire_ts, seq, key, scheduled_minute))
+        if self._heap[0][1] == seq:
+            self._cond.notify_all()
+
+    def _schedule_initial_locked(self, key, reminder, now):
+        """安排提醒的首次触发（含补发）。一次性提醒已过期且超出补发窗口时返回 False。"""
+        window = timedelta(seconds=self.catch_up_window)
+        if reminder['reminder_type'] == 'one-off':
+            target = _parse_minute(reminder['target_datetime_str'])
+            if target > now:
+                self._push_locked(key, target, reminder['target_datetime_str'])
+                return True
+            if now - target <= window and self._last_fired.get(key) != reminder['target_datetime_str']:
+                logger.info(f"补发错过的一次性提醒: 用户 {reminder['user_id']}, 原定 {reminder['target_datetime_str']}")
+                self._push_locked(key, now, reminder['target_datetime_str'])
+                return True
+            logger.info(f"跳过已过期的一次性提醒: {reminder}")
+            return False
+
+        time_str = reminder['time_str']
+        previous = _previous_daily(time_str, now)
+        previous_str = previous.strftime(MINUTE_FORMAT)
+        baseline = _parse_minute(self._last_fired.get(key))
+        if baseline is not None and previous > baseline and now - previous <= window:
+            logger.info(f"补发错过的每日提醒: 用户 {reminder['user_id']}, 原定 {previous_str}")
+            self._push_locked(key, now, previous_str)
+        elif previous == now.replace(second=0, microsecond=0) and baseline is None:
+            # 启动时恰好处于提醒的那一分钟，且没有触发记录
+            self._push_locked(key, now, previous_str)
+        else:
+            next_fire = _next_daily(time_str, now)
+            self._push_locked(key, next_fire, next_fire.strftime(MINUTE_FORMAT))
+        return True
+
+    # --- 持久化 ---
+    def _append_journal_locked(self, record, snapshot_changed=True):
+        """追加一条日志记录；snapshot_changed 为 False（触发记录）时不重写快照。"""
+        try:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._journal_lines += 1
+        except OSError as e:
+            logger.error(f"写入提醒日志失败: {e}")
+        if snapshot_changed:
+            if self._snapshot_dirty_since is None:
+                self._snapshot_dirty_since = time.time()
+                self._cond.notify_all()
+        elif self._snapshot_dirty_since is None and self._journal_lines > self.journal_compact_lines:
+            # 快照待重写时会一并压缩日志，这里只处理快照未过期的情况
+            self._compact_journal_locked()
+
+    def _compact_journal_locked(self):
+        """把日志压缩为 base + 每条提醒最后一次触发记录（调用前快照必须已包含全部增删）。"""
+        journal_temp = self.journal_path + '.tmp'
+        try:
+            lines = 1
+            with open(journal_temp, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'op': 'base', 'signature': self._snapshot_signature}) + '\n')
+                for key, at in self._last_fired.items():
+                    if key in self._reminders:
+                        f.write(json.dumps({'op': 'fired', 'key': key, 'at': at}, ensure_ascii=False) + '\n')
+                        lines += 1
+            os.replace(journal_temp, self.journal_path)
+            self._journal_lines = lines
+        except OSError as e:
+            logger.error(f"压缩提醒日志失败: {e}")
+
+    def _write_snapshot_locked(self):
+        """重写快照（编辑器格式）并把日志压缩为 base + 触发记录。"""
+        reminders = [self._reminders[key] for key in self._order]
+        temp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(reminders, f, ensure_ascii=False, indent=4)
+            os.replace(temp_path, self.snapshot_path)
+            self._snapshot_signature = _file_signature(self.snapshot_path)
+            self._snapshot_dirty_since = None
+            self._compact_journal_locked()
+            logger.info(f"成功将 {len(reminders)} 条提醒保存到 {self.snapshot_path}")
+        except Exception as e:
+            logger.error(f"保存提醒失败: {str(e)}", exc_info=True)
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def flush(self):
+        """立即把未写入快照的变更写入快照并压缩日志（退出、重启前调用）。"""
+        with self._cond:
+            if self._snapshot_dirty_since is not None:
+                self._write_snapshot_locked()
+            elif self._journal_lines > 1 + len(self._last_fired):
+                self._compact_journal_locked()
+
+    def _check_external_change_locked(self, now_ts):
+        if now_ts - self._last_check < self.check_interval:
+            return
+        self._last_check = now_ts
+        if _file_signature(self.snapshot_path) != self._snapshot_signature:
+            if self._snapshot_dirty_since is not None:
+                # 本地还有未写入的变更，先追加的日志记录已保证不丢，但快照以编辑器为准
+                logger.warning("提醒快照被外部修改，本地尚未写入快照的增删将以快照为准被覆盖。")
+            self.load(self._accept)
+
+    # --- 对外接口 ---
+    def add(self, reminder):
+        """新增提醒；已存在完全相同的提醒，或一次性提醒的时间已过、无法安排触发时返回 False。"""
+        reminder = normalize_reminder(reminder)
+        if reminder is None:
+            raise ValueError("无效的提醒数据")
+        key = reminder_key(reminder)
+        with self._cond:
+            if key in self._reminders:
+                return False
+            now = datetime.now()
+            created = now.strftime(MINUTE_FORMAT)
+            self._insert_locked(key, reminder)
+            # 新增提醒以创建时间作为补发基准，重启后可补发创建之后错过的触发
+            self._last_fired[key] = created
+            if not self._schedule_initial_locked(key, reminder, now):
+                self._remove_locked(key)
+                return False
+            self._append_journal_locked({'op': 'add', 'reminder': reminder, 'at': created})
+            return True
+
+    def remove(self, reminder):
+        key = reminder_key(reminder)
+        with self._cond:
+            if self._remove_locked(key) is None:
+                return False
+            self._append_journal_locked({'op': 'remove', 'key': key})
+            return True
+
+    def count(self, user_id, reminder_type=None):
+        with self._cond:
+            keys = self._by_user.get(user_id, ())
+            if reminder_type is None:
+                return len(keys)
+            return sum(1 for key in keys if self._reminders[key]['reminder_type'] == reminder_type)
+
+    def reminders_for(self, user_id):
+        with self._cond:
+            return [dict(self._reminders[key]) for key in self._by_user.get(user_id, ())]
+
+    def next_fire_time(self):
+        with self._cond:
+            self._discard_stale_locked()
+            return datetime.fromtimestamp(self._heap[0][0]) if self._heap else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._reminders)
+
+    def stats(self):
+        with self._cond:
+            next_fire = self.next_fire_time()
+            return {
+                'reminders': len(self._reminders),
+                'users': len(self._by_user),
+                'heap_size': len(self._heap),
+                'next_fire': next_fire.strftime('%Y-%m-%d %H:%M:%S') if next_fire else None,
+                'fired': self.fired_count,
+                'caught_up': self.caught_up_count,
+            }
+
+    # --- 调度线程 ---
+    def _discard_stale_locked(self):
+        while self._heap:
+            fire_ts, seq, key, _ = self._heap[0]
+            if self._scheduled.get(key) == (fire_ts, seq):
+                return
+            heapq.heappop(self._heap)
+        if len(self._heap) > 1024 and len(self._heap) > 4 * len(self._scheduled):
+            self._heap = [entry for entry in self._heap if self._scheduled.get(entry[2]) == entry[:2]]
+            heapq.heapify(self._heap)
+
+    def _pop_due_locked(self, now_ts):
+        due = []
+        while True:
+            self._discard_stale_locked()
+            if not self._heap or self._heap[0][0] > now_ts:
+                return due
+            _, _, key, scheduled_minute = heapq.heappop(self._heap)
+            del self._scheduled[key]
+            # 触发前即记录，触发期间重新加载快照也不会重复补发
+            self._last_fired[key] = scheduled_minute
+            due.append((key, dict(self._reminders[key]), scheduled_minute))
+
+    def _complete_locked(self, key, reminder, scheduled_minute):
+        """触发后更新状态：每日提醒记录触发并安排下一次，一次性提醒删除。"""
+        if key not in self._reminders:
+            return  # 触发期间已被删除或快照被重新加载
+        if reminder['reminder_type'] == 'one-off':
+            self._remove_locked(key)
+            self._append_journal_locked({'op': 'remove', 'key': key})
+            return
+        self._append_journal_locked({'op': 'fired', 'key': key, 'at': scheduled_minute}, snapshot_changed=False)
+        if key not in self._scheduled:
+            after = max(datetime.now(), _parse_minute(scheduled_minute))
+            next_fire = _next_daily(reminder['time_str'], after)
+            self._push_locked(key, next_fire, next_fire.strftime(MINUTE_FORMAT))
+
+    def _run(self):
+        logger.info("提醒调度线程已启动。")
+        while True:
+            with self._cond:
+                due = []
+                while not self._stopped:
+                    now_ts = time.time()
+                    self._check_external_change_locked(now_ts)
+                    due = self._pop_due_locked(now_ts)
+                    if due:
+                        break
+                    if self._snapshot_dirty_since is not None and now_ts - self._snapshot_dirty_since >= self.snapshot_delay:
+                        self._write_snapshot_locked()
+                    wait_time = self.check_interval - (now_ts - self._last_check)
+                    if self._heap:
+                        wait_time = min(wait_time, self._heap[0][0] - now_ts)
+                    if self._snapshot_dirty_since is not None:
+                        wait_time = min(wait_time, self._snapshot_dirty_since + self.snapshot_delay - now_ts)
+                    self._cond.wait(max(0.01, wait_time))
+                if self._stopped:
+                    break
+
+            for key, reminder, scheduled_minute in due:
+                scheduled_at = _parse_minute(scheduled_minute)
+                late_seconds = max(0.0, time.time() - scheduled_at.timestamp()) if scheduled_at else 0.0
+                if late_seconds >= 60:
+                    self.caught_up_count += 1
+                try:
+                    if self.on_fire is not None:
+                        self.on_fire(reminder, scheduled_at, late_seconds)
+                    self.fired_count += 1
+                except Exception as e:
+                    logger.error(f"触发提醒失败，用户 {reminder.get('user_id')}，提醒：{reminder.get('content')}：{e}",
+                                 exc_info=True)
+                with self._cond:
+                    self._complete_locked(key, reminder, scheduled_minute)
+        logger.info("提醒调度线程已停止。")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="ReminderScheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        self.flush()
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+提醒请求的本地时间解析（基于规则，不调用模型）。
+
+支持的说法（数字可以是阿拉伯数字或中文数字）：
+- 相对时间："10分钟后"、"一个半小时以后"、"过5分钟"、"1小时20分钟后"、"30秒后"；
+- 日期与时刻："明天下午三点"、"今晚8点半"、"后天早上7:30"、"下周三上午10点"、"6月15号9点"、
+  "3天后下午2点"，只有时刻时取最近的未来时间（"3点"在上午说是下午3点）；
+- 每日重复："每天早上8点"、"每晚10点"。
+
+parse_reminder_text() 返回与模型提醒解析相同结构的字典：
+    {"type": "one-off-short", "delay_seconds": 300, "message": "..."}      10 分钟以内
+    {"type": "one-off-long", "target_datetime_str": "YYYY-MM-DD HH:MM", "message": "..."}
+    {"type": "recurring", "time_str": "HH:MM", "message": "..."}
+没有把握时（否定或疑问、取消/修改提醒、每周等不支持的重复方式、时间说法不完整或有歧义、
+提醒内容为空、还有没识别的时间词等）返回 None，由调用方交给模型解析。
+"""
+
+import datetime as dt
+import re
+
+SHORT_REMINDER_SECONDS = 600  # 与模型解析的规则一致：10 分钟以内为短期提醒
+
+_FULLWIDTH = str.maketrans('０１２３４５６７８９：', '0123456789:')
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_CN_UNITS = {'十': 10, '百': 100}
+
+_NUM = r'(?:\d+(?:\.\d+)?|[零〇一二两三四五六七八九十百]+)'
+_REL_UNIT = (rf'(?:{_NUM}\s*个?\s*半?\s*(?:小时|钟头|个钟)|半\s*个?\s*(?:小时|钟头)|{_NUM}\s*刻钟'
+             rf'|{_NUM}\s*分钟?|{_NUM}\s*秒钟?)')
+_REL_UNIT_PARTS = re.compile(
+    rf'(?P<num>{_NUM})?\s*个?\s*(?P<half>半)?\s*个?\s*(?P<unit>小时|钟头|个钟|刻钟|分钟|分|秒钟|秒)')
+
+_TOKEN_RE = re.compile('|'.join([
+    rf'(?P<rel_after>(?:{_REL_UNIT}\s*){{1,3}})(?:后|之后|以后)',
+    rf'再?过\s*(?P<rel_before>(?:{_REL_UNIT}\s*){{1,3}})',
+    rf'(?P<days>{_NUM})\s*天\s*(?:后|之后|以后)',
+    r'(?P<dayperiod>今晚|今早|今夜|明早|明晚|明夜)',
+    r'(?P<dayword>大后天|后天|明天|明日|明儿|今天|今日|今儿)',
+    r'(?P<week_prefix>下个?|这个?|本)?(?:周|星期|礼拜)(?P<weekday>[一二三四五六日天1-7])',
+    r'(?P<iso_y>\d{4})-(?P<iso_m>\d{1,2})-(?P<iso_d>\d{1,2})',
+    rf'(?:(?P<year>\d{{4}})\s*年\s*)?(?P<month>{_NUM})\s*月\s*(?P<mday>{_NUM})\s*(?:日|号)?',
+    rf'(?P<dom>{_NUM})\s*(?:日|号)',
+    r'(?P<daily>每天|每日|天天|每晚|每早|每夜)',
+    r'(?P<period>凌晨|清晨|早上|早晨|一早|上午|中午|下午|午后|傍晚|晚上|夜里|夜间|半夜|深夜)',
+    r'(?P<clock_h>\d{1,2})\s*:\s*(?P<clock_m>\d{2})',
+    rf'(?P<hour>{_NUM})\s*(?:点|时)(?:\s*(?:(?P<half>半)|(?P<quarter>一刻)|(?P<three_quarters>三刻)|整|钟'
+    rf'|(?P<minute>{_NUM})\s*分?))?',
+]))
+
+# 有这些说法时不做本地解析：疑问、否定、修改已有提醒、不支持的重复方式、相对某个事件的时间
+_UNSURE_RE = re.compile(
+    r'取消|删除|删掉|不用|不要|别|关闭|关掉|停止|暂停|改成|改为|改到|推迟|延后|提前|吗|\?|？|怎么|几点|什么时候|多久'
+    r'|之前|以前|之内|以内|或者|还是|每隔|每周|每星期|每礼拜|每月|每个月|每年|工作日|周末|每小时|每分钟|隔天')
+_INTENT_RE = re.compile(r'提醒|叫我|喊我|叫醒|通知我|闹钟')
+# 去掉已识别的时间后仍残留的时间说法，说明有没识别的部分
+_RESIDUE_TIME_RE = re.compile(
+    r'\d|[零〇一二两三四五六七八九十百]\s*(?:点|时|分|秒|号|日|天|周|月|年|刻|个?小时|个?钟头)|每|星期|礼拜'
+    r'|周[一二三四五六日天]|小时|分钟|钟头|凌晨|早上|早晨|上午|中午|下午|傍晚|晚上|夜里|半夜|深夜'
+    r'|今天|明天|后天|今晚|明晚|明早|今早')
+_INTENT_WORDS_RE = re.compile(r'提醒我一下|提醒一下|提醒我|提醒|通知我一下|通知我|定个?闹钟|设个?闹钟|闹钟')
+_LEADING_FILLER_RE = re.compile(r'^(?:请|麻烦你?|帮我|你|记得|到时候?|在|于|的时候|的|要|去|[，,。：:\s])+')
+_TRAILING_FILLER_RE = re.compile(r'(?:吧|哦|喔|噢|呀|啊|哈|啦|嘛|呢|的时候|一下|[～~！!。.，,\s])+$')
+
+_WEEKDAYS = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6,
+             '1': 0, '2': 1, '3': 2, '4': 3, '5': 4, '6': 5, '7': 6}
+_DAYWORDS = {'今天': 0, '今日': 0, '今儿': 0, '明天': 1, '明日': 1, '明儿': 1, '后天': 2, '大后天': 3}
+_DAYPERIODS = {'今晚': (0, '晚上'), '今夜': (0, '晚上'), '今早': (0, '早上'),
+               '明早': (1, '早上'), '明晚': (1, '晚上'), '明夜': (1, '晚上')}
+_DAILY_PERIODS = {'每晚': '晚上', '每夜': '晚上', '每早': '早上'}
+
+
+def chinese_to_number(text):
+    """把阿拉伯数字或中文数字（"十五"、"二十"、"一百零五"、"零五"、"两"）转为数值，无法识别时返回 None。"""
+    text = text.strip().translate(_FULLWIDTH)
+    if not text:
+        return None
+    if re.fullmatch(r'\d+', text):
+        return int(text)
+    if re.fullmatch(r'\d+\.\d+', text):
+        return float(text)
+    if not any(ch in _CN_UNITS for ch in text):
+        # 没有单位时按位读："二零二五" -> 2025
+        value = 0
+        for ch in text:
+            if ch not in _CN_DIGITS:
+                return None
+            value = value * 10 + _CN_DIGITS[ch]
+        return value
+    total, current = 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            current = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            total += (current or 1) * _CN_UNITS[ch]
+            current = 0
+        else:
+            return None
+    return total + current
+
+
+def _relative_seconds(text):
+    seconds = 0.0
+    for part in _REL_UNIT_PARTS.finditer(text):
+        num = part.group('num')
+        value = chinese_to_number(num) if num else (0 if part.group('half') else None)
+        if value is None:
+            return None
+        if part.group('half'):
+            value += 0.5
+        unit = part.group('unit')
+        if unit in ('小时', '钟头', '个钟'):
+            seconds += value * 3600
+        elif unit == '刻钟':
+            seconds += value * 900
+        elif unit in ('分钟', '分'):
+            seconds += value * 60
+        else:
+            seconds += value
+    return seconds
+
+
+def _apply_period(hour, period):
+    """按时段把 12 小时制的钟点换算为 24 小时制（可能得到 24，表示次日 0 点）。"""
+    if period in ('下午', '午后', '傍晚'):
+        return hour + 12 if hour < 12 else hour
+    if period in ('晚上', '夜里', '夜间', '深夜'):
+        if 5 <= hour <= 11:
+            return hour + 12
+        return 24 if hour == 12 else hour
+    if period == '中午':
+        return hour + 12 if hour < 6 else hour
+    if period in ('凌晨', '半夜'):
+        return 0 if hour == 12 else hour
+    return hour
+
+
+def _extract_message(residue):
+    message = _INTENT_WORDS_RE.sub('', residue)
+    message = _LEADING_FILLER_RE.sub('', message)
+    message = _TRAILING_FILLER_RE.sub('', message)
+    return message.strip()
+
+
+def _tokenize(text):
+    """找出所有时间说法，返回 ({种类: match}, 去掉时间说法后的文本)；同一种类出现两次时返回 (None, None)。"""
+    tokens = {}
+    pieces = []
+    last = 0
+    for match in _TOKEN_RE.finditer(text):
+        kind = next(name for name in ('rel_after', 'rel_before', 'days', 'dayperiod', 'dayword', 'weekday',
+                                      'iso_y', 'month', 'dom', 'daily', 'period', 'clock_h', 'hour')
+                    if match.group(name) is not None)
+        kind = {'rel_after': 'relative', 'rel_before': 'relative', 'days': 'date', 'dayperiod': 'date',
+                'dayword': 'date', 'weekday': 'date', 'iso_y': 'date', 'month': 'date', 'dom': 'date',
+                'clock_h': 'clock', 'hour': 'clock'}.get(kind, kind)
+        if kind in tokens:
+            return None, None
+        tokens[kind] = match
+        pieces.append(text[last:match.start()])
+        last = match.end()
+    pieces.append(text[last:])
+    return tokens, ''.join(pieces)
+
+
+def _resolve_date(match, today):
+    """日期说法对应的日期，以及由它带出的时段（"今晚" -> 晚上）；无效日期返回 (None, None)。"""
+    if match.group('days') is not None:
+        days = chinese_to_number(match.group('days'))
+        return (today + dt.timedelta(days=days), None) if isinstance(days, int) else (None, None)
+    if match.group('dayperiod') is not None:
+        offset, period = _DAYPERIODS[match.group('dayperiod')]
+        return today + dt.timedelta(days=offset), period
+    if match.group('dayword') is not None:
+        return today + dt.timedelta(days=_DAYWORDS[match.group('dayword')]), None
+    if match.group('weekday') is not None:
+        weekday = _WEEKDAYS[match.group('weekday')]
+        prefix = match.group('week_prefix') or ''
+        if prefix.startswith('下'):
+            days = 7 - today.weekday() + weekday
+        elif prefix:
+            days = weekday - today.weekday()
+            if days < 0:
+                return None, None
+        else:
+            days = (weekday - today.weekday()) % 7
+        return today + dt.timedelta(days=days), None
+    try:
+        if match.group('iso_y') is not None:
+            return dt.date(int(match.group('iso_y')), int(match.group('iso_m')), int(match.group('iso_d'))), None
+        if match.group('month') is not None:
+            month, mday = chinese_to_number(match.group('month')), chinese_to_number(match.group('mday'))
+            year = int(match.group('year')) if match.group('year') else today.year
+            date = dt.date(year, month, mday)
+            if date < today and not match.group('year'):
+                date = dt.date(year + 1, month, mday)
+            return date, None
+        mday = chinese_to_number(match.group('dom'))
+        year, month = today.year, today.month
+        if mday < today.day:
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return dt.date(year, month, mday), None
+    except (TypeError, ValueError):
+        return None, None
+
+
+def _resolve_clock(match):
+    """钟点说法对应的 (小时, 分钟)，无法识别时返回 None。"""
+    if match.group('clock_h') is not None:
+        return int(match.group('clock_h')), int(match.group('clock_m'))
+    hour = chinese_to_number(match.group('hour'))
+    if not isinstance(hour, int):
+        return None
+    if match.group('half'):
+        minute = 30
+    elif match.group('quarter'):
+        minute = 15
+    elif match.group('three_quarters'):
+        minute = 45
+    elif match.group('minute'):
+        minute = chinese_to_number(match.group('minute'))
+        if not isinstance(minute, int):
+            return None
+    else:
+        minute = 0
+    return hour, minute
+
+
+def _one_off(target, now, message):
+    delay = (target - now).total_seconds()
+    if 0 < delay <= SHORT_REMINDER_SECONDS:
+        return {"type": "one-off-short", "delay_seconds": max(1, int(round(delay))), "message": message}
+    return {"type": "one-off-long", "target_datetime_str": target.strftime('%Y-%m-%d %H:%M'), "message": message}
+
+
+def parse_reminder_text(text, now=None):
+    """解析提醒请求，返回与模型解析结果相同结构的字典；没有把握时返回 None。"""
+    if not text:
+        return None
+    now = now or dt.datetime.now()
+    text = text.translate(_FULLWIDTH).strip()
+    if len(text) > 100 or not _INTENT_RE.search(text) or _UNSURE_RE.search(text):
+        return None
+    tokens, residue = _tokenize(text)
+    if not tokens or _RESIDUE_TIME_RE.search(residue):
+        return None
+    message = _extract_message(residue)
+    if not re.search(r'\w', message):
+        return None
+
+    if 'relative' in tokens:
+        if len(tokens) > 1:
+            return None
+        match = tokens['relative']
+        seconds = _relative_seconds(match.group('rel_after') or match.group('rel_before'))
+        if not seconds or seconds <= 0:
+            return None
+        if seconds <= SHORT_REMINDER_SECONDS:
+            return {"type": "one-off-short", "delay_seconds": int(round(seconds)), "message": message}
+        target = now + dt.timedelta(seconds=seconds)
+        if target.second >= 30:
+            target += dt.timedelta(minutes=1)
+        return {"type": "one-off-long", "target_datetime_str": target.strftime('%Y-%m-%d %H:%M'), "message": message}
+
+    if 'clock' not in tokens:
+        return None  # 只有日期或时段（"明天早上叫我"），具体时间交给模型判断
+    clock = _resolve_clock(tokens['clock'])
+    if clock is None:
+        return None
+    hour, minute = clock
+    if not (0 <= hour <= 24 and 0 <= minute <= 59) or (hour == 24 and minute):
+        return None
+    # "一点"、"两点" 常见于"少吃一点"这类说法，没有时段、日期或分钟时不做本地解析
+    if tokens['clock'].group('hour') in ('一', '两') and len(tokens) == 1 and minute == 0:
+        return None
+
+    period = tokens['period'].group('period') if 'period' in tokens else None
+
+    if 'daily' in tokens:
+        if 'date' in tokens:
+            return None
+        daily_period = _DAILY_PERIODS.get(tokens['daily'].group('daily'))
+        if daily_period and period and daily_period != period:
+            return None
+        hour = _apply_period(hour, period or daily_period) % 24
+        return {"type": "recurring", "time_str": f"{hour:02d}:{minute:02d}", "message": message}
+
+    today = now.date()
+    if 'date' in tokens:
+        date, date_period = _resolve_date(tokens['date'], today)
+        if date is None or (date_period and period and date_period != period):
+            return None
+        period = period or date_period
+        if period is None and 1 <= hour <= 6:
+            return None  # "明天3点" 可能是凌晨也可能是下午
+        hour = _apply_period(hour, period)
+        target = dt.datetime.combine(date, dt.time(0, minute)) + dt.timedelta(hours=hour)
+        if date == today and target <= now and tokens['date'].group('weekday') is not None:
+            return None  # 当天的"周三"已经过了这个时间，可能指下周
+        return _one_off(target, now, message)
+
+    if period is None:
+        # 只说了钟点：上午和下午/晚上的同一钟点都可能，取其中最早到来的一个
+        hours = (hour, hour + 12) if 1 <= hour <= 11 else (hour,)
+    else:
+        hours = (_apply_period(hour, period),)
+    targets = []
+    for candidate in hours:
+        target = dt.datetime.combine(today, dt.time(0, minute)) + dt.timedelta(hours=candidate)
+        while target <= now:
+            target += dt.timedelta(days=1)
+        targets.append(target)
+    return _one_off(min(targets), now, message)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+消息发送调度器。
+
+每个聊天窗口有自己的待发送队列，由唯一的 UI 驱动线程按"就绪时间"轮流执行：
+某个聊天在模拟打字延迟时，其他聊天的分段可以先发出去，
+因此一条很长的多段回复不会再阻塞其他用户的回复。
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SendStep:
+    """
+    一个发送动作。
+
+    action: 无参可调用对象，在 UI 驱动线程中执行（发送一段文本、表情、拍一拍等）
+    delay_before: 执行前需要等待的秒数（如撤回前的等待）
+    delay_after: 执行后该聊天需要等待的秒数（模拟打字、动作间隔）
+    """
+
+    __slots__ = ('action', 'delay_before', 'delay_after', 'description')
+
+    def __init__(self, action, delay_before=0.0, delay_after=0.0, description=''):
+        self.action = action
+        self.delay_before = delay_before
+        self.delay_after = delay_after
+        self.description = description
+
+
+class SendScheduler:
+    """
+    按聊天分队列、由单线程驱动的发送调度器。
+
+    - 同一聊天内的动作严格按提交顺序执行，并保留各自的延迟；
+    - 不同聊天之间按就绪时间交错执行，总吞吐量随聊天数增长；
+    - 所有 UI 操作都在同一个线程中完成，避免并发操作微信窗口。
+    """
+
+    def __init__(self, name="SendScheduler"):
+        self.name = name
+        self._cond = threading.Condition()
+        self._queues = {}          # {chat: deque[SendStep]}
+        self._ready_heap = []      # [(ready_at, seq, chat)]，每个有待发送动作的聊天恰好一项
+        self._scheduled = set()    # 已在 _ready_heap 中的聊天
+        self._cooldown = {}        # {chat: 上一个动作结束后允许执行下一个动作的时间}
+        self._running_chat = None  # 正在执行动作的聊天
+        self._seq = itertools.count()
+        self._stop = False
+        self._thread = None
+
+        self.steps_executed = 0
+        self.steps_failed = 0
+
+    # --- 提交 ---
+    def submit(self, chat, steps):
+        """把一组动作追加到聊天的发送队列末尾，立即返回。"""
+        steps = [step for step in steps if step is not None]
+        if not steps:
+            return
+        with self._cond:
+            queue = self._queues.setdefault(chat, deque())
+            queue.extend(steps)
+            if chat not in self._scheduled and chat != self._running_chat:
+                self._schedule_locked(chat, time.monotonic())
+            self._cond.notify_all()
+
+    def _schedule_locked(self, chat, now):
+        queue = self._queues.get(chat)
+        if not queue:
+            self._queues.pop(chat, None)
+            return
+        ready_at = max(now, self._cooldown.get(chat, 0.0)) + queue[0].delay_before
+        heapq.heappush(self._ready_heap, (ready_at, next(self._seq), chat))
+        self._scheduled.add(chat)
+
+    # --- 驱动线程 ---
+    def _next_step(self):
+        """阻塞直到有聊天就绪，返回 (chat, step)；停止时返回 (None, None)。"""
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None, None
+                if not self._ready_heap:
+                    self._cond.wait()
+                    continue
+                ready_at, _, chat = self._ready_heap[0]
+                wait_time = ready_at - time.monotonic()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+                heapq.heappop(self._ready_heap)
+                self._scheduled.discard(chat)
+                step = self._queues[chat].popleft()
+                self._running_chat = chat
+                return chat, step
+
+    def _run(self):
+        logger.info("消息发送调度线程已启动。")
+        while True:
+            chat, step = self._next_step()
+            if step is None:
+                break
+            try:
+                step.action()
+                self.steps_executed += 1
+            except Exception as e:
+                self.steps_failed += 1
+                logger.error(f"向 {chat} 执行发送动作失败 ({step.description}): {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    now = time.monotonic()
+                    self._running_chat = None
+                    self._cooldown[chat] = now + step.delay_after
+                    if self._queues.get(chat):
+                        self._schedule_locked(chat, now)
+                    else:
+                        self._queues.pop(chat, None)
+                    # 清理已过期的冷却记录，避免字典无限增长
+                    if len(self._cooldown) > 256:
+                        self._cooldown = {c: t for c, t in self._cooldown.items() if t > now}
+                    self._cond.notify_all()
+        logger.info("消息发送调度线程已停止。")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            self._stop = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止驱动线程，尚未发送的动作会被丢弃。"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    # --- 状态 ---
+    def is_idle(self):
+        with self._cond:
+            return not self._ready_heap and self._running_chat is None
+
+    def wait_idle(self, timeout=None):
+        """等待所有已提交的动作发送完毕，超时返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._ready_heap or self._running_chat is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def pending_count(self, chat=None):
+        with self._cond:
+            if chat is not None:
+                return len(self._queues.get(chat, ()))
+            return sum(len(q) for q in self._queues.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending_steps': sum(len(q) for q in self._queues.values()),
+                'pending_chats': len(self._queues),
+                'steps_executed': self.steps_executed,
+                'steps_failed': self.steps_failed,
+            }
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+统一的定时器服务。
+
+所有短期定时任务（短期提醒、表情包防抖、延迟重启）共用一个线程和一个按到期时间排序的最小堆，
+取代每个任务一个 threading.Timer 线程的做法：
+    - schedule() 返回可取消的 TimerHandle；
+    - debounce() 按键替换尚未触发的同名任务；
+    - 按分组（如用户）维护计数，count(group) 为 O(1)；
+    - 通过 register_kind() 注册的任务可以持久化到 JSON 文件，重启后由 restore() 恢复；
+      restore() 之前不写文件，未启用恢复（如关闭提醒功能）时不会用空列表覆盖上次保存的任务。
+
+回调默认在定时器线程中执行，应尽量短小；可能阻塞的回调（调用 API、等待队列）使用 blocking=True，
+到期后在单独的线程中执行，不会拖延其他定时任务。
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """定时任务句柄，cancel() 取消尚未触发的任务。"""
+
+    __slots__ = ('id', 'due', 'fn', 'args', 'kwargs', 'group', 'key', 'kind', 'blocking',
+                 'cancelled', 'fired', '_service')
+
+    def __init__(self, service, timer_id, due, fn, args, kwargs, group=None, key=None, kind=None, blocking=False):
+        self._service = service
+        self.id = timer_id
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.group = group
+        self.key = key
+        self.kind = kind
+        self.blocking = blocking
+        self.cancelled = False
+        self.fired = False
+
+    @property
+    def active(self):
+        return not self.cancelled and not self.fired
+
+    def remaining(self):
+        return max(0.0, self.due - time.time())
+
+    def cancel(self):
+        return self._service.cancel(self)
+
+
+class TimerService:
+    """单线程、基于最小堆的定时器服务。时间使用 time.time()，以便持久化后重启继续计算。"""
+
+    def __init__(self, name="TimerService", persist_path=None):
+        self.name = name
+        self.persist_path = persist_path
+        self._cond = threading.Condition()
+        self._heap = []                # [(due, seq, handle)]
+        self._handles = {}             # {timer_id: handle}，未触发且未取消的任务
+        self._keyed = {}               # {key: handle}，debounce 使用
+        self._group_counts = Counter()  # {group: 未触发任务数}
+        self._kinds = {}               # {kind: (回调, blocking)}，可持久化的任务类型
+        self._restored = False         # restore() 执行后才写持久化文件
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._thread = None
+        self._stopped = False
+        self.fired_count = 0
+        self.cancelled_count = 0
+
+    # --- 注册与持久化 ---
+    def register_kind(self, kind, fn, blocking=False):
+        """
+        注册可持久化的任务类型，persisted 任务的 args 必须可 JSON 序列化。
+        blocking 用于 restore() 恢复的任务，应与 schedule() 时传入的一致。
+        """
+        self._kinds[kind] = (fn, blocking)
+
+    def _persist_locked(self):
+        if not self.persist_path or not self._restored:
+            return
+        records = [
+            {'kind': h.kind, 'due': h.due, 'group': h.group, 'args': list(h.args)}
+            for h in sorted(self._handles.values(), key=lambda h: h.due) if h.kind
+        ]
+        temp_path = self.persist_path + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(records, f, ensure_ascii=False, indent=4)
+            os.replace(temp_path, self.persist_path)
+        except Exception as e:
+            logger.error(f"保存待触发的定时任务失败: {e}", exc_info=True)
+
+    def restore(self, max_late=None, accept=None):
+        """
+        从持久化文件恢复任务，已过期的任务立即触发；
+        过期超过 max_late 秒的任务丢弃。accept(record) 返回 False 的任务也会被丢弃。
+        返回恢复的任务数。
+        """
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            with self._cond:
+                self._restored = True
+            return 0
+        try:
+            with open(self.persist_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            # 文件无法读取时保留原文件，本次运行不写入，以免覆盖
+            logger.error(f"读取待触发的定时任务失败: {e}")
+            return 0
+        now = time.time()
+        restored = 0
+        for record in records if isinstance(records, list) else []:
+            kind = record.get('kind') if isinstance(record, dict) else None
+            if kind not in self._kinds:
+                logger.warning(f"跳过未知类型的定时任务: {record}")
+                continue
+            due = float(record.get('due', now))
+            if max_late is not None and now - due > max_late:
+                logger.info(f"跳过过期太久的定时任务: {record}")
+                continue
+            if accept is not None and not accept(record):
+                continue
+            fn, blocking = self._kinds[kind]
+            self.schedule_at(due, fn, *record.get('args', []), group=record.get('group'), kind=kind,
+                             blocking=blocking)
+            restored += 1
+        with self._cond:
+            self._restored = True
+            self._persist_locked()
+        if restored:
+            logger.info(f"已恢复 {restored} 个待触发的定时任务。")
+        return restored
+
+    # --- 调度 ---
+    def schedule_at(self, due, fn, *args, group=None, key=None, kind=None, blocking=False, **kwargs):
+        with self._cond:
+            handle = TimerHandle(self, next(self._ids), due, fn, args, kwargs,
+                                 group=group, key=key, kind=kind, blocking=blocking)
+            if key is not None:
+                previous = self._keyed.get(key)
+                if previous is not None:
+                    self._cancel_locked(previous)
+                self._keyed[key] = handle
+            self._handles[handle.id] = handle
+            if group is not None:
+                self._group_counts[group] += 1
+            heapq.heappush(self._heap, (due, next(self._seq), handle))
+            if self._heap[0][2] is handle:
+                self._cond.notify_all()
+            if kind:
+                self._persist_locked()
+            return handle
+
+    def schedule(self, delay, fn, *args, **kwargs):
+        """delay 秒后执行 fn(*args)。关键字参数 group/key/kind/blocking 由服务使用，其余传给 fn。"""
+        return self.schedule_at(time.time() + max(0.0, float(delay)), fn, *args, **kwargs)
+
+    def debounce(self, key, delay, fn, *args, **kwargs):
+        """以 key 防抖：取消同一 key 尚未触发的任务，重新计时。"""
+        return self.schedule(delay, fn, *args, key=key, **kwargs)
+
+    def _release_locked(self, handle):
+        self._handles.pop(handle.id, None)
+        if handle.key is not None and self._keyed.get(handle.key) is handle:
+            del self._keyed[handle.key]
+        if handle.group is not None:
+            self._group_counts[handle.group] -= 1
+            if self._group_counts[handle.group] <= 0:
+                del self._group_counts[handle.group]
+
+    def _cancel_locked(self, handle):
+        if not handle.active:
+            return False
+        handle.cancelled = True
+        self._release_locked(handle)
+        self.cancelled_count += 1
+        return True
+
+    def cancel(self, handle):
+        with self._cond:
+            cancelled = self._cancel_locked(handle)
+            if cancelled and handle.kind:
+                self._persist_locked()
+            return cancelled
+
+    def cancel_group(self, group):
+        with self._cond:
+            handles = [h for h in self._handles.values() if h.group == group]
+            for handle in handles:
+                self._cancel_locked(handle)
+            if any(h.kind for h in handles):
+                self._persist_locked()
+            return len(handles)
+
+    # --- 状态 ---
+    def count(self, group=None, kind=None):
+        with self._cond:
+            if kind is not None:
+                return sum(1 for h in self._handles.values()
+                           if h.kind == kind and (group is None or h.group == group))
+            if group is None:
+                return len(self._handles)
+            return self._group_counts.get(group, 0)
+
+    def pending(self, kind=None):
+        with self._cond:
+            return [h for h in self._handles.values() if kind is None or h.kind == kind]
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._handles),
+                'groups': len(self._group_counts),
+                'heap_size': len(self._heap),
+                'fired': self.fired_count,
+                'cancelled': self.cancelled_count,
+            }
+
+    # --- 定时器线程 ---
+    def _next_due(self):
+        with self._cond:
+            while not self._stopped:
+                # 丢弃已取消的任务
+                while self._heap and not self._heap[0][2].active:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                due, _, handle = self._heap[0]
+                wait_time = due - time.time()
+                if wait_time > 0:
+                    self._cond.wait(wait_time)
+                    continue
+                heapq.heappop(self._heap)
+                handle.fired = True
+                self._release_locked(handle)
+                if handle.kind:
+                    self._persist_locked()
+                return handle
+            return None
+
+    def _invoke(self, handle):
+        try:
+            handle.fn(*handle.args, **handle.kwargs)
+        except Exception as e:
+            logger.error(f"{self.name} 执行定时任务 {getattr(handle.fn, '__name__', handle.fn)} 失败: {e}", exc_info=True)
+
+    def _run(self):
+        logger.info("定时器服务线程已启动。")
+        while True:
+            handle = self._next_due()
+            if handle is None:
+                break
+            self.fired_count += 1
+            if handle.blocking:
+                threading.Thread(target=self._invoke, args=(handle,), name=f"{self.name}-Task{handle.id}",
+                                 daemon=True).start()
+            else:
+                self._invoke(handle)
+        logger.info("定时器服务线程已停止。")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """停止定时器线程。可持久化的未触发任务保留在文件中（restore() 之后），下次启动时恢复。"""
+        with self._cond:
+            self._stopped = True
+            self._persist_locked()
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+按 token 预算组装对话上下文。
+
+- 估算：本地快速估算 token 数（中日韩等宽字符约 1 token/字，其余约 4 字符/token），
+  只用 str.encode 和长度计算，不依赖分词器；每条消息的结果按内容缓存，历史消息每轮不必重算；
+- 组装：系统提示词、核心记忆、当前消息和预留给回复的 token 先计入预算，
+  剩余部分从最新的历史消息开始往前填充，放不下时停止（不跳过中间的消息）；
+- 每次组装返回各部分的 token 明细，便于记录日志。
+"""
+
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# 每条消息除内容外的格式开销（角色、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+# messages 为要发送的消息列表；breakdown 为 BudgetBreakdown
+ContextPlan = namedtuple('ContextPlan', 'messages breakdown')
+
+BudgetBreakdown = namedtuple('BudgetBreakdown', [
+    'budget', 'reply_reserve', 'system', 'memory', 'history', 'history_messages', 'history_available',
+    'current', 'total', 'memory_dropped',
+])
+
+
+def estimate_text_tokens(text):
+    """估算一段文本的 token 数：中日韩字符约 1 token/字，其他字符约 4 字符/token。"""
+    if not text:
+        return 0
+    length = len(text)
+    if text.isascii():
+        return (length + 3) // 4
+    # UTF-8 下中日韩字符占 3 字节，比字符数多出的字节数的一半即为宽字符数
+    wide = (len(text.encode('utf-8', 'surrogatepass')) - length) // 2
+    return wide + (length - wide + 3) // 4
+
+
+def append_section(text, section):
+    """把一段内容接在 text 之后（空一行）。"""
+    if not section:
+        return text
+    if text.endswith('\n'):
+        return text + '\n' + section
+    return text + '\n\n' + section
+
+
+def message_content_text(message):
+    """消息的文本内容（多模态消息只取文本部分）。"""
+    content = message.get('content') if isinstance(message, dict) else None
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content if isinstance(content, str) else ''
+
+
+class TokenCounter:
+    """带缓存的 token 计数器（线程安全）：按文本内容缓存估算结果，最近最少使用的先淘汰。"""
+
+    def __init__(self, max_entries=4096, min_cached_length=32):
+        self.max_entries = max_entries
+        self.min_cached_length = min_cached_length  # 短文本直接计算，不占用缓存
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text):
+        if not text:
+            return 0
+        if len(text) < self.min_cached_length:
+            return estimate_text_tokens(text)
+        with self._lock:
+            tokens = self._cache.get(text)
+            if tokens is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = estimate_text_tokens(text)
+        with self._lock:
+            self._cache[text] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+    def count_message(self, message):
+        return self.count(message_content_text(message)) + MESSAGE_OVERHEAD
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def build_context(counter, system_prompt, memory_prompt, history, message, budget, reply_reserve=0,
+                  max_history_messages=None):
+    """
+    按预算组装发送给模型的消息列表，返回 ContextPlan。
+
+    系统提示词和当前消息总是发送；核心记忆放不下时整段省略；历史消息从最新的开始往前填充，
+    至多 max_history_messages 条。budget 为整个请求的上限（包括预留给回复的 reply_reserve）。
+    """
+    system_tokens = counter.count(system_prompt) + MESSAGE_OVERHEAD
+    current_tokens = counter.count(message) + MESSAGE_OVERHEAD
+    remaining = budget - reply_reserve - system_tokens - current_tokens
+
+    memory_tokens = counter.count(memory_prompt) if memory_prompt else 0
+    memory_dropped = False
+    if memory_tokens and memory_tokens > remaining:
+        memory_dropped = True
+        memory_tokens = 0
+        memory_prompt = ''
+    remaining -= memory_tokens
+
+    available = len(history)
+    candidates = history
+    if max_history_messages is not None:
+        candidates = history[-max_history_messages:] if max_history_messages > 0 else []
+    selected_start = len(candidates)
+    history_tokens = 0
+    for position in range(len(candidates) - 1, -1, -1):
+        tokens = counter.count_message(candidates[position])
+        if tokens > remaining - history_tokens:
+            break
+        history_tokens += tokens
+        selected_start = position
+    selected = candidates[selected_start:]
+
+    messages = [{"role": "system", "content": append_section(system_prompt, memory_prompt)}]
+    messages.extend(selected)
+    messages.append({"role": "user", "content": message})
+
+    total = system_tokens + memory_tokens + history_tokens + current_tokens + reply_reserve
+    breakdown = BudgetBreakdown(budget, reply_reserve, system_tokens, memory_tokens, history_tokens,
+                                len(selected), available, current_tokens, total, memory_dropped)
+    return ContextPlan(messages, breakdown)
+
+
+def format_breakdown(breakdown):
+    """预算明细的日志文本。"""
+    text = (f"系统提示词 {breakdown.system} + 记忆 {breakdown.memory} + "
+            f"历史 {breakdown.history}（{breakdown.history_messages}/{breakdown.history_available} 条） + "
+            f"当前消息 {breakdown.current} + 预留回复 {breakdown.reply_reserve} = "
+            f"{breakdown.total}/{breakdown.budget} tokens")
+    if breakdown.memory_dropped:
+        text += "，核心记忆超出预算已省略"
+    if breakdown.total > breakdown.budget:
+        text += "，超出预算（系统提示词和当前消息无法裁剪）"
+    return text
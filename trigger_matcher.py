@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+消息触发词匹配：群聊关键词、提醒关键词和 @机器人 一次扫描全部找出。
+
+所有触发词编译成一个 Aho-Corasick 自动机，扫描一遍消息即可得到每个触发词（包括相互重叠的）
+出现的位置，耗时只与消息长度有关，与触发词数量无关。触发词不多时先用它们组成的正则（C 实现）
+做一次快速检查：大多数群聊消息不含任何触发词，这时不进入逐字符的自动机扫描；
+触发词很多时正则的耗时随数量增长，不再做这项检查。
+配置（关键词列表、机器人昵称）变化时 configure() 自动重建。
+"""
+
+import logging
+import re
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_KEYWORD = 'keyword'
+TRIGGER_REMINDER = 'reminder'
+TRIGGER_MENTION = 'mention'
+
+# @机器人 的三种写法，优先级与原逻辑一致：后跟特殊空格 \u2005 > 后跟普通空格 > 整条消息只有 @机器人
+MENTION_UNICODE = 'unicode'
+MENTION_SPACE = 'space'
+MENTION_BARE = 'bare'
+
+# 触发词（含 @ 的三种写法）不超过这个数量时使用正则快速检查
+PREFILTER_MAX_PATTERNS = 64
+
+# kind 为触发类型；value 为匹配到的关键词，@ 为 MENTION_* 写法；[start, end) 为在消息中的位置
+TriggerMatch = namedtuple('TriggerMatch', 'kind value start end')
+
+
+class AhoCorasick:
+    """多模式串匹配自动机（构建后只读，可多线程共享）。"""
+
+    def __init__(self, patterns):
+        """patterns: 可迭代的 (模式串, 值)，同一模式串可以对应多个值。"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for pattern, value in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for ch in pattern:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((len(pattern), value))
+        # 广度优先计算失败指针，并把失败链上的输出合并进来
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    @property
+    def size(self):
+        return len(self._goto)
+
+    def finditer(self, text, start=0):
+        """依次产出 (start, end, 值)，按结束位置排序。"""
+        goto, fail, output = self._goto, self._fail, self._output
+        root = goto[0]
+        node = 0
+        for index, ch in enumerate(text[start:] if start else text, start):
+            if node:
+                while node and ch not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(ch, 0)
+            else:
+                node = root.get(ch, 0)
+            if node and output[node]:
+                for length, value in output[node]:
+                    yield index - length + 1, index + 1, value
+
+
+class TriggerHits:
+    """一条消息的匹配结果。"""
+
+    def __init__(self, text, matches, mention=None):
+        self.text = text
+        self.matches = matches
+        self._mention = mention
+
+    def of(self, kind):
+        return [match for match in self.matches if match.kind == kind]
+
+    def has(self, kind):
+        return any(match.kind == kind for match in self.matches)
+
+    def mention_span(self):
+        """
+        要移除的 @机器人 的位置 (start, end)：第一个后跟 \u2005 的，其次第一个后跟空格的，
+        再次整条消息（去掉首尾空白）只有 @机器人 时的那一处；都没有时返回 None。
+        """
+        mentions = self.of(TRIGGER_MENTION)
+        for variant in (MENTION_UNICODE, MENTION_SPACE):
+            for match in mentions:
+                if match.value == variant:
+                    return match.start, match.end
+        if self._mention and self.text.strip() == self._mention:
+            for match in mentions:
+                if match.value == MENTION_BARE:
+                    return match.start, match.end
+        return None
+
+    def without(self, span):
+        """去掉 span 位置的文本后的结果：与 span 重叠的匹配被丢弃，之后的位置前移。"""
+        if span is None:
+            return self
+        start, end = span
+        removed = end - start
+        matches = []
+        for match in self.matches:
+            if match.end <= start:
+                matches.append(match)
+            elif match.start >= end:
+                matches.append(match._replace(start=match.start - removed, end=match.end - removed))
+        return TriggerHits(self.text[:start] + self.text[end:], matches, self._mention)
+
+
+class TriggerEngine:
+    """
+    预编译的触发词匹配器（线程安全）。
+
+    configure() 传入当前配置，与上次相同时直接返回，否则重建自动机；scan() 返回 TriggerHits。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config_key = None
+        self._compiled = (None, None, None)  # (自动机, 快速检查正则, "@机器人")，整体替换以便扫描时无锁读取
+        self.builds = 0
+        self.scans = 0
+        self.hits = 0
+
+    def configure(self, keywords=(), reminder_keywords=(), robot_name=None):
+        key = (tuple(keywords or ()), tuple(reminder_keywords or ()), robot_name or '')
+        if key == self._config_key:
+            return
+        patterns = [(keyword, (TRIGGER_KEYWORD, keyword)) for keyword in key[0] if keyword]
+        patterns += [(keyword, (TRIGGER_REMINDER, keyword)) for keyword in key[1] if keyword]
+        mention = f"@{robot_name}" if robot_name else None
+        if mention:
+            patterns += [(mention + '\u2005', (TRIGGER_MENTION, MENTION_UNICODE)),
+                         (mention + ' ', (TRIGGER_MENTION, MENTION_SPACE)),
+                         (mention, (TRIGGER_MENTION, MENTION_BARE))]
+        automaton = AhoCorasick(patterns)
+        prefilter = None
+        literals = {pattern for pattern, _ in patterns}
+        if literals and len(literals) <= PREFILTER_MAX_PATTERNS:
+            prefilter = re.compile('|'.join(re.escape(pattern) for pattern in literals))
+        with self._lock:
+            self._config_key = key
+            self._compiled = (automaton, prefilter, mention)
+            self.builds += 1
+        logger.info(f"触发词匹配器已重建：关键词 {len(key[0])} 个，提醒词 {len(key[1])} 个，"
+                    f"自动机节点 {automaton.size} 个。")
+
+    def scan(self, text):
+        automaton, prefilter, mention = self._compiled
+        text = text or ''
+        matches = []
+        # 正则找到的是最左边的一处触发词，自动机从那里开始扫描即可
+        first = prefilter.search(text) if prefilter is not None else None
+        if automaton is not None and text and (prefilter is None or first is not None):
+            matches = [TriggerMatch(kind, value, start, end)
+                       for start, end, (kind, value) in automaton.finditer(text, first.start() if first else 0)]
+            if len(matches) > 1:
+                matches.sort(key=lambda match: (match.start, match.end))
+        with self._lock:
+            self.scans += 1
+            if matches:
+                self.hits += 1
+        return TriggerHits(text, matches, mention)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'builds': self.builds,
+                'scans': self.scans,
+                'with_trigger': self.hits,
+                'automaton_nodes': self._compiled[0].size if self._compiled[0] else 0,
+            }
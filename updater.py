@@ -56,7 +56,11 @@ class Updater:
         "emojis",      # 表情包
         "forum_data",  # 论坛数据
         "recurring_reminders.json",  # 定时提醒
-        "chat_contexts.json", # 聊天上下文文件
+        "recurring_reminders.json.journal",  # 定时提醒日志（触发记录）
+        "short_reminders.json",  # 待触发的短期提醒
+        "recognition_cache.json",  # 图片识别结果缓存
+        "chat_contexts.json", # 聊天上下文文件（旧版）
+        "chat_contexts", # 聊天上下文日志文件夹
         "config.py",    # 配置文件(单独处理)
         "数据备份",  # 数据备份
         ".git",        # Git仓库文件（避免权限问题）
@@ -390,7 +394,8 @@ class Updater:
                 "emojis", 
                 "forum_data",
                 "CoreMemory",
-                "Memory_Temp"
+                "Memory_Temp",
+                "chat_contexts"
             ]
             
             backed_up_items = []
@@ -0,0 +1,704 @@
+# -*- coding: utf-8 -*-
+
+# ***********************************************************************
+# Modified based on the KouriChat project
+# Copyright of this modification: Copyright (C) 2025, iwyxdxl
+# Licensed under GNU GPL-3.0 or higher, see the LICENSE file for details.
+#
+# This file is part of WeChatBot, which includes modifications to the KouriChat project.
+# The original KouriChat project's copyright and license information are preserved in the LICENSE file.
+# For any further details regarding the license, please refer to the LICENSE file.
+# ***********************************************************************
+
+"""
+链接内容抓取层。
+
+- 所有抓取共用一个 requests.Session 和连接池，同一站点的后续请求复用 TCP/TLS 连接；
+- 按 URL 缓存提取后的正文，TTL 到期后淘汰（服务器 Cache-Control: max-age 更短时以其为准，no-store 不缓存）；
+- 过期条目若有 ETag / Last-Modified，则发送条件请求，304 时直接续用缓存的正文；
+- 同一 URL 同时被多次请求时只抓取一次，其余请求等待结果（热门链接被多人同时分享时）。
+
+正文提取是流式的：响应体按块读取并直接送入 lxml 的增量解析器，下载字节数有上限（max_bytes），
+正文容器（article、main、.main-content、#content、.post-content）收集到足够的字符后立即停止下载，
+没有这些容器时读到字节上限为止并使用 body 的文本。不再把整页读入内存，也不再构建完整的 BeautifulSoup 树。
+
+SSRF 防护：首次请求和每次跳转前都检查协议、端口和域名解析出的全部地址，任何一个是内网/特殊地址即拒绝。
+域名解析结果由 DNSCache 缓存（含解析失败的负缓存）；PinnedAddressAdapter 让连接直接使用检查过的 IP，
+urllib3 不再自行解析域名，检查之后 DNS 记录被改成内网地址（DNS rebinding）也无法绕过。
+"""
+
+import codecs
+import ipaddress
+import logging
+import re
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+from requests.utils import select_proxy
+
+logger = logging.getLogger(__name__)
+
+# 正文容器，按优先级从高到低排列（与原 select_one 选择器顺序一致），最后是 body 和整个文档
+# 每种选择器只取文档中第一个匹配的元素
+CONTENT_CONTAINERS = ('article', 'main', '.main-content', '#content', '.post-content', 'body', '*')
+_BODY = CONTENT_CONTAINERS.index('body')
+_DOCUMENT = len(CONTENT_CONTAINERS) - 1
+# BeautifulSoup 的 get_text 同样不包含这些标签中的文本
+_SKIPPED_TAGS = frozenset(('script', 'style', 'template'))
+# 未提供 charset 时在页面开头查找 <meta charset>，需要先缓存的字节数
+_SNIFF_BYTES = 2048
+
+_MAX_AGE_PATTERN = re.compile(r'max-age\s*=\s*(\d+)', re.IGNORECASE)
+_HEADER_CHARSET_PATTERN = re.compile(r'charset\s*=\s*["\']?([\w\-]+)', re.IGNORECASE)
+_META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([A-Za-z0-9_\-]+)', re.IGNORECASE)
+
+
+class UnsafeURLError(requests.exceptions.RequestException):
+    """URL 或跳转目标未通过安全检查。"""
+
+
+def _normalize_encoding(name):
+    try:
+        name = codecs.lookup(name).name
+    except (LookupError, TypeError):
+        return None
+    # GB2312/GBK 页面中常混有其超集 GB18030 的字符
+    return 'gb18030' if name in ('gb2312', 'gbk') else name
+
+
+def header_encoding(content_type):
+    """只采用 Content-Type 中显式给出的 charset（不使用 HTTP 默认的 ISO-8859-1）。"""
+    match = _HEADER_CHARSET_PATTERN.search(content_type or '')
+    return _normalize_encoding(match.group(1)) if match else None
+
+
+def _container_indexes(tag, attrib):
+    indexes = []
+    if tag == 'article':
+        indexes.append(0)
+    elif tag == 'main':
+        indexes.append(1)
+    elif tag == 'body':
+        indexes.append(_BODY)
+    classes = attrib.get('class')
+    if classes:
+        classes = classes.split()
+        if 'main-content' in classes:
+            indexes.append(2)
+        if 'post-content' in classes:
+            indexes.append(4)
+    if attrib.get('id') == 'content':
+        indexes.append(3)
+    return indexes
+
+
+class StreamingTextExtractor:
+    """
+    增量解析 HTML 并按容器收集文本（lxml 解析器 target 接口）。
+
+    feed(chunk) 返回 True 表示已收集到足够的正文，可以停止读取；result() 结束解析并返回提取的文本。
+    提取规则与原先的 BeautifulSoup 实现一致：在已读取的部分中优先取最高优先级容器的文本，
+    各文本节点去除首尾空白后以换行连接，并移除空行。
+    max_chars <= 0 表示读完整个文档。
+    """
+
+    def __init__(self, max_chars=2000, encoding=None):
+        self.max_chars = max_chars
+        self.encoding = encoding
+        self.bytes_fed = 0
+        self._parser = None
+        self._prefix = []
+        self._prefix_size = 0
+        self._stack = []                        # 每个打开的元素在此打开的容器序号
+        self._skip_depth = 0
+        self._started = [False] * len(CONTENT_CONTAINERS)
+        self._open = [False] * len(CONTENT_CONTAINERS)
+        self._open[_DOCUMENT] = True
+        self._texts = [[] for _ in CONTENT_CONTAINERS]
+        self._chars = [0] * len(CONTENT_CONTAINERS)
+        self._pending = []                      # 当前文本节点的片段
+        self.done = False
+
+    # --- lxml target 接口 ---
+    def start(self, tag, attrib):
+        self._flush()
+        opened = []
+        if isinstance(tag, str):
+            if tag in _SKIPPED_TAGS:
+                self._skip_depth += 1
+            for index in _container_indexes(tag, attrib):
+                if not self._started[index]:
+                    self._started[index] = True
+                    self._open[index] = True
+                    opened.append(index)
+        self._stack.append((tag, opened))
+
+    def end(self, tag):
+        self._flush()
+        if not self._stack:
+            return
+        start_tag, opened = self._stack.pop()
+        if start_tag in _SKIPPED_TAGS:
+            self._skip_depth -= 1
+        for index in opened:
+            self._open[index] = False
+
+    def data(self, text):
+        if not self._skip_depth:
+            self._pending.append(text)
+
+    def close(self):
+        self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = ''.join(self._pending).strip()
+        self._pending = []
+        if not text:
+            return
+        limit = self.max_chars
+        for index, is_open in enumerate(self._open):
+            if is_open and (limit <= 0 or self._chars[index] < limit):
+                self._texts[index].append(text)
+                self._chars[index] += len(text) + 1
+        if limit > 0:
+            # 只有正文容器收集够时才提前停止；只有 body 文本时继续读取，后面可能还会出现正文容器
+            best = self._best_index()
+            self.done = best is not None and best < _BODY and self._chars[best] >= limit
+
+    def _best_index(self):
+        for index, chars in enumerate(self._chars):
+            if chars:
+                return index
+        return None
+
+    # --- 输入 ---
+    def _start_parser(self):
+        data = b''.join(self._prefix)
+        self._prefix = []
+        encoding = self.encoding
+        if encoding is None:
+            match = _META_CHARSET_PATTERN.search(data[:_SNIFF_BYTES])
+            encoding = _normalize_encoding(match.group(1).decode('ascii')) if match else None
+        self._parser = etree.HTMLParser(target=self, encoding=encoding or 'utf-8')
+        if data:
+            self._parser.feed(data)
+
+    def feed(self, chunk):
+        if not chunk or self.done:
+            return self.done
+        self.bytes_fed += len(chunk)
+        if self._parser is None:
+            self._prefix.append(chunk)
+            self._prefix_size += len(chunk)
+            if self._prefix_size < _SNIFF_BYTES:
+                return False
+            self._start_parser()
+        else:
+            self._parser.feed(chunk)
+        return self.done
+
+    def result(self):
+        """结束解析并返回提取的文本（可能为空字符串）。"""
+        if self._parser is None:
+            self._start_parser()
+        try:
+            self._parser.close()
+        except etree.LxmlError as e:
+            logger.debug(f"HTML 解析结束时出错（已忽略）: {e}")
+        self._flush()
+        best = self._best_index()
+        if best is None:
+            return ''
+        text = '\n'.join(self._texts[best])
+        return '\n'.join(line for line in text.splitlines() if line.strip())
+
+
+def extract_text_from_chunks(chunks, max_chars=2000, max_bytes=1024 * 1024, encoding=None):
+    """
+    从字节块迭代器中流式提取正文。
+    返回 (文本, 读取的字节数, 是否提前停止)；提前停止指正文已足够或达到 max_bytes。
+    """
+    extractor = StreamingTextExtractor(max_chars=max_chars, encoding=encoding)
+    stopped = False
+    for chunk in chunks:
+        if extractor.feed(chunk) or (max_bytes and extractor.bytes_fed >= max_bytes):
+            stopped = True
+            break
+    return extractor.result(), extractor.bytes_fed, stopped
+
+
+def is_public_address(address):
+    """地址不是私有、回环、链路本地（含云元数据服务 169.254.x.x）、保留、组播或未指定地址时返回 True。"""
+    ip = ipaddress.ip_address(address.split('%', 1)[0])  # 去掉 IPv6 的 zone id
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return not (ip.is_private or ip.is_loopback or ip.is_link_local or
+                ip.is_reserved or ip.is_multicast or ip.is_unspecified)
+
+
+class DNSCache:
+    """
+    线程安全的域名解析缓存。
+
+    resolve(host) 返回该域名的全部 A/AAAA 地址（按系统解析顺序去重）；
+    成功结果缓存 ttl 秒，解析失败缓存 negative_ttl 秒（期间直接抛出 socket.gaierror）。
+    IP 字面量不经过缓存。
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_entries=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # {host: (expires_at, addresses 或 None, 错误信息)}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+
+    def resolve(self, host):
+        host = host.strip('[]').lower()
+        try:
+            ipaddress.ip_address(host.split('%', 1)[0])
+            return [host]
+        except ValueError:
+            pass
+
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(host)
+            if cached is not None and cached[0] > now:
+                self._entries.move_to_end(host)
+                if cached[1] is None:
+                    self.negative_hits += 1
+                    raise socket.gaierror(cached[2])
+                self.hits += 1
+                return list(cached[1])
+
+        started = time.monotonic()
+        try:
+            infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+            addresses = list(OrderedDict.fromkeys(info[4][0] for info in infos))
+            if not addresses:
+                raise socket.gaierror(f"{host} 没有可用的地址")
+            entry = (time.monotonic() + self.ttl, tuple(addresses), None)
+        except socket.gaierror as e:
+            addresses = None
+            entry = (time.monotonic() + self.negative_ttl, None, str(e))
+            error = e
+        finally:
+            elapsed = time.monotonic() - started
+
+        with self._lock:
+            self.misses += 1
+            self.lookup_seconds += elapsed
+            self._entries[host] = entry
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if addresses is None:
+            raise error
+        return addresses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'lookup_seconds': round(self.lookup_seconds, 3),
+            }
+
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """
+    连接时使用 address_picker(hostname) 返回的 IP，而不是让 urllib3 再解析一次域名。
+    Host 头保持原域名，HTTPS 仍按原域名做 SNI 和证书校验；连接池按 (IP, 域名) 复用连接。
+    请求走代理时由代理解析域名，不做固定。
+    """
+
+    def __init__(self, address_picker, **kwargs):
+        self._address_picker = address_picker
+        super().__init__(**kwargs)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if not select_proxy(request.url, proxies) and 'Host' not in request.headers:
+            # 复制后再加 Host 头，避免跳转时把原域名的 Host 头带到新请求中
+            request = request.copy()
+            request.headers['Host'] = urlparse(request.url).netloc.rpartition('@')[2]
+        return super().send(request, stream=stream, timeout=timeout, verify=verify, cert=cert, proxies=proxies)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        if select_proxy(request.url, proxies):
+            return super().get_connection_with_tls_context(request, verify, proxies=proxies, cert=cert)
+        host_params, pool_kwargs = self.build_connection_pool_key_attributes(request, verify, cert)
+        hostname = host_params['host']
+        host_params['host'] = self._address_picker(hostname)
+        if host_params['scheme'] == 'https':
+            pool_kwargs['server_hostname'] = hostname
+            pool_kwargs['assert_hostname'] = hostname
+        return self.poolmanager.connection_from_host(**host_params, pool_kwargs=pool_kwargs)
+
+
+def _cache_lifetime(response, default_ttl):
+    """根据响应头计算缓存时长；返回 0 表示不缓存。"""
+    cache_control = response.headers.get('Cache-Control', '')
+    if 'no-store' in cache_control.lower():
+        return 0
+    match = _MAX_AGE_PATTERN.search(cache_control)
+    if match:
+        return min(default_ttl, int(match.group(1)))
+    return default_ttl
+
+
+class _CacheEntry:
+    __slots__ = ('text', 'etag', 'last_modified', 'expires_at', 'limit', 'hits')
+
+    def __init__(self, text, etag, last_modified, expires_at, limit=None):
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+        self.limit = limit  # 提前停止提取时的字符数上限；None 表示是完整正文
+        self.hits = 0
+
+    def covers(self, max_length):
+        return self.limit is None or (0 < max_length <= self.limit)
+
+
+class _InFlight:
+    """同一 URL 正在进行的抓取，其他请求等待 done 后直接使用 text。"""
+
+    __slots__ = ('done', 'text')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+
+
+class WebFetcher:
+    """
+    带连接池与正文缓存的网页抓取器（线程安全）。
+
+    fetch_text(url, ...) 返回提取后的正文（不超过 max_length 字符，截断时带省略号），
+    失败、非 HTML 或没有正文时返回 None。
+    """
+
+    def __init__(self, cache_ttl=1800, max_entries=500, max_cached_text=20000,
+                 max_bytes=1024 * 1024, chunk_size=16 * 1024, pool_maxsize=10, max_redirects=5,
+                 resolver=None, allowed_ports=(80, 443, 8080, 8443), max_url_length=2048,
+                 allow_private_addresses=False):
+        self.resolver = resolver or DNSCache()
+        self.allowed_ports = allowed_ports      # None 表示不限制端口
+        self.max_url_length = max_url_length
+        self.allow_private_addresses = allow_private_addresses  # 仅用于本地测试
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self.max_cached_text = max_cached_text  # 不限制长度时缓存的正文上限
+        self.max_bytes = max_bytes              # 每个页面最多下载的字节数
+        self.chunk_size = chunk_size
+
+        self.session = requests.Session()
+        self.session.max_redirects = max_redirects
+        self._adapter = PinnedAddressAdapter(self._pinned_address, pool_connections=20, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', self._adapter)
+        self.session.mount('https://', self._adapter)
+        self.session.hooks['response'].append(self._check_redirect_safety)
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # {url: _CacheEntry}，按最近使用排序
+        self._inflight = {}          # {url: _InFlight}，正在抓取的 URL
+
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.requests = 0
+        self.errors = 0
+        self.bytes_downloaded = 0
+        self.early_stops = 0
+
+    # --- 安全检查 ---
+    def _resolve_checked(self, hostname):
+        """解析域名并检查全部地址，返回地址列表；不安全时抛出 UnsafeURLError。"""
+        addresses = self.resolver.resolve(hostname)
+        if not self.allow_private_addresses:
+            for address in addresses:
+                if not is_public_address(address):
+                    raise UnsafeURLError(f"禁止访问内网/特殊地址: {hostname} -> {address}")
+        return addresses
+
+    def _pinned_address(self, hostname):
+        """供 PinnedAddressAdapter 使用：返回经过检查的第一个地址。"""
+        try:
+            return self._resolve_checked(hostname)[0]
+        except socket.gaierror as e:
+            raise requests.exceptions.ConnectionError(f"域名无法解析: {hostname}, 错误: {e}")
+
+    def is_safe_url(self, url):
+        """
+        验证URL是否安全，防止SSRF攻击。
+        只允许 HTTP/HTTPS、常见端口和长度合理的 URL，且域名解析出的所有地址都不能是内网/特殊地址。
+        """
+        try:
+            parsed = urlparse(url)
+
+            # 1. 只允许HTTP和HTTPS协议
+            if parsed.scheme not in ['http', 'https']:
+                logger.warning(f"不允许的协议: {parsed.scheme}")
+                return False
+
+            # 2. 获取主机名
+            hostname = parsed.hostname
+            if not hostname:
+                logger.warning("URL中没有主机名")
+                return False
+
+            # 3. 端口限制（只允许常见的HTTP/HTTPS端口）
+            port = parsed.port
+            if port and self.allowed_ports is not None and port not in self.allowed_ports:
+                logger.warning(f"不允许的端口: {port}, 仅允许: {list(self.allowed_ports)}")
+                return False
+
+            # 4. URL长度限制
+            if len(url) > self.max_url_length:
+                logger.warning(f"URL过长: {len(url)} 字符")
+                return False
+
+            # 5. 解析IP地址并检查是否为内网地址（解析结果有缓存）
+            try:
+                self._resolve_checked(hostname)
+            except socket.gaierror:
+                logger.warning(f"域名无法解析: {hostname}")
+                return False
+            except UnsafeURLError as e:
+                logger.warning(str(e))
+                return False
+            except ValueError as e:
+                logger.warning(f"IP地址格式错误: {hostname}, 错误: {e}")
+                return False
+
+            return True
+
+        except Exception as e:
+            logger.error(f"URL安全验证失败: {url}, 错误: {e}")
+            return False
+
+    def _check_redirect_safety(self, response, *args, **kwargs):
+        """在每次跳转前验证目标 URL 的安全性。"""
+        if response.is_redirect:
+            absolute_redirect = urljoin(response.url, response.headers.get('Location', ''))
+            if not self.is_safe_url(absolute_redirect):
+                logger.warning(f"跳转目标不安全，已阻止: {response.url} -> {absolute_redirect}")
+                raise UnsafeURLError(f"不安全的跳转目标: {absolute_redirect}")
+            logger.debug(f"安全跳转: {response.url} -> {absolute_redirect}")
+
+    # --- 缓存 ---
+    def _get_entry_locked(self, url):
+        entry = self._cache.get(url)
+        if entry is not None:
+            self._cache.move_to_end(url)
+        return entry
+
+    def _store_locked(self, url, entry):
+        self._cache[url] = entry
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _purge_expired_locked(self, now):
+        # 只淘汰没有校验信息的过期条目；带 ETag/Last-Modified 的条目留着做条件请求
+        expired = [url for url, e in self._cache.items()
+                   if e.expires_at <= now and not (e.etag or e.last_modified)]
+        for url in expired:
+            del self._cache[url]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    # --- 抓取 ---
+    def fetch_text(self, url, timeout=10, max_length=2000, user_agent=None):
+        parsed_url = urlparse(url)
+        if not all([parsed_url.scheme, parsed_url.netloc]):
+            logger.warning(f"无效的URL格式，跳过抓取: {url}")
+            return None
+
+        with self._lock:
+            entry = self._get_entry_locked(url)
+            if entry is not None and not entry.covers(max_length):
+                entry = None  # 缓存的正文比这次需要的短，重新抓取
+            if entry is not None and entry.expires_at > time.time():
+                entry.hits += 1
+                self.hits += 1
+                logger.info(f"链接内容命中缓存: {url}")
+                return self._truncate(entry.text, max_length)
+            flight = self._inflight.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[url] = _InFlight()
+
+        if not leader:
+            # 其他线程正在抓取同一 URL，直接使用其结果；等待超时则自行抓取
+            if flight.done.wait(timeout + 1):
+                if not flight.text:
+                    return None
+                with self._lock:
+                    self.hits += 1
+                return self._truncate(flight.text, max_length)
+
+        text = None
+        try:
+            # 只有真正发起请求时才做安全检查（需要解析域名），缓存命中无需访问网络
+            if not self.is_safe_url(url):
+                logger.warning(f"URL安全检查失败，拒绝访问: {url}")
+                return None
+            text = self._fetch_and_cache(url, entry, timeout, user_agent, max_length)
+        finally:
+            if leader:
+                flight.text = text
+                with self._lock:
+                    del self._inflight[url]
+                flight.done.set()
+        return self._truncate(text, max_length) if text else None
+
+    def _fetch_and_cache(self, url, entry, timeout, user_agent, max_length):
+        headers = {}
+        if user_agent:
+            headers['User-Agent'] = user_agent
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        logger.info(f"开始抓取链接内容: {url}" + (" (条件请求)" if entry is not None else ""))
+        with self._lock:
+            self.requests += 1
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout, allow_redirects=True, verify=True,
+                                        stream=True)
+        except requests.exceptions.Timeout:
+            logger.error(f"抓取链接超时 ({timeout}秒): {url}")
+            with self._lock:
+                self.errors += 1
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"抓取链接时发生网络错误: {url}, 错误: {e}")
+            with self._lock:
+                self.errors += 1
+            return None
+
+        # 提前停止时未读完的连接不会放回连接池
+        with response:
+            return self._read_response(url, entry, response, timeout, max_length)
+
+    def _read_response(self, url, entry, response, timeout, max_length):
+        try:
+            now = time.time()
+            if response.status_code == 304 and entry is not None:
+                lifetime = _cache_lifetime(response, self.cache_ttl) or self.cache_ttl
+                with self._lock:
+                    entry.expires_at = now + lifetime
+                    entry.hits += 1
+                    self.revalidated += 1
+                    self._store_locked(url, entry)
+                logger.info(f"链接内容未变化 (304)，使用缓存: {url}")
+                return entry.text
+            response.raise_for_status()
+
+            content_type = response.headers.get('Content-Type', '').lower()
+            if 'html' not in content_type:
+                logger.warning(f"链接内容类型非HTML ({content_type})，跳过文本提取: {url}")
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            limit = max_length if max_length and max_length > 0 else self.max_cached_text
+            text, bytes_read, stopped = extract_text_from_chunks(
+                response.iter_content(chunk_size=self.chunk_size),
+                max_chars=limit,
+                max_bytes=self.max_bytes,
+                encoding=header_encoding(content_type)
+            )
+            if stopped:
+                logger.debug(f"已提前停止读取 {url}（读取 {bytes_read} 字节）")
+        except requests.exceptions.Timeout:
+            logger.error(f"抓取链接超时 ({timeout}秒): {url}")
+            with self._lock:
+                self.errors += 1
+            return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"抓取链接时发生网络错误: {url}, 错误: {e}")
+            with self._lock:
+                self.errors += 1
+            return None
+
+        with self._lock:
+            self.misses += 1
+            self.bytes_downloaded += bytes_read
+            self.early_stops += 1 if stopped else 0
+            self._purge_expired_locked(now)
+            lifetime = _cache_lifetime(response, self.cache_ttl)
+            if text and lifetime > 0:
+                self._store_locked(url, _CacheEntry(
+                    text[:self.max_cached_text],
+                    response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'),
+                    now + lifetime,
+                    limit=limit if stopped else None
+                ))
+            else:
+                self._cache.pop(url, None)
+        if not text:
+            logger.warning(f"未能从链接 {url} 提取到有效文本内容。")
+        return text
+
+    @staticmethod
+    def _truncate(text, max_length):
+        if max_length and len(text) > max_length:
+            logger.info(f"网页内容已提取，并截断至 {max_length} 字符。")
+            return text[:max_length] + "..."
+        logger.info(f"成功提取网页文本内容 (长度 {len(text)}).")
+        return text
+
+    # --- 状态 ---
+    def connections_opened(self):
+        """连接池累计建立的连接数（无法获取时返回 None）。"""
+        try:
+            pools = self._adapter.poolmanager.pools
+            return sum(pools[key].num_connections for key in pools.keys())
+        except Exception:
+            return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                'entries': len(self._cache),
+                'hits': self.hits,
+                'revalidated': self.revalidated,
+                'misses': self.misses,
+                'errors': self.errors,
+                'requests': self.requests,
+                'bytes_downloaded': self.bytes_downloaded,
+                'early_stops': self.early_stops,
+                'hit_rate': round((self.hits + self.revalidated) / lookups, 3) if lookups else 0.0,
+                'connections_opened': self.connections_opened(),
+                'dns': self.resolver.stats(),
+            }
+
+    def close(self):
+        self.session.close()